@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+batch_client.py — Azure OpenAI Batch API submission for offline runs.
+
+Evaluation and hill-climb runs don't need interactive latency, but until
+now every case went through synchronous chat-completions: full price, and
+1,000-case runs spent a good share of their wall-clock stalled on 429s.
+The Batch API takes a JSONL file of chat-completion requests, runs them
+within a 24 h window at a discount, and returns a JSONL file of results —
+no per-request rate limit on our side at all.
+
+Flow (run_batch):
+    1. Requests already in the LLM response cache (llm_cache.py, if on) are
+       answered locally and not submitted.
+    2. The rest are written to a JSONL job file (kept next to the run's
+       results, so a job can be inspected or resubmitted by hand).
+    3. The file is uploaded (purpose=batch), a batch is created against
+       /chat/completions, and its status is polled until terminal.
+    4. The output and error files are streamed back line by line. Results
+       are written to the cache, so a later synchronous re-run is free.
+    5. Anything the batch didn't answer (failed line, expired batch,
+       truncated GPT-5 output) can be rescued synchronously through the
+       caller's `fallback` — the run never silently loses a case.
+
+Scope:
+    - Azure OpenAI deployments only. Bedrock batch inference needs S3 input
+      / output buckets that the AI Hub gateway doesn't expose.
+    - Azure routes batch jobs to Global-Batch deployments, which may be
+      named differently from the synchronous deployment; pass
+      `deployment=` (--batch-deployment) to rewrite the body's "model".
+    - The gateway base URL is configurable (CDI_BATCH_BASE_URL) — point it
+      at batch_stub_server.py to exercise the whole pipeline locally.
+
+PHI note: the job file contains full clinical notes. It is written with
+0600 permissions under the run's results directory; treat it like the
+evaluation dataset itself.
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from gateway_client import GatewayError, get_json, send
+from llm_cache import get_cache
+
+
+DEFAULT_BATCH_BASE = "https://aihubapi.stanfordhealthcare.org/azure-openai"
+BATCH_API_VERSION = "2024-10-21"
+COMPLETION_WINDOW = "24h"
+POLL_INTERVAL = 30          # seconds between status checks
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# (content, error) per custom_id; exactly one of the two is set
+BatchResults = Dict[str, Tuple[Optional[str], Optional[str]]]
+
+
+def make_request(custom_id: str, body: dict,
+                 cache_key: Optional[str] = None) -> dict:
+    """One batch line. `cache_key` (llm_cache.cache_key) links it to the
+    synchronous cache so batch and sync runs share results."""
+    return {"custom_id": custom_id, "body": body, "cache_key": cache_key}
+
+
+def chat_content(body: dict) -> Tuple[Optional[str], Optional[str]]:
+    """Extract message content from a chat-completions response body.
+
+    Returns (content, error). Empty content with finish_reason=length is an
+    error here — the synchronous path would retry with a doubled budget,
+    which a batch can't, so it is left to the fallback.
+    """
+    try:
+        choice = body["choices"][0]
+        content = choice["message"].get("content")
+    except (KeyError, IndexError, TypeError):
+        return None, f"unexpected response shape: {json.dumps(body)[:200]}"
+    if not content:
+        reason = choice.get("finish_reason", "unknown")
+        if reason == "length":
+            return None, "truncated (finish_reason=length)"
+        return "", None
+    return content, None
+
+
+class BatchClient:
+    """Thin wrapper over the Azure OpenAI files + batches endpoints."""
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None,
+                 api_version: str = BATCH_API_VERSION,
+                 poll_interval: float = POLL_INTERVAL):
+        self.api_key = api_key
+        self.base_url = (base_url or os.environ.get("CDI_BATCH_BASE_URL")
+                         or DEFAULT_BATCH_BASE).rstrip("/")
+        self.api_version = api_version
+        self.poll_interval = poll_interval
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}/{path}?api-version={self.api_version}"
+
+    def upload(self, job_path: Path) -> str:
+        # Read into memory so a retried upload re-sends the whole file
+        # (a file handle would be at EOF on the second attempt).
+        content = job_path.read_bytes()
+        resp = send("POST", self._url("files"), self.api_key,
+                    label="Batch upload", read_timeout=600,
+                    data={"purpose": "batch"},
+                    files={"file": (job_path.name, content, "application/jsonl")})
+        return resp.json()["id"]
+
+    def create(self, input_file_id: str) -> dict:
+        resp = send("POST", self._url("batches"), self.api_key,
+                    label="Batch create",
+                    headers={"Content-Type": "application/json"},
+                    data=json.dumps({
+                        "input_file_id": input_file_id,
+                        "endpoint": "/chat/completions",
+                        "completion_window": COMPLETION_WINDOW,
+                    }))
+        return resp.json()
+
+    def status(self, batch_id: str) -> dict:
+        return get_json(self._url(f"batches/{batch_id}"), self.api_key,
+                        label="Batch status")
+
+    def wait(self, batch_id: str, timeout: Optional[float] = None,
+             verbose: bool = True) -> dict:
+        """Poll until the batch reaches a terminal status (or timeout)."""
+        start = time.monotonic()
+        last_line = None
+        while True:
+            batch = self.status(batch_id)
+            counts = batch.get("request_counts") or {}
+            line = (f"  Batch {batch_id}: {batch.get('status')} "
+                    f"({counts.get('completed', 0)}/{counts.get('total', '?')} done, "
+                    f"{counts.get('failed', 0)} failed)")
+            if verbose and line != last_line:
+                print(line)
+                last_line = line
+            if batch.get("status") in TERMINAL_STATUSES:
+                return batch
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise GatewayError(f"Batch {batch_id} still {batch.get('status')} "
+                                   f"after {timeout:.0f}s")
+            time.sleep(self.poll_interval)
+
+    def iter_file(self, file_id: str) -> Iterator[dict]:
+        """Stream a result file as parsed JSON lines."""
+        resp = send("GET", self._url(f"files/{file_id}/content"), self.api_key,
+                    label="Batch download", read_timeout=600, stream=True)
+        try:
+            for raw in resp.iter_lines():
+                if raw:
+                    yield json.loads(raw)
+        finally:
+            resp.close()
+
+    def iter_results(self, batch: dict) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+        """Yield (custom_id, content, error) for every line the batch returned."""
+        if batch.get("output_file_id"):
+            for line in self.iter_file(batch["output_file_id"]):
+                cid = line.get("custom_id")
+                response = line.get("response") or {}
+                if line.get("error"):
+                    yield cid, None, str(line["error"])
+                elif response.get("status_code") != 200:
+                    yield cid, None, f"status {response.get('status_code')}: " \
+                                     f"{json.dumps(response.get('body'))[:200]}"
+                else:
+                    content, error = chat_content(response.get("body") or {})
+                    yield cid, content, error
+        if batch.get("error_file_id"):
+            for line in self.iter_file(batch["error_file_id"]):
+                err = line.get("error") or (line.get("response") or {}).get("body")
+                yield line.get("custom_id"), None, str(err)[:300]
+
+
+def write_job_file(path: Path, requests: List[dict],
+                   deployment: Optional[str] = None) -> int:
+    """Write requests as Batch API JSONL. Returns the number of lines."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        for req in requests:
+            body = dict(req["body"])
+            if deployment:
+                body["model"] = deployment
+            f.write(json.dumps({
+                "custom_id": req["custom_id"],
+                "method": "POST",
+                "url": "/chat/completions",
+                "body": body,
+            }) + "\n")
+    return len(requests)
+
+
+def run_batch(requests: List[dict], api_key: str, job_dir: str,
+              job_name: str = "batch",
+              base_url: Optional[str] = None,
+              deployment: Optional[str] = None,
+              poll_interval: float = POLL_INTERVAL,
+              timeout: Optional[float] = None,
+              fallback: Optional[Callable[[dict], str]] = None,
+              verbose: bool = True) -> BatchResults:
+    """Run `requests` (make_request dicts) through the Batch API.
+
+    Returns {custom_id: (content, error)} covering every request. With a
+    `fallback`, unanswered or failed requests are retried synchronously
+    one by one (fallback(request) -> content).
+    """
+    results: BatchResults = {}
+    cache = get_cache()
+    by_id = {r["custom_id"]: r for r in requests}
+
+    pending = []
+    for req in requests:
+        hit = None
+        if cache is not None and req.get("cache_key") and cache.mode != "record":
+            hit = cache.get(req["cache_key"])
+        if hit is not None:
+            results[req["custom_id"]] = (hit, None)
+        elif cache is not None and cache.mode == "replay":
+            results[req["custom_id"]] = (None, "not in cache (replay mode)")
+        else:
+            pending.append(req)
+    if verbose and cache is not None:
+        print(f"  Batch: {len(requests) - len(pending)}/{len(requests)} requests "
+              f"served from LLM cache")
+
+    if pending:
+        client = BatchClient(api_key, base_url=base_url, poll_interval=poll_interval)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        job_path = Path(job_dir) / f"{job_name}_{stamp}.jsonl"
+        write_job_file(job_path, pending, deployment=deployment)
+        if verbose:
+            print(f"  Batch job file: {job_path} ({len(pending)} requests)")
+
+        try:
+            file_id = client.upload(job_path)
+            batch = client.create(file_id)
+            if verbose:
+                print(f"  Submitted batch {batch['id']} to {client.base_url}")
+            batch = client.wait(batch["id"], timeout=timeout, verbose=verbose)
+            for cid, content, error in client.iter_results(batch):
+                if cid not in by_id:
+                    continue
+                results[cid] = (content, error)
+                req = by_id[cid]
+                if content and cache is not None and req.get("cache_key"):
+                    cache.put(req["cache_key"], req["body"].get("model", ""), content)
+        except GatewayError as e:
+            # Submission / polling failure — everything still pending falls
+            # through to the fallback below (or is reported as an error).
+            print(f"  Batch failed: {e}")
+
+    missing = [cid for cid in by_id
+               if cid not in results or results[cid][0] is None]
+    if missing and fallback is not None:
+        print(f"  Batch: {len(missing)} requests unanswered — running synchronously")
+        for cid in missing:
+            try:
+                results[cid] = (fallback(by_id[cid]), None)
+            except Exception as e:
+                results[cid] = (None, str(e))
+    for cid in by_id:
+        results.setdefault(cid, (None, "no result returned by batch"))
+    return results
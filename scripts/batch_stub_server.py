@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+batch_stub_server.py — local stand-in for the Azure OpenAI Batch API.
+
+Implements just enough of the files + batches endpoints for batch_client.py
+to run end to end without the AI Hub gateway:
+
+    POST /files                      multipart upload (purpose=batch)
+    POST /batches                    create a batch from an uploaded file
+    GET  /batches/{id}               status + request_counts
+    GET  /files/{id}/content         JSONL output / error file
+
+Any path prefix is accepted (e.g. /azure-openai/files), and the
+api-version query parameter is ignored. Batches move through
+validating → in_progress → completed in a background thread.
+
+Responders (--responder):
+    empty     every request returns content "[]" (no diagnoses) — checks
+              plumbing and scoring without any model calls
+    forward   every request is sent synchronously to the real gateway via
+              gateway_client (needs STANFORD_API_KEY) — the batch path with
+              real model output, for validating a run against sync results
+
+--fail-every N marks every Nth request as failed, to exercise the
+synchronous fallback.
+
+Usage:
+    python scripts/batch_stub_server.py --port 8765 &
+    CDI_BATCH_BASE_URL=http://127.0.0.1:8765 \\
+        python scripts/evaluate_cdi_accuracy.py --batch --test
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+
+FILES = {}     # file_id -> bytes
+BATCHES = {}   # batch_id -> batch dict
+_lock = threading.Lock()
+
+
+def _empty_responder(body: dict) -> dict:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "model": body.get("model"),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": "[]"}}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 1, "total_tokens": 1},
+    }
+
+
+def _forward_responder(api_key: str):
+    from cdi_engine import API_ENDPOINTS
+    from gateway_client import post_json
+
+    def respond(body: dict) -> dict:
+        url = API_ENDPOINTS.get(body.get("model"), API_ENDPOINTS["gpt-5"])
+        return post_json(url, body, api_key)
+    return respond
+
+
+def _multipart_file(content_type: str, raw: bytes) -> bytes:
+    """Return the "file" part of a multipart/form-data body."""
+    msg = BytesParser(policy=policy.default).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + raw)
+    for part in msg.iter_parts():
+        if part.get_param("name", header="content-disposition") == "file":
+            return part.get_payload(decode=True)
+    raise ValueError("multipart body has no 'file' part")
+
+
+def _process(batch_id: str, responder, fail_every: int, delay: float) -> None:
+    batch = BATCHES[batch_id]
+    lines = FILES[batch["input_file_id"]].decode("utf-8").splitlines()
+    requests_ = [json.loads(l) for l in lines if l.strip()]
+    with _lock:
+        batch["status"] = "in_progress"
+        batch["request_counts"] = {"total": len(requests_), "completed": 0, "failed": 0}
+    time.sleep(delay)
+
+    out, err = [], []
+    for i, req in enumerate(requests_, 1):
+        cid = req["custom_id"]
+        if fail_every and i % fail_every == 0:
+            err.append({"custom_id": cid, "response": None,
+                        "error": {"code": "stub_failure", "message": "injected failure"}})
+            with _lock:
+                batch["request_counts"]["failed"] += 1
+            continue
+        try:
+            body = responder(req["body"])
+            out.append({"custom_id": cid, "error": None,
+                        "response": {"status_code": 200, "body": body}})
+            with _lock:
+                batch["request_counts"]["completed"] += 1
+        except Exception as e:
+            err.append({"custom_id": cid, "response": None,
+                        "error": {"code": "responder_error", "message": str(e)}})
+            with _lock:
+                batch["request_counts"]["failed"] += 1
+
+    with _lock:
+        if out:
+            fid = f"file-{uuid.uuid4().hex[:12]}"
+            FILES[fid] = "".join(json.dumps(o) + "\n" for o in out).encode("utf-8")
+            batch["output_file_id"] = fid
+        if err:
+            fid = f"file-{uuid.uuid4().hex[:12]}"
+            FILES[fid] = "".join(json.dumps(e) + "\n" for e in err).encode("utf-8")
+            batch["error_file_id"] = fid
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    responder = staticmethod(_empty_responder)
+    fail_every = 0
+    delay = 1.0
+
+    def _send(self, code: int, payload, content_type="application/json"):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+
+        if path.endswith("/files"):
+            fid = f"file-{uuid.uuid4().hex[:12]}"
+            FILES[fid] = _multipart_file(self.headers.get("Content-Type", ""), raw)
+            return self._send(200, {"id": fid, "object": "file", "purpose": "batch",
+                                    "bytes": len(FILES[fid]), "status": "processed"})
+
+        if path.endswith("/batches"):
+            req = json.loads(raw or b"{}")
+            if req.get("input_file_id") not in FILES:
+                return self._send(400, {"error": {"message": "unknown input_file_id"}})
+            bid = f"batch_{uuid.uuid4().hex[:12]}"
+            with _lock:
+                BATCHES[bid] = {"id": bid, "object": "batch", "status": "validating",
+                                "endpoint": req.get("endpoint"),
+                                "input_file_id": req["input_file_id"],
+                                "created_at": int(time.time()),
+                                "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+            threading.Thread(target=_process, daemon=True,
+                             args=(bid, self.responder, self.fail_every, self.delay)).start()
+            return self._send(200, BATCHES[bid])
+
+        self._send(404, {"error": {"message": f"no route for POST {path}"}})
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        m = re.search(r"/batches/([^/]+)$", path)
+        if m:
+            with _lock:
+                batch = BATCHES.get(m.group(1))
+                payload = dict(batch) if batch else None
+            if payload is None:
+                return self._send(404, {"error": {"message": "unknown batch"}})
+            return self._send(200, payload)
+        m = re.search(r"/files/([^/]+)/content$", path)
+        if m and m.group(1) in FILES:
+            return self._send(200, FILES[m.group(1)], "application/jsonl")
+        self._send(404, {"error": {"message": f"no route for GET {path}"}})
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def main():
+    p = argparse.ArgumentParser(description="Local stand-in for the Azure OpenAI Batch API")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--responder", choices=["empty", "forward"], default="empty")
+    p.add_argument("--fail-every", type=int, default=0,
+                   help="Mark every Nth request as failed (exercises the sync fallback)")
+    p.add_argument("--delay", type=float, default=1.0,
+                   help="Seconds a batch stays in_progress before results are produced")
+    args = p.parse_args()
+
+    if args.responder == "forward":
+        api_key = os.environ.get("STANFORD_API_KEY")
+        if not api_key:
+            print("STANFORD_API_KEY not set (required for --responder forward)", file=sys.stderr)
+            return 2
+        Handler.responder = staticmethod(_forward_responder(api_key))
+    Handler.fail_every = args.fail_every
+    Handler.delay = args.delay
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"Batch stub listening on http://{args.host}:{args.port} "
+          f"(responder={args.responder}, fail_every={args.fail_every})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,909 @@
+#!/usr/bin/env python3
+"""
+bench_hotpaths.py — equivalence check + timing for CDI engine hot paths.
+
+Each optimised function in cdi_engine.py is compared against a reference
+copy of the implementation it replaced, on the same inputs. The run fails
+(exit 1) on the first output mismatch, so this doubles as the proof that
+an optimisation changed speed and nothing else.
+
+Covered:
+    _normalise_diagnosis         compiled tables + memo vs re.sub loop
+    _filter_already_documented   documented index vs pairwise scan
+    _extract_documented_diagnoses  note_sections index vs per-header findall
+    classify_drg_impact,         one trie-regex scan vs per-keyword `in` loops
+    categorize_diagnosis         (evaluate_cdi_accuracy)
+    diagnoses_match              memoised DiagnosisMatcher features vs
+                                 (evaluate_cdi_accuracy)  per-call table scan
+    detect_pathology_segments    per-note memo (section index) vs a fresh scan
+                                 (pathology_scanner)
+    CDIEngine._vote              complete-linkage clusters vs first-bucket scan
+                                 (grouping is intentionally different; checked
+                                 instead: pairwise similarity agrees with
+                                 _diagnoses_similar, and clusters don't
+                                 change when runs/predictions are shuffled)
+
+Inputs:
+    --data CSV   evaluation set (e.g. data/cdi_expanded_notes_eval.csv):
+                 discharge summaries, the documented diagnoses extracted
+                 from them, and the CDI ground-truth diagnoses
+    (always)     a seeded synthetic corpus built from the synonym / marker
+                 vocabulary, so the check also runs on machines without
+                 PHI data
+
+Usage:
+    python scripts/bench_hotpaths.py
+    python scripts/bench_hotpaths.py --data data/cdi_expanded_notes_eval.csv --repeat 5
+"""
+
+import argparse
+import ast
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent))
+import cdi_engine  # noqa: E402  (sibling import after path setup)
+
+
+# ===========================================================================
+# REFERENCE IMPLEMENTATIONS (pre-optimisation, kept verbatim)
+# ===========================================================================
+
+def reference_normalise_diagnosis(text: str) -> str:
+    """Baseline _normalise_diagnosis: one re.sub per table entry."""
+    s = text.lower().strip()
+    for marker in cdi_engine._NON_CODABLE_MARKERS:
+        s = re.sub(marker, ' ', s)
+    for pattern, replacement in cdi_engine._CLINICAL_SYNONYMS:
+        s = re.sub(pattern, replacement, s)
+    s = re.sub(r'[^\w\s]', ' ', s)
+    s = re.sub(r'\s+', ' ', s).strip()
+    return s
+
+
+def reference_is_specificity_upgrade(pred_dx: str, doc_dx: str) -> bool:
+    """Baseline _is_specificity_upgrade."""
+    # Normalise both sides — this strips non-codable markers and aligns synonyms
+    pred_n = reference_normalise_diagnosis(pred_dx)
+    doc_n = reference_normalise_diagnosis(doc_dx)
+
+    if not pred_n or not doc_n:
+        return False
+
+    # After normalisation, documented must appear in prediction for it to be
+    # a candidate upgrade (otherwise they're just different diagnoses)
+    if doc_n not in pred_n:
+        return False
+
+    # Extract what the prediction adds beyond the documented text
+    extra_text = pred_n.replace(doc_n, '', 1).strip()
+    extra_words = extra_text.split()
+    stop = {'', 'and', 'or', 'the', 'a', 'an', 'in', 'of', 'at', 'by', 'to',
+            'for', 'with', 'on', 'from', 'as', 'is', 'was', 'be', 'being',
+            'due', 'secondary'}
+    meaningful = [w for w in extra_words if w and w not in stop]
+
+    if not meaningful:
+        return False
+
+    # Codable upgrade keywords — these change the ICD-10 code when present
+    CODABLE_UPGRADE_KEYWORDS = {
+        # Acuity (changes code)
+        'acute', 'subacute', 'fulminant', 'chronic',
+        # Anatomic/pathologic type (changes code)
+        'systolic', 'diastolic', 'restrictive', 'hypertrophic',
+        # Severity that changes coding (malnutrition, respiratory failure)
+        'severe', 'moderate', 'mild',
+        # Complications/added codable states
+        'shock', 'failure', 'hemorrhagic', 'aspiration',
+        # Specific etiologies that add a code
+        'hyperglycemia', 'ketoacidosis', 'hyperosmolar',
+        'hyponatremia', 'hyperkalemia', 'hypokalemia',
+        'hypercalcemia', 'hypocalcemia',
+        # Anemia specificity (codable subtypes)
+        'iron', 'deficiency', 'pernicious',
+    }
+
+    # Non-codable "specificity" — explicitly do NOT treat as upgrades
+    # (after normalisation these would usually be stripped, but guard here too)
+    NON_CODABLE_EXTRAS = {
+        'kdigo', 'stage', 'class', 'grade', 'poa', 'present', 'admission',
+        'resolved', 'improved', 'unspecified', 'other', 'nos',
+        'expected', 'ruled',
+    }
+
+    # If the only "extras" are non-codable markers, this is NOT an upgrade
+    meaningful_filtered = [w for w in meaningful if w not in NON_CODABLE_EXTRAS]
+    if not meaningful_filtered:
+        return False
+
+    # Must contain at least one codable upgrade keyword
+    for keyword in CODABLE_UPGRADE_KEYWORDS:
+        if keyword in meaningful_filtered:
+            return True
+
+    # Two or more meaningful (non-marker) words added = likely a real
+    # new comorbidity / combined code (e.g. "heart failure" →
+    # "diastolic heart failure with hypertension")
+    if len(meaningful_filtered) >= 2:
+        return True
+
+    return False
+
+
+def reference_filter_already_documented(predictions: List[Dict],
+                                        documented: List[str],
+                                        full_text: Optional[str] = None
+                                        ) -> Tuple[List[Dict], List[Dict]]:
+    """Baseline _filter_already_documented: pairwise scan."""
+    if not documented and not full_text:
+        return predictions, []
+
+    # Pre-normalise documented set once
+    doc_normalised = [(d, reference_normalise_diagnosis(d)) for d in documented]
+
+    stop = {'and', 'or', 'the', 'a', 'an', 'with', 'without',
+            'due', 'to', 'of', 'in', 'on', 'secondary',
+            'other', 'not', 'no', 'at', 'by', 'from', 'for'}
+
+    kept = []
+    filtered = []
+    for pred in predictions:
+        dx_raw = pred.get('diagnosis', '').strip()
+        if not dx_raw:
+            continue
+        dx_norm = reference_normalise_diagnosis(dx_raw)
+        if not dx_norm:
+            kept.append(pred)
+            continue
+        dx_terms = set(w for w in dx_norm.split() if w not in stop)
+
+        is_processed = False
+        for doc_raw, doc_norm in doc_normalised:
+            if not doc_norm:
+                continue
+
+            # 1. Always preserve codable specificity upgrades
+            if reference_is_specificity_upgrade(dx_raw, doc_raw):
+                pred_copy = dict(pred)
+                pred_copy['is_specificity_upgrade'] = True
+                kept.append(pred_copy)
+                is_processed = True
+                break
+
+            reason = None
+
+            # 2a. Exact match after normalisation
+            if dx_norm == doc_norm:
+                reason = 'exact match after normalisation'
+            # 2b. Documented is broader and contains prediction (pred less specific)
+            elif dx_norm in doc_norm:
+                reason = 'prediction subsumed by documented'
+            # 2c. Prediction contains documented but only adds non-codable markers
+            #     (specificity_upgrade check already returned False above)
+            elif doc_norm in dx_norm:
+                reason = 'non-codable elaboration of documented'
+            else:
+                # 2d. Jaccard overlap on normalised terms
+                doc_terms = set(w for w in doc_norm.split() if w not in stop)
+                if not dx_terms or not doc_terms:
+                    continue
+                inter = len(dx_terms & doc_terms)
+                union = len(dx_terms | doc_terms)
+                jaccard = inter / union if union else 0
+                coverage = inter / min(len(dx_terms), len(doc_terms))
+                # Filter when either Jaccard >= 0.75 OR when the smaller side
+                # is fully contained (coverage == 1) AND the larger adds only
+                # 1-2 tokens — catches "hf" vs "heart failure" post-expansion.
+                if jaccard >= 0.75:
+                    reason = f'duplicate (jaccard={jaccard:.0%})'
+                elif coverage == 1.0 and abs(len(dx_terms) - len(doc_terms)) <= 1:
+                    reason = 'duplicate (full coverage of smaller side)'
+
+            if reason:
+                pred_copy = dict(pred)
+                pred_copy['filter_reason'] = reason
+                pred_copy['filter_matched_doc'] = doc_raw
+                filtered.append(pred_copy)
+                is_processed = True
+                break
+
+        if is_processed:
+            continue
+
+        # ------------------------------------------------------------------
+        # Full-text fallback DISABLED (2026-04-15).
+        # Caused −21pp malnutrition recall regression: Stanford notes mention
+        # malnutrition in narrative nutrition sections, which the fallback
+        # can't distinguish from formal diagnosis coding.
+        # The normalisation + Jaccard improvements above are sufficient.
+        # ------------------------------------------------------------------
+        kept.append(pred)
+
+    return kept, filtered
+
+
+def reference_extract_documented_diagnoses(discharge_summary: str) -> List[str]:
+    """Baseline _extract_documented_diagnoses: one findall per header."""
+    documented = []
+
+    # Normalise: BigQuery CSVs often flatten newlines to double spaces
+    text = re.sub(r'  +', '\n', discharge_summary)
+
+    section_headers = [
+        # Standard formal diagnosis sections
+        r'Discharge\s+Diagnos[ei]s',
+        r'Admitting\s+Diagnos[ei]s',
+        r'Admission\s+Diagnos[ei]s',
+        r'Principal\s+Diagnos[ei]s',
+        r'Secondary\s+Diagnos[ei]s',
+        r'Final\s+Diagnos[ei]s',
+        r'Discharge\s+Dx',
+        # Problem lists
+        r'Active\s+Problems?',
+        r'Active\s+Hospital\s+Problems?',
+        r'Active\s+Issues?',
+        r'Problem\s+List',
+        r'Hospital\s+Problems?',
+        # Stanford-specific sections (heavy CDI concentration)
+        r'Relevant\s+Clinical\s+Conditions',
+        r'Discharge\s+Teaching\s+Physician\s+Attestation',
+        r'Hospital\s+Course',
+    ]
+
+    for header in section_headers:
+        pattern = header + r'\s*:?\s*\n(.*?)(?=\n[A-Z][A-Za-z\s/]{3,}:|$)'
+        matches = re.findall(pattern, text, re.DOTALL | re.IGNORECASE)
+        for match in matches:
+            for line in match.split('\n'):
+                line = line.strip()
+                if not line or len(line) < 4:
+                    continue
+                # Skip treatment/management sub-bullets
+                if line.startswith('-') and any(kw in line.lower() for kw in
+                    ['continue', 'monitor', 'start', 'wean', 'switch', 'given',
+                     'improved', 'stable', 'mg', 'iv', 'po', 'bid', 'tid',
+                     'daily', 'prn', 'as needed', 'prophylaxis']):
+                    continue
+                cleaned = re.sub(r'^[\s\-\*\d\.)]+', '', line).strip()
+                if cleaned and len(cleaned) > 3:
+                    documented.append(cleaned)
+
+    # Also extract #Problem formatted lines (Stanford EMR format)
+    hash_problems = re.findall(r'^\s*#\s*(.+)', text, re.MULTILINE)
+    for prob in hash_problems:
+        cleaned = prob.strip()
+        if cleaned and len(cleaned) > 3:
+            documented.append(cleaned)
+
+    return documented
+
+
+def reference_detect_pathology_segments(text: str, window: int = 2000) -> List[str]:
+    """Baseline detect_pathology_segments: a fresh scan per call."""
+    from pathology_scanner import PATH_DX_RE, PATH_HEADER_RE
+
+    if not text or not isinstance(text, str):
+        return []
+
+    hits = []
+    for m in PATH_HEADER_RE.finditer(text):
+        start = max(0, m.start() - 200)  # small lead-in for context
+        end = min(len(text), m.start() + window)
+        hits.append((start, end))
+
+    if not hits:
+        return []
+
+    # Merge overlapping windows
+    hits.sort()
+    merged = [hits[0]]
+    for s, e in hits[1:]:
+        if s <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+
+    # Keep only segments that contain at least one pathology-diagnosis term
+    kept = []
+    for s, e in merged:
+        seg = text[s:e]
+        if PATH_DX_RE.search(seg):
+            kept.append(seg)
+    return kept
+
+
+def reference_classify_drg_impact(diagnosis: str) -> str:
+    """Baseline classify_drg_impact: substring loop per table."""
+    dx_lower = diagnosis.lower().strip()
+    for pattern in cdi_engine.MCC_PATTERNS:
+        if pattern in dx_lower:
+            return "MCC"
+    for pattern in cdi_engine.CC_PATTERNS:
+        if pattern in dx_lower:
+            return "CC"
+    return "non-CC"
+
+
+def reference_categorize_diagnosis(dx: str) -> str:
+    """Baseline categorize_diagnosis: substring loop per category."""
+    from evaluate_cdi_accuracy import DIAGNOSIS_CATEGORIES
+
+    dx_lower = dx.lower()
+    for category, keywords in DIAGNOSIS_CATEGORIES.items():
+        if any(kw in dx_lower for kw in keywords):
+            return category
+    return 'other'
+
+
+def reference_diagnoses_match(pred_dx: str, true_dx: str, threshold: float = 0.5) -> bool:
+    """Baseline evaluate_cdi_accuracy.diagnoses_match (same tables)."""
+    from evaluate_cdi_accuracy import (CLINICAL_EQUIVALENTS, MATCH_STOP_WORDS,
+                                       normalize_diagnosis)
+
+    pred_norm = normalize_diagnosis(pred_dx)
+    true_norm = normalize_diagnosis(true_dx)
+    if pred_norm == true_norm:
+        return True
+    if pred_norm in true_norm or true_norm in pred_norm:
+        return True
+    for base_term, equivalent_terms in CLINICAL_EQUIVALENTS.items():
+        pred_has_base = base_term in pred_norm or any(term in pred_norm for term in equivalent_terms)
+        true_has_base = base_term in true_norm or any(term in true_norm for term in equivalent_terms)
+        if pred_has_base and true_has_base:
+            return True
+    pred_words = set(pred_norm.split()) - MATCH_STOP_WORDS
+    true_words = set(true_norm.split()) - MATCH_STOP_WORDS
+    if not pred_words or not true_words:
+        return False
+    return len(pred_words & true_words) / max(len(pred_words), len(true_words)) >= threshold
+
+
+def reference_vote(all_runs: List[List[Dict]], threshold: int) -> List[Dict]:
+    """Baseline CDIEngine._vote: first matching bucket wins."""
+    buckets = []
+    for run_preds in all_runs:
+        seen_this_run = set()
+        for pred in run_preds:
+            dx_name = pred.get("diagnosis", str(pred)) if isinstance(pred, dict) else str(pred)
+            norm = cdi_engine._normalize(dx_name)
+            if norm in seen_this_run:
+                continue
+            seen_this_run.add(norm)
+            matched_bucket = None
+            for bucket in buckets:
+                if cdi_engine._diagnoses_similar(norm, bucket["norm"]):
+                    matched_bucket = bucket
+                    break
+            if matched_bucket:
+                matched_bucket["count"] += 1
+                if isinstance(pred, dict):
+                    old_ev = matched_bucket["best_entry"].get("evidence", "")
+                    new_ev = pred.get("evidence", "")
+                    if len(new_ev) > len(old_ev):
+                        matched_bucket["best_entry"] = pred
+            else:
+                buckets.append({
+                    "norm": norm,
+                    "count": 1,
+                    "best_entry": pred if isinstance(pred, dict) else {"diagnosis": str(pred)},
+                })
+    num_runs = len(all_runs)
+    results = []
+    for bucket in sorted(buckets, key=lambda b: b["count"], reverse=True):
+        if bucket["count"] < threshold:
+            continue
+        entry = dict(bucket["best_entry"])
+        entry["vote_count"] = bucket["count"]
+        entry["vote_total"] = num_runs
+        entry["confidence"] = "high" if bucket["count"] == num_runs else "medium"
+        results.append(entry)
+    return results
+
+
+# ===========================================================================
+# CORPUS
+# ===========================================================================
+
+# Surface forms that exercise every synonym / marker entry, including the
+# chained ones (posthemorrhagic → blood loss → acute blood loss anemia).
+_SEED_PHRASES = [
+    "HFrEF", "HFpEF", "CHF", "HF", "AKI", "CKD", "IDA", "posthemorrhagic",
+    "acute blood loss anemia", "acute  blood   loss anemia",
+    "post-op acute blood loss anemia", "postop acute posthemorrhagic anemia",
+    "anemia of malignancy", "anemia due to malignancy", "anemia of chronic disease",
+    "ARDS", "ARSF", "HOCM", "hypertrophic obstructive cardiomyopathy",
+    "protein-calorie malnutrition", "protein calorie malnutrition",
+    "protein energy malnutrition", "cachexia", "DM type 2", "DM type2", "DM2",
+    "T2DM", "DM1", "T1DM", "UTI", "CAUTI", "NSTEMI", "STEMI", "PE", "DVT",
+    "COPD", "PNA", "OSA", "OHS",
+    "present on admission", "POA", "not present on admission", "NPOA",
+    "KDIGO stage 3", "stage 4", "stage IV", "class III", "class 2",
+    "NYHA class II", "G3a", "G4", "(BMI 41.2 kg/m2)", "(BMI 17)",
+    "(EF < 40%)", "(HFrEF, EF 25%)", "resolved", "improved", "ruled out",
+    "expected", "unspecified",
+    "acute on chronic", "diastolic", "severe", "sepsis", "hyponatremia",
+    "with hyperglycemia", "secondary to", "iron deficiency", "pressure injury",
+]
+
+
+def synthetic_corpus(n: int = 5000, seed: int = 42) -> List[str]:
+    rng = random.Random(seed)
+    joiners = [" ", ", ", " - ", " / ", "; ", " with ", " and "]
+    corpus = list(_SEED_PHRASES)
+    for _ in range(n):
+        k = rng.randint(1, 5)
+        parts = [rng.choice(_SEED_PHRASES) for _ in range(k)]
+        text = parts[0]
+        for p in parts[1:]:
+            text += rng.choice(joiners) + p
+        corpus.append(text)
+    return corpus
+
+
+# Extra documented-line shapes for the filter check: partial words and
+# stop-word-only lines exercise the substring paths of the index.
+_DOC_FRAGMENTS = ["sis", "failure", "of", "heart fail", "ure hea", "anemia",
+                  "chronic", "acute kidney", "type 2", "disease"]
+
+
+def synthetic_filter_cases(n: int = 300, seed: int = 7) -> List[Tuple]:
+    """(predictions, documented, full_text) cases with long documented lists."""
+    rng = random.Random(seed)
+    vocab = _SEED_PHRASES + _DOC_FRAGMENTS
+    cases = []
+    for _ in range(n):
+        documented = []
+        for _ in range(rng.randint(5, 300)):
+            parts = [rng.choice(vocab) for _ in range(rng.randint(1, 3))]
+            documented.append(" ".join(parts))
+        predictions = []
+        for _ in range(rng.randint(3, 20)):
+            if documented and rng.random() < 0.5:
+                base = rng.choice(documented)
+                extra = rng.choice(["", "acute", "severe", "with hyperglycemia",
+                                    "POA", "stage 3", "chronic", "due to sepsis"])
+                dx = rng.choice([f"{extra} {base}", f"{base} {extra}", base])
+            else:
+                dx = " ".join(rng.choice(vocab) for _ in range(rng.randint(1, 4)))
+            predictions.append({"diagnosis": dx, "confidence": "high"})
+        cases.append((predictions, documented, " ".join(documented)))
+    return cases
+
+
+_NOTE_HEADERS = [
+    "Discharge Diagnoses", "DISCHARGE DIAGNOSIS", "Admitting Diagnosis",
+    "Admission Diagnoses", "Principal Diagnosis", "Secondary Diagnoses",
+    "Final Diagnosis", "Discharge Dx", "Active Problems", "Active Problem",
+    "Active Hospital Problems", "Active Issues", "Problem List",
+    "Hospital Problems", "Relevant Clinical Conditions",
+    "Discharge Teaching Physician Attestation", "Hospital Course",
+    "HPI", "Medications", "Follow Up", "Labs/Imaging", "Plan", "Exam",
+    "Disposition", "Condition at discharge",
+]
+_NOTE_LINES = [
+    "1. Sepsis due to E. coli UTI", "- continue ceftriaxone 1g IV daily",
+    "- monitor Cr", "Acute on chronic systolic heart failure, EF 25%",
+    "#Hyponatremia", "  # AKI on CKD stage 3", "Severe protein calorie malnutrition",
+    "Patient was admitted with fever: treated with abx.", "BP 110/70, HR 88",
+    "Plan: wean O2", "stable", "Pt seen and examined", "Anemia (Hgb 6.9)",
+    "see below", "Type 2 DM with hyperglycemia",
+]
+# Case-folding edge cases (ı, ſ, Kelvin sign); rare in real notes, so only
+# a few synthetic notes get one
+_NOTE_FOLD_LINE = "ıllegible ſection \u212aelvin:"
+
+
+def synthetic_notes(n: int = 300, seed: int = 11) -> List[str]:
+    """Notes with real-looking section layout, incl. BigQuery flattening."""
+    rng = random.Random(seed)
+    notes = []
+    for _ in range(n):
+        parts = []
+        for _ in range(rng.randint(2, 25)):
+            header = rng.choice(_NOTE_HEADERS)
+            sep = rng.choice([":\n", ":  ", "\n", ": \n\n", " :\n", ":", ":\t\n"])
+            lines = [rng.choice(_NOTE_LINES) for _ in range(rng.randint(0, 40))]
+            if rng.random() < 0.01:
+                lines.insert(rng.randint(0, len(lines)), _NOTE_FOLD_LINE)
+            body = "\n".join(lines)
+            parts.append(header + sep + body)
+        note = rng.choice(["\n", "\n\n", "  "]).join(parts)
+        if rng.random() < 0.3:
+            note = note.replace("\n", "  ")  # BigQuery-flattened export
+        if rng.random() < 0.2:
+            note += "\n"
+        notes.append(note)
+    return notes
+
+
+# Pathology-report fragments, header phrases in prose and throwaway
+# mentions, spliced into synthetic notes for detect_pathology_segments
+_PATHOLOGY_FRAGMENTS = [
+    "SURGICAL PATHOLOGY REPORT:\nFinal diagnosis: sigmoid adenocarcinoma, "
+    "moderately differentiated",
+    "PATHOLOGY:   Final diagnosis: lymphoma   PLAN:  follow up",
+    "Gross description: polyp, 1.2 cm. Microscopic findings: tubular adenoma "
+    "with low-grade dysplasia",
+    "biopsy showed metastatic carcinoma", "pathology report pending",
+    "Cytology report: malignant pleural effusion", "IMMUNOHISTOCHEMISTRY: CK7+",
+]
+
+
+def synthetic_pathology_notes(notes: List[str], seed: int = 17) -> List[str]:
+    """Copies of `notes` with 0–3 pathology fragments spliced in at random
+    line breaks (and at the very start, where a report header opens the note)."""
+    rng = random.Random(seed)
+    out = []
+    for note in notes:
+        for _ in range(rng.randint(0, 3)):
+            frag = rng.choice(_PATHOLOGY_FRAGMENTS)
+            cuts = [0] + [i + 1 for i, c in enumerate(note) if c == "\n"]
+            at = rng.choice(cuts)
+            note = note[:at] + frag + rng.choice(["\n", "  "]) + note[at:]
+        out.append(note)
+    return out
+
+
+# Distinct diagnoses, each with the surface variants different runs produce
+_VOTE_DIAGNOSES = [
+    ["Sepsis", "Severe sepsis", "Sepsis due to E. coli"],
+    ["Acute kidney injury", "AKI", "AKI on CKD stage 3"],
+    ["Acute on chronic systolic heart failure", "HFrEF exacerbation",
+     "Chronic systolic CHF"],
+    ["Acute hypoxic respiratory failure", "Acute respiratory failure with hypoxia"],
+    ["Severe protein calorie malnutrition", "Severe malnutrition", "Cachexia"],
+    ["Acute blood loss anemia", "Anemia", "Iron deficiency anemia"],
+    ["Hyponatremia", "Low sodium"], ["Hyperkalemia"], ["Hypokalemia"],
+    ["Metabolic encephalopathy", "Toxic metabolic encephalopathy", "Delirium"],
+    ["Lactic acidosis", "Elevated lactate"], ["Thrombocytopenia"],
+    ["Morbid obesity", "Obesity, BMI 42"], ["Pressure injury stage 3 sacrum"],
+    ["Type 2 diabetes with hyperglycemia", "T2DM with hyperglycemia"],
+    ["Urinary tract infection", "UTI", "CAUTI"], ["Pneumonia", "Aspiration pneumonia"],
+    ["Pulmonary embolism"], ["Deep vein thrombosis of left leg"],
+    ["Atrial fibrillation with RVR", "Paroxysmal atrial fibrillation"],
+    ["COPD exacerbation"], ["Hypomagnesemia"], ["Hypoalbuminemia"],
+    ["Coagulopathy", "DIC"], ["Functional quadriplegia"], ["Cerebral edema"],
+    ["Hepatic encephalopathy"], ["Alcohol withdrawal"], ["Pancytopenia"],
+    ["Cardiogenic shock"],
+]
+
+
+def synthetic_vote_cases(n: int = 100, runs: int = 5,
+                         seed: int = 13) -> List[List[List[Dict]]]:
+    """high_recall-shaped voting inputs: `runs` runs of 15–22 predictions
+    over 25 diagnoses per case, each run picking its own surface form."""
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(n):
+        base = rng.sample(_VOTE_DIAGNOSES, 25)
+        cases.append([[{"diagnosis": rng.choice(variants),
+                        "evidence": "x" * rng.randint(0, 40)}
+                       for variants in rng.sample(base, rng.randint(15, 22))]
+                      for _ in range(runs)])
+    return cases
+
+
+def _parse_list_cell(value) -> List[str]:
+    if isinstance(value, str) and value.startswith('['):
+        try:
+            return [str(v) for v in ast.literal_eval(value)]
+        except (ValueError, SyntaxError):
+            return []
+    return [str(value)] if isinstance(value, str) and value else []
+
+
+def data_corpus(path: str) -> Tuple[List[str], List[Tuple], List[str]]:
+    """Normaliser inputs, filter cases and raw notes from an evaluation CSV.
+
+    Filter cases use the CDI ground-truth diagnoses as stand-in predictions
+    against the documented lines extracted from each summary.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(path)
+    corpus, cases, notes = [], [], []
+    for _, row in df.iterrows():
+        summary = row.get('discharge_summary')
+        if not isinstance(summary, str) or not summary:
+            continue
+        documented = cdi_engine._extract_documented_diagnoses(summary)
+        truth = []
+        for col in ('cdi_diagnoses_confirmed', 'cdi_diagnoses_parsed', 'cdi_diagnoses'):
+            if col in row:
+                truth.extend(_parse_list_cell(row[col]))
+        notes.append(summary)
+        corpus.append(summary)
+        corpus.extend(documented)
+        corpus.extend(truth)
+        cases.append(([{"diagnosis": t} for t in truth], documented, summary))
+    return corpus, cases, notes
+
+
+# ===========================================================================
+# BENCHMARKS
+# ===========================================================================
+
+def _time(fn: Callable[[str], object], corpus: List[str], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            fn(text)
+    return time.perf_counter() - start
+
+
+def bench_normalise(corpus: List[str], repeat: int) -> bool:
+    optimised = cdi_engine._normalise_diagnosis
+    mismatches = 0
+    for text in corpus:
+        expected = reference_normalise_diagnosis(text)
+        got = optimised(text)
+        if got != expected:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"  MISMATCH {text[:80]!r}\n    reference: {expected[:80]!r}\n"
+                      f"    optimised: {got[:80]!r}")
+
+    ref_t = _time(reference_normalise_diagnosis, corpus, repeat)
+    optimised.cache_clear()
+    cold_t = _time(optimised.__wrapped__, corpus, repeat)
+    warm_t = _time(optimised, corpus, repeat)
+
+    n = len(corpus) * repeat
+    print(f"_normalise_diagnosis ({len(corpus)} inputs × {repeat})")
+    print(f"  reference          {ref_t*1e6/n:8.1f} µs/call")
+    print(f"  compiled (no memo) {cold_t*1e6/n:8.1f} µs/call  ({ref_t/cold_t:.1f}x)")
+    print(f"  compiled + memo    {warm_t*1e6/n:8.1f} µs/call  ({ref_t/warm_t:.1f}x)")
+    print(f"  outputs identical: {'yes' if not mismatches else f'NO ({mismatches} differ)'}")
+    return mismatches == 0
+
+
+def bench_classify(corpus: List[str], repeat: int) -> bool:
+    from evaluate_cdi_accuracy import categorize_diagnosis
+
+    ok = True
+    pairs = [("classify_drg_impact", reference_classify_drg_impact,
+              cdi_engine.classify_drg_impact),
+             ("categorize_diagnosis", reference_categorize_diagnosis,
+              categorize_diagnosis)]
+    for name, reference, optimised in pairs:
+        mismatches = sum(reference(t) != optimised(t) for t in corpus)
+        ref_t = _time(reference, corpus, repeat)
+        new_t = _time(optimised, corpus, repeat)
+        n = len(corpus) * repeat
+        print(f"{name} ({len(corpus)} inputs × {repeat})")
+        print(f"  reference (keyword loop) {ref_t*1e6/n:6.1f} µs/call")
+        print(f"  single scan              {new_t*1e6/n:6.1f} µs/call  ({ref_t/new_t:.1f}x)")
+        print(f"  outputs identical: {'yes' if not mismatches else f'NO ({mismatches} differ)'}")
+        ok = ok and mismatches == 0
+    return ok
+
+
+def bench_match(cases: List[List[List[Dict]]], repeat: int) -> bool:
+    """P×T scoring: each case's first run as predictions, its last as labels."""
+    import evaluate_cdi_accuracy
+
+    pairs = [(p["diagnosis"], t["diagnosis"]) for runs in cases
+             for p in runs[0] for t in runs[-1]]
+    mismatches = sum(reference_diagnoses_match(p, t) != evaluate_cdi_accuracy.diagnoses_match(p, t)
+                     for p, t in pairs)
+
+    def run(fn):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for p, t in pairs:
+                fn(p, t)
+        return time.perf_counter() - start
+
+    ref_t = run(reference_diagnoses_match)
+    new_t = run(evaluate_cdi_accuracy.diagnoses_match)
+    n = len(pairs) * repeat
+    print(f"diagnoses_match ({len(pairs)} pred×truth pairs × {repeat})")
+    print(f"  reference (table scan) {ref_t*1e6/n:6.1f} µs/pair")
+    print(f"  DiagnosisMatcher       {new_t*1e6/n:6.1f} µs/pair  ({ref_t/new_t:.1f}x)")
+    print(f"  outputs identical: {'yes' if not mismatches else f'NO ({mismatches} differ)'}")
+    return mismatches == 0
+
+
+def bench_sections(notes: List[str], repeat: int) -> bool:
+    from note_sections import index_note
+
+    mismatches = 0
+    for note in notes:
+        index_note.cache_clear()
+        if cdi_engine._extract_documented_diagnoses(note) != \
+                reference_extract_documented_diagnoses(note):
+            mismatches += 1
+            if mismatches <= 3:
+                print(f"  MISMATCH on note {note[:60]!r}")
+
+    def run(fn, clear):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for note in notes:
+                if clear:
+                    index_note.cache_clear()
+                fn(note)
+        return time.perf_counter() - start
+
+    ref_t = run(reference_extract_documented_diagnoses, False)
+    cold_t = run(cdi_engine._extract_documented_diagnoses, True)
+    n = len(notes) * repeat
+    kb = sum(len(x) for x in notes) / len(notes) / 1024
+    print(f"_extract_documented_diagnoses ({len(notes)} notes, avg {kb:.1f} KB × {repeat})")
+    print(f"  reference (15 findall) {ref_t*1e3/n:8.2f} ms/note")
+    print(f"  section index          {cold_t*1e3/n:8.2f} ms/note  ({ref_t/cold_t:.1f}x)")
+    print(f"  outputs identical: {'yes' if not mismatches else f'NO ({mismatches} differ)'}")
+    return mismatches == 0
+
+
+def bench_pathology(notes: List[str], repeat: int) -> bool:
+    from note_sections import index_note
+    from pathology_scanner import detect_pathology_segments
+
+    mismatches = 0
+    for note in notes:
+        index_note.cache_clear()
+        if detect_pathology_segments(note) != reference_detect_pathology_segments(note):
+            mismatches += 1
+            if mismatches <= 3:
+                print(f"  MISMATCH on note {note[:60]!r}")
+
+    def run(fn, clear):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for note in notes:
+                if clear:
+                    index_note.cache_clear()
+                fn(note)
+        return time.perf_counter() - start
+
+    def run_warm():
+        # Second scan of a note whose index (and memo) is already built —
+        # the hill-climb / re-run case; timed per note, as the notes
+        # outnumber index_note's LRU
+        total = 0.0
+        for _ in range(repeat):
+            for note in notes:
+                detect_pathology_segments(note)
+                start = time.perf_counter()
+                detect_pathology_segments(note)
+                total += time.perf_counter() - start
+        return total
+
+    ref_t = run(reference_detect_pathology_segments, False)
+    cold_t = run(detect_pathology_segments, True)
+    warm_t = run_warm()
+    n = len(notes) * repeat
+    with_segments = sum(bool(reference_detect_pathology_segments(x)) for x in notes)
+    print(f"detect_pathology_segments ({len(notes)} notes, {with_segments} with segments "
+          f"× {repeat})")
+    print(f"  reference (fresh scan) {ref_t*1e3/n:8.2f} ms/note")
+    print(f"  memo, cold index       {cold_t*1e3/n:8.2f} ms/note  ({ref_t/cold_t:.1f}x)")
+    print(f"  memo, warm index       {warm_t*1e3/n:8.2f} ms/note  ({ref_t/warm_t:.1f}x)")
+    print(f"  segments identical: {'yes' if not mismatches else f'NO ({mismatches} differ)'}")
+    return mismatches == 0
+
+
+def bench_vote(cases: List[List[List[Dict]]], repeat: int) -> bool:
+    engine = cdi_engine.CDIEngine.__new__(cdi_engine.CDIEngine)
+    rng = random.Random(0)
+
+    def signature(results):
+        return sorted(cdi_engine._normalize(r["diagnosis"]) for r in results)
+
+    pair_mismatches = order_mismatches = 0
+    for runs in cases:
+        norms = sorted({cdi_engine._normalize(p["diagnosis"]) for run in runs for p in run})
+        scores = cdi_engine._similarity_scores(norms)
+        for i, a in enumerate(norms):
+            for j, b in enumerate(norms):
+                if (scores[i, j] >= 0.5) != cdi_engine._diagnoses_similar(a, b):
+                    pair_mismatches += 1
+        # Same clusters (by vote counts and best-entry evidence length)
+        # whatever order the runs and predictions arrive in
+        shuffled = [run[:] for run in runs]
+        rng.shuffle(shuffled)
+        for run in shuffled:
+            rng.shuffle(run)
+        counts = sorted(r["vote_count"] for r in engine._vote(runs, 1))
+        if counts != sorted(r["vote_count"] for r in engine._vote(shuffled, 1)):
+            order_mismatches += 1
+
+    def run(fn):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for runs in cases:
+                fn(runs, 3)
+        return time.perf_counter() - start
+
+    ref_t = run(reference_vote)
+    new_t = run(engine._vote)
+    n = len(cases) * repeat
+    agree = sum(signature(reference_vote(r, 3)) == signature(engine._vote(r, 3))
+                for r in cases)
+    overcounted = sum(any(v["vote_count"] > v["vote_total"] for v in reference_vote(r, 3))
+                      for r in cases)
+    print(f"CDIEngine._vote ({len(cases)} cases × {len(cases[0])} runs × {repeat})")
+    print(f"  reference (bucket scan) {ref_t*1e3/n:7.2f} ms/case")
+    print(f"  clustered               {new_t*1e3/n:7.2f} ms/case  ({ref_t/new_t:.1f}x)")
+    print(f"  pairwise similarity identical: "
+          f"{'yes' if not pair_mismatches else f'NO ({pair_mismatches} pairs differ)'}")
+    print(f"  order-independent: "
+          f"{'yes' if not order_mismatches else f'NO ({order_mismatches} cases differ)'}")
+    print(f"  same voted diagnoses as reference: {agree}/{len(cases)} cases "
+          f"(reference counted a run twice in {overcounted})")
+    return pair_mismatches == 0 and order_mismatches == 0
+
+
+def bench_filter(cases: List[Tuple], repeat: int) -> bool:
+    mismatches = 0
+    for predictions, documented, full_text in cases:
+        expected = reference_filter_already_documented(predictions, documented, full_text)
+        got = cdi_engine._filter_already_documented(predictions, documented, full_text)
+        if got != expected:
+            mismatches += 1
+            if mismatches <= 3:
+                print(f"  MISMATCH on case with {len(documented)} documented lines")
+
+    def run(fn):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for predictions, documented, full_text in cases:
+                fn(predictions, documented, full_text)
+        return time.perf_counter() - start
+
+    ref_t = run(reference_filter_already_documented)
+    new_t = run(cdi_engine._filter_already_documented)
+    n = len(cases) * repeat
+    pairs = sum(len(p) * len(d) for p, d, _ in cases)
+    print(f"_filter_already_documented ({len(cases)} cases, {pairs} pred×doc pairs × {repeat})")
+    print(f"  reference (pairwise) {ref_t*1e3/n:8.2f} ms/case")
+    print(f"  indexed              {new_t*1e3/n:8.2f} ms/case  ({ref_t/new_t:.1f}x)")
+    print(f"  decisions identical: {'yes' if not mismatches else f'NO ({mismatches} differ)'}")
+    return mismatches == 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Equivalence + timing for engine hot paths')
+    parser.add_argument('--data', type=str, default=None,
+                        help='Evaluation CSV to draw real inputs from (optional)')
+    parser.add_argument('--synthetic', type=int, default=5000,
+                        help='Number of synthetic inputs (default 5000)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Timing repetitions over the corpus (default 3)')
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.synthetic)
+    cases = synthetic_filter_cases()
+    notes = synthetic_notes()
+    if args.data:
+        real, real_cases, real_notes = data_corpus(args.data)
+        print(f"Loaded {len(real)} inputs / {len(real_cases)} cases from {args.data}")
+        corpus = real + corpus
+        cases = real_cases + cases
+        notes = real_notes + notes
+
+    ok = bench_normalise(corpus, args.repeat)
+    print()
+    ok = bench_filter(cases, args.repeat) and ok
+    print()
+    ok = bench_classify(corpus, args.repeat) and ok
+    print()
+    ok = bench_sections(notes, args.repeat) and ok
+    print()
+    ok = bench_pathology(synthetic_pathology_notes(notes), args.repeat) and ok
+    print()
+    vote_cases = synthetic_vote_cases()
+    ok = bench_match(vote_cases, args.repeat) and ok
+    print()
+    ok = bench_vote(vote_cases, args.repeat) and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -59,13 +59,9 @@ from __future__ import annotations
 
 import json
 import re
-import time
-import random
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
-import requests
-
 from cdi_engine import (
     BEDROCK_MODEL_IDS,
     BEDROCK_BASE,
@@ -73,6 +69,9 @@ from cdi_engine import (
     estimate_revenue_impact,
     CATEGORY_META,
 )
+from gateway_client import post_json
+from prompt_cache import CACHE_CONTROL, BEDROCK_PROMPT_CACHE, bedrock_system, \
+    bedrock_user_content, track_usage
 
 
 # ===========================================================================
@@ -196,6 +195,13 @@ Query when pathology/cytology/biopsy findings are NOT in discharge diagnoses:
 Every diagnosis must be traceable to documented clinical evidence. Do not invent findings or rely on risk factors alone.
 """
 
+# Fixed opening of the first user message; the notes follow it. Kept as a
+# constant so it can be a prompt-caching breakpoint shared by every case.
+AGENT_USER_PREFIX = (
+    "Analyse this clinical encounter for missed or under-specified diagnoses. "
+    "Review all available notes, then call the report_diagnoses tool with your findings.\n\n"
+)
+
 
 # ===========================================================================
 # TOOL DEFINITIONS (Anthropic native format — Bedrock-compatible)
@@ -273,31 +279,27 @@ class CDIAgentRunner:
     # --- Bedrock call --------------------------------------------------
 
     def _bedrock_call(self, system: str, messages: list, tools: list) -> dict:
-        """Single Bedrock invocation. Returns parsed JSON response."""
-        headers = {
-            "Content-Type": "application/json",
-            "api-key": self.api_key,
-        }
+        """Single Bedrock invocation. Returns parsed JSON response.
+
+        Every turn resends the tools, AGENT_SYSTEM_PROMPT, the notes and the
+        conversation so far. Prompt-caching breakpoints (prompt_cache.py)
+        sit after the system prompt (which covers the tools too), inside the
+        first message (set by _run_tool_loop) and on the latest message,
+        so each turn reads everything before its newest message from cache.
+        """
+        if BEDROCK_PROMPT_CACHE and len(messages) > 1 and isinstance(messages[-1]["content"], list):
+            last = messages[-1]
+            blocks = list(last["content"])
+            blocks[-1] = dict(blocks[-1], cache_control=CACHE_CONTROL)
+            messages = messages[:-1] + [dict(last, content=blocks)]
         body = {
             "anthropic_version": "bedrock-2023-05-31",
             "max_tokens": self.max_tokens,
-            "system": system,
+            "system": bedrock_system(system),
             "messages": messages,
             "tools": tools,
         }
-        for attempt in range(5):
-            try:
-                resp = requests.post(self.url, headers=headers,
-                                     data=json.dumps(body), timeout=300)
-                if resp.status_code == 429 or resp.status_code >= 500:
-                    time.sleep(2 ** (attempt + 1) + random.random() * 2)
-                    continue
-                if resp.status_code != 200:
-                    raise RuntimeError(f"Bedrock {resp.status_code}: {resp.text[:300]}")
-                return resp.json()
-            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-                time.sleep(2 ** (attempt + 1) + random.random() * 2)
-        raise RuntimeError("Bedrock call failed after 5 retries")
+        return post_json(self.url, body, self.api_key, label="Bedrock")
 
     # --- Tool-use loop -------------------------------------------------
 
@@ -311,7 +313,8 @@ class CDIAgentRunner:
           - max_turns reached (failure)
           - Claude stops without calling report_diagnoses (failure)
         """
-        messages = [{"role": "user", "content": user_content}]
+        messages = [{"role": "user",
+                     "content": bedrock_user_content(user_content, AGENT_USER_PREFIX)}]
         tools = [REPORT_DIAGNOSES_TOOL]
 
         for turn in range(self.max_turns):
@@ -415,12 +418,7 @@ class CDIAgentRunner:
         if ip_consult_note:
             parts.append("\n\nINPATIENT CONSULT NOTE:\n" + ip_consult_note)
 
-        body = "".join(parts)
-        return (
-            "Analyse this clinical encounter for missed or under-specified diagnoses. "
-            "Review all available notes, then call the report_diagnoses tool with your findings.\n\n"
-            + body
-        )
+        return AGENT_USER_PREFIX + "".join(parts)
 
     # --- Public API ----------------------------------------------------
 
@@ -430,7 +428,8 @@ class CDIAgentRunner:
         user_content = self._build_user_content(discharge_summary, **note_kwargs)
 
         try:
-            diagnoses, rationale, turns_used = self._run_tool_loop(user_content)
+            with track_usage() as usage:
+                diagnoses, rationale, turns_used = self._run_tool_loop(user_content)
         except RuntimeError as e:
             # Agent failed — return empty predictions with error metadata
             return {
@@ -453,6 +452,7 @@ class CDIAgentRunner:
                     "timestamp": datetime.now().isoformat(),
                     "engine_version": "agent-1.0.0",
                     "turns_used": 0,
+                    "token_usage": usage.snapshot(),
                 },
             }
 
@@ -509,6 +509,7 @@ class CDIAgentRunner:
                 "engine_version": "agent-1.0.0",
                 "turns_used": turns_used,
                 "max_turns": self.max_turns,
+                "token_usage": usage.snapshot(),
             },
         }
 
@@ -20,20 +20,52 @@ Usage:
         mode="balanced",          # "fast" | "balanced" | "high_recall"
     )
 
+    # From asyncio code (analyse() is a blocking wrapper over analyse_async;
+    # needs httpx): one case, or many with bounded concurrency
+    result = await engine.analyse_async(discharge_summary="...", mode="fast")
+    async for index, result in engine.analyse_many(cases, concurrency=8):
+        ...
+
+    # A CSV / JSONL / Parquet file of encounters → results JSONL (engine_batch.py)
+    python cdi_engine.py batch --api-key KEY --input cases.csv --output results.jsonl
+
 Modes:
     fast         — single pass with v15 prompt (1 API call, ~55% recall)
     balanced     — 3x self-consistency voting (3 API calls, best F1)
     high_recall  — 5x voting with lower threshold (5 API calls, max recall)
+
+    Voting passes run concurrently, so balanced/high_recall take about as
+    long as a single call.
 """
 
+import asyncio
+import atexit
+import contextvars
 import json
 import re
+import threading
 import time
-import random
-import requests
-from typing import Dict, List, Optional, Tuple
+from bisect import bisect_right
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import (Any, AsyncIterator, Awaitable, Dict, Generator, Iterable, Iterator,
+                    List, Optional, Tuple, Union)
 from datetime import datetime
 
+import numpy as np
+
+from gateway_client import (GatewayError, close_async_client, post_json, post_json_async,
+                            stream_events)
+from completion_planner import (current_reasoning_effort, parse_reasoning_effort,
+                                plan_completion, record_completion, use_reasoning_effort)
+from json_stream import ItemStream, extract_items, record_parse, track_parses
+from llm_cache import (cache_key, cached_llm_call, cached_llm_call_async,
+                       cached_llm_samples_async, cached_llm_stream)
+from note_packer import count_tokens, input_budget, pack_notes
+from note_sections import index_note
+from pattern_classifier import KeywordClassifier
+from prompt_cache import bedrock_system, bedrock_user_content, track_usage
+
 
 # ===========================================================================
 # STANFORD API
@@ -76,27 +108,68 @@ def _is_bedrock_model(model: str) -> bool:
     return model.startswith("claude")
 
 
-def _call_bedrock(messages: list, api_key: str, model: str,
-                  max_tokens: int = 8000) -> str:
-    """Call a Claude model via AWS Bedrock through the AI Hub gateway.
+# ===========================================================================
+# STRUCTURED OUTPUT
+# ===========================================================================
+# With structured output on (CDIEngine(structured_output=True)), prediction
+# passes ask the provider to enforce the prediction shape instead of hoping
+# the model returns a parseable JSON array:
+#   Azure    response_format json_schema (strict) — the reply is
+#            {"diagnoses": [...]}; both schema roots must be objects.
+#   Bedrock  a forced report_diagnoses tool call; _call_bedrock returns the
+#            tool input's diagnoses array as JSON text.
+# _parse_llm_response accepts either shape, plus free text.
+
+PREDICTION_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "diagnosis": {"type": "string"},
+        "icd10_code": {"type": "string"},
+        "category": {"type": "string", "enum": [
+            "sepsis", "respiratory", "anemia", "malnutrition", "electrolytes",
+            "cardiac", "renal", "coagulation", "pressure_ulcer", "encephalopathy",
+            "obesity", "other"]},
+        "confidence": {"type": "string", "enum": ["high", "medium", "low"]},
+        "evidence": {"type": "string"},
+    },
+    "required": ["diagnosis", "icd10_code", "category", "confidence", "evidence"],
+    "additionalProperties": False,
+}
+
+PREDICTION_SCHEMA = {
+    "type": "object",
+    "properties": {"diagnoses": {"type": "array", "items": PREDICTION_ITEM_SCHEMA}},
+    "required": ["diagnoses"],
+    "additionalProperties": False,
+}
+
+AZURE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "cdi_predictions", "strict": True, "schema": PREDICTION_SCHEMA},
+}
+
+BEDROCK_PREDICTION_TOOL = {
+    "name": "report_diagnoses",
+    "description": "Report the missed or under-specified diagnoses found in the notes.",
+    "input_schema": PREDICTION_SCHEMA,
+}
 
-    Bedrock wraps Anthropic's native messages API but requires
-    `anthropic_version` and does NOT take `model` in the body (model is in
-    the URL path). Response shape matches Anthropic native: top-level
-    `content` array of {type, text} blocks.
-    """
-    bedrock_id = BEDROCK_MODEL_IDS.get(model)
-    if not bedrock_id:
-        raise RuntimeError(f"Unknown Claude model: {model}. "
-                           f"Known: {list(BEDROCK_MODEL_IDS)}")
-    url = BEDROCK_BASE.format(bedrock_id)
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": api_key,
-    }
 
-    # Bedrock body: anthropic_version is required; system prompt goes
-    # in a top-level "system" field, NOT as a message with role "system".
+def _bedrock_body(messages: list, max_tokens: int,
+                  static_prefix: Optional[str] = None,
+                  structured: bool = False) -> dict:
+    """Build a Bedrock-Anthropic request body from OpenAI-style messages.
+
+    Bedrock body: anthropic_version is required; system prompt goes in a
+    top-level "system" field, NOT as a message with role "system".
+
+    Prompt-caching breakpoints (prompt_cache.py) go after the system
+    prompt, after `static_prefix` (the variant's fixed instructions at the
+    start of the last user message) and after the notes.
+
+    structured=True forces a report_diagnoses tool call (see STRUCTURED
+    OUTPUT).
+    """
     system_text = ""
     user_messages = []
     for m in messages:
@@ -105,68 +178,153 @@ def _call_bedrock(messages: list, api_key: str, model: str,
         else:
             user_messages.append(m)
 
+    if user_messages and isinstance(user_messages[-1]["content"], str):
+        last = user_messages[-1]
+        user_messages[-1] = dict(last, content=bedrock_user_content(last["content"],
+                                                                    static_prefix))
+
     body = {
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": max_tokens,
         "messages": user_messages,
     }
     if system_text.strip():
-        body["system"] = system_text.strip()
+        body["system"] = bedrock_system(system_text.strip())
+    if structured:
+        body["tools"] = [BEDROCK_PREDICTION_TOOL]
+        body["tool_choice"] = {"type": "tool", "name": BEDROCK_PREDICTION_TOOL["name"]}
+    return body
 
-    for attempt in range(5):
-        try:
-            resp = requests.post(url, headers=headers,
-                                 data=json.dumps(body), timeout=300)
 
-            if resp.status_code == 429 or resp.status_code >= 500:
-                wait = 2 ** (attempt + 1) + random.random() * 2
-                time.sleep(wait)
-                continue
+# Each backend call is written once, as an exchange: a generator that
+# yields (url, body) for every request it needs and is sent back the
+# decoded response, returning the text. _post drives it with blocking
+# post_json calls (_call_llm, for the scripts that call it directly),
+# _post_async with post_json_async (CDIEngine); the request logic is shared.
+Exchange = Generator[Tuple[str, dict], dict, Any]
 
-            if resp.status_code != 200:
-                if 400 <= resp.status_code < 500 and resp.status_code != 429:
-                    raise RuntimeError(f"API {resp.status_code}: {resp.text[:300]}")
-                wait = 2 ** (attempt + 1)
-                time.sleep(wait)
-                continue
 
-            data = resp.json()
-            # Bedrock-Anthropic response: {"content": [{"type":"text","text":...}], ...}
-            content_blocks = data.get("content", [])
-            text_chunks = [b.get("text", "") for b in content_blocks
-                           if b.get("type") == "text"]
-            content = "".join(text_chunks)
+def _post(exchange: Exchange, api_key: str) -> Any:
+    """Run an exchange with post_json."""
+    try:
+        url, body = next(exchange)
+        while True:
+            url, body = exchange.send(post_json(url, body, api_key))
+    except StopIteration as done:
+        return done.value
+
 
-            if not content:
-                stop = data.get("stop_reason", "unknown")
-                if stop == "max_tokens":
-                    raise RuntimeError(
-                        f"Bedrock response truncated at max_tokens={max_tokens}"
-                    )
-                return ""
+async def _post_async(exchange: Exchange, api_key: str) -> Any:
+    """Run an exchange with post_json_async."""
+    try:
+        url, body = next(exchange)
+        while True:
+            url, body = exchange.send(await post_json_async(url, body, api_key))
+    except StopIteration as done:
+        return done.value
 
-            time.sleep(0.5)
-            return content
 
-        except requests.exceptions.Timeout:
-            time.sleep(2 ** (attempt + 1) + random.random() * 2)
-        except requests.exceptions.ConnectionError:
-            time.sleep(2 ** (attempt + 1) + random.random() * 2)
+def _call_bedrock(messages: list, api_key: str, model: str,
+                  max_tokens: int = 8000,
+                  static_prefix: Optional[str] = None,
+                  structured: bool = False) -> str:
+    """Call a Claude model via AWS Bedrock through the AI Hub gateway.
+
+    Bedrock wraps Anthropic's native messages API but requires
+    `anthropic_version` and does NOT take `model` in the body (model is in
+    the URL path). Response shape matches Anthropic native: top-level
+    `content` array of {type, text} blocks.
+    """
+    return _post(_bedrock_exchange(messages, model, max_tokens, static_prefix, structured),
+                 api_key)
+
 
-    raise RuntimeError("API call failed after 5 retries")
+def _bedrock_exchange(messages: list, model: str, max_tokens: int,
+                      static_prefix: Optional[str], structured: bool) -> Exchange:
+    bedrock_id = BEDROCK_MODEL_IDS.get(model)
+    if not bedrock_id:
+        raise RuntimeError(f"Unknown Claude model: {model}. "
+                           f"Known: {list(BEDROCK_MODEL_IDS)}")
+    url = BEDROCK_BASE.format(bedrock_id)
+
+    data = yield url, _bedrock_body(messages, max_tokens, static_prefix, structured)
+    # Bedrock-Anthropic response: {"content": [{"type":"text","text":...}], ...}
+    content_blocks = data.get("content", [])
+    if structured:
+        for b in content_blocks:
+            if b.get("type") == "tool_use":
+                return json.dumps(b.get("input", {}).get("diagnoses", []))
+    text_chunks = [b.get("text", "") for b in content_blocks
+                   if b.get("type") == "text"]
+    content = "".join(text_chunks)
+
+    if not content:
+        stop = data.get("stop_reason", "unknown")
+        if stop == "max_tokens":
+            raise RuntimeError(
+                f"Bedrock response truncated at max_tokens={max_tokens}"
+            )
+        return ""
+
+    return content
+
+
+def _azure_body(model: str, messages: list, temperature: float,
+                max_tokens: int, reasoning_effort: Optional[str] = None,
+                structured: bool = False) -> dict:
+    """Build an Azure OpenAI chat-completions request body.
+
+    GPT-5 deployments reject custom temperature and take
+    max_completion_tokens (reasoning + output) and reasoning_effort;
+    older models take temperature and a 4k output cap. structured=True
+    adds the prediction JSON schema (see STRUCTURED OUTPUT).
+    """
+    body = {"model": model, "messages": messages}
+    if model.startswith("gpt-5"):
+        body["max_completion_tokens"] = max_tokens
+        if reasoning_effort:
+            body["reasoning_effort"] = reasoning_effort
+    else:
+        body["temperature"] = temperature
+        body["max_tokens"] = 4000
+    if structured:
+        body["response_format"] = AZURE_RESPONSE_FORMAT
+    return body
 
 
 def _call_llm(messages: list, api_key: str, model: str = "gpt-5",
-              temperature: float = 0.2, max_tokens: int = 32000) -> str:
+              temperature: float = 0.2, max_tokens: int = 32000,
+              sample: int = 0, static_prefix: Optional[str] = None,
+              reasoning_effort: Optional[str] = None,
+              structured: bool = False) -> str:
     """Dispatch to the right backend (Azure OpenAI or AWS Bedrock).
 
     GPT-5 note: max_completion_tokens covers BOTH reasoning tokens and output
     tokens. With 16k, reasoning often consumes everything. Default raised to 32k.
     If truncated, retries automatically with doubled budget (up to 65k).
+    completion_planner.py raises the starting budget where past usage of
+    the same kind of request says 32k won't be enough, and supplies
+    reasoning_effort (argument, else the use_reasoning_effort() context).
+
+    structured=True has the provider enforce the prediction schema (see
+    STRUCTURED OUTPUT); it is part of the cache key.
 
     Claude (Bedrock) note: max_tokens is just output budget; no reasoning-token
     overhead. Default 8000 is fine for the v15 prompt.
 
+    Transport (pooled session, timeouts, 429/5xx retry) lives in
+    gateway_client.post_json; permanent 4xx surface as GatewayError.
+
+    If an LLM response cache is configured (llm_cache.py, opt-in), identical
+    requests are answered from disk. `sample` distinguishes repeated
+    samples of the same request (self-consistency passes) so each keeps its
+    own cache entry.
+
+    `static_prefix` is the fixed instruction text the user message starts
+    with; Bedrock gets a prompt-caching breakpoint after it (Azure caches
+    any repeated prefix automatically). It doesn't change the request
+    text or its cache key.
+
     Possible 401 causes (printed via 4xx error on the hint block in
     cdi_llm_predictor.py):
       1. API key has expired or wrong subscription —
@@ -177,71 +335,248 @@ def _call_llm(messages: list, api_key: str, model: str = "gpt-5",
     """
     if _is_bedrock_model(model):
         # Bedrock has its own (smaller, output-only) token budget
-        return _call_bedrock(messages, api_key, model, max_tokens=8000)
+        return cached_llm_call(
+            model, messages, temperature, 8000,
+            lambda: _call_bedrock(messages, api_key, model, max_tokens=8000,
+                                  static_prefix=static_prefix, structured=structured),
+            sample=sample, structured=structured)
+
+    effort = reasoning_effort or current_reasoning_effort()
+    # The cache key keeps the caller's budget: the planned one moves as
+    # history accumulates, the response it buys doesn't
+    return cached_llm_call(
+        model, messages, temperature, max_tokens,
+        lambda: _call_azure(messages, api_key, model, temperature, max_tokens, effort,
+                            structured, static_prefix),
+        sample=sample, reasoning_effort=effort, structured=structured)
+
+
+async def _call_llm_async(messages: list, api_key: str, model: str = "gpt-5",
+                          temperature: float = 0.2, max_tokens: int = 32000,
+                          sample: int = 0, static_prefix: Optional[str] = None,
+                          reasoning_effort: Optional[str] = None,
+                          structured: bool = False) -> str:
+    """_call_llm for asyncio callers: the same request, cache entry and
+    retries, sent with post_json_async."""
+    if _is_bedrock_model(model):
+        return await cached_llm_call_async(
+            model, messages, temperature, 8000,
+            lambda: _post_async(_bedrock_exchange(messages, model, 8000, static_prefix,
+                                                  structured), api_key),
+            sample=sample, structured=structured)
+
+    effort = reasoning_effort or current_reasoning_effort()
+    return await cached_llm_call_async(
+        model, messages, temperature, max_tokens,
+        lambda: _post_async(_azure_exchange(messages, model, temperature, max_tokens, effort,
+                                            structured, static_prefix), api_key),
+        sample=sample, reasoning_effort=effort, structured=structured)
+
+
+def _plan_budget(model: str, messages: list, max_tokens: int,
+                 effort: Optional[str],
+                 static_prefix: Optional[str] = None) -> Tuple[int, Optional[str]]:
+    """(starting budget, planner key); only GPT-5 budgets are planned.
+
+    The key is None for other models, and "" for GPT-5 requests with no
+    fixed instructions to key on (recorded for the tally only).
+    """
+    if not model.startswith("gpt-5"):
+        return max_tokens, None
+    return plan_completion(model, messages, max_tokens, effort, static_prefix)
 
+
+def _call_azure(messages: list, api_key: str, model: str,
+                temperature: float, max_tokens: int,
+                reasoning_effort: Optional[str] = None,
+                structured: bool = False,
+                static_prefix: Optional[str] = None) -> str:
+    """Call an Azure OpenAI deployment, doubling the GPT-5 budget on truncation."""
+    return _post(_azure_exchange(messages, model, temperature, max_tokens, reasoning_effort,
+                                 structured, static_prefix), api_key)
+
+
+def _azure_exchange(messages: list, model: str, temperature: float, max_tokens: int,
+                    reasoning_effort: Optional[str], structured: bool,
+                    static_prefix: Optional[str]) -> Exchange:
     url = API_ENDPOINTS.get(model, API_ENDPOINTS["gpt-5"])
-    headers = {
-        "Content-Type": "application/json",
-        # AI Hub gateway (aihubapi.stanfordhealthcare.org) uses "api-key"
-        # header, not the old APIM "Ocp-Apim-Subscription-Key" header.
-        # Confirmed via WWW-Authenticate response header from the new gateway.
-        "api-key": api_key,
-    }
+    current_max, plan_key = _plan_budget(model, messages, max_tokens, reasoning_effort,
+                                         static_prefix)
+
+    while True:
+        data = yield url, _azure_body(model, messages, temperature, current_max,
+                                      reasoning_effort, structured)
+        content = data["choices"][0]["message"]["content"]
+        fr = data["choices"][0].get("finish_reason", "unknown")
+        if plan_key is not None:
+            record_completion(plan_key, data, truncated=not content and fr == "length")
+
+        if content is None or content == "":
+            if fr == "length":
+                # Reasoning consumed all tokens — retry with doubled budget
+                if current_max < 65000:
+                    current_max = min(current_max * 2, 65000)
+                    print(f"    Reasoning consumed all tokens, retrying with max_completion_tokens={current_max}")
+                    continue
+                raise RuntimeError(
+                    f"Response truncated even at {current_max} tokens — "
+                    "reasoning consumed entire budget"
+                )
+            return ""
 
-    is_gpt5 = model.startswith("gpt-5")
-    current_max = max_tokens
+        return content
 
-    for attempt in range(5):
-        body = {"model": model, "messages": messages}
-        if is_gpt5:
-            body["max_completion_tokens"] = current_max
-        else:
-            body["temperature"] = temperature
-            body["max_tokens"] = 4000
 
-        try:
-            resp = requests.post(url, headers=headers,
-                                 data=json.dumps(body), timeout=300)
+async def _call_llm_samples_async(messages: list, api_key: str, model: str,
+                                  temperature: float, samples: List[int],
+                                  max_tokens: int = 32000,
+                                  reasoning_effort: Optional[str] = None,
+                                  structured: bool = False,
+                                  static_prefix: Optional[str] = None) -> List[str]:
+    """All voting samples of one prompt from a single Azure request (`n`).
 
-            if resp.status_code == 429 or resp.status_code >= 500:
-                wait = 2 ** (attempt + 1) + random.random() * 2
-                time.sleep(wait)
+    One prompt ingestion and one queue slot instead of len(samples). Returns
+    one response per entry of `samples`, in order; each is cached under the
+    same key as the matching one-sample _call_llm(sample=i) call. Bedrock
+    has no `n` — callers use concurrent single calls there.
+    """
+    if _is_bedrock_model(model):
+        raise ValueError(f"{model} does not support n-sampling")
+    effort = reasoning_effort or current_reasoning_effort()
+    return await cached_llm_samples_async(
+        model, messages, temperature, max_tokens, samples,
+        lambda n: _post_async(_azure_n_exchange(messages, model, temperature, max_tokens, n,
+                                                effort, structured, static_prefix), api_key),
+        reasoning_effort=effort, structured=structured)
+
+
+def _azure_n_exchange(messages: list, model: str, temperature: float, max_tokens: int,
+                      n: int, reasoning_effort: Optional[str], structured: bool,
+                      static_prefix: Optional[str]) -> Exchange:
+    """Request n completions in one call; doubles the GPT-5 budget on truncation.
+
+    Choices that come back empty are returned as "" (the vote drops them,
+    like a failed pass). The budget is only raised when every choice was
+    cut off by the length limit.
+    """
+    url = API_ENDPOINTS.get(model, API_ENDPOINTS["gpt-5"])
+    current_max, plan_key = _plan_budget(model, messages, max_tokens, reasoning_effort,
+                                         static_prefix)
+
+    while True:
+        body = _azure_body(model, messages, temperature, current_max, reasoning_effort,
+                           structured)
+        body["n"] = n
+        data = yield url, body
+        choices = sorted(data.get("choices", []), key=lambda c: c.get("index", 0))
+        contents = [c["message"].get("content") or "" for c in choices]
+        truncated = not any(contents) and bool(choices) and all(
+            c.get("finish_reason") == "length" for c in choices)
+        if plan_key is not None:
+            record_completion(plan_key, data, truncated, n=n)
+
+        if truncated:
+            if current_max < 65000:
+                current_max = min(current_max * 2, 65000)
+                print(f"    Reasoning consumed all tokens, retrying with max_completion_tokens={current_max}")
                 continue
+            raise RuntimeError(
+                f"Response truncated even at {current_max} tokens — "
+                "reasoning consumed entire budget"
+            )
 
-            if resp.status_code != 200:
-                if 400 <= resp.status_code < 500 and resp.status_code != 429:
-                    raise RuntimeError(f"API {resp.status_code}: {resp.text[:300]}")
-                wait = 2 ** (attempt + 1)
-                time.sleep(wait)
-                continue
+        return (contents + [""] * n)[:n]
 
-            data = resp.json()
-            content = data["choices"][0]["message"]["content"]
 
-            if content is None or content == "":
-                fr = data["choices"][0].get("finish_reason", "unknown")
-                if fr == "length":
-                    # Reasoning consumed all tokens — retry with doubled budget
-                    if current_max < 65000:
-                        current_max = min(current_max * 2, 65000)
-                        print(f"    Reasoning consumed all tokens, retrying with max_completion_tokens={current_max}")
-                        time.sleep(1)
-                        continue
-                    raise RuntimeError(
-                        f"Response truncated even at {current_max} tokens — "
-                        "reasoning consumed entire budget"
-                    )
-                return ""
+def _stream_llm(messages: list, api_key: str, model: str = "gpt-5",
+                temperature: float = 0.2, max_tokens: int = 32000,
+                sample: int = 0, static_prefix: Optional[str] = None,
+                structured: bool = False) -> Iterator[str]:
+    """_call_llm, streamed: yields the response text as it is generated.
 
-            time.sleep(0.5)
-            return content
+    Same request and same cache entry as _call_llm (a cache hit comes back
+    as one chunk). GPT-5's doubled-budget retry still applies — a
+    truncated reasoning-only response has produced no text, so nothing
+    has been yielded when it is resent.
+    """
+    effort = current_reasoning_effort()
+    if _is_bedrock_model(model):
+        return cached_llm_stream(
+            model, messages, temperature, 8000,
+            lambda: _stream_bedrock(messages, api_key, model, 8000, static_prefix, structured),
+            sample=sample, structured=structured)
+    return cached_llm_stream(
+        model, messages, temperature, max_tokens,
+        lambda: _stream_azure(messages, api_key, model, temperature, max_tokens, effort,
+                              structured, static_prefix),
+        sample=sample, reasoning_effort=effort, structured=structured)
+
+
+def _stream_azure(messages: list, api_key: str, model: str, temperature: float,
+                  max_tokens: int, reasoning_effort: Optional[str] = None,
+                  structured: bool = False,
+                  static_prefix: Optional[str] = None) -> Iterator[str]:
+    url = API_ENDPOINTS.get(model, API_ENDPOINTS["gpt-5"])
+    current_max, plan_key = _plan_budget(model, messages, max_tokens, reasoning_effort,
+                                         static_prefix)
+
+    while True:
+        body = _azure_body(model, messages, temperature, current_max, reasoning_effort,
+                           structured)
+        body["stream"] = True
+        body["stream_options"] = {"include_usage": True}
+        produced = False
+        finish = None
+        usage = {}
+        for event in stream_events(url, body, api_key):
+            usage.update(event.get("usage") or {})
+            for choice in event.get("choices") or []:
+                text = (choice.get("delta") or {}).get("content")
+                if text:
+                    produced = True
+                    yield text
+                finish = choice.get("finish_reason") or finish
+        truncated = not produced and finish == "length"
+        if plan_key is not None:
+            record_completion(plan_key, {"usage": usage}, truncated)
+
+        if truncated:
+            if current_max < 65000:
+                current_max = min(current_max * 2, 65000)
+                print(f"    Reasoning consumed all tokens, retrying with max_completion_tokens={current_max}")
+                continue
+            raise RuntimeError(
+                f"Response truncated even at {current_max} tokens — "
+                "reasoning consumed entire budget"
+            )
+        return
 
-        except requests.exceptions.Timeout:
-            time.sleep(2 ** (attempt + 1) + random.random() * 2)
-        except requests.exceptions.ConnectionError:
-            time.sleep(2 ** (attempt + 1) + random.random() * 2)
 
-    raise RuntimeError("API call failed after 5 retries")
+def _stream_bedrock(messages: list, api_key: str, model: str, max_tokens: int,
+                    static_prefix: Optional[str] = None,
+                    structured: bool = False) -> Iterator[str]:
+    """Bedrock invoke-with-response-stream. With structured output the
+    forced tool call's input JSON ({"diagnoses": [...]}) is streamed."""
+    bedrock_id = BEDROCK_MODEL_IDS.get(model)
+    if not bedrock_id:
+        raise RuntimeError(f"Unknown Claude model: {model}. "
+                           f"Known: {list(BEDROCK_MODEL_IDS)}")
+    url = BEDROCK_BASE.format(bedrock_id) + "-with-response-stream"
+    body = _bedrock_body(messages, max_tokens, static_prefix, structured)
+
+    produced = False
+    stop = None
+    for event in stream_events(url, body, api_key, label="Bedrock"):
+        if event.get("type") == "content_block_delta":
+            delta = event.get("delta") or {}
+            text = delta.get("text") or delta.get("partial_json")
+            if text:
+                produced = True
+                yield text
+        elif event.get("type") == "message_delta":
+            stop = (event.get("delta") or {}).get("stop_reason") or stop
+    if not produced and stop == "max_tokens":
+        raise RuntimeError(f"Bedrock response truncated at max_tokens={max_tokens}")
 
 
 # ===========================================================================
@@ -351,21 +686,14 @@ CC_PATTERNS = {
 }
 
 
-def classify_drg_impact(diagnosis: str) -> str:
-    """Classify diagnosis as MCC, CC, or non-CC based on clinical terminology."""
-    dx_lower = diagnosis.lower().strip()
+# Both tables compiled into one scan (pattern_classifier.py); MCC wins over CC
+_DRG_CLASSIFIER = KeywordClassifier([("MCC", MCC_PATTERNS), ("CC", CC_PATTERNS)],
+                                    default="non-CC")
 
-    # Check MCC first (higher priority)
-    for pattern in MCC_PATTERNS:
-        if pattern in dx_lower:
-            return "MCC"
 
-    # Check CC
-    for pattern in CC_PATTERNS:
-        if pattern in dx_lower:
-            return "CC"
-
-    return "non-CC"
+def classify_drg_impact(diagnosis: str) -> str:
+    """Classify diagnosis as MCC, CC, or non-CC based on clinical terminology."""
+    return _DRG_CLASSIFIER.classify(diagnosis.lower().strip())
 
 
 def estimate_revenue_impact(drg_class: str) -> str:
@@ -411,8 +739,10 @@ def _extract_documented_diagnoses(discharge_summary: str) -> List[str]:
     """
     documented = []
 
-    # Normalise: BigQuery CSVs often flatten newlines to double spaces
-    text = re.sub(r'  +', '\n', discharge_summary)
+    # Parsed once per note and shared with other extractors; the index also
+    # undoes BigQuery's newline → double-space flattening.
+    sections = index_note(discharge_summary)
+    text = sections.text
 
     section_headers = [
         # Standard formal diagnosis sections
@@ -436,9 +766,9 @@ def _extract_documented_diagnoses(discharge_summary: str) -> List[str]:
     ]
 
     for header in section_headers:
-        pattern = header + r'\s*:?\s*\n(.*?)(?=\n[A-Z][A-Za-z\s/]{3,}:|$)'
-        matches = re.findall(pattern, text, re.DOTALL | re.IGNORECASE)
-        for match in matches:
+        # Section body = text after "<header>:\n" up to the next "Header:"
+        # line (see note_sections.NoteSections.body_spans)
+        for match in sections.bodies(header):
             for line in match.split('\n'):
                 line = line.strip()
                 if not line or len(line) < 4:
@@ -542,6 +872,37 @@ _NON_CODABLE_MARKERS = [
 ]
 
 
+# Compiled forms of the two tables above. _normalise_diagnosis
+# runs once per (prediction, documented) pair in the documented filter and
+# once on the full discharge summary, so it is the hottest function in the
+# post-processing path. Markers stay a sequential list (each strip can
+# change what the next one sees); synonyms are one alternation with a
+# group-index → replacement table. Every synonym starts with \b, which is
+# hoisted out of the alternation so the engine only tries the branches at
+# word boundaries (~3x faster than testing all 35 at every offset). Tables
+# are edited above, never here.
+_NON_CODABLE_RES = [re.compile(m) for m in _NON_CODABLE_MARKERS]
+assert all(p.startswith(r'\b') for p, _ in _CLINICAL_SYNONYMS), \
+    "_CLINICAL_SYNONYMS patterns must start with \\b"
+_SYNONYM_RE = re.compile(
+    r'\b(?:' + "|".join(f"({p[2:]})" for p, _ in _CLINICAL_SYNONYMS) + ")")
+_SYNONYM_REPLACEMENTS = {i: r for i, (_, r) in enumerate(_CLINICAL_SYNONYMS, 1)}
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_SPACE_RE = re.compile(r'\s+')
+
+# The sequential table applied each synonym to the output of the previous
+# ones, so a replacement could feed a later pattern ("post-op acute
+# posthemorrhagic anemia" → "post-op acute blood loss anemia" → "acute
+# blood loss anemia"). One alternation pass can't see its own output, so
+# repeat until stable; no chain in the table is longer than this.
+_SYNONYM_MAX_PASSES = 4
+
+
+def _synonym_sub(match: "re.Match") -> str:
+    return _SYNONYM_REPLACEMENTS[match.lastindex]
+
+
+@lru_cache(maxsize=16384)
 def _normalise_diagnosis(text: str) -> str:
     """Canonicalise a diagnosis string for comparison.
 
@@ -550,20 +911,27 @@ def _normalise_diagnosis(text: str) -> str:
       2. Strip non-codable markers (POA, stages, BMI parentheticals, etc.)
       3. Expand/collapse clinical synonyms to canonical forms
       4. Collapse whitespace and punctuation
+
+    Memoised — the same documented diagnoses are normalised against every
+    prediction. scripts/bench_hotpaths.py checks the output is identical
+    to the original pattern-by-pattern implementation.
     """
     s = text.lower().strip()
 
     # Strip parentheticals that are pure qualifiers
-    for marker in _NON_CODABLE_MARKERS:
-        s = re.sub(marker, ' ', s)
+    for marker in _NON_CODABLE_RES:
+        s = marker.sub(' ', s)
 
     # Apply synonym normalisation
-    for pattern, replacement in _CLINICAL_SYNONYMS:
-        s = re.sub(pattern, replacement, s)
+    for _ in range(_SYNONYM_MAX_PASSES):
+        expanded, n = _SYNONYM_RE.subn(_synonym_sub, s)
+        if not n or expanded == s:
+            break
+        s = expanded
 
     # Collapse punctuation and whitespace
-    s = re.sub(r'[^\w\s]', ' ', s)
-    s = re.sub(r'\s+', ' ', s).strip()
+    s = _PUNCT_RE.sub(' ', s)
+    s = _SPACE_RE.sub(' ', s).strip()
     return s
 
 
@@ -591,9 +959,44 @@ def _is_specificity_upgrade(pred_dx: str, doc_dx: str) -> bool:
       "heart failure" → "heart failure, present on admission" (POA is a flag)
     """
     # Normalise both sides — this strips non-codable markers and aligns synonyms
-    pred_n = _normalise_diagnosis(pred_dx)
-    doc_n = _normalise_diagnosis(doc_dx)
-
+    return _is_specificity_upgrade_normalised(_normalise_diagnosis(pred_dx),
+                                              _normalise_diagnosis(doc_dx))
+
+
+_UPGRADE_STOP = frozenset({
+    '', 'and', 'or', 'the', 'a', 'an', 'in', 'of', 'at', 'by', 'to',
+    'for', 'with', 'on', 'from', 'as', 'is', 'was', 'be', 'being',
+    'due', 'secondary'})
+
+# Codable upgrade keywords — these change the ICD-10 code when present
+_CODABLE_UPGRADE_KEYWORDS = frozenset({
+    # Acuity (changes code)
+    'acute', 'subacute', 'fulminant', 'chronic',
+    # Anatomic/pathologic type (changes code)
+    'systolic', 'diastolic', 'restrictive', 'hypertrophic',
+    # Severity that changes coding (malnutrition, respiratory failure)
+    'severe', 'moderate', 'mild',
+    # Complications/added codable states
+    'shock', 'failure', 'hemorrhagic', 'aspiration',
+    # Specific etiologies that add a code
+    'hyperglycemia', 'ketoacidosis', 'hyperosmolar',
+    'hyponatremia', 'hyperkalemia', 'hypokalemia',
+    'hypercalcemia', 'hypocalcemia',
+    # Anemia specificity (codable subtypes)
+    'iron', 'deficiency', 'pernicious',
+})
+
+# Non-codable "specificity" — explicitly do NOT treat as upgrades
+# (after normalisation these would usually be stripped, but guard here too)
+_NON_CODABLE_EXTRAS = frozenset({
+    'kdigo', 'stage', 'class', 'grade', 'poa', 'present', 'admission',
+    'resolved', 'improved', 'unspecified', 'other', 'nos',
+    'expected', 'ruled',
+})
+
+
+def _is_specificity_upgrade_normalised(pred_n: str, doc_n: str) -> bool:
+    """_is_specificity_upgrade on already-normalised strings."""
     if not pred_n or not doc_n:
         return False
 
@@ -605,49 +1008,19 @@ def _is_specificity_upgrade(pred_dx: str, doc_dx: str) -> bool:
     # Extract what the prediction adds beyond the documented text
     extra_text = pred_n.replace(doc_n, '', 1).strip()
     extra_words = extra_text.split()
-    stop = {'', 'and', 'or', 'the', 'a', 'an', 'in', 'of', 'at', 'by', 'to',
-            'for', 'with', 'on', 'from', 'as', 'is', 'was', 'be', 'being',
-            'due', 'secondary'}
-    meaningful = [w for w in extra_words if w and w not in stop]
+    meaningful = [w for w in extra_words if w and w not in _UPGRADE_STOP]
 
     if not meaningful:
         return False
 
-    # Codable upgrade keywords — these change the ICD-10 code when present
-    CODABLE_UPGRADE_KEYWORDS = {
-        # Acuity (changes code)
-        'acute', 'subacute', 'fulminant', 'chronic',
-        # Anatomic/pathologic type (changes code)
-        'systolic', 'diastolic', 'restrictive', 'hypertrophic',
-        # Severity that changes coding (malnutrition, respiratory failure)
-        'severe', 'moderate', 'mild',
-        # Complications/added codable states
-        'shock', 'failure', 'hemorrhagic', 'aspiration',
-        # Specific etiologies that add a code
-        'hyperglycemia', 'ketoacidosis', 'hyperosmolar',
-        'hyponatremia', 'hyperkalemia', 'hypokalemia',
-        'hypercalcemia', 'hypocalcemia',
-        # Anemia specificity (codable subtypes)
-        'iron', 'deficiency', 'pernicious',
-    }
-
-    # Non-codable "specificity" — explicitly do NOT treat as upgrades
-    # (after normalisation these would usually be stripped, but guard here too)
-    NON_CODABLE_EXTRAS = {
-        'kdigo', 'stage', 'class', 'grade', 'poa', 'present', 'admission',
-        'resolved', 'improved', 'unspecified', 'other', 'nos',
-        'expected', 'ruled',
-    }
-
     # If the only "extras" are non-codable markers, this is NOT an upgrade
-    meaningful_filtered = [w for w in meaningful if w not in NON_CODABLE_EXTRAS]
+    meaningful_filtered = [w for w in meaningful if w not in _NON_CODABLE_EXTRAS]
     if not meaningful_filtered:
         return False
 
     # Must contain at least one codable upgrade keyword
-    for keyword in CODABLE_UPGRADE_KEYWORDS:
-        if keyword in meaningful_filtered:
-            return True
+    if not _CODABLE_UPGRADE_KEYWORDS.isdisjoint(meaningful_filtered):
+        return True
 
     # Two or more meaningful (non-marker) words added = likely a real
     # new comorbidity / combined code (e.g. "heart failure" →
@@ -658,6 +1031,73 @@ def _is_specificity_upgrade(pred_dx: str, doc_dx: str) -> bool:
     return False
 
 
+_FILTER_STOP = frozenset({'and', 'or', 'the', 'a', 'an', 'with', 'without',
+                          'due', 'to', 'of', 'in', 'on', 'secondary',
+                          'other', 'not', 'no', 'at', 'by', 'from', 'for'})
+
+
+class _DocumentedIndex:
+    """Documented diagnoses of one case, normalised and indexed once.
+
+    _filter_already_documented used to compare each prediction with every
+    documented line, re-normalising both and rebuilding term sets per pair;
+    long Hospital Course sections yield hundreds of lines. Here each line
+    is normalised and tokenised once, and candidates() returns only the
+    lines that can possibly match a prediction — every rule in the filter
+    needs either a shared whole token or a substring relation:
+
+      - shared token (any token, stop words included): inverted index
+      - prediction inside a line: str.find over all lines joined with "\n"
+        (normalised text never contains a newline)
+      - line inside the prediction: a line of 3+ tokens inside it shares
+        its interior tokens, so only 1-2 token lines (which may match a
+        partial word, "sis" in "sepsis") are checked directly
+
+    Candidates come back in documented order, so the first matching line —
+    and therefore the decision and filter reason — is the same as the
+    pairwise scan's.
+    """
+
+    def __init__(self, documented: List[str]):
+        self.raw: List[str] = []
+        self.norm: List[str] = []
+        self.terms: List[set] = []
+        self.by_token: Dict[str, List[int]] = {}
+        self.short: List[int] = []
+        offsets = []
+        pos = 0
+        for d in documented:
+            n = _normalise_diagnosis(d)
+            if not n:
+                continue  # empty lines never match anything
+            i = len(self.norm)
+            self.raw.append(d)
+            self.norm.append(n)
+            tokens = n.split()
+            self.terms.append(set(w for w in tokens if w not in _FILTER_STOP))
+            for tok in set(tokens):
+                self.by_token.setdefault(tok, []).append(i)
+            if len(tokens) <= 2:
+                self.short.append(i)
+            offsets.append(pos)
+            pos += len(n) + 1
+        self._offsets = offsets
+        self._joined = "\n".join(self.norm)
+
+    def candidates(self, dx_norm: str) -> List[int]:
+        found = set()
+        for tok in set(dx_norm.split()):
+            found.update(self.by_token.get(tok, ()))
+        start = self._joined.find(dx_norm)
+        while start != -1:
+            found.add(bisect_right(self._offsets, start) - 1)
+            start = self._joined.find(dx_norm, start + 1)
+        for i in self.short:
+            if self.norm[i] in dx_norm:
+                found.add(i)
+        return sorted(found)
+
+
 def _filter_already_documented(predictions: List[Dict],
                                 documented: List[str],
                                 full_text: Optional[str] = None) -> Tuple[List[Dict], List[Dict]]:
@@ -690,11 +1130,8 @@ def _filter_already_documented(predictions: List[Dict],
     if not documented and not full_text:
         return predictions, []
 
-    # Pre-normalise documented set once
-    doc_normalised = [(d, _normalise_diagnosis(d)) for d in documented]
-
-    # Pre-normalise full discharge summary (if provided) for fallback substring check
-    full_normalised = _normalise_diagnosis(full_text) if full_text else ""
+    # Normalise + index the documented set once per case
+    index = _DocumentedIndex(documented)
 
     # Codable clinical keywords — gating for fallback check to ensure we only
     # filter on substantive diagnosis phrases, not generic fragments.
@@ -717,9 +1154,7 @@ def _filter_already_documented(predictions: List[Dict],
         'thrombocytopenia', 'neutropenia', 'pancytopenia', 'coagulopathy',
     }
 
-    stop = {'and', 'or', 'the', 'a', 'an', 'with', 'without',
-            'due', 'to', 'of', 'in', 'on', 'secondary',
-            'other', 'not', 'no', 'at', 'by', 'from', 'for'}
+    stop = _FILTER_STOP
 
     kept = []
     filtered = []
@@ -734,12 +1169,11 @@ def _filter_already_documented(predictions: List[Dict],
         dx_terms = set(w for w in dx_norm.split() if w not in stop)
 
         is_processed = False
-        for doc_raw, doc_norm in doc_normalised:
-            if not doc_norm:
-                continue
+        for i in index.candidates(dx_norm):
+            doc_raw, doc_norm = index.raw[i], index.norm[i]
 
             # 1. Always preserve codable specificity upgrades
-            if _is_specificity_upgrade(dx_raw, doc_raw):
+            if _is_specificity_upgrade_normalised(dx_norm, doc_norm):
                 pred_copy = dict(pred)
                 pred_copy['is_specificity_upgrade'] = True
                 kept.append(pred_copy)
@@ -760,7 +1194,7 @@ def _filter_already_documented(predictions: List[Dict],
                 reason = 'non-codable elaboration of documented'
             else:
                 # 2d. Jaccard overlap on normalised terms
-                doc_terms = set(w for w in doc_norm.split() if w not in stop)
+                doc_terms = index.terms[i]
                 if not dx_terms or not doc_terms:
                     continue
                 inter = len(dx_terms & doc_terms)
@@ -848,12 +1282,12 @@ Return JSON only:
 """
 
 
-def _llm_already_documented_filter(predictions: List[Dict],
-                                    documented: List[str],
-                                    api_key: str,
-                                    filter_model: str = "gpt-5-nano",
-                                    full_text: Optional[str] = None
-                                    ) -> Tuple[List[Dict], List[Dict]]:
+async def _llm_already_documented_filter(predictions: List[Dict],
+                                          documented: List[str],
+                                          api_key: str,
+                                          filter_model: str = "gpt-5-nano",
+                                          full_text: Optional[str] = None
+                                          ) -> Tuple[List[Dict], List[Dict]]:
     """LLM-based already-documented filter. One batched call per case.
 
     Runs AFTER the Jaccard filter — only sees predictions that survived
@@ -911,7 +1345,7 @@ def _llm_already_documented_filter(predictions: List[Dict],
     ]
 
     try:
-        raw = _call_llm(msgs, api_key, model=filter_model, max_tokens=2000)
+        raw = await _call_llm_async(msgs, api_key, model=filter_model, max_tokens=2000)
     except Exception as e:
         print(f"    LLM filter call failed (pass-through): {e}")
         return predictions, []
@@ -948,39 +1382,40 @@ def _llm_already_documented_filter(predictions: List[Dict],
 # ===========================================================================
 
 def _parse_llm_response(raw: str) -> List[Dict]:
-    """Parse LLM JSON response, handling common formatting issues."""
-    if not raw:
-        return []
+    """Parse LLM JSON response, handling common formatting issues.
 
-    # Try direct JSON parse
+    A bare array or a structured-output {"diagnoses": [...]} object loads
+    directly; anything else (prose, code fences, a response cut short)
+    goes through json_stream.extract_items. The outcome is recorded for
+    result["metadata"]["parse"].
+    """
     try:
-        result = json.loads(raw)
-        if isinstance(result, list):
-            return result
+        result = json.loads(raw) if raw else None
     except json.JSONDecodeError:
-        pass
+        result = None
+    if isinstance(result, dict) and isinstance(result.get("diagnoses"), list):
+        result = result["diagnoses"]
+    if isinstance(result, list) and all(isinstance(p, dict) for p in result):
+        record_parse("clean")
+        return result
 
-    # Try extracting JSON array from response text
-    match = re.search(r'\[[\s\S]*?\]', raw)
-    if match:
-        try:
-            result = json.loads(match.group(0))
-            if isinstance(result, list):
-                return result
-        except json.JSONDecodeError:
-            pass
-
-    # Try from code fences
-    match = re.search(r'```(?:json)?\s*\n?([\s\S]*?)\n?```', raw)
-    if match:
-        try:
-            result = json.loads(match.group(1))
-            if isinstance(result, list):
-                return result
-        except json.JSONDecodeError:
-            pass
+    predictions, status = extract_items(raw)
+    record_parse(status)
+    return predictions
 
-    return []
+
+def _stream_predictions(chunks: Iterable[str]) -> Iterator[Dict]:
+    """Yield each prediction object as soon as its closing brace arrives.
+
+    The streamed counterpart of _parse_llm_response (json_stream.ItemStream);
+    a final object cut off by the token limit is salvaged at the end.
+    """
+    stream = ItemStream()
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    before = len(stream.items)
+    yield from stream.close()[before:]
+    record_parse(stream.status)
 
 
 def _normalize(text: str) -> str:
@@ -1016,6 +1451,18 @@ CLINICAL_EQUIVALENTS = {
 }
 
 
+# Words ignored by the word-overlap similarity
+_VOTE_STOP = frozenset({
+    'and', 'or', 'the', 'a', 'an', 'with', 'without', 'due', 'to',
+    'of', 'in', 'on', 'acute', 'chronic', 'type', 'by', 'from',
+    'unspecified', 'other', 'not', 'no'})
+
+# CLINICAL_EQUIVALENTS flattened to (class id, terms) — a diagnosis belongs
+# to a class if any term is a substring of its normalised text
+_EQUIVALENCE_CLASSES = [(base, (base, *equivs))
+                        for base, equivs in CLINICAL_EQUIVALENTS.items()]
+
+
 def _diagnoses_similar(a: str, b: str, threshold: float = 0.5) -> bool:
     """Check if two diagnoses are clinically similar (for vote aggregation)."""
     na, nb = _normalize(a), _normalize(b)
@@ -1033,17 +1480,189 @@ def _diagnoses_similar(a: str, b: str, threshold: float = 0.5) -> bool:
             return True
 
     # Word overlap
-    stop = {'and', 'or', 'the', 'a', 'an', 'with', 'without', 'due', 'to',
-            'of', 'in', 'on', 'acute', 'chronic', 'type', 'by', 'from',
-            'unspecified', 'other', 'not', 'no'}
-    wa = set(na.split()) - stop
-    wb = set(nb.split()) - stop
+    wa = set(na.split()) - _VOTE_STOP
+    wb = set(nb.split()) - _VOTE_STOP
     if not wa or not wb:
         return False
     overlap = len(wa & wb) / max(len(wa), len(wb))
     return overlap >= threshold
 
 
+# ===========================================================================
+# VOTE CLUSTERING
+# ===========================================================================
+# Putting each prediction in the first bucket whose name passes
+# _diagnoses_similar is a linear scan over buckets, re-normalising and
+# re-walking CLINICAL_EQUIVALENTS on every check, with results that depend
+# on which run happened to list a diagnosis first. In high_recall (5 runs
+# × 15–25 predictions) that is thousands of checks per case.
+#
+# Instead the distinct normalised names are scored against each other once:
+#   - equal / substring / shared equivalence class → 1.0
+#   - otherwise the word-overlap coefficient |A∩B| / max(|A|,|B|) — the
+#     same measure _diagnoses_similar uses, computed for all pairs with one
+#     token-matrix product
+# and clustered with complete linkage: two clusters merge only if every
+# pair across them is similar, so "sepsis" and "UTI" can't be chained
+# together through "sepsis due to UTI". Names are sorted first and ties
+# broken by index, so the clusters don't depend on arrival order.
+
+
+def _similarity_scores(norms: List[str]) -> np.ndarray:
+    """Pairwise similarity (n × n) of normalised names; >= 0.5 is similar.
+
+    Agrees with _diagnoses_similar(a, b) >= 0.5 for every pair.
+    """
+    n = len(norms)
+
+    # Equivalence classes: one membership matrix, one product
+    classes = np.array([[any(t in norm for t in terms) for _, terms in _EQUIVALENCE_CLASSES]
+                        for norm in norms], dtype=np.float32).reshape(n, -1)
+    same_class = (classes @ classes.T) > 0
+
+    # Word overlap over non-stop tokens
+    token_sets = [set(norm.split()) - _VOTE_STOP for norm in norms]
+    vocab = {tok: i for i, tok in enumerate(sorted(set().union(*token_sets)))}
+    tokens = np.zeros((n, len(vocab)), dtype=np.float32)
+    for row, toks in enumerate(token_sets):
+        tokens[row, [vocab[t] for t in toks]] = 1.0
+    inter = tokens @ tokens.T
+    sizes = tokens.sum(axis=1)
+    denom = np.maximum.outer(sizes, sizes)
+    scores = np.divide(inter, denom, out=np.zeros_like(inter), where=denom > 0)
+
+    # Substring containment (includes equality)
+    contained = np.array([[a in b or b in a for b in norms] for a in norms],
+                         dtype=bool).reshape(n, n)
+
+    scores[contained | same_class] = 1.0
+    return scores
+
+
+def _cluster_diagnoses(norms: List[str], threshold: float = 0.5) -> List[int]:
+    """Complete-linkage clustering of distinct normalised names.
+
+    Returns a cluster label per entry of `norms`. Labels are deterministic
+    for a given set of names, whatever order they came in.
+    """
+    order = sorted(range(len(norms)), key=lambda i: norms[i])
+    scores = _similarity_scores([norms[i] for i in order])
+    n = len(order)
+
+    # Cluster-to-cluster linkage; the diagonal and retired clusters are -1
+    link = scores.astype(np.float64)
+    np.fill_diagonal(link, -1.0)
+    members = [[i] for i in range(n)]
+    while n > 1:
+        best = int(np.argmax(link))
+        i, j = divmod(best, link.shape[0])
+        if link[i, j] < threshold:
+            break
+        i, j = min(i, j), max(i, j)
+        # Complete linkage: the merged cluster is as similar to k as its
+        # least similar half was
+        merged = np.minimum(link[i], link[j])
+        merged[i] = -1.0
+        link[i, :] = merged
+        link[:, i] = merged
+        link[j, :] = -1.0
+        link[:, j] = -1.0
+        members[i].extend(members[j])
+        members[j] = []
+
+    labels = [0] * len(norms)
+    for label, group in enumerate(members):
+        for sorted_pos in group:
+            labels[order[sorted_pos]] = label
+    return labels
+
+
+# ===========================================================================
+# CASCADE TRIAGE
+# ===========================================================================
+# mode="cascade" answers a case with a cheap model (gpt-5-4-mini by
+# default) and only pays for self.model when the case looks complex or the
+# cheap answer is unsure. The complexity half is a local, zero-cost
+# triage on the notes:
+#   - total note length (long stays, many notes)
+#   - number of "Header:" sections (note_sections index, already cached
+#     for the documented filter)
+#   - lab-value density: "<lab name> ... <number>" mentions per 1k chars
+#     — lab-heavy charts are where the lab → diagnosis mapping rules
+#     (albumin → malnutrition, Cr → AKI stage, ...) earn their keep
+# A case over any limit goes straight to self.model.
+#
+# CASCADE_MODEL, the limits below and the escalation rules in
+# _cascade_escalation_reason have not been benchmarked yet, so cascade is
+# an UNTUNED_MODES entry: analyse() runs it, but it is not in MODES or the
+# --mode choices. Tune it with `evaluate_cdi_accuracy.py --engine-mode
+# cascade` (per-tier recall and summary["cost_by_tier"]) against a fast
+# run on the same sample before making it a public mode.
+
+CASCADE_MODEL = "gpt-5-4-mini"
+CASCADE_MAX_CHARS = 30000
+CASCADE_MAX_SECTIONS = 60
+CASCADE_MAX_LAB_DENSITY = 3.0     # lab values per 1000 characters
+
+_LAB_VALUE_RE = re.compile(
+    r"\b(?:sodium|na|potassium|k|chloride|cl|bicarb(?:onate)?|hco3|bun|creatinine|cr"
+    r"|glucose|calcium|ca|magnesium|mg|phos(?:phorus)?|albumin|prealbumin|lactate"
+    r"|wbc|hgb|hemoglobin|hct|plt|platelets?|inr|ptt|troponin|bnp|ast|alt"
+    r"|bilirubin|t\.?\s?bili|lipase|ferritin|procalcitonin|ph|pco2|po2|a1c)\b"
+    r"[^\n\d]{0,12}\d+(?:\.\d+)?",
+    re.IGNORECASE,
+)
+
+
+def triage_case(notes: List[str]) -> Dict:
+    """Local complexity triage for cascade mode (no model calls).
+
+    Args:
+        notes: the case's note texts (None / empty entries allowed).
+
+    Returns dict with chars, sections, lab_values, lab_density, complex
+    and reasons (the limits that were exceeded).
+    """
+    texts = [n for n in notes if n]
+    chars = sum(len(t) for t in texts)
+    sections = sum(len(index_note(t).sections()) for t in texts)
+    lab_values = sum(len(_LAB_VALUE_RE.findall(t)) for t in texts)
+    lab_density = 1000.0 * lab_values / chars if chars else 0.0
+
+    reasons = []
+    if chars > CASCADE_MAX_CHARS:
+        reasons.append(f"chars {chars} > {CASCADE_MAX_CHARS}")
+    if sections > CASCADE_MAX_SECTIONS:
+        reasons.append(f"sections {sections} > {CASCADE_MAX_SECTIONS}")
+    if lab_density > CASCADE_MAX_LAB_DENSITY:
+        reasons.append(f"lab density {lab_density:.1f} > {CASCADE_MAX_LAB_DENSITY}")
+    return {
+        "chars": chars,
+        "sections": sections,
+        "lab_values": lab_values,
+        "lab_density": round(lab_density, 2),
+        "complex": bool(reasons),
+        "reasons": reasons,
+    }
+
+
+def _cascade_escalation_reason(predictions: List[Dict]) -> Optional[str]:
+    """Why the cheap model's answer isn't good enough to return, or None.
+
+    Escalate when the cheap model marks any finding low-confidence, or is
+    less than sure of an MCC (the findings where a wrong call costs most).
+    An empty answer is accepted: short, simple admissions often have
+    nothing to query.
+    """
+    for p in predictions:
+        confidence = str(p.get("confidence", "medium")).lower()
+        if confidence == "low":
+            return f"low-confidence finding: {p.get('diagnosis', '')!r}"
+        if confidence != "high" and classify_drg_impact(p.get("diagnosis", "")) == "MCC":
+            return f"unsure MCC: {p.get('diagnosis', '')!r}"
+    return None
+
+
 # ===========================================================================
 # MAIN ENGINE
 # ===========================================================================
@@ -1097,6 +1716,82 @@ def load_prompt_variant(variant_name: str) -> Dict:
     }
 
 
+def _settle_pathology_scan(future: Optional[Future]) -> None:
+    """Don't orphan a streamed case's pathology scan (a thread, see
+    _start_pathology_scan) when the case failed or was abandoned: cancel
+    it, or if its call is already in flight wait for it, so it settles
+    inside the case's usage tally. A no-op once _finalise has collected it."""
+    if future is not None and not future.cancel():
+        wait([future])
+
+
+# Synchronous callers (analyse(), the streaming path's _finalise,
+# analyse_from_responses) run their coroutines on one long-lived event loop
+# on a daemon thread. Every case from every caller thread (the evaluator's
+# --workers) then shares that loop's httpx client and its keep-alive
+# connections, as the requests.Session path does, instead of handshaking
+# anew per case.
+_engine_loop: Optional[asyncio.AbstractEventLoop] = None
+_engine_loop_lock = threading.Lock()
+
+
+def _get_engine_loop() -> asyncio.AbstractEventLoop:
+    global _engine_loop
+    with _engine_loop_lock:
+        if _engine_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="cdi-engine-loop",
+                             daemon=True).start()
+            atexit.register(_close_engine_loop, loop)
+            _engine_loop = loop
+    return _engine_loop
+
+
+def _close_engine_loop(loop: asyncio.AbstractEventLoop) -> None:
+    try:
+        asyncio.run_coroutine_threadsafe(close_async_client(), loop).result(timeout=5)
+    except Exception:
+        pass                    # exiting anyway; the sockets close with the process
+
+
+def _run(coro: Awaitable) -> Any:
+    """Run an engine coroutine from synchronous code and return its result.
+
+    The coroutine runs on the shared engine loop (above), in a copy of the
+    caller's context, so usage tallies and the reasoning effort carry over.
+    Works from inside another running loop too (it blocks that loop's
+    thread meanwhile) — but not from the engine loop itself.
+    """
+    loop = _get_engine_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("Blocking CDIEngine call made on the engine's own event loop; "
+                           "await the async method instead")
+    # call_soon_threadsafe copies this thread's context for the task
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()         # e.g. KeyboardInterrupt: don't leave the case running
+        raise
+
+
+# Self-consistency voting modes: mode -> (passes, vote threshold)
+VOTING_MODES = {
+    "balanced": (3, 2),      # keep ≥2/3 votes
+    "high_recall": (5, 2),   # keep ≥2/5 votes (lower threshold = more recall)
+}
+MODES = ("fast", *VOTING_MODES)
+# Implemented but not yet tuned (see CASCADE TRIAGE): analyse() accepts
+# them so the evaluator can benchmark them; they stay out of MODES and the
+# CLI until then
+UNTUNED_MODES = ("cascade",)
+
+
 class CDIEngine:
     """Production CDI prediction engine."""
 
@@ -1105,7 +1800,15 @@ class CDIEngine:
                  llm_filter: bool = False,
                  filter_model: str = "gpt-5-nano",
                  pathology_scan: bool = False,
-                 pathology_scan_model: Optional[str] = None):
+                 pathology_scan_model: Optional[str] = None,
+                 max_workers: int = 5,
+                 quorum_timeout: Optional[float] = None,
+                 n_samples: bool = False,
+                 adaptive_voting: bool = False,
+                 cascade_model: str = CASCADE_MODEL,
+                 note_token_budget: Optional[int] = None,
+                 reasoning_effort: Optional[Dict[str, str]] = None,
+                 structured_output: bool = False):
         self.api_key = api_key
         self.model = model
         self.prompt_variant = prompt_variant
@@ -1131,6 +1834,47 @@ class CDIEngine:
         self.pathology_scan = pathology_scan
         # Default to main model if not specified — runs on the same gateway
         self.pathology_scan_model = pathology_scan_model or model
+        # Voting passes are dispatched concurrently as asyncio tasks —
+        # max_workers caps in-flight calls per case. quorum_timeout
+        # (seconds) lets the vote proceed without stragglers once enough
+        # passes have succeeded to meet the threshold. None = wait for all
+        # passes (identical output to the old sequential loop).
+        self.max_workers = max_workers
+        self.quorum_timeout = quorum_timeout
+        # n-sampling: ask an Azure deployment for all voting passes in one
+        # request (`n`), paying prompt ingestion and queueing once. Off by
+        # default; Bedrock models and deployments that reject `n` use the
+        # concurrent passes above.
+        self.n_samples = n_samples
+        # Adaptive voting: issue balanced / high_recall passes in waves,
+        # adding each wave to the vote buckets so far, and stop once the
+        # remaining passes can't change the accepted set (see
+        # _adaptive_runs). Stopping never changes the output; the wave-wise
+        # grouping itself can differ slightly from one over all runs at
+        # once. Saves a pass on easy cases at the cost of an extra round
+        # trip on hard ones. Off by default.
+        self.adaptive_voting = adaptive_voting
+        # mode="cascade": cheap first-tier model (see CASCADE TRIAGE)
+        self.cascade_model = cascade_model
+        # Token budget for the notes (note_packer.py): the smaller input
+        # limit of the two models this engine may call, less the variant's
+        # instructions. Cases under it are sent unchanged.
+        if note_token_budget is None:
+            instructions = sum(count_tokens(v) for k, v in self.variant.items()
+                               if isinstance(v, str) and k.startswith(("system", "user_prefix")))
+            note_token_budget = min(input_budget(model), input_budget(cascade_model)) - instructions
+        self.note_token_budget = note_token_budget
+        # GPT-5 reasoning_effort per mode ({mode: effort}, "*" for all; see
+        # completion_planner.parse_reasoning_effort). Empty = deployment
+        # default, and the request bodies / cache keys are as before.
+        self.reasoning_effort = reasoning_effort or {}
+        # Provider-enforced prediction schema for the prediction passes
+        # (see STRUCTURED OUTPUT). Off by default; a deployment that
+        # rejects it turns it off for this engine (see _call_predict).
+        self.structured_output = structured_output
+
+    def effort_for(self, mode: str) -> Optional[str]:
+        return self.reasoning_effort.get(mode, self.reasoning_effort.get("*"))
 
     def _build_user_content(self, discharge_summary: str,
                             progress_note: Optional[str] = None,
@@ -1146,15 +1890,37 @@ class CDIEngine:
         Supports both legacy (single progress_note/consult_note) and expanded
         dataset (multiple notes of each type from cdi_expanded_notes.csv).
         """
-        content = self.user_prefix + "DISCHARGE SUMMARY:\n" + discharge_summary
+        return self._pack_user_content(
+            discharge_summary, progress_note, hp_note, consult_note,
+            ed_note=ed_note, progress_notes=progress_notes,
+            consult_notes=consult_notes, procedure_notes=procedure_notes,
+            ip_consult_note=ip_consult_note)[0]
+
+    def _pack_user_content(self, discharge_summary: str,
+                           progress_note: Optional[str] = None,
+                           hp_note: Optional[str] = None,
+                           consult_note: Optional[str] = None,
+                           ed_note: Optional[str] = None,
+                           progress_notes: Optional[List[str]] = None,
+                           consult_notes: Optional[List[str]] = None,
+                           procedure_notes: Optional[List[str]] = None,
+                           ip_consult_note: Optional[str] = None) -> Tuple[str, Dict]:
+        """_build_user_content, plus the note_packer stats.
+
+        Notes that fit self.note_token_budget go in unchanged; an oversize
+        case is packed (redundant sections, then head/tail trimming by
+        priority) here instead of being rejected by the gateway.
+        """
+        # (label, kind, text) in prompt order
+        notes = [("DISCHARGE SUMMARY", "discharge_summary", discharge_summary)]
 
         # H&P — admission workup, baseline labs, initial assessment
         if hp_note:
-            content += f"\n\nHISTORY & PHYSICAL:\n{hp_note}"
+            notes.append(("HISTORY & PHYSICAL", "hp_note", hp_note))
 
         # ED note — presenting complaint, initial labs/imaging
         if ed_note:
-            content += f"\n\nEMERGENCY DEPARTMENT NOTE:\n{ed_note}"
+            notes.append(("EMERGENCY DEPARTMENT NOTE", "ed_note", ed_note))
 
         # Progress notes — daily assessments with labs, vitals, clinical trajectory
         all_progress = []
@@ -1164,7 +1930,7 @@ class CDIEngine:
             all_progress.append(progress_note)
         for i, pn in enumerate(all_progress, 1):
             label = "PROGRESS NOTE" if len(all_progress) == 1 else f"PROGRESS NOTE {i}"
-            content += f"\n\n{label}:\n{pn}"
+            notes.append((label, "progress_note", pn))
 
         # Consult notes — specialist consultations
         all_consults = []
@@ -1174,34 +1940,38 @@ class CDIEngine:
             all_consults.append(consult_note)
         for i, cn in enumerate(all_consults, 1):
             label = "CONSULTATION NOTE" if len(all_consults) == 1 else f"CONSULTATION NOTE {i}"
-            content += f"\n\n{label}:\n{cn}"
+            notes.append((label, "consult_note", cn))
 
         # Procedure notes — operative/procedural details and complications
         if procedure_notes:
             for i, pn in enumerate([n for n in procedure_notes if n], 1):
                 label = "PROCEDURE NOTE" if i == 1 and len(procedure_notes) == 1 else f"PROCEDURE NOTE {i}"
-                content += f"\n\n{label}:\n{pn}"
+                notes.append((label, "procedure_note", pn))
 
         # Inpatient consult note
         if ip_consult_note:
-            content += f"\n\nINPATIENT CONSULT NOTE:\n{ip_consult_note}"
+            notes.append(("INPATIENT CONSULT NOTE", "ip_consult_note", ip_consult_note))
 
-        return content
+        packed, stats = pack_notes(notes, self.note_token_budget)
+        content = self.user_prefix + "\n\n".join(f"{label}:\n{text}" for label, text in packed)
+        return content, stats
 
-    def _single_pass(self, user_content: str, temperature: float = 0.2,
-                      raise_on_error: bool = True) -> List[Dict]:
+    async def _single_pass(self, user_content: str, temperature: float = 0.2,
+                           raise_on_error: bool = True, sample: int = 0,
+                           model: Optional[str] = None) -> List[Dict]:
         """Run a single LLM prediction pass.
 
         Args:
             raise_on_error: If False, returns empty list on failure (for voting).
+            sample: Voting pass index; keeps cached passes distinct.
+            model: Override self.model (cascade mode's cheap tier).
         """
         messages = []
         if self.system_prompt:  # v13_category_expanded uses user-only design
             messages.append({"role": "system", "content": self.system_prompt})
         messages.append({"role": "user", "content": user_content})
         try:
-            raw = _call_llm(messages, self.api_key, model=self.model,
-                             temperature=temperature)
+            raw = await self._call_predict(messages, temperature, sample, model or self.model)
             return _parse_llm_response(raw)
         except Exception as e:
             if raise_on_error:
@@ -1209,8 +1979,211 @@ class CDIEngine:
             print(f"    Voting pass failed (will skip): {e}")
             return []
 
-    def _two_pass_verify(self, user_content: str,
-                         temperature: float = 0.2) -> List[Dict]:
+    async def _call_predict(self, messages: list, temperature: float, sample: int,
+                            model: str) -> str:
+        """_call_llm for a prediction pass, with structured output if on.
+
+        A 4xx other than 429 on a structured request means the deployment
+        doesn't take the schema: structured output is turned off for this
+        engine and the pass is resent as plain JSON (a rejected request
+        isn't billed).
+        """
+        structured = self.structured_output
+        try:
+            return await _call_llm_async(messages, self.api_key, model=model,
+                                         temperature=temperature, sample=sample,
+                                         static_prefix=self.user_prefix,
+                                         structured=structured)
+        except GatewayError as e:
+            if not structured or e.status_code is None or not 400 <= e.status_code < 500 \
+                    or e.status_code == 429:
+                raise
+            print(f"    Structured output rejected by {model} ({e.status_code}) — "
+                  f"asking for plain JSON from now on")
+            self.structured_output = False
+            return await _call_llm_async(messages, self.api_key, model=model,
+                                         temperature=temperature, sample=sample,
+                                         static_prefix=self.user_prefix)
+
+    async def _self_consistency_runs(self, user_content: str, num_runs: int,
+                                     threshold: int, first_sample: int = 0
+                                     ) -> List[List[Dict]]:
+        """Run the voting passes concurrently and collect the successful runs.
+
+        All passes go out at once, so a balanced case costs roughly one call
+        of wall-clock time instead of three. Failed or empty passes are
+        dropped, as before. Runs come back in pass order, not completion
+        order, so the vote doesn't depend on which call returned first.
+
+        If self.quorum_timeout is set, stop waiting for stragglers that many
+        seconds after `threshold` successful runs have arrived.
+
+        With self.n_samples on an Azure model, all passes come from one
+        request instead (see _n_sample_runs).
+
+        Passes are numbered first_sample .. first_sample + num_runs - 1
+        (the cache's sample index), so adaptive voting can add passes to a
+        case without repeating earlier ones.
+        """
+        if self.n_samples and not _is_bedrock_model(self.model):
+            runs = await self._n_sample_runs(user_content, num_runs, first_sample)
+            if runs is not None:
+                return runs
+
+        slots: List[List[Dict]] = [[] for _ in range(num_runs)]
+        gate = asyncio.Semaphore(max(1, min(num_runs, self.max_workers)))
+
+        async def run_pass(sample: int) -> List[Dict]:
+            async with gate:
+                return await self._single_pass(user_content, 0.7, False, sample)
+
+        # Tasks inherit the context: the passes' token usage counts towards
+        # analyse()'s tally
+        tasks = {asyncio.create_task(run_pass(first_sample + i)): i for i in range(num_runs)}
+        pending = set(tasks)
+        quorum_at = None
+        try:
+            while pending:
+                timeout = None
+                if quorum_at is not None and self.quorum_timeout is not None:
+                    timeout = max(0.0, quorum_at + self.quorum_timeout - time.monotonic())
+                done, pending = await asyncio.wait(pending, timeout=timeout,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    print(f"    Quorum reached — not waiting for "
+                          f"{len(pending)} straggling pass(es)")
+                    break
+                for task in done:
+                    slots[tasks[task]] = task.result()
+                if quorum_at is None and sum(1 for s in slots if s) >= threshold:
+                    quorum_at = time.monotonic()
+        finally:
+            # Abandoned stragglers are cancelled; their results are discarded
+            for task in pending:
+                task.cancel()
+
+        return [run for run in slots if run]
+
+    async def _n_sample_runs(self, user_content: str, num_runs: int,
+                             first_sample: int = 0) -> Optional[List[List[Dict]]]:
+        """All voting passes from one n-sampled request.
+
+        Each choice is parsed on its own; empty or unparseable choices are
+        dropped like failed passes. Returns None if the request failed, so
+        the caller falls back to one call per pass. A 4xx that names `n`
+        (the deployment doesn't accept it) turns n-sampling off for this
+        engine; other rejections only fall back for this case.
+        """
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        messages.append({"role": "user", "content": user_content})
+        try:
+            raws = await _call_llm_samples_async(
+                messages, self.api_key, self.model, 0.7,
+                list(range(first_sample, first_sample + num_runs)),
+                structured=self.structured_output, static_prefix=self.user_prefix)
+        except GatewayError as e:
+            if e.status_code is not None and 400 <= e.status_code < 500 \
+                    and e.status_code != 429 and e.names_param("n"):
+                print(f"    n-sampling rejected by {self.model} ({e.status_code}) — "
+                      f"using one call per pass from now on")
+                self.n_samples = False
+            else:
+                print(f"    n-sampled request failed, falling back to one call per pass: {e}")
+            return None
+        except Exception as e:
+            print(f"    n-sampled request failed, falling back to one call per pass: {e}")
+            return None
+        runs = [_parse_llm_response(raw) for raw in raws]
+        return [run for run in runs if run]
+
+    async def _cascade(self, user_content: str, notes: List[str]) -> Tuple[List[Dict], Dict]:
+        """mode="cascade": cheap model first, self.model only when needed.
+
+        Complex cases (triage_case) go straight to self.model. Otherwise
+        self.cascade_model answers; its answer is returned unless it failed
+        or _cascade_escalation_reason objects, in which case self.model
+        answers instead.
+
+        Returns (predictions, info); info records the triage, which tier
+        answered ("cheap", "escalated" or "direct"), why, and the number
+        of prediction calls.
+        """
+        triage = triage_case(notes)
+        info = {"triage": triage, "cheap_model": self.cascade_model,
+                "tier": None, "reason": None, "calls": 0}
+
+        if triage["complex"]:
+            info.update(tier="direct", reason="; ".join(triage["reasons"]), calls=1)
+            return await self._single_pass(user_content, temperature=0.2), info
+
+        info["calls"] = 1
+        try:
+            cheap = await self._single_pass(user_content, temperature=0.2,
+                                            model=self.cascade_model)
+            reason = _cascade_escalation_reason(cheap)
+        except Exception as e:
+            cheap, reason = None, f"cheap pass failed: {e}"
+        if reason is None:
+            info["tier"] = "cheap"
+            return cheap, info
+
+        info.update(tier="escalated", reason=reason, calls=2)
+        return await self._single_pass(user_content, temperature=0.2), info
+
+    async def _adaptive_runs(self, user_content: str, num_runs: int, threshold: int
+                             ) -> Tuple[List[List[Dict]], int, List[Dict]]:
+        """Voting passes in waves, stopping once the vote is settled.
+
+        The first wave is the smallest one after which a stop is possible
+        (num_runs - threshold + 1 passes: 2 for balanced, 4 for
+        high_recall); then one pass per wave. Each wave is added to the
+        vote buckets so far without regrouping them (see _vote_buckets),
+        and the remaining passes are skipped once _vote_settled says they
+        can't change the accepted set. Failed passes use up their slot, as
+        in the all-at-once path.
+
+        Returns (successful runs, passes issued, vote buckets).
+        """
+        issued = min(num_runs, max(1, num_runs - threshold + 1))
+        runs = await self._self_consistency_runs(user_content, issued, threshold)
+        buckets = self._vote_buckets(runs, threshold=threshold)
+        while issued < num_runs and not self._vote_settled(runs, threshold,
+                                                           num_runs - issued, buckets):
+            wave = await self._self_consistency_runs(user_content, 1, 1,
+                                                     first_sample=issued)
+            buckets = self._vote_buckets(wave, buckets=buckets, first_run=len(runs),
+                                         threshold=threshold)
+            runs += wave
+            issued += 1
+        return runs, issued, buckets
+
+    def _vote_settled(self, runs: List[List[Dict]], threshold: int, remaining: int,
+                      buckets: Optional[List[Dict]] = None) -> bool:
+        """True if `remaining` more passes can't change the accepted set or
+        its entries.
+
+        `buckets` are the runs' vote buckets (default: grouped afresh).
+        Later waves are added to them without splitting or merging any
+        (see _vote_buckets), so a bucket can only gain votes — at most one
+        per pass — and an accepted bucket keeps its best entry. Then:
+        a diagnosis no run has listed yet needs `threshold` new votes, so
+        remaining must be below threshold; and each existing bucket must be
+        either already accepted (count >= threshold) or out of reach
+        (count + remaining < threshold). Fewer than two runs are never
+        settled: _combine_runs would return a lone run unvoted, which a
+        further run changes.
+        """
+        if remaining >= threshold or len(runs) < 2:
+            return False
+        if buckets is None:
+            buckets = self._vote_buckets(runs)
+        return all(len(b["runs"]) >= threshold or len(b["runs"]) + remaining < threshold
+                   for b in buckets)
+
+    async def _two_pass_verify(self, user_content: str,
+                               temperature: float = 0.2) -> List[Dict]:
         """v18 two-pass verify (IEEE 2025 verification paradigm).
 
         Pass 1: generate broadly — "list every potentially missed diagnosis
@@ -1242,8 +2215,9 @@ class CDIEngine:
         msgs1.append({"role": "user", "content": pass1_user})
 
         try:
-            raw1 = _call_llm(msgs1, self.api_key, model=self.model,
-                              temperature=temperature)
+            raw1 = await _call_llm_async(msgs1, self.api_key, model=self.model,
+                                         temperature=temperature,
+                                         static_prefix=v["user_prefix_pass1"])
             candidates = _parse_llm_response(raw1)
         except Exception as e:
             print(f"    Pass 1 (generation) failed: {e}")
@@ -1273,8 +2247,9 @@ class CDIEngine:
         msgs2.append({"role": "user", "content": pass2_user})
 
         try:
-            raw2 = _call_llm(msgs2, self.api_key, model=self.model,
-                              temperature=temperature)
+            raw2 = await _call_llm_async(
+                msgs2, self.api_key, model=self.model, temperature=temperature,
+                static_prefix=v["user_prefix_pass2"].split("{candidates}")[0])
             confirmed = _parse_llm_response(raw2)
         except Exception as e:
             print(f"    Pass 2 (verification) failed: {e}")
@@ -1282,63 +2257,43 @@ class CDIEngine:
 
         return confirmed
 
-    def _vote(self, all_runs: List[List[Dict]], threshold: int) -> List[Dict]:
+    def _vote(self, all_runs: List[List[Dict]], threshold: int,
+              num_passes: Optional[int] = None,
+              buckets: Optional[List[Dict]] = None) -> List[Dict]:
         """Aggregate multiple prediction runs via majority voting.
 
         Returns diagnoses that appear in >= threshold runs, with:
-        - confidence: high (all runs), medium (>=threshold), low (below)
+        - confidence: high (all runs), medium (>=threshold), low (below).
+          After an adaptive early stop, num_passes is the mode's nominal
+          pass count and "high" needs that many votes: 2/2 of a stopped
+          balanced case is "medium", as the skipped pass could have
+          dropped it.
         - vote_count: number of runs that included this diagnosis
         - best entry: the most detailed version from any run
-        """
-        # Group by normalised diagnosis
-        buckets = []  # list of {norm, count, best_entry, evidence_set}
-
-        for run_preds in all_runs:
-            seen_this_run = set()
-            for pred in run_preds:
-                dx_name = pred.get("diagnosis", str(pred)) if isinstance(pred, dict) else str(pred)
-                norm = _normalize(dx_name)
-
-                if norm in seen_this_run:
-                    continue
-                seen_this_run.add(norm)
-
-                # Find matching bucket
-                matched_bucket = None
-                for bucket in buckets:
-                    if _diagnoses_similar(norm, bucket["norm"]):
-                        matched_bucket = bucket
-                        break
-
-                if matched_bucket:
-                    matched_bucket["count"] += 1
-                    # Keep the entry with the longest evidence
-                    if isinstance(pred, dict):
-                        old_ev = matched_bucket["best_entry"].get("evidence", "")
-                        new_ev = pred.get("evidence", "")
-                        if len(new_ev) > len(old_ev):
-                            matched_bucket["best_entry"] = pred
-                else:
-                    buckets.append({
-                        "norm": norm,
-                        "count": 1,
-                        "best_entry": pred if isinstance(pred, dict) else {"diagnosis": str(pred)},
-                    })
 
+        Similar names are grouped by _cluster_diagnoses; a run counts once
+        per cluster even if it listed two variants of the same diagnosis.
+        Adaptive voting passes the `buckets` it built wave by wave.
+        """
         # Filter by vote threshold and assign confidence
         num_runs = len(all_runs)
+        unanimous = max(num_runs, num_passes or 0)
         results = []
-        for bucket in sorted(buckets, key=lambda b: b["count"], reverse=True):
-            if bucket["count"] < threshold:
+        if buckets is None:
+            buckets = self._vote_buckets(all_runs)
+        for bucket in sorted(buckets,
+                             key=lambda b: len(b["runs"]), reverse=True):
+            count = len(bucket["runs"])
+            if count < threshold:
                 continue
 
             entry = dict(bucket["best_entry"])
-            entry["vote_count"] = bucket["count"]
+            entry["vote_count"] = count
             entry["vote_total"] = num_runs
 
-            if bucket["count"] == num_runs:
+            if count == unanimous:
                 entry["confidence"] = "high"
-            elif bucket["count"] >= threshold:
+            elif count >= threshold:
                 entry["confidence"] = "medium"
             else:
                 entry["confidence"] = "low"
@@ -1347,6 +2302,77 @@ class CDIEngine:
 
         return results
 
+    @staticmethod
+    def _vote_buckets(all_runs: List[List[Dict]], buckets: Optional[List[Dict]] = None,
+                      first_run: int = 0, threshold: Optional[int] = None) -> List[Dict]:
+        """Group the runs' predictions into vote buckets.
+
+        Returns [{"runs": set of run indices, "names": set of normalised
+        names, "best_entry": entry}] in order of first appearance.
+
+        Adaptive voting adds each wave to the buckets so far instead of
+        regrouping every run: `buckets` are those (left unmodified), and
+        all_runs is the new wave, numbered from first_run. Existing buckets
+        are never split or merged. A name joins the bucket that already
+        has it, else the bucket it is similar to every name of (complete
+        linkage, as _cluster_diagnoses; most similar bucket, then earliest);
+        the wave's remaining names are clustered among themselves into new
+        buckets. A bucket that had `threshold` votes before the wave keeps
+        its best entry.
+        """
+        buckets = [dict(b, runs=set(b["runs"]), names=set(b["names"]))
+                   for b in buckets or []]
+        # (run index, normalised name, entry) for every distinct name per run
+        items = []
+        for run_idx, run_preds in enumerate(all_runs, first_run):
+            seen_this_run = set()
+            for pred in run_preds:
+                dx_name = pred.get("diagnosis", str(pred)) if isinstance(pred, dict) else str(pred)
+                norm = _normalize(dx_name)
+                if norm in seen_this_run:
+                    continue
+                seen_this_run.add(norm)
+                entry = pred if isinstance(pred, dict) else {"diagnosis": str(pred)}
+                items.append((run_idx, norm, entry))
+        if not items:
+            return buckets
+
+        frozen = {i for i, b in enumerate(buckets)
+                  if threshold is not None and len(b["runs"]) >= threshold}
+        home = {norm: i for i, b in enumerate(buckets) for norm in b["names"]}
+        new = sorted({norm for _, norm, _ in items} - home.keys())
+        if buckets and new:
+            known = sorted(home)
+            scores = _similarity_scores(known + new)[len(known):, :len(known)]
+            # Complete linkage of each new name to each bucket
+            link = np.stack([scores[:, [k for k, norm in enumerate(known) if home[norm] == i]]
+                             .min(axis=1) for i in range(len(buckets))], axis=1)
+            best = link.argmax(axis=1)
+            joined = {norm: int(best[row]) for row, norm in enumerate(new)
+                      if link[row, best[row]] >= 0.5}
+            home.update(joined)
+            new = [norm for norm in new if norm not in joined]
+        labels = dict(zip(new, _cluster_diagnoses(new))) if new else {}
+
+        # New buckets in order of first appearance
+        opened = {}  # cluster label -> bucket index
+        for run_idx, norm, entry in items:
+            if norm in home:
+                i = home[norm]
+            else:
+                i = opened.get(labels[norm])
+                if i is None:
+                    i = opened[labels[norm]] = len(buckets)
+                    buckets.append({"runs": set(), "names": set(), "best_entry": entry})
+            bucket = buckets[i]
+            bucket["runs"].add(run_idx)
+            bucket["names"].add(norm)
+            # Keep the entry with the longest evidence (earliest on ties)
+            old_ev = bucket["best_entry"].get("evidence", "")
+            if i not in frozen and len(entry.get("evidence", "")) > len(old_ev):
+                bucket["best_entry"] = entry
+        return buckets
+
     def _enrich(self, predictions: List[Dict]) -> List[Dict]:
         """Add DRG impact, revenue estimate, and category metadata."""
         enriched = []
@@ -1406,72 +2432,461 @@ class CDIEngine:
             procedure_notes: List of up to 2 procedure notes.
             ip_consult_note: Optional inpatient consult note.
             mode: "fast" (1 call), "balanced" (3 calls, voting), "high_recall" (5 calls).
+                "cascade" (cheap model, escalating to self.model; 1-2 calls)
+                is accepted for benchmarking only, see UNTUNED_MODES.
 
         Returns:
             dict with keys:
                 predictions: List of enriched diagnosis predictions
                 summary: dict with counts by DRG tier and category
                 metadata: timing, mode, model info
+
+        A blocking wrapper: runs analyse_async() on the engine's shared
+        event loop thread (see _run), so concurrent callers share one pooled
+        client. From asyncio code, await analyse_async() instead.
         """
-        start_time = datetime.now()
-        user_content = self._build_user_content(
+        return _run(self.analyse_async(
             discharge_summary, progress_note, hp_note, consult_note,
             ed_note=ed_note,
             progress_notes=progress_notes,
             consult_notes=consult_notes,
             procedure_notes=procedure_notes,
             ip_consult_note=ip_consult_note,
-        )
+            mode=mode,
+        ))
 
-        # Multi-pass methods (v18, v19, etc) dispatch on prompt_variant's
-        # predict_method, NOT on the user's --engine-mode flag. mode is
-        # ignored for these variants.
-        if self.predict_method == "two_pass_verify":
-            predictions = self._two_pass_verify(user_content, temperature=0.2)
-
-        elif mode == "fast":
-            raw_preds = self._single_pass(user_content, temperature=0.2)
-            # Assign confidence based on LLM's own confidence field
-            predictions = raw_preds
-
-        elif mode == "balanced":
-            # Self-consistency: 3 runs, keep ≥2/3 votes
-            # Fault-tolerant — if a pass fails, vote with fewer runs
-            runs = []
-            for i in range(3):
-                preds = self._single_pass(user_content, temperature=0.7,
-                                           raise_on_error=False)
-                if preds:  # only include successful runs
-                    runs.append(preds)
-                if i < 2:
-                    time.sleep(1)
-            if len(runs) >= 2:
-                predictions = self._vote(runs, threshold=2)
-            elif len(runs) == 1:
-                predictions = runs[0]  # fallback to single pass
-            else:
-                predictions = []
+    async def analyse_async(self, discharge_summary: str,
+                            progress_note: Optional[str] = None,
+                            hp_note: Optional[str] = None,
+                            consult_note: Optional[str] = None,
+                            ed_note: Optional[str] = None,
+                            progress_notes: Optional[List[str]] = None,
+                            consult_notes: Optional[List[str]] = None,
+                            procedure_notes: Optional[List[str]] = None,
+                            ip_consult_note: Optional[str] = None,
+                            mode: str = "balanced") -> Dict:
+        """analyse() for asyncio callers.
+
+        Every model call of the case (prediction passes, pathology scan, LLM
+        filter) is an awaited request on the loop's httpx client, so a case
+        in flight holds no thread of its own; the calls are paced by
+        gateway_client's shared per-endpoint governor.
+        """
+        # Checked before any LLM call is started (the pathology scan below)
+        if self.predict_method != "two_pass_verify" and mode not in MODES + UNTUNED_MODES:
+            raise ValueError(f"Unknown mode: {mode}. Use 'fast', 'balanced' "
+                             f"or 'high_recall'.")
+        with track_usage() as usage, track_parses() as parses:
+            start_time = datetime.now()
+            user_content, note_packing = self._pack_user_content(
+                discharge_summary, progress_note, hp_note, consult_note,
+                ed_note=ed_note,
+                progress_notes=progress_notes,
+                consult_notes=consult_notes,
+                procedure_notes=procedure_notes,
+                ip_consult_note=ip_consult_note,
+            )
+
+            # Multi-pass methods (v18, v19, etc) dispatch on prompt_variant's
+            # predict_method, NOT on the user's --engine-mode flag. mode is
+            # ignored for these variants.
+            # Stage graph: the pathology scan depends only on the notes and
+            # the documented-diagnosis list, not on the predictions —
+            #
+            #   notes ─┬─► documented ─► pathology scan (LLM) ──────────────┐
+            #          └─► main pass(es) (LLM) ─► Jaccard ─► LLM filter ─► merge ─► enrich
+            #
+            # so its LLM call runs alongside the main pass and _finalise
+            # waits for it at the merge: max(main, scan) instead of the sum.
+            pathology_task = None
+            if self.pathology_scan:
+                pathology_task = asyncio.create_task(self._scan_pathology(
+                    _extract_documented_diagnoses(discharge_summary),
+                    discharge_summary=discharge_summary,
+                    hp_note=hp_note, ed_note=ed_note,
+                    progress_notes=progress_notes,
+                    consult_notes=consult_notes,
+                    procedure_notes=procedure_notes,
+                    ip_consult_note=ip_consult_note,
+                ))
+
+            try:
+                voting_runs = None
+                voting_passes = None
+                cascade_info = None
+                # Only the prediction passes take the mode's reasoning effort;
+                # the filter and pathology calls keep their own. prediction_usage
+                # counts the HTTP requests they actually made (one per
+                # n-sampled request, plus fallbacks and retries; none on a
+                # cache hit) for metadata.api_calls.
+                with use_reasoning_effort(self.effort_for(mode)), \
+                        track_usage() as prediction_usage:
+                    if self.predict_method == "two_pass_verify":
+                        predictions = await self._two_pass_verify(user_content, temperature=0.2)
+
+                    elif mode == "fast":
+                        raw_preds = await self._single_pass(user_content, temperature=0.2)
+                        # Assign confidence based on LLM's own confidence field
+                        predictions = raw_preds
+
+                    elif mode in VOTING_MODES:
+                        # Self-consistency: balanced = 3 runs keep ≥2/3, high_recall =
+                        # 5 runs keep ≥2/5. Passes run concurrently.
+                        # Fault-tolerant — if a pass fails, vote with fewer runs
+                        num_runs, threshold = VOTING_MODES[mode]
+                        buckets = None
+                        if self.adaptive_voting:
+                            runs, voting_passes, buckets = await self._adaptive_runs(
+                                user_content, num_runs, threshold)
+                        else:
+                            runs = await self._self_consistency_runs(user_content, num_runs, threshold)
+                            voting_passes = num_runs
+                        voting_runs = len(runs)
+                        predictions = self._combine_runs(
+                            runs, threshold,
+                            num_passes=num_runs if voting_passes < num_runs else None,
+                            buckets=buckets)
+
+                    else:   # mode == "cascade"
+                        # Cheap model first; self.model for complex or unsure cases
+                        all_notes = [discharge_summary, progress_note, hp_note, consult_note,
+                                     ed_note, ip_consult_note, *(progress_notes or []),
+                                     *(consult_notes or []), *(procedure_notes or [])]
+                        predictions, cascade_info = await self._cascade(user_content, all_notes)
+
+                result = await self._finalise(
+                    predictions, mode, start_time, voting_runs,
+                    api_calls=prediction_usage.snapshot()["calls"],
+                    voting_passes=voting_passes,
+                    cascade_info=cascade_info,
+                    pathology_scan=pathology_task,
+                    discharge_summary=discharge_summary,
+                    hp_note=hp_note, ed_note=ed_note,
+                    progress_notes=progress_notes,
+                    consult_notes=consult_notes,
+                    procedure_notes=procedure_notes,
+                    ip_consult_note=ip_consult_note,
+                )
+            finally:
+                # Don't leave the scan running for a case that failed or was
+                # cancelled; a no-op once _finalise has collected it
+                if pathology_task is not None:
+                    pathology_task.cancel()
+        result["metadata"]["token_usage"] = usage.snapshot()
+        result["metadata"]["parse"] = parses.snapshot()
+        result["metadata"]["note_packing"] = note_packing
+        return result
+
+    async def analyse_many(self, cases: Iterable[Dict], concurrency: int = 4,
+                           mode: str = "balanced") -> AsyncIterator[Tuple[int, Any]]:
+        """Analyse `cases` with up to `concurrency` in flight; yield as they finish.
+
+        Each case is a dict of analyse() note keyword arguments
+        (discharge_summary required). Yields (index into `cases`, outcome)
+        in completion order; the outcome is analyse()'s result, or the
+        exception the case raised (a CancelledError for a case task that
+        was cancelled) — one failed case doesn't stop the rest
+        (cf. asyncio.gather(return_exceptions=True)).
+
+        `cases` is read lazily, only as slots free up, so a generator over
+        a large file is never held in memory at once. Each case is a task
+        on the running loop (with its own usage tally), not a thread.
+        """
+        pending: Dict[asyncio.Task, int] = {}
+
+        def submit_next() -> None:
+            for index, case in source:
+                notes = dict(case)
+                ds = notes.pop("discharge_summary")
+                pending[asyncio.create_task(self.analyse_async(ds, mode=mode, **notes))] = index
+                return
+
+        source = enumerate(cases)
+        try:
+            for _ in range(concurrency):
+                submit_next()
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = pending.pop(task)
+                    submit_next()
+                    if task.cancelled():
+                        # Cancelled from outside (e.g. a timeout wrapper):
+                        # that case's outcome, like any other exception
+                        yield index, asyncio.CancelledError()
+                    else:
+                        yield index, (task.exception() or task.result())
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def analyse_stream(self, discharge_summary: str, mode: str = "fast",
+                       **notes) -> Iterator[Dict]:
+        """analyse(), yielding findings while the model is still writing.
+
+        `notes` are analyse()'s other note keyword arguments. Events:
+
+            {"event": "finding", "prediction": {...}}
+                one enriched prediction, as soon as its JSON object has
+                arrived and passed the already-documented (Jaccard) filter
+            {"event": "done", "result": {...}}
+                the complete analyse() result
+
+        Only fast mode on a single_pass variant streams: the finding stage
+        (parse → documented filter → enrich) consumes the response as a
+        generator, so the first finding shows up seconds into generation
+        and the per-item work overlaps the rest of it. Voting, cascade and
+        two-pass need every pass before anything can be shown; they yield
+        their findings when analyse() returns. The "done" result is the
+        authoritative list — the optional LLM filter and the pathology scan
+        only see the complete set, and it is sorted by DRG impact.
+        """
+        if mode != "fast" or self.predict_method != "single_pass":
+            result = self.analyse(discharge_summary, mode=mode, **notes)
+            for p in result["predictions"]:
+                yield {"event": "finding", "prediction": p}
+            yield {"event": "done", "result": result}
+            return
+
+        # Step the generator inside its own context, so the usage / parse
+        # tallies it sets don't leak into (or get reset from) the consumer's
+        ctx = contextvars.copy_context()
+        events = self._stream_fast(discharge_summary, **notes)
+        try:
+            while True:
+                try:
+                    event = ctx.run(next, events)
+                except StopIteration:
+                    return
+                yield event
+        finally:
+            # Closed early (e.g. the web client went away): unwind the
+            # generator now and in its own context, not whenever it is
+            # garbage-collected — its tallies can only be reset in there
+            ctx.run(events.close)
+
+    def _stream_fast(self, discharge_summary: str, **notes) -> Iterator[Dict]:
+        with track_usage() as usage, track_parses() as parses:
+            start_time = datetime.now()
+            user_content, note_packing = self._pack_user_content(
+                discharge_summary, notes.get("progress_note"), notes.get("hp_note"),
+                notes.get("consult_note"),
+                ed_note=notes.get("ed_note"),
+                progress_notes=notes.get("progress_notes"),
+                consult_notes=notes.get("consult_notes"),
+                procedure_notes=notes.get("procedure_notes"),
+                ip_consult_note=notes.get("ip_consult_note"),
+            )
+            note_kwargs = dict(
+                hp_note=notes.get("hp_note"), ed_note=notes.get("ed_note"),
+                progress_notes=notes.get("progress_notes"),
+                consult_notes=notes.get("consult_notes"),
+                procedure_notes=notes.get("procedure_notes"),
+                ip_consult_note=notes.get("ip_consult_note"),
+            )
+            documented = _extract_documented_diagnoses(discharge_summary)
+            pathology_future = None
+            if self.pathology_scan:
+                pathology_future = self._start_pathology_scan(
+                    documented, discharge_summary=discharge_summary, **note_kwargs)
+
+            try:
+                messages = []
+                if self.system_prompt:
+                    messages.append({"role": "system", "content": self.system_prompt})
+                messages.append({"role": "user", "content": user_content})
 
-        elif mode == "high_recall":
-            # 5 runs, keep ≥2/5 votes (lower threshold = more recall)
-            runs = []
-            for i in range(5):
-                preds = self._single_pass(user_content, temperature=0.7,
-                                           raise_on_error=False)
-                if preds:
-                    runs.append(preds)
-                if i < 4:
-                    time.sleep(1)
-            if len(runs) >= 2:
-                predictions = self._vote(runs, threshold=2)
-            elif len(runs) == 1:
-                predictions = runs[0]
-            else:
                 predictions = []
+                with use_reasoning_effort(self.effort_for("fast")), \
+                        track_usage() as prediction_usage:
+                    chunks = _stream_llm(messages, self.api_key, model=self.model,
+                                         temperature=0.2, static_prefix=self.user_prefix,
+                                         structured=self.structured_output)
+                    for pred in _stream_predictions(chunks):
+                        predictions.append(pred)
+                        kept, _ = _filter_already_documented([pred], documented,
+                                                             full_text=discharge_summary)
+                        for p in self._enrich(kept):
+                            yield {"event": "finding", "prediction": p}
+
+                result = _run(self._finalise(
+                    predictions, "fast", start_time, None,
+                    api_calls=prediction_usage.snapshot()["calls"],
+                    pathology_scan=pathology_future,
+                    discharge_summary=discharge_summary, **note_kwargs,
+                ))
+            finally:
+                # Also reached when the consumer closes the stream early
+                _settle_pathology_scan(pathology_future)
+        result["metadata"]["token_usage"] = usage.snapshot()
+        result["metadata"]["parse"] = parses.snapshot()
+        result["metadata"]["note_packing"] = note_packing
+        result["metadata"]["streamed"] = True
+        yield {"event": "done", "result": result}
+
+    async def _scan_pathology(self, documented: List[str], **notes) -> Dict:
+        """The Phase E pathology scan; `notes` are the note keyword
+        arguments of scan_for_pathology_gaps."""
+        from pathology_scanner import scan_for_pathology_gaps_async
+        return await scan_for_pathology_gaps_async(
+            api_key=self.api_key, documented_diagnoses=documented,
+            model=self.pathology_scan_model, **notes)
+
+    def _start_pathology_scan(self, documented: List[str], **notes) -> Future:
+        """Start the pathology scan on a background thread, for the
+        streaming path (a sync generator, with no event loop to run
+        _scan_pathology on while the prediction streams in).
+
+        `notes` are the note keyword arguments of scan_for_pathology_gaps.
+        The scan's token usage counts towards the caller's track_usage().
+        """
+        from pathology_scanner import scan_for_pathology_gaps
+        pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            return pool.submit(contextvars.copy_context().run, scan_for_pathology_gaps,
+                               api_key=self.api_key, documented_diagnoses=documented,
+                               model=self.pathology_scan_model, **notes)
+        finally:
+            pool.shutdown(wait=False)
+
+    def _combine_runs(self, runs: List[List[Dict]], threshold: int,
+                      num_passes: Optional[int] = None,
+                      buckets: Optional[List[Dict]] = None) -> List[Dict]:
+        """Vote over successful runs; degrade to a single run / nothing."""
+        if len(runs) >= 2:
+            return self._vote(runs, threshold=threshold, num_passes=num_passes,
+                              buckets=buckets)
+        if len(runs) == 1:
+            return runs[0]  # fallback to single pass
+        return []
+
+    # --- Batch API support --------------------------------------------------
+    #
+    # Offline runs (evaluate_cdi_accuracy --batch) submit every prediction
+    # pass of every case as one Batch API job, then hand the raw responses
+    # back here. batch_requests() yields exactly the requests analyse()
+    # would have sent (same messages, same cache key per pass) and
+    # analyse_from_responses() applies the same parse → vote → filter →
+    # enrich pipeline, so batch and synchronous runs are interchangeable.
+
+    def supports_batch(self, mode: Optional[str] = None) -> bool:
+        """Batch mode needs single-pass prompts on an Azure deployment.
+
+        two_pass_verify feeds pass-1 output into pass 2, cascade decides on
+        escalation from the first answer, and Bedrock has no batch endpoint
+        on the gateway.
+        """
+        return (self.predict_method == "single_pass" and mode != "cascade"
+                and not _is_bedrock_model(self.model))
+
+    def batch_requests(self, mode: str = "balanced", **notes) -> List[Dict]:
+        """Return the prediction passes for one case as batch request specs.
 
+        Each spec: {"sample", "messages", "temperature", "max_tokens",
+        "reasoning_effort", "structured", "static_prefix", "body", "cache_key"} — cache_key
+        matches the entry _call_llm would use, so batch results land in (and
+        are served from) the same cache.
+        `notes` are the analyse() note keyword arguments.
+        """
+        if not self.supports_batch():
+            raise ValueError(f"Batch mode not supported for {self.prompt_variant} "
+                             f"on {self.model}")
+        user_content = self._build_user_content(
+            notes.get("discharge_summary", ""), notes.get("progress_note"),
+            notes.get("hp_note"), notes.get("consult_note"),
+            ed_note=notes.get("ed_note"),
+            progress_notes=notes.get("progress_notes"),
+            consult_notes=notes.get("consult_notes"),
+            procedure_notes=notes.get("procedure_notes"),
+            ip_consult_note=notes.get("ip_consult_note"),
+        )
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        messages.append({"role": "user", "content": user_content})
+
+        if mode == "fast":
+            passes = [(0, 0.2)]
+        elif mode in VOTING_MODES:
+            passes = [(i, 0.7) for i in range(VOTING_MODES[mode][0])]
         else:
             raise ValueError(f"Unknown mode: {mode}. Use 'fast', 'balanced', or 'high_recall'.")
 
+        max_tokens = 32000  # _call_llm default
+        effort = self.effort_for(mode)
+        # Planned budget in the body; cache key on the nominal one, as _call_llm
+        budget, _ = _plan_budget(self.model, messages, max_tokens, effort, self.user_prefix)
+        return [{
+            "sample": sample,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "reasoning_effort": effort,
+            "structured": self.structured_output,
+            "static_prefix": self.user_prefix,
+            "body": _azure_body(self.model, messages, temperature, budget, effort,
+                                self.structured_output),
+            "cache_key": cache_key(self.model, messages, temperature, max_tokens, sample,
+                                   reasoning_effort=effort,
+                                   structured=self.structured_output),
+        } for sample, temperature in passes]
+
+    def analyse_from_responses(self, raw_responses: List[Optional[str]],
+                               mode: str = "balanced", **notes) -> Dict:
+        """Finish analyse() from pre-fetched raw responses (one per pass).
+
+        None marks a pass that failed; like the synchronous path, failed
+        voting passes are dropped and a failed fast pass is an error.
+        """
+        with track_usage() as usage, track_parses() as parses:
+            start_time = datetime.now()
+            voting_runs = None
+            if mode == "fast":
+                if raw_responses[0] is None:
+                    raise RuntimeError("Batch prediction pass failed")
+                predictions = _parse_llm_response(raw_responses[0])
+            else:
+                num_runs, threshold = VOTING_MODES[mode]
+                runs = [_parse_llm_response(r) for r in raw_responses if r is not None]
+                runs = [r for r in runs if r]
+                voting_runs = len(runs)
+                predictions = self._combine_runs(runs, threshold)
+
+            result = _run(self._finalise(
+                predictions, mode, start_time, voting_runs,
+                api_calls=len(raw_responses),
+                discharge_summary=notes.get("discharge_summary", ""),
+                hp_note=notes.get("hp_note"), ed_note=notes.get("ed_note"),
+                progress_notes=notes.get("progress_notes"),
+                consult_notes=notes.get("consult_notes"),
+                procedure_notes=notes.get("procedure_notes"),
+                ip_consult_note=notes.get("ip_consult_note"),
+            ))
+        result["metadata"]["token_usage"] = usage.snapshot()
+        result["metadata"]["parse"] = parses.snapshot()
+        result["metadata"]["batch"] = True
+        return result
+
+    async def _finalise(self, predictions: List[Dict], mode: str,
+                        start_time: datetime, voting_runs: Optional[int],
+                        discharge_summary: str,
+                        api_calls: Optional[int] = None,
+                        voting_passes: Optional[int] = None,
+                        cascade_info: Optional[Dict] = None,
+                        pathology_scan: Optional[Union[asyncio.Future, Future]] = None,
+                        hp_note: Optional[str] = None,
+                        ed_note: Optional[str] = None,
+                        progress_notes: Optional[List[str]] = None,
+                        consult_notes: Optional[List[str]] = None,
+                        procedure_notes: Optional[List[str]] = None,
+                        ip_consult_note: Optional[str] = None) -> Dict:
+        """Post-prediction pipeline: documented filters, pathology scan,
+        enrichment, summary and metadata.
+
+        pathology_scan is a scan already started: analyse_async()'s task,
+        or the streaming path's thread future (_start_pathology_scan).
+        Without one the scan runs here.
+        """
         # Filter RESTORED (2026-05-01): the 17 Apr bypass was based on the
         # judgment that the filter cost ~2.76pp recall for marginal
         # precision gain. Phase C (28 Apr) demonstrated the opposite is
@@ -1494,7 +2909,7 @@ class CDIEngine:
         # gpt-5-nano default keeps this at ~$0.0001/case. Off by default.
         filtered_by_llm: List[Dict] = []
         if self.llm_filter and documented:
-            predictions, filtered_by_llm = _llm_already_documented_filter(
+            predictions, filtered_by_llm = await _llm_already_documented_filter(
                 predictions, documented, self.api_key,
                 filter_model=self.filter_model,
                 full_text=discharge_summary,
@@ -1511,19 +2926,18 @@ class CDIEngine:
         phase_e_info = {"called": False, "skip_reason": None,
                         "segments_found": 0, "gaps_added": 0}
         if self.pathology_scan:
-            from pathology_scanner import scan_for_pathology_gaps
-            scan_result = scan_for_pathology_gaps(
-                discharge_summary=discharge_summary,
-                api_key=self.api_key,
-                documented_diagnoses=documented,
-                procedure_notes=procedure_notes,
-                consult_notes=consult_notes,
-                progress_notes=progress_notes,
-                ip_consult_note=ip_consult_note,
-                hp_note=hp_note,
-                ed_note=ed_note,
-                model=self.pathology_scan_model,
-            )
+            if pathology_scan is None:
+                scan_result = await self._scan_pathology(
+                    documented,
+                    discharge_summary=discharge_summary,
+                    hp_note=hp_note, ed_note=ed_note,
+                    progress_notes=progress_notes,
+                    consult_notes=consult_notes,
+                    procedure_notes=procedure_notes,
+                    ip_consult_note=ip_consult_note,
+                )
+            else:
+                scan_result = await asyncio.wrap_future(pathology_scan)
             phase_e_info["called"] = scan_result["scan_called"]
             phase_e_info["skip_reason"] = scan_result["skip_reason"]
             phase_e_info["segments_found"] = scan_result["segments_found"]
@@ -1574,15 +2988,23 @@ class CDIEngine:
                 "model": self.model,
                 "mode": mode if self.predict_method == "single_pass" else self.predict_method,
                 "predict_method": self.predict_method,
-                "api_calls": (
-                    2 if self.predict_method == "two_pass_verify"
-                    else {"fast": 1, "balanced": 3, "high_recall": 5}[mode]
-                ),
+                # Prediction requests actually sent (not the mode's nominal
+                # pass count); feeds the evaluator's cost_by_tier
+                "api_calls": api_calls,
                 "elapsed_seconds": round(elapsed, 1),
                 "timestamp": datetime.now().isoformat(),
                 "engine_version": "1.2.0",
                 "prompt_variant": self.prompt_variant,
-                "voting": self.predict_method == "single_pass" and mode != "fast",
+                "voting": self.predict_method == "single_pass" and mode in VOTING_MODES,
+                "voting_runs_succeeded": voting_runs,
+                # mode="cascade": triage, tier that answered, reason
+                "cascade": cascade_info,
+                # Adaptive voting: vote_total on each prediction is the number
+                # of runs actually made, not the mode's nominal 3 / 5
+                "voting_early_stopped": (
+                    voting_passes is not None and self.predict_method == "single_pass"
+                    and voting_passes < VOTING_MODES[mode][0]
+                ),
                 "llm_filter": self.llm_filter,
                 "filter_model": self.filter_model if self.llm_filter else None,
                 "filtered_by_llm_count": len(filtered_by_llm),
@@ -1599,14 +3021,45 @@ class CDIEngine:
 # CLI for quick testing
 # ===========================================================================
 
+def add_engine_args(parser) -> None:
+    """Add the CDIEngine flags shared by the single-case and batch CLIs."""
+    parser.add_argument("--api-key", required=True, help="Stanford SecureGPT API key")
+    parser.add_argument("--model", default="gpt-5", choices=["gpt-5", "gpt-4.1", "gpt-5-nano"])
+    parser.add_argument("--mode", default="fast", choices=MODES,
+                        help="fast (1 call), balanced (3-vote), or high_recall (5-vote)")
+    parser.add_argument("--n-samples", action="store_true",
+                        help="Voting modes: request all passes in one call (n=3/5)")
+    parser.add_argument("--adaptive-voting", action="store_true",
+                        help="Voting modes: run passes in waves and stop once the "
+                             "remaining ones can't change the accepted diagnoses")
+    parser.add_argument("--structured-output", action="store_true",
+                        help="Have the provider enforce the prediction JSON schema")
+    parser.add_argument("--reasoning-effort", default=None,
+                        help='GPT-5 reasoning effort: "low", or per mode e.g. '
+                             '"fast=low,high_recall=high"')
+
+
+def engine_from_args(args) -> "CDIEngine":
+    """CDIEngine configured by the flags add_engine_args added."""
+    return CDIEngine(api_key=args.api_key, model=args.model, n_samples=args.n_samples,
+                     adaptive_voting=args.adaptive_voting,
+                     reasoning_effort=parse_reasoning_effort(args.reasoning_effort),
+                     structured_output=args.structured_output)
+
+
 if __name__ == "__main__":
     import argparse
     import sys
 
-    parser = argparse.ArgumentParser(description="CDI Coding Intelligence Engine")
-    parser.add_argument("--api-key", required=True, help="Stanford SecureGPT API key")
-    parser.add_argument("--model", default="gpt-5", choices=["gpt-5", "gpt-4.1", "gpt-5-nano"])
-    parser.add_argument("--mode", default="fast", choices=["fast", "balanced", "high_recall"])
+    if sys.argv[1:2] == ["batch"]:
+        # cdi_engine.py batch --input encounters.csv --output results.jsonl ...
+        from engine_batch import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(
+        description="CDI Coding Intelligence Engine "
+                    "(for a file of encounters: cdi_engine.py batch --help)")
+    add_engine_args(parser)
     parser.add_argument("--input", help="Path to discharge summary text file")
     args = parser.parse_args()
 
@@ -1617,7 +3070,7 @@ if __name__ == "__main__":
         print("Enter discharge summary (Ctrl+D to finish):")
         text = sys.stdin.read()
 
-    engine = CDIEngine(api_key=args.api_key, model=args.model)
+    engine = engine_from_args(args)
     result = engine.analyse(discharge_summary=text, mode=args.mode)
 
     print(f"\n{'='*70}")
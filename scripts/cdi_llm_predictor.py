@@ -9,20 +9,23 @@ that physicians frequently forget to document, leaving money on the table.
 
 import json
 import re
-import time
-import requests
+import sys
 import pandas as pd
-from typing import Dict, List
+from typing import Dict, Iterator, List
 from datetime import datetime
+from pathlib import Path
 
-def call_stanford_llm(prompt: str, api_key: str, model: str = "gpt-4.1") -> str:
-    """Call Stanford's PHI-safe LLM"""
-    headers = {
-        # AI Hub gateway (aihubapi.stanfordhealthcare.org) uses "api-key"
-        # header, not the old APIM "Ocp-Apim-Subscription-Key" header.
-        'api-key': api_key,
-        'Content-Type': 'application/json'
-    }
+# Sibling modules, also when imported as scripts.cdi_llm_predictor (llm_judge)
+sys.path.insert(0, str(Path(__file__).parent))
+from gateway_client import GatewayError, post_json, stream_events
+from llm_cache import cached_llm_call, cached_llm_stream
+from note_sections import index_note
+
+def _build_request(prompt: str, model: str):
+    """(url, request body, is_claude) for one prompt"""
+    # AI Hub gateway (aihubapi.stanfordhealthcare.org) uses "api-key"
+    # header, not the old APIM "Ocp-Apim-Subscription-Key" header — set by
+    # gateway_client.post_json.
 
     # Model endpoints — Stanford SecureGPT AI Hub
     # Migrated 8 May 2026 from apim.stanfordhealthcare.org → aihubapi.stanfordhealthcare.org
@@ -47,11 +50,11 @@ def call_stanford_llm(prompt: str, api_key: str, model: str = "gpt-4.1") -> str:
             "claude-opus-4": "claude-opus-4-20250514",
             "claude-sonnet-4": "claude-sonnet-4-20250514",
         }
-        payload = json.dumps({
+        request_body = {
             "model": claude_model_map.get(model, model),
             "max_tokens": 4000,
             "messages": [{"role": "user", "content": prompt}]
-        })
+        }
     else:
         # OpenAI format - GPT-5 models have different API requirements
         is_gpt5 = model.startswith("gpt-5")
@@ -69,68 +72,102 @@ def call_stanford_llm(prompt: str, api_key: str, model: str = "gpt-4.1") -> str:
         else:
             request_body["temperature"] = 0.1  # Low temperature for consistency
             request_body["max_tokens"] = 4000
-        payload = json.dumps(request_body)
 
-    # Retry with exponential backoff for transient errors (rate limits, timeouts)
-    max_retries = 5
-    for attempt in range(max_retries):
+    return url, request_body, is_claude
+
+
+def _api_error_message(e: GatewayError) -> str:
+    error_msg = f"API Error {e.status_code}: {e.body}" if e.status_code else str(e)
+    if e.status_code == 401:
+        error_msg += "\n\nPossible causes:"
+        error_msg += "\n1. API key has expired - contact Fateme Nateghi for new credentials"
+        error_msg += "\n2. Not connected to Stanford VPN (required for PHI-safe API access)"
+        error_msg += "\n3. API key format is incorrect"
+    return error_msg
+
+
+def call_stanford_llm(prompt: str, api_key: str, model: str = "gpt-4.1") -> str:
+    """Call Stanford's PHI-safe LLM (served from llm_cache when one is configured)"""
+    url, request_body, is_claude = _build_request(prompt, model)
+
+    def _fetch():
+        # Retry with exponential backoff for transient errors (rate limits,
+        # timeouts) is handled by the shared gateway client.
         try:
-            response = requests.post(url, headers=headers, data=payload, timeout=120)
-
-            if response.status_code == 429 or response.status_code >= 500:
-                # Rate limited or server error — retry with backoff
-                wait = 2 ** attempt + 1  # 2, 3, 5, 9, 17 seconds
-                print(f"  ⏳ API {response.status_code}, retrying in {wait}s (attempt {attempt+1}/{max_retries})")
-                time.sleep(wait)
-                continue
-
-            if response.status_code != 200:
-                error_msg = f"API Error {response.status_code}: {response.text}"
-                if response.status_code == 401:
-                    error_msg += "\n\nPossible causes:"
-                    error_msg += "\n1. API key has expired - contact Fateme Nateghi for new credentials"
-                    error_msg += "\n2. Not connected to Stanford VPN (required for PHI-safe API access)"
-                    error_msg += "\n3. API key format is incorrect"
-                raise Exception(error_msg)
-
-            break  # Success
-        except requests.exceptions.RequestException as e:
-            if attempt < max_retries - 1:
-                wait = 2 ** attempt + 1
-                print(f"  ⏳ Connection error, retrying in {wait}s (attempt {attempt+1}/{max_retries}): {e}")
-                time.sleep(wait)
-            else:
-                raise
+            resp_json = post_json(url, request_body, api_key, read_timeout=120, verbose=True)
+        except GatewayError as e:
+            raise Exception(_api_error_message(e))
 
-    # Throttle: brief pause between calls to avoid rate limits
-    time.sleep(0.5)
+        # No post-call sleep: pacing is done by the gateway's rate governor
+        # (rate_limiter.py) before each request.
 
-    # Parse response - Claude vs OpenAI have different formats
-    try:
-        resp_json = json.loads(response.text)
-        if is_claude:
-            return resp_json['content'][0]['text']
-        else:
-            content = resp_json['choices'][0]['message']['content']
-            # Debug: Check for empty content with GPT-5
-            if content is None or content == "":
-                # Log the full response structure for debugging
-                import os
-                debug_log = os.environ.get('CDI_DEBUG_LOG')
-                if debug_log:
-                    with open(debug_log, 'a') as f:
-                        f.write(f"\n{'='*80}\n")
-                        f.write(f"EMPTY CONTENT DETECTED for model: {model}\n")
-                        f.write(f"Full API response:\n{json.dumps(resp_json, indent=2)[:3000]}\n")
-                # Check for finish_reason
-                finish_reason = resp_json['choices'][0].get('finish_reason', 'unknown')
-                if finish_reason == 'length':
-                    raise Exception(f"GPT-5 response truncated (finish_reason=length). Try shorter prompt.")
-                elif finish_reason == 'content_filter':
-                    raise Exception(f"GPT-5 content filtered. Response blocked by safety filter.")
-            return content if content else ""
-    except (KeyError, json.JSONDecodeError) as e:
-        raise Exception(f"Unexpected API response format: {response.text[:500]}. Error: {e}")
+        # Parse response - Claude vs OpenAI have different formats
+        try:
+            if is_claude:
+                return resp_json['content'][0]['text']
+            else:
+                content = resp_json['choices'][0]['message']['content']
+                # Debug: Check for empty content with GPT-5
+                if content is None or content == "":
+                    # Log the full response structure for debugging
+                    import os
+                    debug_log = os.environ.get('CDI_DEBUG_LOG')
+                    if debug_log:
+                        with open(debug_log, 'a') as f:
+                            f.write(f"\n{'='*80}\n")
+                            f.write(f"EMPTY CONTENT DETECTED for model: {model}\n")
+                            f.write(f"Full API response:\n{json.dumps(resp_json, indent=2)[:3000]}\n")
+                    # Check for finish_reason
+                    finish_reason = resp_json['choices'][0].get('finish_reason', 'unknown')
+                    if finish_reason == 'length':
+                        raise Exception(f"GPT-5 response truncated (finish_reason=length). Try shorter prompt.")
+                    elif finish_reason == 'content_filter':
+                        raise Exception(f"GPT-5 content filtered. Response blocked by safety filter.")
+                return content if content else ""
+        except (KeyError, json.JSONDecodeError) as e:
+            raise Exception(f"Unexpected API response format: {json.dumps(resp_json)[:500]}. Error: {e}")
+
+    return cached_llm_call(model, request_body["messages"],
+                           request_body.get("temperature"),
+                           request_body.get("max_completion_tokens", request_body.get("max_tokens")),
+                           _fetch)
+
+
+def stream_stanford_llm(prompt: str, api_key: str, model: str = "gpt-4.1") -> Iterator[str]:
+    """call_stanford_llm, streamed: yields the response text as it arrives.
+
+    Same request and same cache entry as call_stanford_llm. Claude models
+    aren't streamed; their response comes back as one chunk.
+    """
+    url, request_body, is_claude = _build_request(prompt, model)
+    if is_claude:
+        yield call_stanford_llm(prompt, api_key, model)
+        return
+
+    def _fetch():
+        body = dict(request_body, stream=True, stream_options={"include_usage": True})
+        produced = False
+        finish_reason = None
+        try:
+            for event in stream_events(url, body, api_key, read_timeout=120, verbose=True):
+                for choice in event.get("choices") or []:
+                    text = (choice.get("delta") or {}).get("content")
+                    if text:
+                        produced = True
+                        yield text
+                    finish_reason = choice.get("finish_reason") or finish_reason
+        except GatewayError as e:
+            raise Exception(_api_error_message(e))
+        if not produced and finish_reason == 'length':
+            raise Exception("GPT-5 response truncated (finish_reason=length). Try shorter prompt.")
+        elif not produced and finish_reason == 'content_filter':
+            raise Exception("GPT-5 content filtered. Response blocked by safety filter.")
+
+    yield from cached_llm_stream(model, request_body["messages"],
+                                 request_body.get("temperature"),
+                                 request_body.get("max_completion_tokens",
+                                                  request_body.get("max_tokens")),
+                                 _fetch)
 
 
 def extract_documented_diagnoses(discharge_summary: str) -> List[str]:
@@ -144,7 +181,9 @@ def extract_documented_diagnoses(discharge_summary: str) -> List[str]:
     documented = []
 
     # Normalize: replace 2+ spaces with newlines so section parsing works uniformly
-    text = re.sub(r'  +', '\n', discharge_summary)
+    # (done once per note by the shared section index)
+    sections = index_note(discharge_summary)
+    text = sections.text
 
     # Section headers that contain documented diagnoses
     section_headers = [
@@ -157,9 +196,7 @@ def extract_documented_diagnoses(discharge_summary: str) -> List[str]:
     ]
 
     for header in section_headers:
-        pattern = header + r'\s*:?\s*\n(.*?)(?=\n[A-Z][A-Za-z\s/]{3,}:|$)'
-        matches = re.findall(pattern, text, re.DOTALL | re.IGNORECASE)
-        for match in matches:
+        for match in sections.bodies(header):
             for line in match.split('\n'):
                 line = line.strip()
                 if not line or len(line) < 4:
@@ -259,6 +296,65 @@ def predict_missed_diagnoses(discharge_summary: str, api_key: str, model: str =
         procedure_notes: List of up to 2 procedure notes (operative/procedural).
         ip_consult_note: Inpatient consult note.
     """
+    prompt = _build_prediction_prompt(
+        discharge_summary, progress_note=progress_note, hp_note=hp_note, ed_note=ed_note,
+        progress_notes=progress_notes, consult_notes=consult_notes,
+        procedure_notes=procedure_notes, ip_consult_note=ip_consult_note)
+
+    response = call_stanford_llm(prompt, api_key, model)
+
+    # DEBUG: Log raw response for GPT-5 investigation
+    if model.startswith("gpt-5"):
+        import os
+        debug_log = os.environ.get('CDI_DEBUG_LOG')
+        if debug_log:
+            with open(debug_log, 'a') as f:
+                f.write(f"\n{'='*80}\n")
+                f.write(f"Model: {model}\n")
+                f.write(f"Prompt length: {len(prompt)} chars\n")
+                f.write(f"Response length: {len(response)} chars\n")
+                f.write(f"Response preview (first 2000 chars):\n{response[:2000]}\n")
+                f.write(f"Response end (last 500 chars):\n{response[-500:]}\n")
+
+    return _parse_prediction_response(response, discharge_summary, filter_documented)
+
+
+def stream_missed_diagnoses(discharge_summary: str, api_key: str, model: str = "gpt-4.1",
+                            filter_documented: bool = True, **notes) -> Iterator[Dict]:
+    """
+    predict_missed_diagnoses, yielding each diagnosis as the model writes it.
+
+    `notes` are predict_missed_diagnoses' note keyword arguments. Events:
+        {"event": "finding", "diagnosis": {...}}  — as soon as its JSON
+            object has arrived and passed filter_already_documented
+        {"event": "done", "result": {...}}  — exactly what
+            predict_missed_diagnoses returns for the full response
+    """
+    from json_stream import ItemStream
+
+    prompt = _build_prediction_prompt(discharge_summary, **notes)
+    documented = extract_documented_diagnoses(discharge_summary) if filter_documented else []
+    items = ItemStream()
+    chunks = []
+    for chunk in stream_stanford_llm(prompt, api_key, model):
+        chunks.append(chunk)
+        for item in items.feed(chunk):
+            for diagnosis in filter_already_documented([item], documented):
+                yield {"event": "finding", "diagnosis": diagnosis}
+    yield {"event": "done",
+           "result": _parse_prediction_response("".join(chunks), discharge_summary,
+                                                filter_documented)}
+
+
+def _build_prediction_prompt(discharge_summary: str,
+                             progress_note: str = None,
+                             hp_note: str = None,
+                             ed_note: str = None,
+                             progress_notes: List[str] = None,
+                             consult_notes: List[str] = None,
+                             procedure_notes: List[str] = None,
+                             ip_consult_note: str = None) -> str:
+    """The predict_missed_diagnoses prompt for one case"""
 
     # Build additional clinical context from all available notes
     additional_sections = []
@@ -693,22 +789,12 @@ IMPORTANT:
 - Be specific about evidence (cite actual values from the note)
 - Quality over quantity: 2-3 high-confidence, truly undocumented findings are better than 8 that include already-documented conditions
 """
+    return prompt
 
-    response = call_stanford_llm(prompt, api_key, model)
-
-    # DEBUG: Log raw response for GPT-5 investigation
-    if model.startswith("gpt-5"):
-        import os
-        debug_log = os.environ.get('CDI_DEBUG_LOG')
-        if debug_log:
-            with open(debug_log, 'a') as f:
-                f.write(f"\n{'='*80}\n")
-                f.write(f"Model: {model}\n")
-                f.write(f"Prompt length: {len(prompt)} chars\n")
-                f.write(f"Response length: {len(response)} chars\n")
-                f.write(f"Response preview (first 2000 chars):\n{response[:2000]}\n")
-                f.write(f"Response end (last 500 chars):\n{response[-500:]}\n")
 
+def _parse_prediction_response(response: str, discharge_summary: str,
+                               filter_documented: bool = True) -> Dict:
+    """predict_missed_diagnoses result from the model's raw response"""
     try:
         # Try direct JSON parse first
         result = json.loads(response)
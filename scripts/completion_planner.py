@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+completion_planner.py — size GPT-5 completion budgets from observed usage.
+
+GPT-5's max_completion_tokens covers reasoning AND output. When reasoning
+uses it all up the response comes back empty with finish_reason=length,
+and _call_azure resends the whole request with the budget doubled (32k →
+64k). The first call is paid for in full — prompt and every reasoning
+token — and thrown away.
+
+The planner learns how many completion tokens each kind of request
+actually uses and starts from a budget that fits:
+
+    - Every successful GPT-5 response's usage.completion_tokens is
+      recorded under (model, reasoning effort, prompt, input-size bucket).
+      "Prompt" is a hash of the fixed instructions only — the system
+      message plus the user message's static prefix (the variant's
+      user_prefix), never the notes — so each variant, the LLM filter,
+      the pathology scan and the judge each get their own history. A
+      request with neither is tallied but not planned. Input size is
+      bucketed in powers of two (<1k, <2k, <4k … tokens), as reasoning
+      length grows with the notes.
+    - Once a key has MIN_HISTORY samples, the initial budget is its
+      PERCENTILE-th percentile × HEADROOM, rounded up to 1k. The planner
+      only ever raises the caller's budget: a budget below it would save
+      TPM reservation but risk more retries, each costing a whole call.
+    - History is kept in memory for the run. To carry it over to the
+      next run, set CDI_COMPLETION_STATS to a JSON file path ("default"
+      for ~/.cache/cdi_llm/completion_stats.json); it is written every
+      SAVE_EVERY records and at exit. It holds token counts only, no
+      text.
+
+planner_stats() reports how often truncation retries still happened and
+what share of the tokens they cost; the evaluator prints it in its run
+summary.
+
+reasoning_effort (minimal | low | medium | high) is the other lever on
+reasoning length. CDIEngine sets it per mode (--reasoning-effort, e.g.
+"fast=low,high_recall=high") through the use_reasoning_effort() context;
+it is sent to GPT-5 deployments only, and is part of the response cache
+key and of the planner key.
+"""
+
+import atexit
+import contextvars
+import hashlib
+import json
+import math
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_STATS_PATH = Path.home() / ".cache" / "cdi_llm" / "completion_stats.json"
+
+MIN_HISTORY = 8             # samples before a key's history sets the budget
+MAX_HISTORY = 200           # most recent samples kept per key
+PERCENTILE = 95
+HEADROOM = 1.25
+MAX_BUDGET = 65000          # same cap as the doubling retry
+SAVE_EVERY = 25             # records between writes of the stats file
+
+REASONING_EFFORTS = ("minimal", "low", "medium", "high")
+
+_effort: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "cdi_reasoning_effort", default=None)
+
+
+# ===========================================================================
+# REASONING EFFORT
+# ===========================================================================
+
+def parse_reasoning_effort(spec: Optional[str]) -> Dict[str, str]:
+    """--reasoning-effort value → {mode: effort}.
+
+    "low" applies to every mode ("*"); "fast=low,high_recall=high" sets
+    modes individually.
+    """
+    out = {}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        mode, _, effort = part.rpartition("=")
+        if effort not in REASONING_EFFORTS:
+            raise ValueError(f"Unknown reasoning effort {effort!r} "
+                             f"(use one of {', '.join(REASONING_EFFORTS)})")
+        out[mode or "*"] = effort
+    return out
+
+
+@contextmanager
+def use_reasoning_effort(effort: Optional[str]) -> Iterator[None]:
+    """GPT-5 calls made inside this block send `reasoning_effort`."""
+    token = _effort.set(effort)
+    try:
+        yield
+    finally:
+        _effort.reset(token)
+
+
+def current_reasoning_effort() -> Optional[str]:
+    return _effort.get()
+
+
+# ===========================================================================
+# PLANNER
+# ===========================================================================
+
+def _size_bucket(messages: list) -> str:
+    from note_packer import count_tokens
+
+    tokens = sum(count_tokens(m["content"]) for m in messages
+                 if isinstance(m.get("content"), str))
+    return f"<{1 << ((max(tokens, 1) - 1) // 1000).bit_length()}k"
+
+
+def _prompt_id(messages: list, static_prefix: Optional[str] = None) -> str:
+    """Hash of the request's fixed instructions; "" if it has none."""
+    system = ""
+    if messages and messages[0].get("role") == "system":
+        system = messages[0].get("content") or ""
+        system = system if isinstance(system, str) else json.dumps(system)
+    if not system and not static_prefix:
+        return ""
+    head = f"{system}\0{static_prefix or ''}"
+    return hashlib.sha1(head.encode("utf-8")).hexdigest()[:10]
+
+
+class CompletionPlanner:
+    """Per-key completion-token history, plus a tally of truncations."""
+
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        self._lock = threading.Lock()
+        self._history: Optional[Dict[str, List[int]]] = None
+        self._unsaved = 0
+        self.stats = {"calls": 0, "planned_calls": 0, "truncation_retries": 0,
+                      "tokens": 0, "wasted_tokens": 0}
+
+    def _load_locked(self) -> Dict[str, List[int]]:
+        if self._history is None:
+            self._history = {}
+            if self.path is not None and self.path.exists():
+                try:
+                    self._history = json.loads(self.path.read_text())
+                except (OSError, ValueError) as e:
+                    print(f"    Completion stats unreadable, starting fresh: {e}")
+        return self._history
+
+    def plan(self, model: str, messages: list, max_tokens: int,
+             effort: Optional[str] = None,
+             static_prefix: Optional[str] = None) -> Tuple[int, str]:
+        """(initial budget, planner key) for one request.
+
+        The key is "" when the request has no fixed instructions to key on;
+        record() then only tallies it.
+        """
+        prompt = _prompt_id(messages, static_prefix)
+        if not prompt:
+            return max_tokens, ""
+        key = "|".join((model, effort or "default", prompt, _size_bucket(messages)))
+        with self._lock:
+            history = self._load_locked().get(key) or []
+            if len(history) < MIN_HISTORY:
+                return max_tokens, key
+            ranked = sorted(history)
+            p = ranked[min(len(ranked) - 1, math.ceil(PERCENTILE / 100 * len(ranked)) - 1)]
+            self.stats["planned_calls"] += 1
+        planned = min(MAX_BUDGET, math.ceil(p * HEADROOM / 1000) * 1000)
+        return max(max_tokens, planned), key
+
+    def record(self, key: str, data: dict, truncated: bool, n: int = 1) -> None:
+        """Record one response: its usage, and whether it must be retried."""
+        usage = data.get("usage") or {}
+        completion = usage.get("completion_tokens", 0) or 0
+        total = (usage.get("prompt_tokens", 0) or 0) + completion
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["tokens"] += total
+            if truncated:
+                # Censored sample (the need is unknown, only that it was
+                # more); the retry that follows records the real figure
+                self.stats["truncation_retries"] += 1
+                self.stats["wasted_tokens"] += total
+                return
+            if not completion or not key:
+                return
+            history = self._load_locked().setdefault(key, [])
+            history.append(math.ceil(completion / max(n, 1)))
+            del history[:-MAX_HISTORY]
+            self._unsaved += 1
+            save = self._unsaved >= SAVE_EVERY
+        if save:
+            self.save()
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._unsaved or self._history is None:
+                return
+            payload = json.dumps(self._history, sort_keys=True)
+            self._unsaved = 0
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(payload)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"    Could not save completion stats: {e}")
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            out = dict(self.stats)
+        out["truncation_rate"] = (round(out["truncation_retries"] / out["calls"], 4)
+                                  if out["calls"] else 0.0)
+        out["wasted_share"] = (round(out["wasted_tokens"] / out["tokens"], 4)
+                               if out["tokens"] else 0.0)
+        return out
+
+
+def _default_planner() -> CompletionPlanner:
+    setting = os.environ.get("CDI_COMPLETION_STATS", "")
+    if setting.lower() in ("", "off", "0", "none"):
+        return CompletionPlanner(None)
+    return CompletionPlanner(DEFAULT_STATS_PATH if setting.lower() == "default"
+                             else Path(setting))
+
+
+_planner = _default_planner()
+if _planner.path is not None:
+    atexit.register(_planner.save)
+
+
+def plan_completion(model: str, messages: list, max_tokens: int,
+                    effort: Optional[str] = None,
+                    static_prefix: Optional[str] = None) -> Tuple[int, str]:
+    return _planner.plan(model, messages, max_tokens, effort, static_prefix)
+
+
+def record_completion(key: str, data: dict, truncated: bool, n: int = 1) -> None:
+    _planner.record(key, data, truncated, n)
+
+
+def planner_stats() -> Dict[str, float]:
+    """Process-wide truncation tally, for run summaries."""
+    return _planner.snapshot()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+diagnosis_matcher.py — rule-based diagnosis matching on precomputed features.
+
+The scorers (evaluate_cdi_accuracy.diagnoses_match, run_hill_climb's copy
+and llm_judge.HybridMatcher._rule_based_match) all follow the same recipe:
+
+    normalise both strings → exact match → substring match →
+    shared clinical-equivalence class → content-word overlap
+
+but each rebuilt its equivalents dict on every call and re-derived the
+normalised form, word set and class membership of both strings — for
+every one of the P×T (prediction × ground-truth) pairs of every case.
+Ground-truth labels and common predictions recur across cases, so nearly
+all of that work was repeated.
+
+DiagnosisMatcher is built once per table. features(dx) computes a
+string's normalised form, content-word set and equivalence-class IDs once
+and memoises them by string; match() is then a string compare, two `in`
+checks, and set intersections. Each scorer keeps its own equivalents
+table, stop words, normaliser and threshold, so scores are unchanged.
+"""
+
+from functools import lru_cache
+from typing import Callable, FrozenSet, Iterable, Mapping, NamedTuple
+
+
+class DiagnosisFeatures(NamedTuple):
+    norm: str                   # normalised text
+    words: FrozenSet[str]       # content words (normalised, minus stop words)
+    classes: FrozenSet[int]     # IDs of the equivalence classes it mentions
+
+
+class DiagnosisMatcher:
+    """Exact / substring / equivalence-class / word-overlap matcher.
+
+    Args:
+        equivalents: {base term: [equivalent terms]}. A string belongs to a
+            class if the base term or any equivalent is a substring of its
+            normalised form.
+        stop_words: words ignored by the overlap check.
+        normalise: the scorer's normaliser (applied to both strings).
+        cache_size: number of distinct strings whose features are kept.
+    """
+
+    def __init__(self, equivalents: Mapping[str, Iterable[str]],
+                 stop_words: Iterable[str],
+                 normalise: Callable[[str], str],
+                 cache_size: int = 65536):
+        self._classes = [(base, *terms) for base, terms in equivalents.items()]
+        self.stop_words = frozenset(stop_words)
+        self.normalise = normalise
+        self.features = lru_cache(maxsize=cache_size)(self._features)
+
+    def _features(self, dx: str) -> DiagnosisFeatures:
+        norm = self.normalise(dx)
+        classes = frozenset(i for i, terms in enumerate(self._classes)
+                            if any(term in norm for term in terms))
+        return DiagnosisFeatures(norm, frozenset(norm.split()) - self.stop_words, classes)
+
+    def match(self, pred_dx: str, true_dx: str, threshold: float = 0.5) -> bool:
+        """True if the two diagnoses match (overlap = |A∩B| / max(|A|,|B|))."""
+        p, t = self.features(pred_dx), self.features(true_dx)
+
+        if p.norm == t.norm:
+            return True
+        if p.norm in t.norm or t.norm in p.norm:
+            return True
+        if not p.classes.isdisjoint(t.classes):
+            return True
+
+        if not p.words or not t.words:
+            return False
+        return len(p.words & t.words) / max(len(p.words), len(t.words)) >= threshold
+
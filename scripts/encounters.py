@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+encounters.py — predict once per encounter, score once per CDI query.
+
+The eval data has one row per CDI query, not per encounter:
+metadata/summary/dataset_summary.csv counts 539 examples across 359
+patients. An encounter with three queries has three rows carrying the
+same notes, and sending each row to the model on its own would run that
+encounter three times and produce three (slightly different, at voting
+temperature) prediction sets.
+
+Every row gets an encounter key instead: the encounter id (encounter_csn,
+else anon_id / case id) plus a hash of the exact note text sent to the
+model. Rows with the same key share one prediction run: the evaluator
+memoises through SharedPredictions, the hill-climb runner reuses the
+first row's predictions per key. Each row is still scored separately
+against its own queries, so per-row results and aggregate recall keep
+their meaning; only the redundant model calls go.
+
+Keying on the note hash as well as the id keeps two rows apart when the
+id matches but the context doesn't (e.g. a re-extracted note, or
+--discharge-only).
+"""
+
+import hashlib
+import threading
+from typing import Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def encounter_key(encounter_id, *notes) -> str:
+    """Key for "same encounter, same model input".
+
+    `notes` are the note texts (or lists of texts) passed to the predictor;
+    None and empty entries are allowed.
+    """
+    h = hashlib.sha256()
+    for note in notes:
+        if isinstance(note, (list, tuple)):
+            for n in note:
+                h.update(str(n or "").encode("utf-8"))
+                h.update(b"\x1e")
+        else:
+            h.update(str(note or "").encode("utf-8"))
+        h.update(b"\x1f")
+    return f"{encounter_id}:{h.hexdigest()[:16]}"
+
+
+class SharedPredictions:
+    """Thread-safe once-per-key memo for a run's predictions.
+
+    get(key, compute) runs compute() for the first row of an encounter;
+    concurrent rows of the same encounter wait for it instead of calling
+    the model themselves. A compute that raises is not remembered, so the
+    next row of that encounter retries (transient gateway errors
+    shouldn't fail every query of the encounter).
+    """
+
+    def __init__(self):
+        self._results: Dict[str, object] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self.computed = 0
+        self.reused = 0
+
+    def get(self, key: Optional[str], compute: Callable[[], T]) -> T:
+        if key is None:
+            return compute()
+        with self._guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key in self._results:
+                with self._guard:
+                    self.reused += 1
+                return self._results[key]
+            result = compute()
+            self._results[key] = result
+            with self._guard:
+                self.computed += 1
+            return result
+
+    def stats(self) -> Dict[str, int]:
+        return {"encounters_predicted": self.computed, "rows_reused": self.reused}
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+engine_batch.py — run CDIEngine over a file of encounters, streaming in and out.
+
+    python cdi_engine.py batch --api-key KEY --input encounters.parquet \\
+        --output results.jsonl --mode balanced --concurrency 8
+
+Memory stays flat whatever the input size:
+
+    - Encounters are read a row at a time (csv module, JSONL lines,
+      Parquet record batches) and handed to CDIEngine.analyse_many, which
+      only pulls the next row when a slot frees up. At most
+      --concurrency cases are in flight, each an asyncio task on one
+      event loop sharing one pooled HTTP client, closed when the run ends.
+    - Each result is appended to the output JSONL as soon as its case
+      finishes (completion order, not input order) and flushed, so a
+      crash loses only the cases in flight.
+    - Rerunning with the same --output resumes: encounters that already
+      have a result line are skipped. A failed case is written as an
+      {"encounter_id", "error"} line and retried on the next run; when an
+      id appears more than once, the last line wins.
+
+The eval extracts have one row per CDI query, so an encounter can repeat
+on consecutive rows; it is analysed once per run (first row wins).
+
+Columns (any may be missing except discharge_summary): the analyse() note
+names — discharge_summary, hp_note, ed_note, progress_note, consult_note,
+ip_consult_note, and progress_notes / consult_notes / procedure_notes as
+lists (JSONL, Parquet) or as numbered columns progress_note_1..3,
+consult_note_1..2, procedure_note_1..2 (the cdi_expanded_notes.csv
+layout). The id is --id-column, else the first of encounter_csn,
+patient_id, anon_id that is set, else the row number.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Set
+
+ID_COLUMNS = ("encounter_csn", "patient_id", "anon_id")
+SINGLE_NOTES = ("progress_note", "hp_note", "consult_note", "ed_note", "ip_consult_note")
+NOTE_LISTS = {"progress_notes": 3, "consult_notes": 2, "procedure_notes": 2}
+
+PARQUET_BATCH_ROWS = 256
+
+
+# ===========================================================================
+# INPUT
+# ===========================================================================
+
+def iter_rows(path: Path) -> Iterator[Dict]:
+    """Rows of a .csv, .jsonl/.ndjson or .parquet file, one dict at a time."""
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        # Note columns run far past the csv module's 128 KiB field default
+        csv.field_size_limit(sys.maxsize)
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    elif suffix in (".jsonl", ".ndjson"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif suffix == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Reading Parquet needs pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=PARQUET_BATCH_ROWS):
+            yield from batch.to_pylist()
+    else:
+        raise SystemExit(f"Unsupported input format {suffix!r} "
+                         f"(use .csv, .jsonl, .ndjson or .parquet)")
+
+
+def _text(value) -> Optional[str]:
+    """A note cell as text; None for empty / NaN / "nan"."""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    text = str(value).strip()
+    return text if text and text.lower() != "nan" else None
+
+
+def row_notes(row: Dict) -> Dict:
+    """analyse() note keyword arguments for one row."""
+    notes = {"discharge_summary": _text(row.get("discharge_summary"))}
+    for name in SINGLE_NOTES:
+        notes[name] = _text(row.get(name))
+    for name, numbered in NOTE_LISTS.items():
+        values = row.get(name)
+        if isinstance(values, str):
+            values = [values]
+        if not values:
+            values = [row.get(f"{name[:-1]}_{i}") for i in range(1, numbered + 1)]
+        notes[name] = [t for t in map(_text, values) if t] or None
+    return notes
+
+
+def row_id(row: Dict, index: int, id_column: Optional[str] = None) -> str:
+    for column in ((id_column,) if id_column else ID_COLUMNS):
+        value = _text(row.get(column))
+        if value is not None:
+            # CSV ids read back from pandas exports come as "123.0"
+            return value[:-2] if value.endswith(".0") and value[:-2].isdigit() else value
+    return f"row_{index}"
+
+
+# ===========================================================================
+# OUTPUT / RESUME
+# ===========================================================================
+
+def completed_ids(output: Path) -> Set[str]:
+    """Encounter ids with a result line (not an error line) in `output`.
+
+    The last line for an id wins, so a case that failed and later
+    succeeded counts as done, and one that succeeded then failed on a
+    rerun does not.
+    """
+    done: Set[str] = set()
+    if not output.exists():
+        return done
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue            # torn final line from an interrupted run
+            if "error" in record:
+                done.discard(record.get("encounter_id"))
+            else:
+                done.add(record.get("encounter_id"))
+    return done
+
+
+def _open_for_append(output: Path):
+    """Open `output` for appending, first ending a torn final line."""
+    output.parent.mkdir(parents=True, exist_ok=True)
+    f = open(output, "a+b")
+    if f.tell():
+        f.seek(-1, 2)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+    return f
+
+
+# ===========================================================================
+# RUN
+# ===========================================================================
+
+async def run_batch(engine, input_path: Path, output: Path, mode: str = "fast",
+                    concurrency: int = 4, id_column: Optional[str] = None,
+                    limit: Optional[int] = None, resume: bool = True) -> Dict[str, int]:
+    """Analyse every encounter in `input_path`, appending results to `output`.
+
+    Returns counts: analysed, failed, skipped (already done, repeated or
+    without a discharge summary).
+    """
+    done = completed_ids(output) if resume else set()
+    if done:
+        print(f"Resuming: {len(done)} encounters already in {output}")
+    counts = {"analysed": 0, "failed": 0, "skipped": 0}
+    in_flight: Dict[int, str] = {}      # analyse_many index → encounter id
+
+    def cases() -> Iterator[Dict]:
+        submitted = 0
+        for index, row in enumerate(iter_rows(input_path)):
+            if limit is not None and submitted >= limit:
+                return
+            encounter_id = row_id(row, index, id_column)
+            notes = row_notes(row)
+            if encounter_id in done or not notes["discharge_summary"]:
+                counts["skipped"] += 1
+                continue
+            done.add(encounter_id)
+            in_flight[submitted] = encounter_id
+            submitted += 1
+            yield notes
+
+    start = time.time()
+    with _open_for_append(output) as f:
+        async for index, outcome in engine.analyse_many(cases(), concurrency=concurrency,
+                                                        mode=mode):
+            encounter_id = in_flight.pop(index)
+            if isinstance(outcome, Exception):
+                counts["failed"] += 1
+                record = {"encounter_id": encounter_id,
+                          "error": f"{type(outcome).__name__}: {outcome}"}
+                print(f"  ✗ {encounter_id}: {record['error']}")
+            else:
+                counts["analysed"] += 1
+                record = {"encounter_id": encounter_id, **outcome}
+                print(f"  ✓ {encounter_id}: {outcome['summary']['total_findings']} findings "
+                      f"({outcome['metadata']['elapsed_seconds']}s)")
+            f.write((json.dumps(record, default=str) + "\n").encode("utf-8"))
+            f.flush()
+
+    elapsed = time.time() - start
+    print(f"\nDone in {elapsed:.0f}s: {counts['analysed']} analysed, "
+          f"{counts['failed']} failed, {counts['skipped']} skipped → {output}")
+    return counts
+
+
+def main(argv=None) -> int:
+    from cdi_engine import add_engine_args, engine_from_args
+    from gateway_client import close_async_client
+    from llm_cache import add_cache_args, configure_from_args
+    from prompt_cache import usage_stats
+
+    parser = argparse.ArgumentParser(
+        prog="cdi_engine.py batch",
+        description="Run CDIEngine over a CSV / JSONL / Parquet file of encounters, "
+                    "writing one JSONL result line per encounter as it finishes")
+    add_engine_args(parser)
+    parser.add_argument("--input", required=True, type=Path,
+                        help="Encounters: .csv, .jsonl/.ndjson or .parquet")
+    parser.add_argument("--output", required=True, type=Path,
+                        help="Results JSONL (appended to; reruns resume from it)")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Encounters analysed at once (default 4)")
+    parser.add_argument("--id-column", default=None,
+                        help=f"Encounter id column (default: first of {', '.join(ID_COLUMNS)})")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Analyse at most N encounters this run")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Re-analyse encounters already in --output")
+    add_cache_args(parser)
+    args = parser.parse_args(argv)
+    configure_from_args(args)
+
+    engine = engine_from_args(args)
+
+    async def run() -> Dict[str, int]:
+        try:
+            return await run_batch(engine, args.input, args.output, mode=args.mode,
+                                   concurrency=args.concurrency, id_column=args.id_column,
+                                   limit=args.limit, resume=not args.no_resume)
+        finally:
+            await close_async_client()
+
+    counts = asyncio.run(run())
+    usage = usage_stats()
+    print(f"Tokens: {usage['input_tokens']:,} in ({usage['cached_share']:.0%} cached), "
+          f"{usage['output_tokens']:,} out over {usage['calls']} calls")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
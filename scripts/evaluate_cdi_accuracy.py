@@ -29,8 +29,19 @@ import argparse
 from datetime import datetime
 from typing import List, Dict, Tuple, Set
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from cdi_llm_predictor import predict_missed_diagnoses  # legacy
-from cdi_engine import CDIEngine  # v15 prompt + voting + precision filter
+from cdi_engine import CASCADE_MODEL, CDIEngine, _call_llm, load_prompt_variant  # v15 prompt + voting + precision filter
+from completion_planner import parse_reasoning_effort, planner_stats
+from json_stream import parse_stats
+from batch_client import make_request, run_batch
+from llm_cache import add_cache_args, configure_from_args, get_cache
+from pattern_classifier import KeywordClassifier
+from diagnosis_matcher import DiagnosisMatcher
+from encounters import SharedPredictions, encounter_key
+from prompt_cache import usage_stats
+from rate_limiter import governor_stats
+from run_checkpoint import RunCheckpoint, config_hash, file_hash
 
 # Diagnosis categories for analysis
 # Phase C.1 (2026-04-25): expanded keyword sets so HFrEF/HFpEF, AF variants,
@@ -63,13 +74,13 @@ DIAGNOSIS_CATEGORIES = {
 }
 
 
+# First category (in dict order) with a matching keyword, in one scan
+_CATEGORY_CLASSIFIER = KeywordClassifier(list(DIAGNOSIS_CATEGORIES.items()), default='other')
+
+
 def categorize_diagnosis(dx: str) -> str:
     """Assign a diagnosis to a category"""
-    dx_lower = dx.lower()
-    for category, keywords in DIAGNOSIS_CATEGORIES.items():
-        if any(kw in dx_lower for kw in keywords):
-            return category
-    return 'other'
+    return _CATEGORY_CLASSIFIER.classify(dx.lower())
 
 
 def extract_cdi_diagnosis_from_query(query_text: str) -> List[str]:
@@ -135,101 +146,80 @@ def normalize_diagnosis(dx: str) -> str:
     return dx
 
 
-def diagnoses_match(pred_dx: str, true_dx: str, threshold: float = 0.5) -> bool:
-    """
-    Check if predicted diagnosis matches true diagnosis.
-    Uses fuzzy matching + clinical equivalents.
-    """
-    pred_norm = normalize_diagnosis(pred_dx)
-    true_norm = normalize_diagnosis(true_dx)
-
-    # Exact match
-    if pred_norm == true_norm:
-        return True
-
-    # Substring match
-    if pred_norm in true_norm or true_norm in pred_norm:
-        return True
-
-    # Clinical equivalents - expanded for better matching
-    clinical_equivalents = {
-        'pressure ulcer': ['decubitus ulcer', 'pressure injury', 'pressure sore', 'bed sore', 'stage 2', 'stage 3', 'stage 4'],
-        'malnutrition': ['protein calorie malnutrition', 'hypoalbuminemia', 'cachexia', 'underweight', 'severe malnutrition', 'moderate malnutrition', 'mild malnutrition'],
-        'sepsis': ['severe sepsis', 'septic shock', 'urosepsis', 'septicemia'],
-        'thrombocytopenia': ['pancytopenia', 'low platelets'],
-        'anemia': ['blood loss anemia', 'acute blood loss anemia', 'iron deficiency anemia', 'chronic anemia', 'normocytic anemia', 'posthemorrhagic anemia'],
-        'respiratory failure': ['hypoxic respiratory failure', 'acute respiratory failure', 'hypoxia', 'hypercapnic', 'hypercapnia'],
-        'heart failure': ['chf', 'congestive heart failure', 'systolic heart failure', 'diastolic heart failure',
-                          'acute on chronic heart failure', 'hfref', 'hfpef', 'pulmonary edema'],
-        'acute kidney injury': ['aki', 'acute renal failure', 'acute renal insufficiency', 'ckd', 'kidney disease'],
-        'hyperglycemia': ['diabetes with hyperglycemia', 'steroid induced hyperglycemia', 'uncontrolled diabetes', 'diabetes mellitus'],
-        'hypoglycemia': ['diabetes with hypoglycemia'],
-        'hyponatremia': ['hypovolemic hyponatremia', 'euvolemic hyponatremia', 'hypervolemic hyponatremia', 'low sodium'],
-        'encephalopathy': ['metabolic encephalopathy', 'hepatic encephalopathy', 'toxic encephalopathy', 'delirium', 'altered mental status'],
-        'lactic acidosis': ['elevated lactate', 'hyperlactatemia'],
-        'obesity': ['morbid obesity', 'severe obesity', 'class ii obesity', 'class iii obesity', 'class 2 obesity', 'class 3 obesity', 'bmi 35', 'bmi 40', 'bmi 45'],
-        'hematoma': ['groin hematoma', 'postoperative hematoma', 'retroperitoneal hematoma'],
-        'debridement': ['excisional debridement', 'surgical debridement', 'wound debridement'],
-        'quadriplegia': ['functional quadriplegia', 'tetraplegia', 'paralysis'],
-        'pulmonary edema': ['acute pulmonary edema', 'cardiogenic pulmonary edema', 'non cardiogenic pulmonary edema', 'flash pulmonary edema'],
-        # UTI variants — CDI queries say "UTI" but model may say "cystitis", "pyelonephritis", etc.
-        'urinary tract infection': ['uti', 'cystitis', 'acute cystitis', 'pyelonephritis',
-                                     'catheter associated urinary tract infection', 'cauti',
-                                     'complicated uti', 'urosepsis'],
-        # Demand ischemia / Type 2 MI — same clinical entity, different naming conventions
-        'demand ischemia': ['type 2 myocardial infarction', 'type 2 mi', 'type ii mi',
-                            'type ii myocardial infarction', 'nstemi type 2', 'demand mi'],
-        # DVT/PE variants
-        'deep vein thrombosis': ['dvt', 'deep venous thrombosis', 'venous thromboembolism', 'vte'],
-        'pulmonary embolism': ['pe', 'pulmonary thromboembolism'],
-        # Pleural effusion variants
-        'pleural effusion': ['malignant pleural effusion', 'parapneumonic effusion', 'empyema'],
-        # Pneumonia variants
-        'pneumonia': ['aspiration pneumonia', 'aspiration pneumonitis', 'hospital acquired pneumonia',
-                      'ventilator associated pneumonia', 'hap', 'vap', 'cap',
-                      'community acquired pneumonia'],
-        # Afib variants
-        'atrial fibrillation': ['afib', 'a fib', 'paroxysmal atrial fibrillation',
-                                'persistent atrial fibrillation', 'rvr', 'rapid ventricular response'],
-        # Diabetes specificity
-        'diabetes': ['diabetes mellitus', 'type 2 diabetes', 'type 1 diabetes', 'dm2', 'dm1',
-                     'diabetic ketoacidosis', 'dka', 'hhs', 'hyperosmolar'],
-        # Wound/skin
-        'wound': ['surgical wound', 'wound dehiscence', 'surgical site infection', 'ssi'],
-        # C. diff
-        'clostridioides difficile': ['c diff', 'c difficile', 'cdiff', 'clostridium difficile',
-                                      'pseudomembranous colitis'],
-        # Dehydration
-        'dehydration': ['hypovolemia', 'volume depletion'],
-        # Pericardial effusion
-        'pericardial effusion': ['malignant pericardial effusion', 'cardiac tamponade'],
-    }
-
-    for base_term, equivalent_terms in clinical_equivalents.items():
-        pred_has_base = base_term in pred_norm or any(term in pred_norm for term in equivalent_terms)
-        true_has_base = base_term in true_norm or any(term in true_norm for term in equivalent_terms)
-        if pred_has_base and true_has_base:
-            return True
-
-    # Key word overlap
-    pred_words = set(pred_norm.split())
-    true_words = set(true_norm.split())
+# Clinical equivalents - expanded for better matching. Two diagnoses match
+# if both mention the same class (base term or any equivalent).
+CLINICAL_EQUIVALENTS = {
+    'pressure ulcer': ['decubitus ulcer', 'pressure injury', 'pressure sore', 'bed sore', 'stage 2', 'stage 3', 'stage 4'],
+    'malnutrition': ['protein calorie malnutrition', 'hypoalbuminemia', 'cachexia', 'underweight', 'severe malnutrition', 'moderate malnutrition', 'mild malnutrition'],
+    'sepsis': ['severe sepsis', 'septic shock', 'urosepsis', 'septicemia'],
+    'thrombocytopenia': ['pancytopenia', 'low platelets'],
+    'anemia': ['blood loss anemia', 'acute blood loss anemia', 'iron deficiency anemia', 'chronic anemia', 'normocytic anemia', 'posthemorrhagic anemia'],
+    'respiratory failure': ['hypoxic respiratory failure', 'acute respiratory failure', 'hypoxia', 'hypercapnic', 'hypercapnia'],
+    'heart failure': ['chf', 'congestive heart failure', 'systolic heart failure', 'diastolic heart failure',
+                      'acute on chronic heart failure', 'hfref', 'hfpef', 'pulmonary edema'],
+    'acute kidney injury': ['aki', 'acute renal failure', 'acute renal insufficiency', 'ckd', 'kidney disease'],
+    'hyperglycemia': ['diabetes with hyperglycemia', 'steroid induced hyperglycemia', 'uncontrolled diabetes', 'diabetes mellitus'],
+    'hypoglycemia': ['diabetes with hypoglycemia'],
+    'hyponatremia': ['hypovolemic hyponatremia', 'euvolemic hyponatremia', 'hypervolemic hyponatremia', 'low sodium'],
+    'encephalopathy': ['metabolic encephalopathy', 'hepatic encephalopathy', 'toxic encephalopathy', 'delirium', 'altered mental status'],
+    'lactic acidosis': ['elevated lactate', 'hyperlactatemia'],
+    'obesity': ['morbid obesity', 'severe obesity', 'class ii obesity', 'class iii obesity', 'class 2 obesity', 'class 3 obesity', 'bmi 35', 'bmi 40', 'bmi 45'],
+    'hematoma': ['groin hematoma', 'postoperative hematoma', 'retroperitoneal hematoma'],
+    'debridement': ['excisional debridement', 'surgical debridement', 'wound debridement'],
+    'quadriplegia': ['functional quadriplegia', 'tetraplegia', 'paralysis'],
+    'pulmonary edema': ['acute pulmonary edema', 'cardiogenic pulmonary edema', 'non cardiogenic pulmonary edema', 'flash pulmonary edema'],
+    # UTI variants — CDI queries say "UTI" but model may say "cystitis", "pyelonephritis", etc.
+    'urinary tract infection': ['uti', 'cystitis', 'acute cystitis', 'pyelonephritis',
+                                 'catheter associated urinary tract infection', 'cauti',
+                                 'complicated uti', 'urosepsis'],
+    # Demand ischemia / Type 2 MI — same clinical entity, different naming conventions
+    'demand ischemia': ['type 2 myocardial infarction', 'type 2 mi', 'type ii mi',
+                        'type ii myocardial infarction', 'nstemi type 2', 'demand mi'],
+    # DVT/PE variants
+    'deep vein thrombosis': ['dvt', 'deep venous thrombosis', 'venous thromboembolism', 'vte'],
+    'pulmonary embolism': ['pe', 'pulmonary thromboembolism'],
+    # Pleural effusion variants
+    'pleural effusion': ['malignant pleural effusion', 'parapneumonic effusion', 'empyema'],
+    # Pneumonia variants
+    'pneumonia': ['aspiration pneumonia', 'aspiration pneumonitis', 'hospital acquired pneumonia',
+                  'ventilator associated pneumonia', 'hap', 'vap', 'cap',
+                  'community acquired pneumonia'],
+    # Afib variants
+    'atrial fibrillation': ['afib', 'a fib', 'paroxysmal atrial fibrillation',
+                            'persistent atrial fibrillation', 'rvr', 'rapid ventricular response'],
+    # Diabetes specificity
+    'diabetes': ['diabetes mellitus', 'type 2 diabetes', 'type 1 diabetes', 'dm2', 'dm1',
+                 'diabetic ketoacidosis', 'dka', 'hhs', 'hyperosmolar'],
+    # Wound/skin
+    'wound': ['surgical wound', 'wound dehiscence', 'surgical site infection', 'ssi'],
+    # C. diff
+    'clostridioides difficile': ['c diff', 'c difficile', 'cdiff', 'clostridium difficile',
+                                  'pseudomembranous colitis'],
+    # Dehydration
+    'dehydration': ['hypovolemia', 'volume depletion'],
+    # Pericardial effusion
+    'pericardial effusion': ['malignant pericardial effusion', 'cardiac tamponade'],
+}
 
-    stop_words = {'and', 'or', 'the', 'a', 'an', 'with', 'without', 'due', 'to', 'of', 'in', 'on',
-                  'confirmed', 'ruled', 'out', 'poa', 'present', 'admission', 'acute', 'chronic'}
-    pred_words = pred_words - stop_words
-    true_words = true_words - stop_words
+# Ignored by the key-word overlap check
+MATCH_STOP_WORDS = {'and', 'or', 'the', 'a', 'an', 'with', 'without', 'due', 'to', 'of', 'in', 'on',
+                    'confirmed', 'ruled', 'out', 'poa', 'present', 'admission', 'acute', 'chronic'}
 
-    if not pred_words or not true_words:
-        return False
+# Built once; memoises each string's normalised form, words and classes
+# (diagnosis_matcher.py), since scoring compares every prediction against
+# every ground-truth label of every case.
+_MATCHER = DiagnosisMatcher(CLINICAL_EQUIVALENTS, MATCH_STOP_WORDS, normalize_diagnosis)
 
-    overlap = len(pred_words.intersection(true_words))
-    max_len = max(len(pred_words), len(true_words))
 
-    if max_len == 0:
-        return False
+def diagnoses_match(pred_dx: str, true_dx: str, threshold: float = 0.5) -> bool:
+    """
+    Check if predicted diagnosis matches true diagnosis.
+    Uses fuzzy matching + clinical equivalents.
 
-    return overlap / max_len >= threshold
+    Exact match, then substring match, then a shared clinical-equivalent
+    class, then key-word overlap >= threshold.
+    """
+    return _MATCHER.match(pred_dx, true_dx, threshold)
 
 
 def evaluate_single_case(discharge_summary: str, true_diagnoses: List[str],
@@ -250,7 +240,15 @@ def evaluate_single_case(discharge_summary: str, true_diagnoses: List[str],
                          llm_filter: bool = False,
                          filter_model: str = "gpt-5-nano",
                          pathology_scan: bool = False,
-                         pathology_scan_model: str = None) -> Dict:
+                         pathology_scan_model: str = None,
+                         n_samples: bool = False,
+                         adaptive_voting: bool = False,
+                         cascade_model: str = None,
+                         reasoning_effort: Dict[str, str] = None,
+                         structured_output: bool = False,
+                         batch_responses: List[str] = None,
+                         shared_predictions: SharedPredictions = None,
+                         encounter: str = None) -> Dict:
     """
     Evaluate LLM predictor on a single case.
 
@@ -274,6 +272,18 @@ def evaluate_single_case(discharge_summary: str, true_diagnoses: List[str],
                     If False, use legacy cdi_llm_predictor.
         engine: Pre-initialised CDIEngine instance (shared across cases to avoid re-init).
         engine_mode: CDIEngine mode — "fast", "balanced", or "high_recall".
+        n_samples: Request all voting passes in one call (`n`) on Azure models.
+        adaptive_voting: Stop issuing voting passes once the vote is settled.
+        cascade_model: Cheap first-tier model for engine_mode="cascade".
+        reasoning_effort: GPT-5 reasoning effort per engine mode ({mode: effort}).
+        structured_output: Provider-enforced prediction JSON schema.
+        batch_responses: Raw prediction-pass responses already fetched via the
+            Batch API (--batch). The engine finishes the case from these
+            instead of calling the model.
+        shared_predictions: Per-run SharedPredictions. With `encounter` set,
+            the first row of an encounter runs the predictor and later rows
+            score their own queries against the same predictions.
+        encounter: encounter_key() of this row.
     """
 
     if verbose:
@@ -281,67 +291,99 @@ def evaluate_single_case(discharge_summary: str, true_diagnoses: List[str],
         print(f"CDI queried about: {', '.join(true_diagnoses)}")
 
     try:
-        if use_agent:
-            # Experiment track: agentic CDI runner on Bedrock Claude.
-            # Replicates the Anthropic-built cdi-agent shape (multi-turn
-            # tool use + structured-output tool + ICD-10 format validation
-            # hook) on Stanford's PHI-safe gateway. Independent code path
-            # from CDIEngine — same input/output shape so this branch is
-            # otherwise identical to the engine branch below.
-            if agent_runner is None:
-                from cdi_agent_runner import CDIAgentRunner
-                agent_runner = CDIAgentRunner(api_key=api_key, model=model)
-            result = agent_runner.analyse(
-                discharge_summary=discharge_summary,
-                progress_note=progress_note,
-                hp_note=hp_note,
-                ed_note=ed_note,
-                progress_notes=progress_notes,
-                consult_notes=consult_notes,
-                procedure_notes=procedure_notes,
-                ip_consult_note=ip_consult_note,
-            )
-            preds = result.get('predictions', [])
-            pred_diagnoses = [dx.get('diagnosis', '') for dx in preds]
-            pred_categories = [dx.get('category', '') for dx in preds]
-        elif use_engine:
-            # Use CDIEngine (v15 prompt + self-consistency voting + 90% precision filter)
-            if engine is None:
-                engine = CDIEngine(api_key=api_key, model=model,
-                                   prompt_variant=prompt_variant,
-                                   llm_filter=llm_filter,
-                                   filter_model=filter_model,
-                                   pathology_scan=pathology_scan,
-                                   pathology_scan_model=pathology_scan_model)
-            result = engine.analyse(
-                discharge_summary=discharge_summary,
-                progress_note=progress_note,
-                hp_note=hp_note,
-                ed_note=ed_note,
-                progress_notes=progress_notes,
-                consult_notes=consult_notes,
-                procedure_notes=procedure_notes,
-                ip_consult_note=ip_consult_note,
-                mode=engine_mode,
-            )
-            # CDIEngine returns predictions in result['predictions']
-            preds = result.get('predictions', [])
-            pred_diagnoses = [dx.get('diagnosis', '') for dx in preds]
-            pred_categories = [dx.get('category', '') for dx in preds]
+        def _predict():
+            nonlocal engine, agent_runner
+            if use_agent:
+                # Experiment track: agentic CDI runner on Bedrock Claude.
+                # Replicates the Anthropic-built cdi-agent shape (multi-turn
+                # tool use + structured-output tool + ICD-10 format validation
+                # hook) on Stanford's PHI-safe gateway. Independent code path
+                # from CDIEngine — same input/output shape so this branch is
+                # otherwise identical to the engine branch below.
+                if agent_runner is None:
+                    from cdi_agent_runner import CDIAgentRunner
+                    agent_runner = CDIAgentRunner(api_key=api_key, model=model)
+                result = agent_runner.analyse(
+                    discharge_summary=discharge_summary,
+                    progress_note=progress_note,
+                    hp_note=hp_note,
+                    ed_note=ed_note,
+                    progress_notes=progress_notes,
+                    consult_notes=consult_notes,
+                    procedure_notes=procedure_notes,
+                    ip_consult_note=ip_consult_note,
+                )
+                preds = result.get('predictions', [])
+                pred_diagnoses = [dx.get('diagnosis', '') for dx in preds]
+                pred_categories = [dx.get('category', '') for dx in preds]
+                info = result.get('metadata', {})
+            elif use_engine:
+                # Use CDIEngine (v15 prompt + self-consistency voting + 90% precision filter)
+                if engine is None:
+                    engine = CDIEngine(api_key=api_key, model=model,
+                                       prompt_variant=prompt_variant,
+                                       llm_filter=llm_filter,
+                                       filter_model=filter_model,
+                                       pathology_scan=pathology_scan,
+                                       pathology_scan_model=pathology_scan_model,
+                                       n_samples=n_samples,
+                                       adaptive_voting=adaptive_voting,
+                                       cascade_model=cascade_model or CASCADE_MODEL,
+                                       reasoning_effort=reasoning_effort,
+                                       structured_output=structured_output)
+                notes = dict(
+                    discharge_summary=discharge_summary,
+                    progress_note=progress_note,
+                    hp_note=hp_note,
+                    ed_note=ed_note,
+                    progress_notes=progress_notes,
+                    consult_notes=consult_notes,
+                    procedure_notes=procedure_notes,
+                    ip_consult_note=ip_consult_note,
+                )
+                if batch_responses is not None:
+                    result = engine.analyse_from_responses(
+                        batch_responses, mode=engine_mode, **notes)
+                else:
+                    result = engine.analyse(mode=engine_mode, **notes)
+                # CDIEngine returns predictions in result['predictions']
+                preds = result.get('predictions', [])
+                pred_diagnoses = [dx.get('diagnosis', '') for dx in preds]
+                pred_categories = [dx.get('category', '') for dx in preds]
+                info = result.get('metadata', {})
+            else:
+                # Legacy: use cdi_llm_predictor (old 22-pattern prompt, no voting)
+                result = predict_missed_diagnoses(discharge_summary, api_key, model=model,
+                                                  progress_note=progress_note,
+                                                  hp_note=hp_note,
+                                                  ed_note=ed_note,
+                                                  progress_notes=progress_notes,
+                                                  consult_notes=consult_notes,
+                                                  procedure_notes=procedure_notes,
+                                                  ip_consult_note=ip_consult_note)
+                # Legacy predictor returns missed_diagnoses
+                missed = result.get('missed_diagnoses', [])
+                pred_diagnoses = [dx.get('diagnosis', '') for dx in missed]
+                pred_categories = [dx.get('category', '') for dx in missed]
+                info = {}
+            # Cost / latency of the prediction, for per-tier benchmarking
+            cascade = info.get('cascade') or {}
+            prediction_info = {
+                'prediction_seconds': info.get('elapsed_seconds'),
+                'prediction_tokens': info.get('token_usage'),
+                'api_calls': info.get('api_calls'),
+                'cascade_tier': cascade.get('tier'),
+                'cascade_reason': cascade.get('reason'),
+                'note_packing': info.get('note_packing'),
+            }
+            return pred_diagnoses, pred_categories, prediction_info
+
+        # Rows of the same encounter share one prediction run (encounters.py)
+        if shared_predictions is not None:
+            pred_diagnoses, pred_categories, prediction_info = \
+                shared_predictions.get(encounter, _predict)
         else:
-            # Legacy: use cdi_llm_predictor (old 22-pattern prompt, no voting)
-            result = predict_missed_diagnoses(discharge_summary, api_key, model=model,
-                                              progress_note=progress_note,
-                                              hp_note=hp_note,
-                                              ed_note=ed_note,
-                                              progress_notes=progress_notes,
-                                              consult_notes=consult_notes,
-                                              procedure_notes=procedure_notes,
-                                              ip_consult_note=ip_consult_note)
-            # Legacy predictor returns missed_diagnoses
-            missed = result.get('missed_diagnoses', [])
-            pred_diagnoses = [dx.get('diagnosis', '') for dx in missed]
-            pred_categories = [dx.get('category', '') for dx in missed]
+            pred_diagnoses, pred_categories, prediction_info = _predict()
 
         if verbose:
             print(f"LLM predicted {len(pred_diagnoses)} diagnoses")
@@ -394,7 +436,9 @@ def evaluate_single_case(discharge_summary: str, true_diagnoses: List[str],
             'missed': false_negatives,
             'discoveries': extra_discoveries,
             'success': True,
-            'used_llm_judge': use_llm_judge
+            'used_llm_judge': use_llm_judge,
+            'encounter': encounter,
+            **prediction_info,
         }
 
     except Exception as e:
@@ -407,6 +451,73 @@ def evaluate_single_case(discharge_summary: str, true_diagnoses: List[str],
         }
 
 
+def _attach_batch_responses(tasks: List[Tuple], engine: CDIEngine,
+                            engine_mode: str, api_key: str, batch_dir: str,
+                            base_url: str = None,
+                            deployment: str = None) -> None:
+    """Run all prediction passes through one Batch API job.
+
+    Sets case_kwargs['batch_responses'] on every task: one raw response per
+    pass (None where the pass failed even after the synchronous fallback).
+    Tasks of the same encounter share the first task's passes.
+    """
+    note_keys = ('discharge_summary', 'progress_note', 'hp_note', 'ed_note',
+                 'progress_notes', 'consult_notes', 'procedure_notes',
+                 'ip_consult_note')
+    requests_ = []
+    specs = {}
+    owner = []         # per task: index of the task whose passes it uses
+    num_passes = {}    # owning task -> number of passes
+    # One set of passes per encounter: later rows of an encounter reuse the
+    # first row's requests (see encounters.py)
+    first_task = {}
+    for t, (_, _, case_kwargs) in enumerate(tasks):
+        encounter = case_kwargs.get('encounter')
+        if encounter is not None and encounter in first_task:
+            owner.append(first_task[encounter])
+            continue
+        if encounter is not None:
+            first_task[encounter] = t
+        owner.append(t)
+        notes = {k: case_kwargs[k] for k in note_keys}
+        passes = engine.batch_requests(mode=engine_mode, **notes)
+        num_passes[t] = len(passes)
+        for spec in passes:
+            custom_id = f"{t}:{spec['sample']}"
+            specs[custom_id] = spec
+            requests_.append(make_request(custom_id, spec['body'],
+                                          cache_key=spec['cache_key']))
+
+    def _fallback(req):
+        spec = specs[req['custom_id']]
+        return _call_llm(spec['messages'], api_key, model=engine.model,
+                         temperature=spec['temperature'],
+                         max_tokens=spec['max_tokens'], sample=spec['sample'],
+                         reasoning_effort=spec.get('reasoning_effort'),
+                         structured=spec.get('structured', False),
+                         static_prefix=spec.get('static_prefix'))
+
+    print(f"\nBatch mode: {len(requests_)} prediction requests for {len(tasks)} cases "
+          f"({len(num_passes)} distinct encounters)")
+    batch_results = run_batch(requests_, api_key, job_dir=batch_dir,
+                              job_name=f"eval_{engine.prompt_variant}_{engine_mode}",
+                              base_url=base_url, deployment=deployment,
+                              fallback=_fallback)
+
+    failed = 0
+    for t, (_, _, case_kwargs) in enumerate(tasks):
+        o = owner[t]
+        responses = []
+        for sample in range(num_passes[o]):
+            content, error = batch_results[f"{o}:{sample}"]
+            if error and o == t:
+                failed += 1
+                print(f"    Case {case_kwargs['case_id']} pass {sample} failed: {error}")
+            responses.append(content)
+        case_kwargs['batch_responses'] = responses
+    print(f"Batch mode: {len(requests_) - failed}/{len(requests_)} passes answered\n")
+
+
 def run_evaluation(df: pd.DataFrame, api_key: str, model: str = "gpt-5",
                    limit: int = None, verbose: bool = False,
                    use_llm_judge: bool = False, judge_model: str = "gpt-5-nano",
@@ -418,7 +529,19 @@ def run_evaluation(df: pd.DataFrame, api_key: str, model: str = "gpt-5",
                    llm_filter: bool = False,
                    filter_model: str = "gpt-5-nano",
                    pathology_scan: bool = False,
-                   pathology_scan_model: str = None) -> Tuple[List[Dict], Dict]:
+                   pathology_scan_model: str = None,
+                   n_samples: bool = False,
+                   adaptive_voting: bool = False,
+                   cascade_model: str = None,
+                   reasoning_effort: Dict[str, str] = None,
+                   structured_output: bool = False,
+                   workers: int = 1,
+                   batch: bool = False,
+                   batch_dir: str = "results/batch_jobs",
+                   batch_base_url: str = None,
+                   batch_deployment: str = None,
+                   dedup_encounters: bool = True,
+                   checkpoint: RunCheckpoint = None) -> Tuple[List[Dict], Dict]:
     """
     Run full evaluation on dataset.
 
@@ -432,6 +555,38 @@ def run_evaluation(df: pd.DataFrame, api_key: str, model: str = "gpt-5",
         judge_model: Model to use for LLM judge
         use_engine: If True (default), use CDIEngine (v15 prompt + voting + precision filter).
         engine_mode: CDIEngine mode — "fast", "balanced", or "high_recall".
+        n_samples: Request all voting passes of a case in one call (`n`)
+            instead of one call per pass. Azure models only; Claude keeps
+            concurrent single calls.
+        adaptive_voting: Issue voting passes in waves and stop once the
+            remaining passes can't change the accepted diagnoses
+            (CDIEngine._adaptive_runs). Not used with --batch, which sends
+            every pass up front.
+        cascade_model: Cheap first-tier model for engine_mode="cascade"
+            (default cdi_engine.CASCADE_MODEL). The summary's "cascade"
+            block gives recall, latency and tokens per answering tier.
+        reasoning_effort: GPT-5 reasoning effort per engine mode ({mode:
+            effort}, "*" for every mode). Prediction passes only.
+        structured_output: Ask for the prediction JSON schema (Azure
+            response_format / Bedrock forced tool call) on the prediction
+            passes. The summary's parse counts show what it saves.
+        workers: Number of cases evaluated concurrently. The engine / agent
+            runner / judge are shared across workers. Output order always
+            follows the input order.
+        batch: Submit every prediction pass as one Batch API job (see
+            batch_client.py) instead of calling the model per case. Scoring,
+            the LLM filter and the pathology scan still run per case.
+        batch_dir: Where the JSONL job file is written (contains PHI).
+        batch_base_url: Batch API base URL (default $CDI_BATCH_BASE_URL or
+            the AI Hub Azure OpenAI route).
+        batch_deployment: Global-Batch deployment name, if it differs from
+            the synchronous deployment.
+        dedup_encounters: Predict once per encounter (encounter id + note
+            hash, see encounters.py) and score each CDI-query row against
+            that shared prediction set. False restores one prediction run
+            per row.
+        checkpoint: Append each evaluated case to this run_checkpoint log
+            and skip the cases already in it (keyed by case id and row).
     """
 
     print(f"\n{'='*80}")
@@ -458,11 +613,20 @@ def run_evaluation(df: pd.DataFrame, api_key: str, model: str = "gpt-5",
                            llm_filter=llm_filter,
                            filter_model=filter_model,
                            pathology_scan=pathology_scan,
-                           pathology_scan_model=pathology_scan_model)
+                           pathology_scan_model=pathology_scan_model,
+                           n_samples=n_samples,
+                           adaptive_voting=adaptive_voting,
+                           cascade_model=cascade_model or CASCADE_MODEL,
+                           reasoning_effort=reasoning_effort,
+                           structured_output=structured_output)
         filter_label = f" + LLM filter ({filter_model})" if llm_filter else ""
         path_label = f" + Phase E pathology scan ({pathology_scan_model or model})" if pathology_scan else ""
         print(f"CDIEngine: {prompt_variant} prompt + {engine_mode} mode" +
               (" (self-consistency voting)" if engine_mode != "fast" else "") +
+              (", n-sampled" if n_samples and engine_mode != "fast" else "") +
+              (", adaptive" if adaptive_voting and engine_mode != "fast" else "") +
+              (f" ({cascade_model or CASCADE_MODEL} → {model})" if engine_mode == "cascade" else "") +
+              (f", reasoning effort {engine.effort_for(engine_mode)}" if engine.effort_for(engine_mode) else "") +
               filter_label + path_label)
 
     # Initialize LLM matcher if using LLM judge
@@ -480,24 +644,11 @@ def run_evaluation(df: pd.DataFrame, api_key: str, model: str = "gpt-5",
         df = df.head(limit)
         print(f"(Limited to {limit} cases for testing)")
 
-    results = []
-
-    # Checkpoint file for resuming if interrupted
-    checkpoint_file = None
-    if limit is None:  # Only checkpoint for full runs
-        import os
-        checkpoint_file = '/tmp/cdi_evaluation_checkpoint.json'
-        if os.path.exists(checkpoint_file):
-            try:
-                with open(checkpoint_file, 'r') as f:
-                    checkpoint_data = json.load(f)
-                    results = checkpoint_data.get('results', [])
-                    start_idx = checkpoint_data.get('last_index', 0) + 1
-                    print(f"\n📌 Resuming from checkpoint: starting at index {start_idx}")
-                    df = df.iloc[start_idx:]
-            except:
-                print("⚠️  Checkpoint file corrupt, starting fresh")
-
+    # Parse every row up front into (index, label, kwargs) tasks, then run
+    # them either sequentially (workers=1, the historical behaviour) or on a
+    # thread pool.
+    tasks = []
+    shared_predictions = SharedPredictions() if dedup_encounters else None
     for idx, row in df.iterrows():
         # Support multiple ID column names
         case_id = row.get('patient_id', row.get('anon_id', f'case_{idx}'))
@@ -589,9 +740,17 @@ def run_evaluation(df: pd.DataFrame, api_key: str, model: str = "gpt-5",
         note_label = f" [+{extra_note_count} notes]" if extra_note_count > 0 else (
             " [+progress note]" if progress_note else "")
 
-        print(f"Processing {idx+1}/{len(df)}: {case_id} ({len(true_diagnoses)} CDI queries){note_label}")
-
-        result = evaluate_single_case(
+        encounter = None
+        if dedup_encounters:
+            encounter_id = row.get('encounter_csn')
+            if encounter_id is None or pd.isna(encounter_id):
+                encounter_id = case_id
+            encounter = encounter_key(encounter_id, discharge_summary, progress_note,
+                                      hp_note, ed_note, progress_notes, consult_notes,
+                                      procedure_notes, ip_consult_note)
+
+        label = f"{idx+1}/{len(df)}: {case_id} ({len(true_diagnoses)} CDI queries){note_label}"
+        tasks.append((idx, label, dict(
             discharge_summary=discharge_summary,
             true_diagnoses=true_diagnoses,
             api_key=api_key,
@@ -617,16 +776,83 @@ def run_evaluation(df: pd.DataFrame, api_key: str, model: str = "gpt-5",
             filter_model=filter_model,
             pathology_scan=pathology_scan,
             pathology_scan_model=pathology_scan_model,
-        )
-        results.append(result)
-
-        # Save checkpoint every 10 cases for full runs
-        if checkpoint_file and len(results) % 10 == 0:
-            try:
-                with open(checkpoint_file, 'w') as f:
-                    json.dump({'results': results, 'last_index': idx}, f)
-            except:
-                pass  # Don't fail if checkpoint save fails
+            n_samples=n_samples,
+            adaptive_voting=adaptive_voting,
+            cascade_model=cascade_model,
+            reasoning_effort=reasoning_effort,
+            structured_output=structured_output,
+            shared_predictions=shared_predictions,
+            encounter=encounter,
+        )))
+
+    if shared_predictions is not None:
+        n_encounters = len({t[2]['encounter'] for t in tasks})
+        print(f"{len(tasks)} query rows across {n_encounters} encounters — "
+              f"predicting once per encounter")
+
+    # Resume: rows already in the checkpoint (case id + row label, so
+    # --sample / --limit / a reordered dataset can't misalign them) keep
+    # their recorded result and aren't run again
+    def _task_key(task):
+        idx, _, case_kwargs = task
+        return f"{case_kwargs['case_id']}:{idx}"
+
+    slots = [None] * len(tasks)
+    if checkpoint is not None:
+        for i, task in enumerate(tasks):
+            slots[i] = checkpoint.get(_task_key(task))
+        resumed = sum(slot is not None for slot in slots)
+        if resumed:
+            print(f"\n📌 Resuming from checkpoint {checkpoint.dir}: "
+                  f"{resumed}/{len(tasks)} cases already evaluated")
+    pending = [i for i, slot in enumerate(slots) if slot is None]
+
+    # Batch API: fetch every prediction pass for every case up front, then
+    # run the normal per-case path below with the responses attached.
+    if batch and pending:
+        if not use_engine or not engine.supports_batch(engine_mode):
+            print("⚠️  --batch needs the engine with a single-pass prompt on an "
+                  "Azure model; running synchronously instead")
+            batch = False
+        else:
+            _attach_batch_responses([tasks[i] for i in pending], engine, engine_mode,
+                                    api_key, batch_dir, batch_base_url, batch_deployment)
+
+    def _run_task(task):
+        idx, label, case_kwargs = task
+        print(f"Processing {label}")
+        return evaluate_single_case(**case_kwargs)
+
+    def _record(i, result):
+        slots[i] = result
+        # Failed cases aren't checkpointed, so a resumed run retries them
+        if checkpoint is not None and result.get('success'):
+            checkpoint.append(_task_key(tasks[i]), result)
+
+    if workers <= 1 or len(pending) <= 1:
+        for i in pending:
+            _record(i, _run_task(tasks[i]))
+    else:
+        # Case-level concurrency. Each case is independent (one engine /
+        # agent / judge call chain), so the wall-clock is dominated by gateway
+        # latency and parallelises cleanly. Results land in per-case slots so
+        # the output order matches the input order regardless of completion
+        # order; each is checkpointed as soon as it completes (only this
+        # main thread writes the checkpoint).
+        print(f"Evaluating {len(pending)} cases with {workers} workers")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_run_task, tasks[i]): i for i in pending}
+            for fut in as_completed(futures):
+                i = futures[fut]
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    # evaluate_single_case already catches prediction errors;
+                    # this only fires on bugs in the scoring path.
+                    result = {'case_id': tasks[i][2]['case_id'],
+                              'success': False, 'error': str(e)}
+                _record(i, result)
+    results = slots
 
     # Calculate aggregate metrics
     successful = [r for r in results if r.get('success', False)]
@@ -665,6 +891,10 @@ def run_evaluation(df: pd.DataFrame, api_key: str, model: str = "gpt-5",
         print(f"  Cache hits: {llm_judge_stats['cache_hits']}")
         print(f"  LLM call rate: {llm_judge_stats['llm_call_rate']*100:.1f}%")
 
+    # Response cache stats (only when --cache / CDI_LLM_CACHE is on)
+    cache = get_cache()
+    llm_cache_stats = dict(cache.stats, mode=cache.mode) if cache else None
+
     summary = {
         'total_cases': len(df),
         'evaluated_cases': len(successful),
@@ -680,17 +910,78 @@ def run_evaluation(df: pd.DataFrame, api_key: str, model: str = "gpt-5",
         'model': model,
         'use_engine': use_engine,
         'engine_mode': engine_mode if use_engine else None,
+        'batch': batch,
         'discharge_only': discharge_only,
         'prompt_variant': prompt_variant if use_engine else 'legacy_22_pattern',
         'use_llm_judge': use_llm_judge,
         'judge_model': judge_model if use_llm_judge else None,
         'llm_judge_stats': llm_judge_stats,
+        'llm_cache_stats': llm_cache_stats,
+        'rate_limit_stats': governor_stats(),
+        'token_usage': usage_stats(),
+        'completion_budget_stats': planner_stats(),
+        'parse_stats': parse_stats(),
+        'encounter_stats': shared_predictions.stats() if shared_predictions else None,
+        'cost_by_tier': cost_by_tier(successful),
+        'note_packing': note_packing_totals(successful),
         'timestamp': datetime.now().isoformat()
     }
 
     return results, summary
 
 
+def cost_by_tier(successful: List[Dict]) -> Dict[str, Dict]:
+    """Recall vs. cost / latency, overall and per cascade tier.
+
+    Recall counts every query row; calls, tokens and latency count each
+    encounter's prediction once (rows of one encounter share it). Compare
+    the "all" entry of a --engine-mode cascade run with a fast run on the
+    same sample to see what the cascade saves and what it costs in recall.
+    """
+    groups = {'all': successful}
+    for r in successful:
+        if r.get('cascade_tier'):
+            groups.setdefault(r['cascade_tier'], []).append(r)
+
+    out = {}
+    for tier, rows in groups.items():
+        queries = sum(r.get('num_cdi_queries', 0) for r in rows)
+        tp = sum(r.get('true_positives', 0) for r in rows)
+        predictions = {}
+        for r in rows:
+            predictions.setdefault(r.get('encounter') or id(r), r)
+        seconds = [r['prediction_seconds'] for r in predictions.values()
+                   if r.get('prediction_seconds') is not None]
+        tokens = [r.get('prediction_tokens') or {} for r in predictions.values()]
+        out[tier] = {
+            'rows': len(rows),
+            'predictions': len(predictions),
+            'recall': tp / queries if queries else 0,
+            'api_calls': sum(r.get('api_calls') or 0 for r in predictions.values()),
+            'input_tokens': sum(t.get('input_tokens', 0) for t in tokens),
+            'cached_input_tokens': sum(t.get('cached_input_tokens', 0) for t in tokens),
+            'output_tokens': sum(t.get('output_tokens', 0) for t in tokens),
+            'mean_prediction_seconds': sum(seconds) / len(seconds) if seconds else None,
+        }
+    return out
+
+
+def note_packing_totals(successful: List[Dict]) -> Dict[str, int]:
+    """How many encounters' notes had to be packed into the token budget
+    (note_packer.py), and the tokens that cost."""
+    packing = {}
+    for r in successful:
+        if r.get('note_packing'):
+            packing.setdefault(r.get('encounter') or id(r), r['note_packing'])
+    packed = [p for p in packing.values() if p.get('dropped_tokens')]
+    return {
+        'encounters': len(packing),
+        'encounters_packed': len(packed),
+        'input_tokens': sum(p['input_tokens'] for p in packing.values()),
+        'dropped_tokens': sum(p['dropped_tokens'] for p in packed),
+    }
+
+
 def print_summary(summary: Dict, results: List[Dict]):
     """Print evaluation summary"""
 
@@ -704,6 +995,54 @@ def print_summary(summary: Dict, results: List[Dict]):
         print(f"  LLM Judge: {summary.get('judge_model')} (semantic matching)")
     else:
         print(f"  Matching: Rule-based")
+    cache_stats = summary.get('llm_cache_stats')
+    if cache_stats:
+        print(f"  LLM cache ({cache_stats['mode']}): {cache_stats['hits']} hits, "
+              f"{cache_stats['misses']} misses, {cache_stats['writes']} writes")
+    enc_stats = summary.get('encounter_stats')
+    if enc_stats:
+        print(f"  Encounter dedup: {enc_stats['encounters_predicted']} encounters predicted, "
+              f"{enc_stats['rows_reused']} query rows reused a prediction")
+    for deployment, rl in (summary.get('rate_limit_stats') or {}).items():
+        if rl.get('throttled') or rl.get('waited_seconds'):
+            name = deployment.split('/deployments/')[-1].split('/')[0] if '/deployments/' in deployment \
+                else deployment.split('/model/')[-1].split('/')[0]
+            print(f"  Gateway pacing [{name}]: {rl['requests']} requests, {rl['throttled']} throttled (429), "
+                  f"{rl.get('server_errors', 0)} server errors, "
+                  f"{rl['waited_seconds']:.0f}s paced, rpm={rl['rpm'] and round(rl['rpm'])}")
+
+    usage = summary.get('token_usage') or {}
+    if usage.get('calls'):
+        print(f"  Token usage: {usage['calls']} calls, {usage['input_tokens']:,} input tokens "
+              f"({usage['cached_input_tokens']:,} from prompt cache, {usage['cached_share']:.0%}), "
+              f"{usage['output_tokens']:,} output")
+
+    budget = summary.get('completion_budget_stats') or {}
+    if budget.get('calls'):
+        print(f"  Completion budgets: {budget['planned_calls']} of {budget['calls']} GPT-5 calls "
+              f"sized from history, {budget['truncation_retries']} truncation retries "
+              f"({budget['truncation_rate']:.1%}), {budget['wasted_share']:.1%} of tokens lost to them")
+
+    parses = summary.get('parse_stats') or {}
+    if parses.get('responses'):
+        print(f"  Response parsing: {parses['responses']} responses, {parses['clean']} clean, "
+              f"{parses['repaired']} repaired, {parses['failed']} unparseable, "
+              f"{parses['empty']} empty")
+
+    packing = summary.get('note_packing') or {}
+    if packing.get('encounters_packed'):
+        print(f"  Note packing: {packing['encounters_packed']}/{packing['encounters']} encounters over "
+              f"the token budget, {packing['dropped_tokens']:,} of {packing['input_tokens']:,} "
+              f"note tokens dropped")
+
+    tiers = summary.get('cost_by_tier') or {}
+    if len(tiers) > 1:
+        print("\nCascade tiers (recall vs. cost):")
+        for tier, t in tiers.items():
+            secs = t['mean_prediction_seconds']
+            print(f"  {tier:10s} {t['predictions']:4d} predictions, recall {t['recall']:.1%}, "
+                  f"{t['api_calls']} calls, {t['input_tokens']:,} in / {t['output_tokens']:,} out tokens, "
+                  f"{'n/a' if secs is None else f'{secs:.1f}s'} mean latency")
 
     print(f"\nDataset:")
     print(f"  Total cases: {summary['total_cases']}")
@@ -792,17 +1131,17 @@ def save_results(results: List[Dict], summary: Dict, output_dir: str = "results"
     print(f"✅ Results saved to: {results_path}")
     print(f"✅ Summary saved to: {summary_path}")
 
-    # Clean up checkpoint file after successful completion
-    checkpoint_file = '/tmp/cdi_evaluation_checkpoint.json'
-    if os.path.exists(checkpoint_file):
-        try:
-            os.remove(checkpoint_file)
-        except:
-            pass
-
     return results_path, summary_path
 
 
+# Flags that don't change a case's result (which cases run, where output
+# goes, how fast) — left out of the checkpoint's config hash
+CHECKPOINT_IGNORED_ARGS = {'sample', 'limit', 'test', 'output', 'verbose', 'workers',
+                           'batch', 'batch_dir', 'batch_base_url', 'batch_deployment',
+                           'cache', 'cache_path', 'cache_ttl_days', 'no_checkpoint',
+                           'fresh'}
+
+
 def main():
     parser = argparse.ArgumentParser(description='Evaluate CDI LLM predictor accuracy')
     parser.add_argument('--data', type=str, default='data/cdi_linked_discharge_cleaned_confirmed_only.csv',
@@ -841,8 +1180,16 @@ def main():
     parser.add_argument('--no-engine', action='store_true',
                         help='Disable CDIEngine, use legacy predictor instead')
     parser.add_argument('--engine-mode', type=str, default='fast',
-                        choices=['fast', 'balanced', 'high_recall'],
-                        help='CDIEngine mode: fast (1 call), balanced (3-vote), high_recall (default: fast)')
+                        choices=['fast', 'balanced', 'high_recall', 'cascade'],
+                        help='CDIEngine mode: fast (1 call), balanced (3-vote), high_recall, '
+                             'cascade (cheap model first, --model only for complex or '
+                             'low-confidence cases) (default: fast). cascade is not a public '
+                             'CDIEngine mode yet (cdi_engine.UNTUNED_MODES); it is here to '
+                             'benchmark and tune it')
+    parser.add_argument('--cascade-model', type=str, default=None,
+                        help='Cheap first-tier model for --engine-mode cascade '
+                             '(default gpt-5-4-mini). Compare a cascade run against a fast '
+                             'run on the same sample for recall vs. cost / latency.')
     parser.add_argument('--discharge-only', action='store_true',
                         help='Use only the discharge summary, suppress all expanded note types '
                              '(for apples-to-apples baseline comparison)')
@@ -875,8 +1222,56 @@ def main():
     parser.add_argument('--pathology-scan-model', type=str, default=None,
                         help='Model for the Phase E pathology scan. Defaults to --model. '
                              'Try claude-opus-4-7 for stricter cancer-finding extraction.')
+    parser.add_argument('--n-samples', action='store_true',
+                        help='Balanced / high_recall: ask the Azure deployment for all voting '
+                             'passes in ONE request (n=3 or 5) instead of 3-5 identical '
+                             'requests — the prompt is ingested and queued once. Falls back '
+                             'to one call per pass for Claude or if the deployment rejects n.')
+    parser.add_argument('--adaptive-voting', action='store_true',
+                        help='Balanced / high_recall: run voting passes in waves (2 then 1 for '
+                             'balanced, 4 then 1 for high_recall) and skip the rest once they '
+                             'could no longer change the accepted diagnoses. Each wave is added '
+                             'to the vote buckets so far, so stopping early gives the same '
+                             'diagnoses as running every pass.')
+    parser.add_argument('--reasoning-effort', type=str, default=None,
+                        help='GPT-5 reasoning_effort for the prediction passes: one of '
+                             'minimal/low/medium/high for every mode, or per mode, e.g. '
+                             '"fast=low,high_recall=high". Default: deployment default.')
+    parser.add_argument('--structured-output', action='store_true',
+                        help='Have the provider enforce the prediction JSON schema '
+                             '(Azure response_format json_schema, Bedrock forced tool call) '
+                             'so no paid prediction pass comes back unparseable.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Evaluate N cases concurrently (default 1 = sequential). '
+                             'Engine voting passes are already concurrent within a case, '
+                             'so in-flight requests ≈ workers × passes — keep this modest '
+                             '(4-8) to stay under gateway rate limits.')
+    parser.add_argument('--batch', action='store_true',
+                        help='Submit all prediction passes as one Batch API job (cheaper, '
+                             'no rate limiting; results can take up to 24h). Azure models '
+                             'with single-pass prompts only. Failed passes are retried '
+                             'synchronously.')
+    parser.add_argument('--batch-dir', type=str, default='results/batch_jobs',
+                        help='Directory for batch JSONL job files (contain PHI).')
+    parser.add_argument('--batch-base-url', type=str, default=None,
+                        help='Batch API base URL (default $CDI_BATCH_BASE_URL or the '
+                             'AI Hub Azure OpenAI route). Point at batch_stub_server.py '
+                             'to test locally.')
+    parser.add_argument('--batch-deployment', type=str, default=None,
+                        help='Global-Batch deployment name, if different from --model.')
+    parser.add_argument('--no-encounter-dedup', action='store_true',
+                        help='Run the predictor once per CDI-query row instead of once per '
+                             'encounter (rows with the same encounter and notes otherwise '
+                             'share one prediction set; see encounters.py).')
+    parser.add_argument('--no-checkpoint', action='store_true',
+                        help='Do not keep a resumable checkpoint of evaluated cases.')
+    parser.add_argument('--fresh', action='store_true',
+                        help='Ignore (and delete) an existing checkpoint for this '
+                             'configuration instead of resuming from it.')
+    add_cache_args(parser)
 
     args = parser.parse_args()
+    configure_from_args(args)
     if args.no_engine:
         args.use_engine = False
     if args.use_agent and not args.model.startswith('claude'):
@@ -936,6 +1331,18 @@ def main():
         limit = 10
         print("\n🧪 TEST MODE: Evaluating first 10 cases only")
 
+    # Checkpoint per run configuration: everything that decides a case's
+    # result, plus the dataset's content and the engine prompt's text (an
+    # edited prompt file keeps its variant name). Sampling and limits only
+    # choose which cases run, so they don't split the checkpoint.
+    checkpoint = None
+    if not args.no_checkpoint:
+        config = {k: v for k, v in vars(args).items() if k not in CHECKPOINT_IGNORED_ARGS}
+        config['data_sha256'] = file_hash(args.data)
+        if args.use_engine and not args.use_agent:
+            config['prompt'] = config_hash(load_prompt_variant(args.prompt_variant))
+        checkpoint = RunCheckpoint('evaluation', config, resume=not args.fresh)
+
     # Run evaluation
     results, summary = run_evaluation(
         df=df,
@@ -954,6 +1361,18 @@ def main():
         filter_model=args.filter_model,
         pathology_scan=args.pathology_scan,
         pathology_scan_model=args.pathology_scan_model,
+        n_samples=args.n_samples,
+        adaptive_voting=args.adaptive_voting,
+        cascade_model=args.cascade_model,
+        reasoning_effort=parse_reasoning_effort(args.reasoning_effort),
+        structured_output=args.structured_output,
+        workers=args.workers,
+        batch=args.batch,
+        batch_dir=args.batch_dir,
+        batch_base_url=args.batch_base_url,
+        batch_deployment=args.batch_deployment,
+        dedup_encounters=not args.no_encounter_dedup,
+        checkpoint=checkpoint,
     )
 
     # Print summary
@@ -961,6 +1380,8 @@ def main():
 
     # Save results
     save_results(results, summary, args.output)
+    if checkpoint is not None:
+        checkpoint.discard()
 
     return 0
 
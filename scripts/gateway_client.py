@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+gateway_client.py — shared HTTP client for the Stanford AI Hub gateway.
+
+Every LLM call in the pipeline (cdi_engine, CDIAgentRunner._bedrock_call,
+run_hill_climb.call_llm, cdi_llm_predictor.call_stanford_llm and the
+batch_client job API) goes to the same host,
+aihubapi.stanfordhealthcare.org, through this module.
+
+This module owns:
+    - one process-wide keep-alive `requests.Session` with a connection pool
+      sized for concurrent voting / --workers runs
+    - the connect / read timeouts and retry budget, set in one place
+    - the retry policy: 429 and 5xx back off and retry, timeouts and
+      connection errors back off and retry, any other non-200 is permanent
+    - pacing: every attempt goes through the per-deployment governor in
+      rate_limiter.py, which learns the gateway's RPM/TPM from 429s and
+      rate-limit headers
+
+Callers build the request body and parse the response themselves; they
+only hand the JSON round-trip to `post_json`, or the streamed one to
+`stream_events` (SSE from Azure, AWS event-stream from Bedrock's
+invoke-with-response-stream).
+
+`post_json_async` / `send_async` are the asyncio twins, on httpx, used by
+CDIEngine. They share the timeouts, the retry policy and the governor
+(awaited through acquire_async, so a paced call doesn't block the loop).
+An httpx.AsyncClient belongs to the loop that created it, so there is one
+per event loop (get_async_client), pooled like the session and closed by
+close_async_client; CDIEngine keeps a single long-lived loop so its
+connections are reused across cases.
+"""
+
+import asyncio
+import base64
+import json
+import random
+import re
+import struct
+import threading
+import weakref
+from typing import Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from prompt_cache import record_usage
+from rate_limiter import estimate_tokens, get_governor
+
+
+# ===========================================================================
+# CONFIGURATION
+# ===========================================================================
+
+# Pool sizing. All traffic goes to one host, so POOL_MAXSIZE is what
+# matters: it bounds the number of keep-alive connections kept open. With
+# balanced/high_recall voting (3-5 concurrent passes per case) times
+# evaluator --workers, 32 covers typical runs; requests beyond that still
+# go through, they just aren't returned to the pool afterwards.
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 32
+
+CONNECT_TIMEOUT = 10     # seconds to establish TCP + TLS
+READ_TIMEOUT = 300       # seconds to wait for a response (GPT-5 reasoning is slow)
+MAX_RETRIES = 5
+
+
+class GatewayError(RuntimeError):
+    """Non-retryable or exhausted gateway failure.
+
+    `status_code` is the HTTP status of the last response (None when the
+    request never got one, e.g. repeated timeouts), so callers can attach
+    status-specific hints such as the 401 checklist in cdi_llm_predictor.
+    """
+
+    def __init__(self, message: str, status_code: Optional[int] = None,
+                 body: str = ""):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+    def names_param(self, name: str) -> bool:
+        """True if the gateway's error blames request parameter `name`
+        (Azure: error.param, else the parameter quoted in the message)."""
+        try:
+            error = json.loads(self.body).get("error") or {}
+            if error.get("param") == name:
+                return True
+        except (ValueError, AttributeError):
+            pass
+        quoted = re.compile(r"""[`'"]%s[`'"]""" % re.escape(name))
+        return bool(quoted.search(self.body or "") or quoted.search(str(self)))
+
+
+# ===========================================================================
+# SESSION
+# ===========================================================================
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Return the shared session, creating it on first use.
+
+    urllib3 connection pools are thread-safe, so a single session is shared
+    by every thread (voting passes, evaluator workers).
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Retries are handled in post_json so the policy is visible
+                # and consistent; the adapter itself never retries.
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                                      pool_maxsize=POOL_MAXSIZE,
+                                      max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+_async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the running event loop's httpx.AsyncClient, creating it on first use.
+
+    An async client belongs to the loop it was created on, so each loop
+    gets its own, pooled like the session; close_async_client() closes it.
+    Keep the loop alive across calls to reuse connections (CDIEngine's
+    blocking methods all share one loop thread).
+    """
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=None,
+                                max_keepalive_connections=POOL_MAXSIZE))
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_client() -> None:
+    """Close the running loop's async client (call before the loop ends)."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _backoff(attempt: int) -> float:
+    return 2 ** (attempt + 1) + random.random() * 2
+
+
+def _retry(governor, attempt: int, max_retries: int, label: str, verbose: bool,
+           status: Optional[int] = None, text: str = "", error: str = "") -> bool:
+    """The retry policy, after a failed attempt (an `error` or a non-2xx `status`).
+
+    Returns True to retry, False once the attempts are used up; raises
+    GatewayError for a status that won't fix itself. A 429 has already
+    paused the deployment in the governor (observe()); 5xx / timeouts /
+    connection errors pause it here with jittered exponential backoff.
+    Either way the next acquire() does the waiting, for every caller of
+    the deployment.
+    """
+    if status == 429:
+        if verbose:
+            print(f"    {label} 429, pacing down "
+                  f"(attempt {attempt+1}/{max_retries})")
+        return True
+    if status is not None and status < 500:
+        # Other 4xx (bad request, auth, unknown deployment) won't fix itself
+        raise GatewayError(f"{label} {status}: {text[:300]}", status_code=status, body=text)
+    if attempt + 1 == max_retries:
+        return False
+    wait = _backoff(attempt)
+    if verbose:
+        print(f"    {label} {error or status}, retrying in {wait:.0f}s "
+              f"(attempt {attempt+1}/{max_retries})")
+    governor.backoff(wait)
+    return True
+
+
+def _usage_tokens(data: dict) -> Optional[int]:
+    """Total tokens billed for a response (Azure or Bedrock usage shape)."""
+    usage = data.get("usage") or {}
+    if "total_tokens" in usage:
+        return usage["total_tokens"]
+    if "input_tokens" in usage or "output_tokens" in usage:
+        return usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+    return None
+
+
+# ===========================================================================
+# REQUEST
+# ===========================================================================
+
+def send(method: str, url: str, api_key: str,
+         est_tokens: int = 0,
+         read_timeout: float = READ_TIMEOUT,
+         max_retries: int = MAX_RETRIES,
+         label: str = "API",
+         verbose: bool = False,
+         **request_kwargs) -> requests.Response:
+    """Send one gateway request with pacing and retries; return the 2xx response.
+
+    Each attempt first waits for the deployment's rate governor. A 429
+    pauses the whole deployment for Retry-After (shared across threads);
+    5xx / timeouts / connection errors pause it with jittered exponential
+    backoff (2, 4, 8, ... seconds, via the governor) and retry. Any other
+    non-2xx status is treated as permanent and raised immediately as
+    GatewayError (see _retry).
+
+    Args:
+        method: HTTP method ("GET", "POST").
+        url: Full endpoint URL (Azure deployment, Bedrock invoke, batch API).
+        api_key: AI Hub key, sent as the "api-key" header (NOT the old
+            APIM "Ocp-Apim-Subscription-Key").
+        est_tokens: Estimated TPM cost, for the governor's token bucket.
+        read_timeout: Per-attempt read timeout in seconds.
+        max_retries: Total attempts before giving up.
+        label: Prefix for error messages ("API", "Bedrock", ...).
+        verbose: Print a line for each retry.
+        **request_kwargs: Passed through to requests (data, files, stream, ...).
+    """
+    headers = dict(request_kwargs.pop("headers", None) or {})
+    headers["api-key"] = api_key
+    session = get_session()
+    governor = get_governor(url.split("?", 1)[0])
+
+    last_status = None
+    last_error = ""
+    for attempt in range(max_retries):
+        governor.acquire(est_tokens)
+        try:
+            resp = session.request(method, url, headers=headers,
+                                   timeout=(CONNECT_TIMEOUT, read_timeout),
+                                   **request_kwargs)
+        except (requests.exceptions.Timeout,
+                requests.exceptions.ConnectionError) as e:
+            last_error = f"{type(e).__name__}: {e}"
+            if _retry(governor, attempt, max_retries, label, verbose,
+                      error=type(e).__name__):
+                continue
+            break
+
+        governor.observe(resp.status_code, resp.headers)
+        if 200 <= resp.status_code < 300:
+            return resp
+
+        last_status = resp.status_code
+        last_error = f"{label} {resp.status_code}: {resp.text[:300]}"
+        if not _retry(governor, attempt, max_retries, label, verbose,
+                      status=resp.status_code, text=resp.text):
+            break
+
+    raise GatewayError(f"{label} call failed after {max_retries} retries"
+                       + (f" (last: {last_error})" if last_error else ""),
+                       status_code=last_status)
+
+
+async def send_async(method: str, url: str, api_key: str,
+                     est_tokens: int = 0,
+                     read_timeout: float = READ_TIMEOUT,
+                     max_retries: int = MAX_RETRIES,
+                     label: str = "API",
+                     verbose: bool = False,
+                     **request_kwargs):
+    """send() for asyncio callers: same pacing and retry policy, over the
+    running loop's httpx client. Waiting for the governor or a backoff
+    suspends the task, not a thread. **request_kwargs go to httpx
+    (content, ...)."""
+    import httpx
+
+    headers = dict(request_kwargs.pop("headers", None) or {})
+    headers["api-key"] = api_key
+    client = get_async_client()
+    governor = get_governor(url.split("?", 1)[0])
+    timeout = httpx.Timeout(read_timeout, connect=CONNECT_TIMEOUT)
+
+    last_status = None
+    last_error = ""
+    for attempt in range(max_retries):
+        await governor.acquire_async(est_tokens)
+        try:
+            resp = await client.request(method, url, headers=headers, timeout=timeout,
+                                        **request_kwargs)
+        except httpx.TransportError as e:     # timeouts, connection errors
+            last_error = f"{type(e).__name__}: {e}"
+            if _retry(governor, attempt, max_retries, label, verbose,
+                      error=type(e).__name__):
+                continue
+            break
+
+        governor.observe(resp.status_code, resp.headers)
+        if 200 <= resp.status_code < 300:
+            return resp
+
+        last_status = resp.status_code
+        last_error = f"{label} {resp.status_code}: {resp.text[:300]}"
+        if not _retry(governor, attempt, max_retries, label, verbose,
+                      status=resp.status_code, text=resp.text):
+            break
+
+    raise GatewayError(f"{label} call failed after {max_retries} retries"
+                       + (f" (last: {last_error})" if last_error else ""),
+                       status_code=last_status)
+
+
+def post_json(url: str, body: dict, api_key: str,
+              read_timeout: float = READ_TIMEOUT,
+              max_retries: int = MAX_RETRIES,
+              label: str = "API",
+              verbose: bool = False) -> dict:
+    """POST `body` as JSON to the gateway and return the decoded response.
+
+    See send() for the pacing / retry policy. The request is serialised
+    once and reused across retries; its token estimate (prompt size plus
+    completion budget) is settled against the response's reported usage,
+    which is also added to the prompt_cache usage tallies.
+    """
+    payload = json.dumps(body)
+    est_tokens = _estimate_body_tokens(payload, body)
+    resp = send("POST", url, api_key, est_tokens=est_tokens,
+                read_timeout=read_timeout, max_retries=max_retries,
+                label=label, verbose=verbose,
+                headers={"Content-Type": "application/json"}, data=payload)
+    try:
+        data = resp.json()
+    except ValueError:
+        raise GatewayError(f"{label} returned non-JSON response: {resp.text[:300]}",
+                           status_code=resp.status_code, body=resp.text)
+    get_governor(url.split("?", 1)[0]).settle(est_tokens, _usage_tokens(data))
+    record_usage(data)
+    return data
+
+
+async def post_json_async(url: str, body: dict, api_key: str,
+                          read_timeout: float = READ_TIMEOUT,
+                          max_retries: int = MAX_RETRIES,
+                          label: str = "API",
+                          verbose: bool = False) -> dict:
+    """post_json for asyncio callers (see send_async). Usage lands in the
+    calling task's track_usage() tallies."""
+    payload = json.dumps(body)
+    est_tokens = _estimate_body_tokens(payload, body)
+    resp = await send_async("POST", url, api_key, est_tokens=est_tokens,
+                            read_timeout=read_timeout, max_retries=max_retries,
+                            label=label, verbose=verbose,
+                            headers={"Content-Type": "application/json"},
+                            content=payload)
+    try:
+        data = resp.json()
+    except ValueError:
+        raise GatewayError(f"{label} returned non-JSON response: {resp.text[:300]}",
+                           status_code=resp.status_code, body=resp.text)
+    get_governor(url.split("?", 1)[0]).settle(est_tokens, _usage_tokens(data))
+    record_usage(data)
+    return data
+
+
+def _estimate_body_tokens(payload: str, body: dict) -> int:
+    # With n completions the output budget is reserved once per choice
+    return estimate_tokens(
+        payload,
+        (body.get("max_completion_tokens") or body.get("max_tokens") or 0) * body.get("n", 1))
+
+
+# ===========================================================================
+# STREAMING
+# ===========================================================================
+
+EVENTSTREAM_CONTENT_TYPE = "application/vnd.amazon.eventstream"
+
+# AWS event-stream header value types → fixed size in bytes (None: 2-byte
+# length prefix follows)
+_EVENTSTREAM_HEADER_SIZES = {0: 0, 1: 0, 2: 1, 3: 2, 4: 4, 5: 8, 6: None, 7: None,
+                             8: 8, 9: 16}
+
+
+def stream_events(url: str, body: dict, api_key: str,
+                  read_timeout: float = READ_TIMEOUT,
+                  max_retries: int = MAX_RETRIES,
+                  label: str = "API",
+                  verbose: bool = False) -> Iterator[dict]:
+    """POST `body` and yield the decoded events of the streamed response.
+
+    Server-sent events (`data: {...}` lines; Azure chat completions with
+    "stream": true) and AWS event-stream frames (Bedrock
+    invoke-with-response-stream, whose payloads wrap the Anthropic
+    stream events) are told apart by Content-Type.
+
+    Pacing and retries (send()) cover getting the stream started; a
+    failure after that raises — the caller has already consumed part of
+    the response. Usage reported in the stream (Azure's final chunk with
+    stream_options.include_usage, Bedrock's message_start / message_delta)
+    is settled and tallied like post_json's.
+    """
+    payload = json.dumps(body)
+    est_tokens = _estimate_body_tokens(payload, body)
+    resp = send("POST", url, api_key, est_tokens=est_tokens,
+                read_timeout=read_timeout, max_retries=max_retries,
+                label=label, verbose=verbose, stream=True,
+                headers={"Content-Type": "application/json"}, data=payload)
+    usage = {}
+    try:
+        if resp.headers.get("Content-Type", "").startswith(EVENTSTREAM_CONTENT_TYPE):
+            events = _eventstream_events(resp, label)
+        else:
+            events = _sse_events(resp)
+        for event in events:
+            usage.update(event.get("usage") or {})
+            usage.update((event.get("message") or {}).get("usage") or {})
+            yield event
+    except requests.exceptions.RequestException as e:
+        raise GatewayError(f"{label} stream interrupted: {type(e).__name__}: {e}")
+    finally:
+        resp.close()
+        data = {"usage": usage} if usage else {}
+        get_governor(url.split("?", 1)[0]).settle(est_tokens, _usage_tokens(data))
+        if usage:
+            record_usage(data)
+
+
+def _sse_events(resp: requests.Response) -> Iterator[dict]:
+    for line in resp.iter_lines():
+        if not line.startswith(b"data:"):
+            continue                    # "event:" lines, comments, keep-alives
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            return
+        yield json.loads(data)
+
+
+def _eventstream_events(resp: requests.Response, label: str) -> Iterator[dict]:
+    buf = b""
+    for chunk in resp.iter_content(chunk_size=None):
+        buf += chunk
+        while len(buf) >= 12:
+            total, headers_len = struct.unpack(">II", buf[:8])
+            if len(buf) < total:
+                break
+            headers = _eventstream_headers(buf[12:12 + headers_len])
+            message = json.loads(buf[12 + headers_len:total - 4] or b"{}")
+            buf = buf[total:]
+            if headers.get(":message-type") == "exception":
+                raise GatewayError(f"{label} stream error "
+                                   f"({headers.get(':exception-type')}): {message}")
+            if "bytes" in message:
+                yield json.loads(base64.b64decode(message["bytes"]))
+
+
+def _eventstream_headers(raw: bytes) -> dict:
+    """String-valued headers of one event-stream frame (":event-type" etc)."""
+    headers, i = {}, 0
+    while i < len(raw):
+        name_len = raw[i]
+        name = raw[i + 1:i + 1 + name_len].decode("utf-8")
+        value_type = raw[i + 1 + name_len]
+        i += 2 + name_len
+        size = _EVENTSTREAM_HEADER_SIZES.get(value_type)
+        if size is None:
+            size = struct.unpack(">H", raw[i:i + 2])[0]
+            if value_type == 7:
+                headers[name] = raw[i + 2:i + 2 + size].decode("utf-8")
+            i += 2
+        i += size
+    return headers
+
+
+def get_json(url: str, api_key: str, label: str = "API",
+             verbose: bool = False) -> dict:
+    """GET a JSON resource (batch status, file metadata) with the same policy."""
+    resp = send("GET", url, api_key, label=label, verbose=verbose)
+    try:
+        return resp.json()
+    except ValueError:
+        raise GatewayError(f"{label} returned non-JSON response: {resp.text[:300]}",
+                           status_code=resp.status_code, body=resp.text)
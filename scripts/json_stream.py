@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+json_stream.py — pull prediction objects out of model text, whole or partial.
+
+_parse_llm_response used to try json.loads, then the non-greedy regex
+`\\[[\\s\\S]*?\\]`, then a code-fence regex, and return [] when all three
+failed. The regex stops at the first "]" anywhere — including one inside
+an evidence string ("Hgb 6.8 [ref 12-16]") — so a perfectly good answer
+with a bracket in it parsed as nothing. So did an answer cut short by the
+token limit. In voting mode that pass silently dropped out of the vote
+after being paid for.
+
+ItemStream scans for the prediction array instead of pattern-matching it:
+
+    - The array starts at the first "[" followed by "{" or "]" — prose,
+      code fences and a {"diagnoses": [...]} wrapper before it are
+      skipped.
+    - Brackets are counted outside strings only (escapes honoured), so
+      "]" in evidence text is just text.
+    - Each top-level object is json.loads-ed as soon as its closing "}"
+      arrives. feed() returns the newly completed ones, which is what a
+      streaming caller wants; an object that fails to load (e.g. a
+      trailing comma) gets one light repair, else it is skipped and
+      counted.
+    - close() salvages a final object cut off mid-way: the open string
+      and brackets are closed and a dangling key dropped. It is kept if
+      its diagnosis (and code) came through whole — a truncated evidence
+      string, or a key cut off after them, is still worth having; "Hypo"
+      instead of a diagnosis isn't.
+
+Every parse is recorded into a ParseTally (status "clean", "repaired",
+"failed" or "empty") — process-wide for run summaries, and per
+track_parses() block for result["metadata"]["parse"].
+"""
+
+import contextvars
+import json
+import re
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+PARSE_STATUSES = ("clean", "repaired", "failed", "empty")
+
+# Characters that matter outside / inside a JSON string
+_STRUCTURE_RE = re.compile(r'[{}\[\]"]')
+_STRING_END_RE = re.compile(r'["\\]')
+
+# Light repairs for an object that doesn't load as-is
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+_DANGLING_KEY_RE = re.compile(r',\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+
+
+# ===========================================================================
+# INCREMENTAL PARSER
+# ===========================================================================
+
+class ItemStream:
+    """Incremental parser for a JSON array of objects embedded in text."""
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.stack: List[str] = []      # open "{" / "[" from the array down
+        self.in_string = False
+        self.string_is_key = False      # the open string is an object key
+        self.item_start: Optional[int] = None
+        self.started = False            # array opening found
+        self.done = False               # array closed
+        self.items: List[Dict] = []
+        self.bad_items = 0
+        self.repaired = 0
+        self.salvaged = 0
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """Add text; return the objects completed by it."""
+        self.buf += chunk
+        before = len(self.items)
+        while not self.done and self._step():
+            pass
+        return self.items[before:]
+
+    def _step(self) -> bool:
+        """Advance past one structural character; False = need more text."""
+        buf = self.buf
+        if not self.started:
+            idx = buf.find("[", self.pos)
+            if idx == -1:
+                self.pos = len(buf)
+                return False
+            rest = buf[idx + 1:].lstrip()
+            if not rest:
+                self.pos = idx          # wait to see what follows "["
+                return False
+            self.pos = idx + 1
+            if rest[0] in "{]":
+                self.started = True
+                self.stack.append("[")
+            return True
+
+        if self.in_string:
+            m = _STRING_END_RE.search(buf, self.pos)
+            if m is None:
+                self.pos = len(buf)
+                return False
+            if m.group() == "\\":
+                if m.end() >= len(buf):
+                    self.pos = m.start()    # escape split across chunks
+                    return False
+                self.pos = m.end() + 1
+            else:
+                self.in_string = False
+                self.pos = m.end()
+            return True
+
+        m = _STRUCTURE_RE.search(buf, self.pos)
+        if m is None:
+            self.pos = len(buf)
+            return False
+        ch, idx = m.group(), m.start()
+        self.pos = m.end()
+        if ch == '"':
+            self.in_string = True
+            # A key follows "{" or "," inside an object; anything else
+            # (after ":" or inside an array) is a value
+            j = idx - 1
+            while j >= 0 and buf[j].isspace():
+                j -= 1
+            self.string_is_key = self.stack[-1] == "{" and j >= 0 and buf[j] in "{,"
+        elif ch in "{[":
+            if len(self.stack) == 1 and ch == "{":
+                self.item_start = idx
+            self.stack.append(ch)
+        else:
+            self.stack.pop()
+            if not self.stack:
+                self.done = True
+            elif len(self.stack) == 1 and self.item_start is not None:
+                self._add(buf[self.item_start:idx + 1])
+                self.item_start = None
+        return True
+
+    def _add(self, text: str, salvage: bool = False) -> None:
+        item, repaired = _loads_object(text)
+        if salvage and item is not None and self.in_string and not self.string_is_key \
+                and len(self.stack) == 2:
+            # A top-level value of the object was cut off mid-string; a cut
+            # key is dropped by close() and a cut nested value (an evidence
+            # list) leaves the fields that came whole
+            if list(item)[-1:] in (["diagnosis"], ["icd10_code"]):
+                item = None
+        if item is None or (salvage and not item.get("diagnosis")):
+            self.bad_items += 1
+            return
+        self.items.append(item)
+        self.repaired += repaired
+        self.salvaged += salvage
+
+    def close(self) -> List[Dict]:
+        """End of text: salvage a cut-off final object. Returns all items."""
+        if not self.done and self.item_start is not None:
+            text = self.buf[self.item_start:]
+            if self.in_string:
+                text += '"'
+            text = text.rstrip().rstrip(",")
+            if self.stack[-1] == "{":
+                # In an array a trailing string is an element, not a key
+                text = _DANGLING_KEY_RE.sub("", text)
+            if text.endswith(":"):
+                text += "null"
+            text += "".join("}" if c == "{" else "]" for c in reversed(self.stack[1:]))
+            self._add(text, salvage=True)
+            self.item_start = None
+        return self.items
+
+    @property
+    def clean(self) -> bool:
+        """The array was found, closed, and every object loaded as-is."""
+        return self.done and not (self.bad_items or self.repaired or self.salvaged)
+
+    @property
+    def status(self) -> str:
+        """Parse status (see PARSE_STATUSES), once close() has been called."""
+        if not self.buf:
+            return "empty"
+        if self.clean:
+            return "clean"
+        return "repaired" if self.items or self.done else "failed"
+
+
+def _loads_object(text: str) -> Tuple[Optional[Dict], bool]:
+    """(object, whether it needed the trailing-comma repair)."""
+    for repaired, candidate in ((False, text), (True, _TRAILING_COMMA_RE.sub(r"\1", text))):
+        try:
+            obj = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        return (obj if isinstance(obj, dict) else None), repaired
+    return None, False
+
+
+def extract_items(text: str) -> Tuple[List[Dict], str]:
+    """(objects of the first JSON array of objects in `text`, parse status)."""
+    stream = ItemStream()
+    stream.feed(text or "")
+    return stream.close(), stream.status
+
+
+# ===========================================================================
+# PARSE TALLY
+# ===========================================================================
+
+class ParseTally:
+    """Thread-safe count of parse outcomes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(PARSE_STATUSES, 0)
+
+    def record(self, status: str) -> None:
+        with self._lock:
+            self._counts[status] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self._counts)
+        out["responses"] = sum(out[s] for s in PARSE_STATUSES)
+        return out
+
+
+_process_tally = ParseTally()
+_current: contextvars.ContextVar[Optional[List[ParseTally]]] = contextvars.ContextVar(
+    "cdi_parse_tally", default=None)
+
+
+def record_parse(status: str) -> None:
+    _process_tally.record(status)
+    for tally in _current.get() or ():
+        tally.record(status)
+
+
+@contextmanager
+def track_parses() -> Iterator[ParseTally]:
+    """Tally the parses made inside this block (see prompt_cache.track_usage
+    for how this follows pool threads)."""
+    tally = ParseTally()
+    token = _current.set((_current.get() or []) + [tally])
+    try:
+        yield tally
+    finally:
+        _current.reset(token)
+
+
+def parse_stats() -> Dict[str, int]:
+    """Process-wide parse outcomes, for run summaries."""
+    return _process_tally.snapshot()
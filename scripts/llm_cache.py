@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+llm_cache.py — opt-in, content-addressed on-disk cache for LLM responses.
+
+Hill-climb runs, evaluator re-runs and judge re-runs send byte-identical
+requests (same variant, same notes, same model, same temperature) over and
+over. After a scoring-only change (a diagnoses_match tweak, a new metric)
+the predictions don't need to be regenerated at all. With the cache on,
+such a re-run is answered from disk: zero gateway calls, seconds instead
+of hours.
+
+Key: sha256 over the canonical JSON of (model, messages, temperature,
+max_tokens, sample, options that are set). `sample` separates the N self-consistency passes of
+one case — without it all voting passes would share one cache entry and
+the vote would collapse to a single sample.
+
+Storage: one SQLite file (WAL mode, safe across threads in one process and
+across processes). Only the key hash and the response text are stored, not
+the prompt — but responses quote chart evidence, so the file holds PHI.
+Keep it on the secure workstation; it is created with 0600 permissions.
+
+Modes:
+    off        — no caching (default)
+    readwrite  — serve hits, call the API on misses and store the result
+    record     — always call the API, overwrite the stored response
+    replay     — serve hits only; a miss raises CacheMiss (no API calls,
+                 useful to guarantee a re-score run is free and repeatable)
+
+Configuration — either call `configure(...)` (the evaluator / hill-climb
+CLIs do this from --cache flags) or set environment variables:
+    CDI_LLM_CACHE           mode (off | readwrite | record | replay)
+    CDI_LLM_CACHE_PATH      SQLite file (default ~/.cache/cdi_llm/responses.sqlite3)
+    CDI_LLM_CACHE_TTL_DAYS  entries older than this are ignored and purged
+    CDI_LLM_CACHE_MAX_MB    size bound; least-recently-used entries are evicted
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional
+
+
+CACHE_MODES = ("off", "readwrite", "record", "replay")
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "cdi_llm" / "responses.sqlite3"
+DEFAULT_MAX_MB = 2048
+
+# When the file exceeds max_bytes, evict down to this fraction of it so we
+# don't run an eviction pass after every single insert.
+_EVICT_TO = 0.9
+
+
+class CacheMiss(RuntimeError):
+    """Raised in replay mode when a request has no stored response."""
+
+
+def cache_key(model: str, messages: list, temperature: float,
+              max_tokens: int, sample: int = 0, **options) -> str:
+    """Stable content hash of one LLM request.
+
+    `options` are further request settings that change the response
+    (reasoning_effort, structured output). Only those that are set are
+    part of the key, so requests that don't use them keep the keys they
+    always had.
+    """
+    request = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "sample": sample,
+    }
+    request.update((k, v) for k, v in options.items() if v)
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False,
+                           separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """SQLite-backed response store with TTL and LRU size bound."""
+
+    def __init__(self, path: Optional[str] = None, mode: str = "readwrite",
+                 ttl_days: Optional[float] = None,
+                 max_mb: Optional[float] = DEFAULT_MAX_MB):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}. Known: {CACHE_MODES}")
+        self.mode = mode
+        self.path = Path(path) if path else DEFAULT_CACHE_PATH
+        self.ttl_seconds = ttl_days * 86400 if ttl_days else None
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evicted": 0}
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        new_file = not self.path.exists()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False,
+                                     timeout=30)
+        if new_file:
+            os.chmod(self.path, 0o600)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self._conn.commit()
+        if self.ttl_seconds:
+            self.purge_expired()
+
+    # --- primitives ----------------------------------------------------
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if self.ttl_seconds and now - created > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?",
+                               (now, key))
+            self._conn.commit()
+            return response
+
+    def put(self, key: str, model: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (key, model, response, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now),
+            )
+            self._conn.commit()
+            self.stats["writes"] += 1
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        if not self.max_bytes:
+            return
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * _EVICT_TO)
+        evicted = 0
+        for key, size in self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed ASC").fetchall():
+            if total <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self._conn.commit()
+        self.stats["evicted"] += evicted
+
+    def purge_expired(self) -> int:
+        """Delete entries older than the TTL. Returns the number removed."""
+        if not self.ttl_seconds:
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM responses WHERE created < ?",
+                                     (cutoff,))
+            self._conn.commit()
+            return cur.rowcount
+
+    # --- call wrapper --------------------------------------------------
+
+    def call(self, key: str, model: str, fn: Callable[[], str]) -> str:
+        """Return the cached response for `key`, or run `fn` per the mode."""
+        hit = self.lookup(key, model)
+        if hit is not None:
+            return hit
+        return self.store(key, model, fn())
+
+    def lookup(self, key: str, model: str) -> Optional[str]:
+        """The response to serve for `key` under this mode, else None (call
+        the API). Counts the hit or miss; a replay miss raises CacheMiss."""
+        if self.mode not in ("readwrite", "replay"):
+            return None
+        hit = self.get(key)
+        with self._lock:
+            self.stats["hits" if hit is not None else "misses"] += 1
+        if hit is None and self.mode == "replay":
+            raise CacheMiss(f"No cached response for {model} request {key[:12]}… "
+                            f"(replay mode)")
+        return hit
+
+    def lookup_many(self, keys: List[str], model: str) -> List[Optional[str]]:
+        """lookup() for the samples of one n-sampled request: a response or
+        None per key. A replay miss on any of them raises CacheMiss."""
+        if self.mode not in ("readwrite", "replay"):
+            return [None] * len(keys)
+        hits = [self.get(key) for key in keys]
+        missing = [key for key, hit in zip(keys, hits) if hit is None]
+        with self._lock:
+            self.stats["hits"] += len(keys) - len(missing)
+            self.stats["misses"] += len(missing)
+        if missing and self.mode == "replay":
+            raise CacheMiss(f"No cached response for {len(missing)} {model} "
+                            f"sample(s) of request {missing[0][:12]}… (replay mode)")
+        return hits
+
+    def store(self, key: str, model: str, response: str) -> str:
+        # Empty responses are usually transient (content filter, truncation
+        # that the caller chose not to retry) — don't pin them.
+        if response:
+            self.put(key, model, response)
+        return response
+
+
+# ===========================================================================
+# PROCESS-WIDE INSTANCE
+# ===========================================================================
+
+_cache: Optional[LLMCache] = None
+_configured = False
+_config_lock = threading.Lock()
+
+
+def configure(mode: Optional[str] = None, path: Optional[str] = None,
+              ttl_days: Optional[float] = None,
+              max_mb: Optional[float] = None) -> Optional[LLMCache]:
+    """Set up the process-wide cache. Unset arguments fall back to env vars.
+
+    Returns the cache, or None when the mode is "off".
+    """
+    global _cache, _configured
+    mode = mode or os.environ.get("CDI_LLM_CACHE", "off")
+    path = path or os.environ.get("CDI_LLM_CACHE_PATH")
+    if ttl_days is None and os.environ.get("CDI_LLM_CACHE_TTL_DAYS"):
+        ttl_days = float(os.environ["CDI_LLM_CACHE_TTL_DAYS"])
+    if max_mb is None:
+        max_mb = float(os.environ.get("CDI_LLM_CACHE_MAX_MB", DEFAULT_MAX_MB))
+
+    with _config_lock:
+        _cache = None if mode == "off" else LLMCache(path, mode=mode,
+                                                     ttl_days=ttl_days,
+                                                     max_mb=max_mb)
+        _configured = True
+    if _cache is not None:
+        print(f"LLM response cache: {mode} ({_cache.path})")
+    return _cache
+
+
+def get_cache() -> Optional[LLMCache]:
+    """Return the process-wide cache, configuring from env on first use."""
+    if not _configured:
+        configure()
+    return _cache
+
+
+def cached_llm_call(model: str, messages: list, temperature: float,
+                    max_tokens: int, fn: Callable[[], str],
+                    sample: int = 0, **options) -> str:
+    """Run `fn` (the real API call) through the cache if one is configured."""
+    cache = get_cache()
+    if cache is None:
+        return fn()
+    key = cache_key(model, messages, temperature, max_tokens, sample, **options)
+    return cache.call(key, model, fn)
+
+
+async def cached_llm_call_async(model: str, messages: list, temperature: float,
+                                max_tokens: int, fn: Callable[[], Awaitable[str]],
+                                sample: int = 0, **options) -> str:
+    """cached_llm_call for a coroutine function `fn`. The SQLite reads and
+    writes run on a worker thread, off the event loop."""
+    cache = get_cache()
+    if cache is None:
+        return await fn()
+    key = cache_key(model, messages, temperature, max_tokens, sample, **options)
+    hit = await asyncio.to_thread(cache.lookup, key, model)
+    if hit is not None:
+        return hit
+    return await asyncio.to_thread(cache.store, key, model, await fn())
+
+
+def cached_llm_samples(model: str, messages: list, temperature: float,
+                       max_tokens: int, samples: List[int],
+                       fn: Callable[[int], List[str]], **options) -> List[str]:
+    """Like cached_llm_call, for one request that returns several samples.
+
+    `fn(k)` makes a single API call for k completions (the chat-completions
+    `n` parameter). Each sample keeps its own cache entry — the same key
+    a separate call with that `sample` index would use — so n-sampled and
+    one-call-per-sample runs share the cache. Only the samples that miss
+    are requested.
+    """
+    cache = get_cache()
+    if cache is None:
+        return fn(len(samples))
+    keys = _sample_keys(model, messages, temperature, max_tokens, samples, options)
+    out = cache.lookup_many(keys, model)
+    missing = [i for i, response in enumerate(out) if response is None]
+    if missing:
+        _sample_store(cache, model, keys, out, missing, fn(len(missing)))
+    return out
+
+
+async def cached_llm_samples_async(model: str, messages: list, temperature: float,
+                                   max_tokens: int, samples: List[int],
+                                   fn: Callable[[int], Awaitable[List[str]]],
+                                   **options) -> List[str]:
+    """cached_llm_samples for a coroutine function `fn`, with the SQLite
+    work on a worker thread (as cached_llm_call_async)."""
+    cache = get_cache()
+    if cache is None:
+        return await fn(len(samples))
+    keys = _sample_keys(model, messages, temperature, max_tokens, samples, options)
+    out = await asyncio.to_thread(cache.lookup_many, keys, model)
+    missing = [i for i, response in enumerate(out) if response is None]
+    if missing:
+        responses = await fn(len(missing))
+        await asyncio.to_thread(_sample_store, cache, model, keys, out, missing, responses)
+    return out
+
+
+def _sample_keys(model: str, messages: list, temperature: float, max_tokens: int,
+                 samples: List[int], options: Dict) -> List[str]:
+    return [cache_key(model, messages, temperature, max_tokens, s, **options)
+            for s in samples]
+
+
+def _sample_store(cache: LLMCache, model: str, keys: List[str],
+                  out: List[Optional[str]], missing: List[int],
+                  responses: List[str]) -> None:
+    for i, response in zip(missing, responses):
+        out[i] = cache.store(keys[i], model, response)
+
+
+def cached_llm_stream(model: str, messages: list, temperature: float,
+                      max_tokens: int, fn: Callable[[], Iterator[str]],
+                      sample: int = 0, **options) -> Iterator[str]:
+    """Like cached_llm_call for a streamed response: `fn()` yields text chunks.
+
+    A hit is yielded as one chunk. A miss streams through and is stored
+    once the stream has finished, under the same key as the non-streamed
+    request, so streamed and blocking calls share the cache.
+    """
+    cache = get_cache()
+    if cache is None:
+        yield from fn()
+        return
+    key = cache_key(model, messages, temperature, max_tokens, sample, **options)
+    hit = cache.lookup(key, model)
+    if hit is not None:
+        yield hit
+        return
+    chunks = []
+    for chunk in fn():
+        chunks.append(chunk)
+        yield chunk
+    cache.store(key, model, "".join(chunks))
+
+
+def add_cache_args(parser) -> None:
+    """Add the shared --cache* flags to an argparse parser."""
+    parser.add_argument('--cache', choices=CACHE_MODES, default=None,
+                        help='LLM response cache mode (default: $CDI_LLM_CACHE or off). '
+                             '"readwrite" reuses identical requests from earlier runs; '
+                             '"replay" forbids API calls entirely (re-scoring only).')
+    parser.add_argument('--cache-path', type=str, default=None,
+                        help=f'SQLite cache file (default {DEFAULT_CACHE_PATH}). '
+                             'Contains model responses quoting chart evidence — PHI.')
+    parser.add_argument('--cache-ttl-days', type=float, default=None,
+                        help='Ignore and purge cached responses older than this.')
+
+
+def configure_from_args(args) -> Optional[LLMCache]:
+    """Apply the --cache* flags added by add_cache_args."""
+    return configure(mode=args.cache, path=args.cache_path,
+                     ttl_days=args.cache_ttl_days)
@@ -25,12 +25,14 @@ import os
 import sys
 import json
 import re
+import threading
 from typing import Tuple, Dict, Optional
 from functools import lru_cache
 
 # Add parent directory for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from scripts.cdi_llm_predictor import call_stanford_llm
+from scripts.diagnosis_matcher import DiagnosisMatcher
 
 
 # Prompt template for LLM judge
@@ -141,6 +143,37 @@ def diagnoses_match_llm(
         return (False, 0.3, f"LLM error, fallback: {str(e)}")
 
 
+def _normalize_dx(dx: str) -> str:
+    """Normalize diagnosis for comparison"""
+    dx = dx.lower().strip()
+    dx = re.sub(r'\s+', ' ', dx)
+    dx = re.sub(r'[^\w\s]', '', dx)
+    return dx
+
+
+# Clinical equivalents for HybridMatcher's rule stage (high confidence matches)
+RULE_EQUIVALENTS = {
+    'sepsis': ['sepsis', 'septic', 'urosepsis', 'septicemia'],
+    'pressure ulcer': ['pressure ulcer', 'pressure injury', 'decubitus', 'pressure sore', 'bed sore'],
+    'malnutrition': ['malnutrition', 'protein calorie malnutrition', 'cachexia', 'underweight'],
+    'heart failure': ['heart failure', 'chf', 'congestive heart failure', 'hfref', 'hfpef'],
+    'respiratory failure': ['respiratory failure', 'hypoxic respiratory failure', 'hypoxia'],
+    'anemia': ['anemia', 'blood loss anemia', 'iron deficiency anemia'],
+    'acute kidney injury': ['acute kidney injury', 'aki', 'acute renal failure', 'acute renal insufficiency'],
+    'demand ischemia': ['demand ischemia', 'type 2 mi', 'type 2 myocardial infarction', 'nstemi type 2'],
+    'encephalopathy': ['encephalopathy', 'metabolic encephalopathy', 'hepatic encephalopathy', 'delirium'],
+    'pulmonary edema': ['pulmonary edema', 'flash pulmonary edema', 'cardiogenic pulmonary edema'],
+    'thrombocytopenia': ['thrombocytopenia', 'low platelets', 'pancytopenia'],
+    'hypoalbuminemia': ['hypoalbuminemia', 'low albumin'],
+}
+
+RULE_STOP_WORDS = {'and', 'or', 'the', 'a', 'an', 'with', 'without', 'due', 'to', 'of', 'in', 'on',
+                   'confirmed', 'present', 'admission', 'poa', 'acute', 'chronic', 'clinically', 'valid'}
+
+# Shared by every HybridMatcher; thread-safe (lru_cache) for --workers N
+_RULE_MATCHER = DiagnosisMatcher(RULE_EQUIVALENTS, RULE_STOP_WORDS, _normalize_dx)
+
+
 class HybridMatcher:
     """
     Hybrid matcher that combines rule-based and LLM-based matching.
@@ -176,13 +209,15 @@ class HybridMatcher:
             "llm_calls": 0,
             "cache_hits": 0
         }
+        # One matcher is shared across evaluation workers (--workers N), so
+        # cache and counter updates go through a lock. The LLM call itself
+        # runs outside it — two workers may occasionally judge the same pair
+        # concurrently, which costs one extra call but never blocks.
+        self._lock = threading.Lock()
 
     def _normalize(self, dx: str) -> str:
         """Normalize diagnosis for comparison"""
-        dx = dx.lower().strip()
-        dx = re.sub(r'\s+', ' ', dx)
-        dx = re.sub(r'[^\w\s]', '', dx)
-        return dx
+        return _normalize_dx(dx)
 
     def _rule_based_match(self, pred_dx: str, true_dx: str) -> Tuple[Optional[bool], float]:
         """
@@ -193,8 +228,11 @@ class HybridMatcher:
             - match_result: True/False if confident, None if uncertain
             - confidence: Confidence in the result
         """
-        pred_norm = self._normalize(pred_dx)
-        true_norm = self._normalize(true_dx)
+        # Features (normalised text, content words, equivalence classes)
+        # are computed once per string and memoised on the module matcher
+        pred = _RULE_MATCHER.features(pred_dx)
+        true = _RULE_MATCHER.features(true_dx)
+        pred_norm, true_norm = pred.norm, true.norm
 
         # Exact match
         if pred_norm == true_norm:
@@ -205,26 +243,8 @@ class HybridMatcher:
             return (True, 0.9)
 
         # Clinical equivalents (high confidence matches)
-        clinical_equivalents = {
-            'sepsis': ['sepsis', 'septic', 'urosepsis', 'septicemia'],
-            'pressure ulcer': ['pressure ulcer', 'pressure injury', 'decubitus', 'pressure sore', 'bed sore'],
-            'malnutrition': ['malnutrition', 'protein calorie malnutrition', 'cachexia', 'underweight'],
-            'heart failure': ['heart failure', 'chf', 'congestive heart failure', 'hfref', 'hfpef'],
-            'respiratory failure': ['respiratory failure', 'hypoxic respiratory failure', 'hypoxia'],
-            'anemia': ['anemia', 'blood loss anemia', 'iron deficiency anemia'],
-            'acute kidney injury': ['acute kidney injury', 'aki', 'acute renal failure', 'acute renal insufficiency'],
-            'demand ischemia': ['demand ischemia', 'type 2 mi', 'type 2 myocardial infarction', 'nstemi type 2'],
-            'encephalopathy': ['encephalopathy', 'metabolic encephalopathy', 'hepatic encephalopathy', 'delirium'],
-            'pulmonary edema': ['pulmonary edema', 'flash pulmonary edema', 'cardiogenic pulmonary edema'],
-            'thrombocytopenia': ['thrombocytopenia', 'low platelets', 'pancytopenia'],
-            'hypoalbuminemia': ['hypoalbuminemia', 'low albumin'],
-        }
-
-        for base_term, equivalents in clinical_equivalents.items():
-            pred_has = any(eq in pred_norm for eq in equivalents)
-            true_has = any(eq in true_norm for eq in equivalents)
-            if pred_has and true_has:
-                return (True, 0.85)
+        if not pred.classes.isdisjoint(true.classes):
+            return (True, 0.85)
 
         # Check for "ruled out" - this is a definite NON-match
         if 'ruled out' in true_norm and 'ruled out' not in pred_norm:
@@ -232,11 +252,9 @@ class HybridMatcher:
         if 'ruled out' in pred_norm and 'ruled out' not in true_norm:
             return (False, 0.95)
 
-        # Word overlap analysis
-        stop_words = {'and', 'or', 'the', 'a', 'an', 'with', 'without', 'due', 'to', 'of', 'in', 'on',
-                      'confirmed', 'present', 'admission', 'poa', 'acute', 'chronic', 'clinically', 'valid'}
-        pred_words = set(pred_norm.split()) - stop_words
-        true_words = set(true_norm.split()) - stop_words
+        # Word overlap analysis (stop words already removed)
+        pred_words = pred.words
+        true_words = true.words
 
         if not pred_words or not true_words:
             return (False, 0.8)
@@ -284,22 +302,24 @@ class HybridMatcher:
         rule_result, rule_confidence = self._rule_based_match(pred_dx, true_dx)
 
         if rule_result is not None:
-            if rule_result:
-                self._stats["rule_matches"] += 1
-            else:
-                self._stats["rule_non_matches"] += 1
+            with self._lock:
+                if rule_result:
+                    self._stats["rule_matches"] += 1
+                else:
+                    self._stats["rule_non_matches"] += 1
             return (rule_result, rule_confidence)
 
         # Need LLM for uncertain cases
         cache_key = f"{self._normalize(pred_dx)}|{self._normalize(true_dx)}"
 
-        if self.cache_enabled and cache_key in self._cache:
-            self._stats["cache_hits"] += 1
-            is_match, confidence, _ = self._cache[cache_key]
-            return (is_match, confidence)
+        with self._lock:
+            if self.cache_enabled and cache_key in self._cache:
+                self._stats["cache_hits"] += 1
+                is_match, confidence, _ = self._cache[cache_key]
+                return (is_match, confidence)
 
-        # Call LLM
-        self._stats["llm_calls"] += 1
+            # Call LLM
+            self._stats["llm_calls"] += 1
         is_match, confidence, reasoning = diagnoses_match_llm(
             pred_dx, true_dx, self.api_key,
             model=self.llm_model, verbose=verbose
@@ -307,25 +327,28 @@ class HybridMatcher:
 
         # Cache result
         if self.cache_enabled:
-            self._cache[cache_key] = (is_match, confidence, reasoning)
+            with self._lock:
+                self._cache[cache_key] = (is_match, confidence, reasoning)
 
         return (is_match, confidence)
 
     def get_stats(self) -> Dict:
         """Get matching statistics"""
-        total = (self._stats["rule_matches"] + self._stats["rule_non_matches"] +
-                 self._stats["llm_calls"])
+        with self._lock:
+            stats = dict(self._stats)
+        total = stats["rule_matches"] + stats["rule_non_matches"] + stats["llm_calls"]
         return {
-            **self._stats,
+            **stats,
             "total_comparisons": total,
-            "llm_call_rate": self._stats["llm_calls"] / total if total > 0 else 0,
-            "cache_hit_rate": self._stats["cache_hits"] / self._stats["llm_calls"]
-                if self._stats["llm_calls"] > 0 else 0
+            "llm_call_rate": stats["llm_calls"] / total if total > 0 else 0,
+            "cache_hit_rate": stats["cache_hits"] / stats["llm_calls"]
+                if stats["llm_calls"] > 0 else 0
         }
 
     def clear_cache(self):
         """Clear the judgment cache"""
-        self._cache.clear()
+        with self._lock:
+            self._cache.clear()
 
 
 def test_matcher():
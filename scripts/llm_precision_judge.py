@@ -39,6 +39,9 @@ import pandas as pd
 # Import _call_llm from cdi_engine for consistent API handling
 sys.path.insert(0, str(Path(__file__).parent))
 from cdi_engine import _call_llm
+from llm_cache import add_cache_args, configure_from_args
+from note_packer import trim_to_tokens
+from run_checkpoint import RunCheckpoint, file_hash
 
 
 JUDGE_SYSTEM_PROMPT = """You are a senior Clinical Documentation Integrity (CDI) specialist.
@@ -77,14 +80,13 @@ def safe_eval(x):
         return []
 
 
-def truncate_note(text: str, max_chars: int = 6000) -> str:
+def truncate_note(text: str, max_tokens: int = 1500) -> str:
     if not isinstance(text, str):
         return ""
-    if len(text) <= max_chars:
-        return text
-    # Keep the start (usually includes diagnoses/problem list) and the end
-    half = max_chars // 2
-    return text[:half] + "\n\n... [truncated] ...\n\n" + text[-half:]
+    # Keep the start (usually includes diagnoses/problem list) and the end.
+    # Cut by tokens (note_packer) — the old 6,000/10,000/3,500-char limits
+    # were ~4 chars/token guesses that dense lab text overran.
+    return trim_to_tokens(text, max_tokens)
 
 
 def assemble_notes(row) -> str:
@@ -106,7 +108,7 @@ def assemble_notes(row) -> str:
     for label, col in mapping:
         v = row.get(col)
         if isinstance(v, str) and v.strip():
-            limit = 10000 if col == "discharge_summary" else 3500
+            limit = 2500 if col == "discharge_summary" else 875
             sections.append(f"=== {label} ===\n{truncate_note(v, limit)}")
     return "\n\n".join(sections)
 
@@ -159,23 +161,36 @@ def sample_unmatched_predictions(results_df, data_df, n_sample: int, seed: int =
       - cases where model matched none
     """
     random.seed(seed)
-    rows = []
+    # The results CSV has one row per CDI query, and the evaluator predicts
+    # once per encounter (encounters.py), so an encounter with three queries
+    # contributes the same prediction list three times. Group those rows:
+    # a prediction is unmatched only if it matched none of the encounter's
+    # queries, and is judged once against all of their ground truth.
+    encounters = {}
     for _, r in results_df.iterrows():
         preds = safe_eval(r["llm_predictions"])
         matches = safe_eval(r["matches"])
-        matched = {m.get("predicted", "") for m in matches if isinstance(m, dict)}
-        truths = safe_eval(r["cdi_diagnoses"])
+        enc = encounters.setdefault((r["case_id"], tuple(preds)), {
+            "case_id": r["case_id"], "preds": preds, "truths": [], "matched": set(),
+        })
+        enc["matched"].update(m.get("predicted", "") for m in matches if isinstance(m, dict))
+        enc["truths"].extend(t for t in safe_eval(r["cdi_diagnoses"]) if t not in enc["truths"])
+
+    rows = []
+    for enc in encounters.values():
+        preds, matched = enc["preds"], enc["matched"]
         unmatched = [p for p in preds if p not in matched]
         for pred in unmatched:
             rows.append({
-                "case_id": r["case_id"],
+                "case_id": enc["case_id"],
                 "prediction": pred,
-                "cdi_ground_truth": truths,
+                "cdi_ground_truth": enc["truths"],
                 "case_had_match": len(matched) > 0,
                 "n_preds": len(preds),
             })
 
-    print(f"Total unmatched predictions available: {len(rows)}")
+    print(f"Total unmatched predictions available: {len(rows)} "
+          f"({len(results_df)} result rows, {len(encounters)} encounters)")
     if len(rows) <= n_sample:
         return rows
 
@@ -251,8 +266,12 @@ def main():
                               "minimise self-evaluation bias."))
     parser.add_argument("--seed", type=int, default=42)
     parser.add_argument("--output-dir", default="results", help="Where to write judge output")
-    parser.add_argument("--resume", action="store_true", help="Resume from checkpoint if present")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume from this configuration's checkpoint if present "
+                             "(otherwise it is discarded)")
+    add_cache_args(parser)
     args = parser.parse_args()
+    configure_from_args(args)
 
     api_key = os.environ.get("STANFORD_API_KEY")
     if not api_key:
@@ -294,15 +313,18 @@ def main():
         print("No unmatched predictions to grade")
         return 0
 
-    # Resume from checkpoint
-    checkpoint = f"/tmp/cdi_judge_checkpoint_{args.seed}.json"
-    graded = []
-    start_idx = 0
-    if args.resume and os.path.exists(checkpoint):
-        with open(checkpoint) as f:
-            graded = json.load(f)
-        start_idx = len(graded)
-        print(f"Resuming from checkpoint: {start_idx} already graded")
+    # Resume from checkpoint: one per judging configuration (including the
+    # content of the results and dataset files), keyed by the item's
+    # position in the (seeded, deterministic) sample plus its case
+    checkpoint = RunCheckpoint("precision_judge", {
+        "results": os.path.abspath(args.results),
+        "results_sha256": file_hash(args.results),
+        "data": os.path.abspath(args.data),
+        "data_sha256": file_hash(args.data),
+        "sample": args.sample, "seed": args.seed, "judge_model": args.judge_model,
+    }, resume=args.resume)
+    if len(checkpoint):
+        print(f"Resuming from checkpoint {checkpoint.dir}: {len(checkpoint)} already graded")
 
     # Build case -> notes map for quick lookup
     data_by_case = data.set_index("case_id").to_dict(orient="index")
@@ -311,10 +333,15 @@ def main():
     Path(args.output_dir).mkdir(parents=True, exist_ok=True)
     out_path = Path(args.output_dir) / f"llm_judge_precision_{ts}.json"
 
+    graded = []
     try:
-        for i, item in enumerate(sample[start_idx:], start=start_idx):
+        for i, item in enumerate(sample):
             case_id = item["case_id"]
             prediction = item["prediction"]
+            key = f"{i}:{case_id}"
+            if key in checkpoint:
+                graded.append(checkpoint.get(key))
+                continue
             print(f"[{i+1}/{len(sample)}] {case_id}: {prediction[:80]}")
 
             if case_id not in data_by_case:
@@ -335,22 +362,21 @@ def main():
                 **item,
                 **verdict_obj,
             })
+            # API errors aren't checkpointed, so a resumed run retries them
+            if verdict_obj.get("verdict") != "ERROR":
+                checkpoint.append(key, graded[-1])
 
-            # Checkpoint every 20
+            # Running tally every 20
             if (i + 1) % 20 == 0:
-                with open(checkpoint, "w") as f:
-                    json.dump(graded, f, default=str)
-                # Running tally
                 verdicts = [g.get("verdict", "ERROR") for g in graded]
                 from collections import Counter
                 tally = Counter(verdicts)
                 print(f"  Running tally: {dict(tally)}")
 
     except KeyboardInterrupt:
-        print("\nInterrupted. Saving partial results.")
+        print("\nInterrupted. Saving partial results (rerun with --resume to continue).")
     finally:
-        with open(checkpoint, "w") as f:
-            json.dump(graded, f, default=str)
+        checkpoint.close()
 
     # Final report
     from collections import Counter
@@ -393,9 +419,8 @@ def main():
     print(f"\nSaved: {out_path}")
 
     # Clean up checkpoint
-    if os.path.exists(checkpoint) and tally.get("ERROR", 0) < valid_total * 0.1:
-        try: os.remove(checkpoint)
-        except Exception: pass
+    if len(graded) == len(sample) and tally.get("ERROR", 0) < valid_total * 0.1:
+        checkpoint.discard()
 
     return 0
 
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+note_packer.py — fit a case's notes into the model's input budget, by tokens.
+
+CDIEngine sends every note of a case in one prompt. A case whose notes
+overrun the deployment's input limit is otherwise only found out by the
+gateway, with a 400 and a wasted round trip — per voting pass — so the
+engine packs the note list with pack_notes() before the prompt is built:
+
+    1. Count tokens locally. tiktoken's o200k_base (the GPT-5 / GPT-4.1
+       encoding) when it is installed, else the same ~4 chars/token
+       estimate rate_limiter uses. Offline either way.
+    2. If everything fits, return the notes untouched — the prompt is
+       byte-identical to the unpacked one (same LLM cache keys, same
+       provider prompt-cache prefix).
+    3. Otherwise drop redundant sections first: a section body that
+       already appeared in a higher-priority note (copy-forward progress
+       notes repeating the H&P's history, a consult restating the
+       medication list). Lower-priority notes lose their copies; the
+       header stays with a short marker.
+    4. Still over: trim notes by tokens, lowest priority first, keeping
+       head and tail (assessment/plan sits at the end of most notes).
+       Each note keeps at least MIN_NOTE_TOKENS before any note is dropped
+       outright; the discharge summary is trimmed last and never dropped.
+
+Priority (NOTE_PRIORITY) follows what the CDI reviewer reads first:
+discharge summary, H&P, progress, consult, procedure, ED, inpatient
+consult.
+
+Budgets are per model (MODEL_INPUT_TOKENS, the deployment's input limit);
+CDI_NOTE_TOKEN_BUDGET caps them all, e.g. to keep prompts cheap. Without
+tiktoken the count is an estimate, so only ESTIMATE_MARGIN of the budget
+is used.
+"""
+
+import hashlib
+import os
+import re
+from typing import Dict, List, Tuple
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:       # not installed, or the encoding file can't be fetched
+    _ENCODING = None
+
+TOKENIZER = "o200k_base" if _ENCODING is not None else "estimate"
+CHARS_PER_TOKEN = 4             # same estimate as rate_limiter.estimate_tokens
+ESTIMATE_MARGIN = 0.85          # share of the budget used when estimating
+
+# Input limits (tokens) by model-name prefix; longest matching prefix wins.
+# GPT-5 deployments take 272k input (400k context less 128k output);
+# Claude on Bedrock 200k context, less the 8k output budget _call_llm uses.
+MODEL_INPUT_TOKENS = {
+    "gpt-5": 272000,
+    "gpt-4.1": 1000000,
+    "claude": 192000,
+}
+DEFAULT_INPUT_TOKENS = 128000
+
+NOTE_PRIORITY = ("discharge_summary", "hp_note", "progress_note", "consult_note",
+                 "procedure_note", "ed_note", "ip_consult_note")
+
+MIN_NOTE_TOKENS = 1000          # trim floor before notes are dropped outright
+MIN_REDUNDANT_CHARS = 200       # shorter section bodies are never deduplicated
+
+TRUNCATION_MARKER = "\n\n... [truncated] ...\n\n"
+REDUNDANT_MARKER = " [repeated from an earlier note]"
+
+_WS_RE = re.compile(r"\s+")
+
+
+# ===========================================================================
+# TOKEN COUNTING
+# ===========================================================================
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the head and tail of `text`, max_tokens in all (marker included)."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    half = max((max_tokens - count_tokens(TRUNCATION_MARKER)) // 2, 0)
+    if _ENCODING is not None:
+        ids = _ENCODING.encode(text, disallowed_special=())
+        head, tail = ids[:half], ids[len(ids) - half:] if half else []
+        return _ENCODING.decode(head) + TRUNCATION_MARKER + _ENCODING.decode(tail)
+    chars = half * CHARS_PER_TOKEN
+    return text[:chars] + TRUNCATION_MARKER + (text[-chars:] if chars else "")
+
+
+def input_budget(model: str) -> int:
+    """Tokens of prompt `model` accepts, capped by CDI_NOTE_TOKEN_BUDGET."""
+    prefixes = [p for p in MODEL_INPUT_TOKENS if model.startswith(p)]
+    budget = MODEL_INPUT_TOKENS[max(prefixes, key=len)] if prefixes else DEFAULT_INPUT_TOKENS
+    override = os.environ.get("CDI_NOTE_TOKEN_BUDGET")
+    if override:
+        budget = min(budget, int(override))
+    if _ENCODING is None:
+        budget = int(budget * ESTIMATE_MARGIN)
+    return budget
+
+
+# ===========================================================================
+# PACKING
+# ===========================================================================
+
+def _priority(kind: str) -> int:
+    return NOTE_PRIORITY.index(kind) if kind in NOTE_PRIORITY else len(NOTE_PRIORITY)
+
+
+def _drop_redundant_sections(texts: List[str], order: List[int]) -> int:
+    """Replace section bodies already seen in a higher-priority note.
+
+    `order` is the note indices, highest priority first. Edits `texts` in
+    place; returns the number of sections dropped.
+    """
+    from note_sections import index_note
+
+    seen = set()
+    dropped = 0
+    for i in order:
+        index = index_note(texts[i])
+        spans = []
+        for _, start, end in index.sections():
+            body = _WS_RE.sub(" ", index.text[start:end]).strip().lower()
+            if len(body) < MIN_REDUNDANT_CHARS:
+                continue
+            digest = hashlib.sha1(body.encode("utf-8")).digest()
+            if digest in seen:
+                spans.append((start, end))
+            else:
+                seen.add(digest)
+        if spans:
+            text = index.text
+            for start, end in reversed(spans):
+                text = text[:start] + REDUNDANT_MARKER + text[end:]
+            texts[i] = text
+            dropped += len(spans)
+    return dropped
+
+
+def pack_notes(notes: List[Tuple[str, str, str]], budget: int,
+               ) -> Tuple[List[Tuple[str, str]], Dict]:
+    """Fit notes into `budget` tokens.
+
+    notes: (label, kind, text) in prompt order; kind is one of
+    NOTE_PRIORITY. Returns ([(label, text)] in prompt order, without the
+    notes that had to be dropped) and packing stats.
+    """
+    texts = [text for _, _, text in notes]
+    counts = [count_tokens(t) for t in texts]
+    input_tokens = sum(counts)
+    stats = {"tokenizer": TOKENIZER, "budget_tokens": budget,
+             "input_tokens": input_tokens, "packed_tokens": input_tokens,
+             "dropped_tokens": 0, "sections_dropped": 0,
+             "notes_trimmed": 0, "notes_dropped": 0}
+    if input_tokens <= budget:
+        return [(label, text) for label, _, text in notes], stats
+
+    # Highest priority first; within a kind, prompt order
+    order = sorted(range(len(notes)), key=lambda i: (_priority(notes[i][1]), i))
+
+    stats["sections_dropped"] = _drop_redundant_sections(texts, order)
+    if stats["sections_dropped"]:
+        counts = [count_tokens(t) for t in texts]
+
+    keep = [True] * len(notes)
+    trimmed = set()
+    # Trim lowest priority first, down to the floor; then drop whole notes
+    # (never the first — the discharge summary); then trim what's left.
+    for floor in (MIN_NOTE_TOKENS, None, 0):
+        for i in reversed(order):
+            excess = sum(c for c, k in zip(counts, keep) if k) - budget
+            if excess <= 0:
+                break
+            if not keep[i]:
+                continue
+            if floor is None:
+                if i != order[0]:
+                    keep[i] = False
+                continue
+            target = max(counts[i] - excess, floor)
+            if target < counts[i]:
+                texts[i] = trim_to_tokens(texts[i], target)
+                counts[i] = count_tokens(texts[i])
+                trimmed.add(i)
+
+    packed_tokens = sum(c for c, k in zip(counts, keep) if k)
+    stats.update(packed_tokens=packed_tokens,
+                 dropped_tokens=input_tokens - packed_tokens,
+                 notes_trimmed=len(trimmed - {i for i, k in enumerate(keep) if not k}),
+                 notes_dropped=keep.count(False))
+    return [(label, texts[i]) for i, (label, _, _) in enumerate(notes) if keep[i]], stats
+
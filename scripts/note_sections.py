@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+note_sections.py — parse a clinical note's section layout once, reuse it everywhere.
+
+The per-header way to pull a section out of a note is a pattern of the form
+
+    <header>\\s*:?\\s*\\n(.*?)(?=\\n[A-Z][A-Za-z\\s/]{3,}:|$)      (DOTALL | IGNORECASE)
+
+run once for each header. The lazy DOTALL body re-evaluates the
+section-boundary lookahead at every character, and the lookahead itself
+runs `[A-Za-z\\s/]{3,}` (which includes newlines) to the end of each
+letter/space run before failing. On a 50 KB note with a long Hospital
+Course that is the single biggest regex cost in post-processing, and the
+documented-diagnosis extractor asks for 15 headers per note.
+
+NoteSections does the boundary work once, in one pass:
+
+    - BigQuery CSV exports flatten newlines to runs of 2+ spaces; those are
+      turned back into "\\n" exactly as the extractors always did.
+    - A section boundary is a "\\n" followed by a letter, at least three
+      more [A-Za-z\\s/] characters, then ":". Because ":" is not in that
+      class, the only ":" the lookahead can ever reach is the one right
+      after the maximal letter/space run — so one finditer over the runs
+      finds every boundary, with no backtracking.
+    - body_spans(header) finds each header (+ "\\s*:?\\s*\\n") with the
+      same non-overlapping scan as re.findall, and ends the body at the
+      next boundary via bisect. The spans are identical to the pattern
+      above's capture group (checked in bench_hotpaths.py).
+    - Header lookup itself is the next cost: an IGNORECASE search can't
+      use a literal prefix, so 15 headers would mean 15 slow full-text
+      scans. The header's leading literal word is located with str.find on
+      a lowercased copy and the full pattern is only tried there. Notes
+      containing İ, ı or ſ keep the plain search: those are the only
+      characters IGNORECASE matches to an ASCII letter that str.lower()
+      doesn't map to it (İ also lowers to two characters).
+
+index_note() caches the parsed index per note (LRU on the note text), so
+the engine's documented-diagnosis extractor, the legacy predictor's
+extractor, the note packer and the pathology scanner share one parse per
+note per process.
+"""
+
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Callable, Dict, List, Pattern, Tuple
+
+
+# Runs of 2+ spaces are flattened newlines from BigQuery CSV exports
+_FLATTENED_NEWLINES_RE = re.compile(r'  +')
+
+# Character classes of the boundary lookahead. The original pattern ran
+# them under IGNORECASE, which also admits İ, ı, ſ and the Kelvin sign;
+# spelling those out gives the same classes without per-character folding.
+_BOUNDARY_RUN_RE = re.compile('[A-Za-z\\s/\u0130\u0131\u017f\u212a]+')
+_BOUNDARY_FIRST_RE = re.compile('[A-Za-z\u0130\u0131\u017f\u212a]')
+
+# What separates a header from its body: optional colon, then a newline
+_HEADER_TAIL = r'\s*:?\s*\n'
+
+# Characters that defeat the lowercased-literal prefilter (see above)
+_FOLD_UNSAFE_RE = re.compile('[\u0130\u0131\u017f]')
+
+# Leading literal of a header regex (letters up to the first metacharacter
+# or escape), used to find candidate positions with str.find
+_HEADER_LITERAL_RE = re.compile(r'[A-Za-z]+')
+
+# Generic "Header Name:" line, used only for the sections() overview
+_HEADER_LABEL_RE = re.compile(r'([A-Za-z][A-Za-z\s/]{3,}):', re.IGNORECASE)
+
+
+def flatten_newlines(text: str) -> str:
+    """Undo BigQuery's newline → double-space flattening."""
+    return _FLATTENED_NEWLINES_RE.sub('\n', text)
+
+
+class NoteSections:
+    """Section index over one note.
+
+    Attributes:
+        raw: the note as given
+        text: the note with flattened newlines restored (what the
+            section-based extractors parse)
+        boundaries: sorted offsets in `text` of every section-boundary "\\n"
+    """
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.text = flatten_newlines(raw)
+        self.boundaries = self._find_boundaries(self.text)
+        self._lower = (None if _FOLD_UNSAFE_RE.search(self.text)
+                       else self.text.lower())
+        self._spans: Dict[str, List[Tuple[int, int]]] = {}
+        self._memo: Dict[str, object] = {}
+
+    @staticmethod
+    def _find_boundaries(text: str) -> List[int]:
+        boundaries = []
+        for run in _BOUNDARY_RUN_RE.finditer(text):
+            end = run.end()
+            if end >= len(text) or text[end] != ':':
+                continue
+            # Every "\n" inside the run that is followed by a letter and
+            # 3+ more run characters before the ":" is a boundary.
+            pos = text.find('\n', run.start(), end)
+            while pos != -1:
+                first = pos + 1
+                if end - first >= 4 and _BOUNDARY_FIRST_RE.match(text, first):
+                    boundaries.append(pos)
+                pos = text.find('\n', first, end)
+        return boundaries
+
+    def section_end(self, start: int) -> int:
+        """Where a section body starting at `start` ends.
+
+        The first boundary at or after `start`, else end of text — where a
+        trailing "\\n" counts as the end, as `$` does without MULTILINE.
+        """
+        i = bisect_left(self.boundaries, start)
+        end = len(self.text)
+        if self.text.endswith('\n') and start <= end - 1:
+            end -= 1
+        if i < len(self.boundaries):
+            end = min(end, self.boundaries[i])
+        return end
+
+    def body_spans(self, header: str) -> List[Tuple[int, int]]:
+        """(start, end) of every body under `header` (a regex, IGNORECASE).
+
+        Same matches, in the same order, as
+        re.findall(header + r'\\s*:?\\s*\\n(.*?)(?=\\n[A-Z][A-Za-z\\s/]{3,}:|$)',
+                   text, re.DOTALL | re.IGNORECASE).
+        """
+        spans = self._spans.get(header)
+        if spans is None:
+            pattern, literal = _compile_header(header)
+            spans = []
+            pos = 0
+            while True:
+                m = self._find_header(pattern, literal, pos)
+                if m is None:
+                    break
+                start = m.end()
+                end = self.section_end(start)
+                spans.append((start, end))
+                # Like findall: resume after the whole match. An empty
+                # match can't happen — the header and "\n" are required.
+                pos = end
+            self._spans[header] = spans
+        return spans
+
+    def _find_header(self, pattern: Pattern, literal: str, pos: int):
+        """pattern.search(self.text, pos), skipping ahead by literal prefix."""
+        if self._lower is None or not literal:
+            return pattern.search(self.text, pos)
+        find = self._lower.find
+        while True:
+            pos = find(literal, pos)
+            if pos == -1:
+                return None
+            m = pattern.match(self.text, pos)
+            if m is not None:
+                return m
+            pos += 1
+
+    def bodies(self, header: str) -> List[str]:
+        return [self.text[s:e] for s, e in self.body_spans(header)]
+
+    def sections(self) -> List[Tuple[str, int, int]]:
+        """(header label, body start, body end) for every boundary header.
+
+        An overview of the note's "Header:" layout, e.g. for choosing which
+        sections to keep when a prompt has to be trimmed.
+        """
+        out = []
+        for b in self.boundaries:
+            m = _HEADER_LABEL_RE.match(self.text, b + 1)
+            if m is None:
+                continue
+            label = ' '.join(m.group(1).split())
+            out.append((label, m.end(), self.section_end(m.end())))
+        return out
+
+    def memo(self, key: str, compute: Callable[[], object]):
+        """Per-note memo for derived results (e.g. pathology segments)."""
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+
+@lru_cache(maxsize=64)
+def _compile_header(header: str) -> Tuple[Pattern, str]:
+    """(compiled header pattern, lowercased leading literal or "")."""
+    pattern = re.compile(header + _HEADER_TAIL, re.IGNORECASE)
+    m = _HEADER_LITERAL_RE.match(header)
+    if m is None or '|' in header:
+        return pattern, ""
+    literal = m.group(0)
+    if header[m.end():m.end() + 1] in ('?', '*', '+', '{'):
+        literal = literal[:-1]          # "Problems?" — the "s" is optional
+    return pattern, literal.lower()
+
+
+@lru_cache(maxsize=256)
+def index_note(text: str) -> NoteSections:
+    """Return the (cached) section index for a note."""
+    return NoteSections(text)
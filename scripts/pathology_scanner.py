@@ -35,10 +35,11 @@ import json
 import re
 import sys
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 sys.path.insert(0, str(Path(__file__).parent))
-from cdi_engine import _call_llm  # noqa: E402  (sibling import after path setup)
+from cdi_engine import _call_llm, _call_llm_async  # noqa: E402  (sibling import after path setup)
+from note_sections import index_note  # noqa: E402
 
 
 # ===========================================================================
@@ -91,7 +92,14 @@ def detect_pathology_segments(text: str, window: int = 2000) -> List[str]:
     """
     if not text or not isinstance(text, str):
         return []
+    # The same note is often scanned again (hill-climb variants, re-runs in
+    # one process); the section index memoises the result per note, as a
+    # tuple, and each caller gets its own list.
+    return list(index_note(text).memo(f"pathology_segments:{window}",
+                                      lambda: _detect_pathology_segments(text, window)))
 
+
+def _detect_pathology_segments(text: str, window: int) -> Tuple[str, ...]:
     hits = []
     for m in PATH_HEADER_RE.finditer(text):
         start = max(0, m.start() - 200)  # small lead-in for context
@@ -99,7 +107,7 @@ def detect_pathology_segments(text: str, window: int = 2000) -> List[str]:
         hits.append((start, end))
 
     if not hits:
-        return []
+        return ()
 
     # Merge overlapping windows
     hits.sort()
@@ -116,7 +124,7 @@ def detect_pathology_segments(text: str, window: int = 2000) -> List[str]:
         seg = text[s:e]
         if PATH_DX_RE.search(seg):
             kept.append(seg)
-    return kept
+    return tuple(kept)
 
 
 # ===========================================================================
@@ -195,6 +203,52 @@ def scan_for_pathology_gaps(
         scan_called: bool — was the LLM invoked?
         skip_reason: str if scan was skipped
     """
+    scan = _prepare_scan(discharge_summary, documented_diagnoses, procedure_notes,
+                         consult_notes, progress_notes, ip_consult_note, hp_note,
+                         ed_note, max_segments)
+    if "msgs" not in scan:
+        return scan
+    try:
+        raw = _call_llm(scan["msgs"], api_key, model=model, max_tokens=4000)
+    except Exception as e:
+        return _scan_failed(scan, e)
+    return _scan_result(scan, raw)
+
+
+async def scan_for_pathology_gaps_async(
+    discharge_summary: str,
+    api_key: str,
+    documented_diagnoses: List[str],
+    procedure_notes: Optional[List[str]] = None,
+    consult_notes: Optional[List[str]] = None,
+    progress_notes: Optional[List[str]] = None,
+    ip_consult_note: Optional[str] = None,
+    hp_note: Optional[str] = None,
+    ed_note: Optional[str] = None,
+    model: str = "gpt-5-4",
+    max_segments: int = 6,
+) -> Dict:
+    """scan_for_pathology_gaps for asyncio callers (CDIEngine.analyse)."""
+    scan = _prepare_scan(discharge_summary, documented_diagnoses, procedure_notes,
+                         consult_notes, progress_notes, ip_consult_note, hp_note,
+                         ed_note, max_segments)
+    if "msgs" not in scan:
+        return scan
+    try:
+        raw = await _call_llm_async(scan["msgs"], api_key, model=model, max_tokens=4000)
+    except Exception as e:
+        return _scan_failed(scan, e)
+    return _scan_result(scan, raw)
+
+
+def _prepare_scan(discharge_summary, documented_diagnoses, procedure_notes,
+                  consult_notes, progress_notes, ip_consult_note, hp_note,
+                  ed_note, max_segments) -> Dict:
+    """Find the segments and build the scan prompt.
+
+    Returns the final result dict if there is nothing to scan, else
+    {"msgs", "segments_found", "notes_with_pathology"}.
+    """
     # Gather all candidate text with provenance labels. Ordered by yield from
     # the 1086-case dataset survey (11 May 2026): hp_note had the most
     # pathology segments (36/82), discharge_summary second (17), etc.
@@ -241,18 +295,21 @@ def scan_for_pathology_gaps(
         {"role": "system", "content": PATH_SCAN_SYSTEM},
         {"role": "user", "content": user},
     ]
+    return {"msgs": msgs, "segments_found": len(all_segments),
+            "notes_with_pathology": notes_with_path}
+
+
+def _scan_failed(scan: Dict, error: Exception) -> Dict:
+    return {
+        "gaps": [],
+        "segments_found": scan["segments_found"],
+        "notes_with_pathology": scan["notes_with_pathology"],
+        "scan_called": False,
+        "skip_reason": f"LLM call failed: {error}",
+    }
 
-    try:
-        raw = _call_llm(msgs, api_key, model=model, max_tokens=4000)
-    except Exception as e:
-        return {
-            "gaps": [],
-            "segments_found": len(all_segments),
-            "notes_with_pathology": notes_with_path,
-            "scan_called": False,
-            "skip_reason": f"LLM call failed: {e}",
-        }
 
+def _scan_result(scan: Dict, raw: str) -> Dict:
     gaps = _parse_json_array(raw)
     # Tag each gap as coming from the pathology scan so downstream merging
     # can dedupe against the main engine output.
@@ -265,8 +322,8 @@ def scan_for_pathology_gaps(
 
     return {
         "gaps": gaps,
-        "segments_found": len(all_segments),
-        "notes_with_pathology": notes_with_path,
+        "segments_found": scan["segments_found"],
+        "notes_with_pathology": scan["notes_with_pathology"],
         "scan_called": True,
         "skip_reason": None,
     }
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+pattern_classifier.py — priority keyword classification in one regex pass.
+
+classify_drg_impact (MCC_PATTERNS, then CC_PATTERNS) and the evaluator's
+categorize_diagnosis (DIAGNOSIS_CATEGORIES, in dict order) both answer the
+same question: "which is the first tier with a keyword that occurs in this
+string?" The question is asked for every prediction and every
+ground-truth label in every run.
+
+KeywordClassifier compiles all keywords of all tiers, once, into a single
+prefix-factored regex (a trie written as nested alternations, so the regex
+engine does one character comparison per trie edge, not per keyword) and
+scans the string once:
+
+    - At each position the regex reports the longest keyword starting
+      there. Every keyword contained in that match (prefixes included) is
+      known in advance, so each keyword maps to the best tier among all
+      keywords inside it.
+    - The scan resumes just before the match end, far enough back to catch
+      a keyword that starts inside the match and runs past it (the longest
+      suffix/prefix overlap between keywords, computed at build time).
+    - The best tier seen wins; tier 0 stops the scan early.
+
+Same answer as the substring loops for every input (keywords are plain
+substrings — no word boundaries, exactly like `kw in text`).
+
+Usage:
+    DRG = KeywordClassifier([("MCC", MCC_PATTERNS), ("CC", CC_PATTERNS)],
+                            default="non-CC")
+    DRG.classify("acute on chronic systolic heart failure")   # -> "MCC"
+"""
+
+import re
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+
+def _trie_regex(words: Iterable[str]) -> str:
+    """Regex matching any of `words`, factored by common prefix.
+
+    Greedy at every node, so at a given start position it matches the
+    longest word that occurs there.
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def emit(node: dict) -> str:
+        branches = [re.escape(ch) + emit(child)
+                    for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        ends_here = '' in node
+        if len(branches) == 1 and not ends_here:
+            return branches[0]
+        group = '(?:' + '|'.join(branches) + ')'
+        return group + '?' if ends_here else group
+
+    return emit(trie)
+
+
+def _max_overlap(words: Sequence[str]) -> int:
+    """Longest proper suffix of one word that is a proper prefix of another."""
+    prefixes = {w[:n] for w in words for n in range(1, len(w))}
+    best = 0
+    for w in words:
+        for n in range(len(w) - 1, best, -1):
+            if w[-n:] in prefixes:
+                best = n
+                break
+    return best
+
+
+class KeywordClassifier:
+    """First tier (in the given order) with a keyword occurring in the text.
+
+    Args:
+        tiers: (label, keywords) pairs, highest priority first. Keywords
+            are matched as plain, case-sensitive substrings — callers
+            lowercase the text as they did before.
+        default: label returned when no keyword occurs.
+
+    Built from the tables as they are at construction time; a table edited
+    afterwards needs a new classifier.
+    """
+
+    def __init__(self, tiers: Sequence[Tuple[str, Iterable[str]]], default: str):
+        self.labels: List[str] = [label for label, _ in tiers]
+        self.default = default
+
+        rank: Dict[str, int] = {}
+        for i, (_, keywords) in enumerate(tiers):
+            for kw in keywords:
+                if not kw:
+                    raise ValueError(f"empty keyword in tier {self.labels[i]!r}")
+                rank.setdefault(kw, i)
+
+        # Best tier among all keywords contained in each keyword
+        self._best: Dict[str, int] = {
+            kw: min(r for other, r in rank.items() if other in kw) for kw in rank
+        }
+        self._search = re.compile(_trie_regex(rank)).search if rank else None
+        self._overlap = _max_overlap(list(rank))
+
+    def rank(self, text: str) -> int:
+        """Index of the winning tier, or len(labels) if none matches."""
+        top = len(self.labels)
+        if self._search is None:
+            return top
+        best, overlap, search = self._best, self._overlap, self._search
+        pos = 0
+        while True:
+            m = search(text, pos)
+            if m is None:
+                return top
+            r = best[m.group()]
+            if r < top:
+                top = r
+                if r == 0:
+                    return 0
+            pos = max(m.start() + 1, m.end() - overlap)
+
+    def classify(self, text: str) -> str:
+        r = self.rank(text)
+        return self.labels[r] if r < len(self.labels) else self.default
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+prompt_cache.py — provider prompt caching: Bedrock breakpoints + usage tally.
+
+Every prediction request starts with the same instructions: the system
+prompt, the variant's user_prefix (CDIEngine) or AGENT_SYSTEM_PROMPT plus
+the report_diagnoses tool (CDIAgentRunner), several thousand tokens in
+all. After that come the case's notes, which are themselves resent by
+every voting pass, by both passes of two-pass verify and on every turn of
+the agent loop.
+
+Both providers can skip re-ingesting a prefix they have seen recently:
+
+    Azure OpenAI   automatic for prompts ≥1024 tokens; the request only
+                   has to start with the same bytes. The prompts are laid
+                   out static-first (instructions, then notes) so this
+                   applies; the response reports
+                   usage.prompt_tokens_details.cached_tokens.
+    Bedrock Claude only up to explicit `cache_control` breakpoints.
+                   bedrock_system() / bedrock_user_content() add them
+                   after the system prompt, after the static instructions
+                   and after the notes; the response reports
+                   usage.cache_read_input_tokens /
+                   cache_creation_input_tokens.
+
+Cached tokens are billed at a fraction of the input rate, and a cache hit
+also cuts time-to-first-token. UsageTally adds up what the responses
+report, so the saving can be measured: gateway_client.post_json records
+every response into the process-wide tally (usage_stats(), printed in the
+evaluator summary) and into the tally of the current `track_usage()`
+block (CDIEngine.analyse puts it in result["metadata"]["token_usage"]).
+
+Breakpoints are on by default — they never change the model's output.
+Set CDI_BEDROCK_PROMPT_CACHE=off if a gateway rejects `cache_control`.
+"""
+
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+BEDROCK_PROMPT_CACHE = os.environ.get("CDI_BEDROCK_PROMPT_CACHE", "on").lower() not in (
+    "0", "off", "false", "no")
+
+
+# ===========================================================================
+# BEDROCK BREAKPOINTS
+# ===========================================================================
+
+def _text_block(text: str, cached: bool) -> dict:
+    block = {"type": "text", "text": text}
+    if cached and BEDROCK_PROMPT_CACHE:
+        block["cache_control"] = CACHE_CONTROL
+    return block
+
+
+def bedrock_system(system_text: str):
+    """Bedrock `system` field with a breakpoint after the system prompt.
+
+    Returned as a plain string when caching is off, so the request body is
+    byte-identical to what was sent before.
+    """
+    if not BEDROCK_PROMPT_CACHE:
+        return system_text
+    return [_text_block(system_text, cached=True)]
+
+
+def bedrock_user_content(text: str, static_prefix: Optional[str] = None):
+    """Content of a user message, with breakpoints after the static
+    instructions (`static_prefix`, if the text starts with it) and at the
+    end (after the notes).
+
+    The prefix breakpoint is shared by every case; the end breakpoint by
+    the other passes / turns of the same case.
+    """
+    if not BEDROCK_PROMPT_CACHE:
+        return text
+    if static_prefix and len(static_prefix) < len(text) and text.startswith(static_prefix):
+        return [_text_block(static_prefix, cached=True),
+                _text_block(text[len(static_prefix):], cached=True)]
+    return [_text_block(text, cached=True)]
+
+
+# ===========================================================================
+# USAGE TALLY
+# ===========================================================================
+
+class UsageTally:
+    """Thread-safe running total of token usage across responses."""
+
+    FIELDS = ("calls", "input_tokens", "cached_input_tokens",
+              "cache_write_tokens", "output_tokens")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = dict.fromkeys(self.FIELDS, 0)
+
+    def record(self, data: dict) -> None:
+        """Add one response's usage (Azure or Bedrock shape)."""
+        usage = data.get("usage") or {}
+        if "prompt_tokens" in usage:
+            # Azure: cached tokens are included in prompt_tokens
+            details = usage.get("prompt_tokens_details") or {}
+            counts = (usage.get("prompt_tokens", 0), details.get("cached_tokens", 0),
+                      0, usage.get("completion_tokens", 0))
+        else:
+            # Bedrock: input_tokens excludes cache reads and writes
+            read = usage.get("cache_read_input_tokens", 0)
+            write = usage.get("cache_creation_input_tokens", 0)
+            counts = (usage.get("input_tokens", 0) + read + write, read,
+                      write, usage.get("output_tokens", 0))
+        with self._lock:
+            self._totals["calls"] += 1
+            for field, n in zip(self.FIELDS[1:], counts):
+                self._totals[field] += n or 0
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            out = dict(self._totals)
+        out["cached_share"] = (round(out["cached_input_tokens"] / out["input_tokens"], 3)
+                               if out["input_tokens"] else 0.0)
+        return out
+
+
+_process_tally = UsageTally()
+_current: contextvars.ContextVar[Optional[List[UsageTally]]] = contextvars.ContextVar(
+    "cdi_usage_tally", default=None)
+
+
+def record_usage(data: dict) -> None:
+    """Record a response into the process-wide tally and any active
+    track_usage() blocks."""
+    _process_tally.record(data)
+    for tally in _current.get() or ():
+        tally.record(data)
+
+
+@contextmanager
+def track_usage() -> Iterator[UsageTally]:
+    """Tally the usage of every response received inside this block.
+
+    asyncio tasks inherit the block (CDIEngine's voting passes are counted),
+    but context variables don't follow work onto pool threads by themselves —
+    submit with contextvars.copy_context().run to have those calls counted.
+    """
+    tally = UsageTally()
+    token = _current.set((_current.get() or []) + [tally])
+    try:
+        yield tally
+    finally:
+        _current.reset(token)
+
+
+def usage_stats() -> Dict[str, float]:
+    """Process-wide usage totals, for run summaries."""
+    return _process_tally.snapshot()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+rate_limiter.py — adaptive, process-wide request pacing for the AI Hub gateway.
+
+Every gateway_client request, sync or async, asks this module for a slot
+first, so concurrent voting passes and --workers runs share one view of
+the gateway's limits instead of each backing off on its own.
+
+This module keeps one governor per deployment (Azure deployment URL or
+Bedrock model), each with two token buckets — requests per minute and
+tokens per minute — and paces calls to just under the limit:
+
+    - Limits are learned, not configured. Azure / APIM responses carry
+      x-ratelimit-limit-* / x-ratelimit-remaining-* headers; when present
+      they set the bucket rates (at SAFETY_FACTOR of the limit) and clamp
+      the bucket level to what the gateway says is left.
+    - A 429 pauses every caller using that deployment until Retry-After
+      (or retry-after-ms) has passed, instead of each one backing off
+      independently. If the gateway never told us the limit, the request
+      rate is cut to DECREASE_FACTOR of what we were actually sending.
+    - While no limit is known and calls succeed, the request rate creeps
+      back up (additive increase), so a transient 429 doesn't slow a
+      long run forever.
+
+acquire() sleeps the calling thread until its slot; acquire_async() books
+the same slot under the same lock and sleeps only the awaiting task, so
+threads and asyncio tasks share one budget.
+
+Unknown limits start unpaced — the first 429 (or the first response with
+rate-limit headers) is what turns pacing on. Seed values can be supplied
+via CDI_GATEWAY_RPM / CDI_GATEWAY_TPM to start paced.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Mapping, Optional
+
+
+SAFETY_FACTOR = 0.9       # pace at 90% of a header-advertised limit
+DECREASE_FACTOR = 0.7     # multiplicative decrease on 429 with unknown limit
+INCREASE_PER_SUCCESS = 0.5  # RPM added per clean call while limit is unknown
+INCREASE_QUIET_SECONDS = 30.0  # ...but only once this long has passed since the last 429
+MIN_RPM = 1.0
+RATE_WINDOW = 10.0        # seconds of send history used to measure our own rate
+BURST_SECONDS = 1.0       # bucket capacity, in seconds of sustained rate
+DEFAULT_429_PAUSE = 5.0   # used when a 429 has no Retry-After header
+
+
+class TokenBucket:
+    """Debt-based token bucket.
+
+    `reserve` always succeeds immediately and returns how long the caller
+    must wait before sending; callers that arrive while the bucket is in
+    debt queue up behind each other in arrival order. rate=None means
+    unlimited.
+    """
+
+    def __init__(self, rate_per_min: Optional[float] = None):
+        self.rate_per_min = rate_per_min
+        self.level = self.capacity
+        self._last = time.monotonic()
+
+    @property
+    def capacity(self) -> float:
+        if not self.rate_per_min:
+            return 0.0
+        return max(1.0, self.rate_per_min / 60.0 * BURST_SECONDS)
+
+    def set_rate(self, rate_per_min: Optional[float]) -> None:
+        self._refill(time.monotonic())
+        was_unlimited = not self.rate_per_min
+        self.rate_per_min = rate_per_min
+        if was_unlimited:
+            self.level = self.capacity
+        else:
+            self.level = min(self.level, self.capacity)
+
+    def _refill(self, now: float) -> None:
+        if self.rate_per_min:
+            self.level = min(self.capacity,
+                             self.level + (now - self._last) * self.rate_per_min / 60.0)
+        self._last = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        if not self.rate_per_min:
+            return 0.0
+        self._refill(now)
+        self.level -= amount
+        if self.level >= 0:
+            return 0.0
+        return -self.level / (self.rate_per_min / 60.0)
+
+    def pause_until(self, t: float) -> None:
+        """Empty the bucket and start refilling only at monotonic time `t`.
+
+        Without this, the bucket refills during a Retry-After pause and every
+        waiting thread is released in one burst the moment the pause ends —
+        which is exactly what triggers the next 429. With `_last` in the
+        future, _refill() goes negative until `t`, so reservations made during
+        the pause are spaced out at `rate` starting from `t`.
+        """
+        self.level = min(self.level, 0.0)
+        self._last = max(self._last, t)
+
+    def clamp(self, available: float) -> None:
+        """Never believe we have more than the gateway says is left."""
+        if self.rate_per_min:
+            self.level = min(self.level, available)
+
+
+def _header(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    ms = _header(headers, "retry-after-ms") or _header(headers, "x-ms-retry-after-ms")
+    if ms is not None:
+        return ms / 1000.0
+    # Retry-After may also be an HTTP date; the gateway sends seconds, and
+    # anything unparseable falls back to DEFAULT_429_PAUSE.
+    return _header(headers, "retry-after")
+
+
+class ModelGovernor:
+    """Request + token pacing for one deployment."""
+
+    def __init__(self, key: str, rpm: Optional[float] = None,
+                 tpm: Optional[float] = None):
+        self.key = key
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.rpm_from_headers = False
+        self.blocked_until = 0.0
+        self.last_throttled = float("-inf")
+        self.stats = {"requests": 0, "throttled": 0, "server_errors": 0,
+                      "waited_seconds": 0.0}
+        self._sent = deque()  # monotonic send times, last RATE_WINDOW s
+        self._lock = threading.Lock()
+
+    def acquire(self, est_tokens: int = 0) -> float:
+        """Block until a request of ~est_tokens may be sent. Returns seconds waited."""
+        wait = self._reserve(est_tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, est_tokens: int = 0) -> float:
+        """acquire() for asyncio callers: the task sleeps, not the thread."""
+        wait = self._reserve(est_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def _reserve(self, est_tokens: int) -> float:
+        """Book a slot for one request; seconds until it may be sent."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            wait = max(wait, self.requests.reserve(1, now))
+            wait = max(wait, self.tokens.reserve(est_tokens, now))
+            self._sent.append(now + wait)
+            self.stats["requests"] += 1
+            self.stats["waited_seconds"] += wait
+        return wait
+
+    def _observed_rpm(self, now: float) -> float:
+        """Our own recent send rate, scaled to per-minute."""
+        while self._sent and self._sent[0] < now - RATE_WINDOW:
+            self._sent.popleft()
+        if not self._sent:
+            return MIN_RPM
+        span = max(1.0, now - self._sent[0])
+        return len(self._sent) / span * 60.0
+
+    def settle(self, est_tokens: int, used_tokens: Optional[int]) -> None:
+        """Correct the TPM bucket once the response reports actual usage."""
+        if used_tokens is None:
+            return
+        with self._lock:
+            if self.tokens.rate_per_min:
+                self.tokens.level -= (used_tokens - est_tokens)
+
+    def observe(self, status_code: int, headers: Mapping[str, str]) -> None:
+        """Learn from a gateway response (any status)."""
+        with self._lock:
+            now = time.monotonic()
+
+            limit_req = _header(headers, "x-ratelimit-limit-requests")
+            limit_tok = _header(headers, "x-ratelimit-limit-tokens")
+            if limit_req:
+                self.requests.set_rate(max(MIN_RPM, limit_req * SAFETY_FACTOR))
+                self.rpm_from_headers = True
+            if limit_tok:
+                self.tokens.set_rate(limit_tok * SAFETY_FACTOR)
+
+            remaining_req = _header(headers, "x-ratelimit-remaining-requests")
+            remaining_tok = _header(headers, "x-ratelimit-remaining-tokens")
+            if remaining_req is not None:
+                self.requests.clamp(remaining_req)
+            if remaining_tok is not None:
+                self.tokens.clamp(remaining_tok)
+
+            if status_code == 429:
+                self.stats["throttled"] += 1
+                pause = _retry_after_seconds(headers) or DEFAULT_429_PAUSE
+                # A burst of concurrent calls produces a burst of 429s; only
+                # the first one of a pause period cuts the rate.
+                first_of_burst = now >= self.blocked_until
+                self.last_throttled = now
+                self.blocked_until = max(self.blocked_until, now + pause)
+                if first_of_burst and not self.rpm_from_headers:
+                    current = self.requests.rate_per_min or self._observed_rpm(now)
+                    self.requests.set_rate(max(MIN_RPM, current * DECREASE_FACTOR))
+                self.requests.pause_until(self.blocked_until)
+            elif status_code == 200 and not self.rpm_from_headers \
+                    and self.requests.rate_per_min \
+                    and now - self.last_throttled > INCREASE_QUIET_SECONDS:
+                self.requests.set_rate(self.requests.rate_per_min + INCREASE_PER_SUCCESS)
+
+    def backoff(self, seconds: float) -> None:
+        """Pause this deployment (after a 5xx or timeout) without changing its rate."""
+        with self._lock:
+            self.stats["server_errors"] += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "rpm": self.requests.rate_per_min,
+                "tpm": self.tokens.rate_per_min,
+            }
+
+
+# ===========================================================================
+# PROCESS-WIDE REGISTRY
+# ===========================================================================
+
+_governors: Dict[str, ModelGovernor] = {}
+_registry_lock = threading.Lock()
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+def get_governor(key: str) -> ModelGovernor:
+    """Return the governor for a deployment, creating it on first use."""
+    gov = _governors.get(key)
+    if gov is None:
+        with _registry_lock:
+            gov = _governors.get(key)
+            if gov is None:
+                gov = ModelGovernor(key, rpm=_env_float("CDI_GATEWAY_RPM"),
+                                    tpm=_env_float("CDI_GATEWAY_TPM"))
+                _governors[key] = gov
+    return gov
+
+
+def governor_stats() -> Dict[str, Dict]:
+    """Per-deployment pacing stats, for run summaries."""
+    with _registry_lock:
+        items = list(_governors.items())
+    return {key: gov.snapshot() for key, gov in items}
+
+
+def estimate_tokens(payload: str, completion_budget: int = 0) -> int:
+    """Rough prompt-token estimate (~4 chars/token) plus the output budget.
+
+    Azure counts max_tokens / max_completion_tokens against TPM up front,
+    so the budget belongs in the estimate.
+    """
+    return len(payload) // 4 + completion_budget
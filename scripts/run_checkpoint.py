@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+run_checkpoint.py — append-only, per-run checkpoints with resume by case id.
+
+evaluate_cdi_accuracy, llm_precision_judge and HillClimbRunner all run
+for hours over hundreds of cases and checkpoint through RunCheckpoint:
+
+    - One directory per run configuration, <root>/<name>-<config hash>/.
+      The hash covers whatever decides the results (model, mode, flags,
+      prompts, dataset content via file_hash); config.json beside the log
+      records what it was. Runs with different settings therefore never
+      resume from each other's results.
+    - results.jsonl is append-only: one {"id", "record"} line per finished
+      case, flushed and fsynced before append() returns. A crash loses at
+      most the line being written; a torn final line is skipped on load.
+    - On resume the log is loaded into a dict keyed by case id, so
+      `case_id in checkpoint` is O(1) per row and doesn't depend on row
+      order. When an id appears twice, the later line wins.
+    - resume=False (--fresh in the evaluator and hill-climb runner; the
+      judge's default unless --resume) deletes the log for the same
+      configuration and starts over; discard() removes the directory once
+      the run's own output is saved.
+
+Root: $CDI_CHECKPOINT_DIR, default ~/.cache/cdi_llm/checkpoints. Records
+hold predictions and evidence quotes — PHI, like the LLM cache.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+DEFAULT_ROOT = Path.home() / ".cache" / "cdi_llm" / "checkpoints"
+
+
+def config_hash(config: Dict) -> str:
+    payload = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def file_hash(path) -> Optional[str]:
+    """sha256 of a file's content, for a config's dataset identity (an
+    edited file of the same size is a different dataset). None if missing."""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RunCheckpoint:
+    """Append-only JSONL log of the finished cases of one run configuration.
+
+    resume=False starts over: an existing log for the same configuration
+    is deleted.
+    """
+
+    def __init__(self, name: str, config: Dict, root: Optional[Path] = None,
+                 resume: bool = True):
+        root = Path(root or os.environ.get("CDI_CHECKPOINT_DIR") or DEFAULT_ROOT)
+        self.config = config
+        self.dir = root / f"{name}-{config_hash(config)}"
+        self.path = self.dir / "results.jsonl"
+        self._lock = threading.Lock()
+        self._file = None
+        self._records: Dict[str, Dict] = {}
+        if not resume:
+            shutil.rmtree(self.dir, ignore_errors=True)
+        self._load()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        config_path = self.dir / "config.json"
+        if not config_path.exists():
+            config_path.write_text(json.dumps(config, indent=2, sort_keys=True, default=str))
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue            # torn final line from an interrupted run
+                self._records[entry["id"]] = entry["record"]
+
+    def __contains__(self, case_id) -> bool:
+        return str(case_id) in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, case_id, default=None):
+        return self._records.get(str(case_id), default)
+
+    def records(self) -> List[Dict]:
+        """Every finished record, in the order first written."""
+        return list(self._records.values())
+
+    def append(self, case_id, record: Dict) -> None:
+        """Record a finished case; durable on disk when this returns."""
+        line = json.dumps({"id": str(case_id), "record": record}, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a+b")
+                if self._file.tell():
+                    # End a torn final line before appending after it
+                    self._file.seek(-1, os.SEEK_END)
+                    if self._file.read(1) != b"\n":
+                        self._file.write(b"\n")
+            self._file.write(line.encode("utf-8"))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._records[str(case_id)] = record
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def discard(self) -> None:
+        """Delete the checkpoint (the run finished and saved its output)."""
+        self.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
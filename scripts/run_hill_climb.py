@@ -7,9 +7,9 @@ them against ground truth. Designed to run for hours with full retry logic.
 
 Key differences from hill_climb_eval.py:
   - Actually applies prompt modifications to the LLM call (not just tracks config)
-  - Robust retry logic inherited from v1 predictor (5 retries, exponential backoff)
+  - Robust retry logic via the shared gateway_client (5 retries, exponential backoff)
   - Per-case error recovery — API failures skip case, don't crash iteration
-  - Checkpoint/resume after crashes
+  - Checkpoint/resume after crashes, per case (run_checkpoint.py)
   - Logs every case result for debugging
   - Runs until convergence (no improvement for N consecutive iterations)
 
@@ -21,15 +21,23 @@ import os
 import sys
 import json
 import re
-import time
 import random
 import traceback
-import requests
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).parent))
+from gateway_client import GatewayError, post_json  # noqa: E402  (sibling import after path setup)
+from llm_cache import (add_cache_args, cache_key, cached_llm_call,  # noqa: E402
+                       cached_llm_samples, configure_from_args)
+from batch_client import make_request, run_batch  # noqa: E402
+from diagnosis_matcher import DiagnosisMatcher  # noqa: E402
+from encounters import encounter_key  # noqa: E402
+from run_checkpoint import RunCheckpoint, config_hash, file_hash  # noqa: E402
+
 # ===========================================================================
 # STANFORD API CALLER (with robust retry)
 # ===========================================================================
@@ -50,16 +58,70 @@ API_ENDPOINTS = {
 }
 
 
-def call_llm(messages, api_key, model="gpt-5", temperature=0.2, max_tokens=16000):
+def call_llm(messages, api_key, model="gpt-5", temperature=0.2, max_tokens=16000,
+             sample=0):
     """Call Stanford LLM with robust retry logic via the AI Hub gateway.
     Auth header is "api-key" (NOT the old "Ocp-Apim-Subscription-Key").
+    Retry/backoff and the pooled connection live in gateway_client; with
+    --cache, identical requests (per `sample` index) are served from disk.
     """
     url = API_ENDPOINTS.get(model, API_ENDPOINTS["gpt-5"])
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": api_key,
-    }
+    request_body = build_request_body(messages, model, temperature)
+
+    def _fetch():
+        try:
+            data = post_json(url, request_body, api_key, read_timeout=180, verbose=True)
+        except GatewayError as e:
+            print(f"    {e}")
+            raise
+
+        content = data["choices"][0]["message"]["content"]
+
+        # Handle empty GPT-5 responses (reasoning consumed all tokens)
+        if content is None or content == "":
+            finish_reason = data["choices"][0].get("finish_reason", "unknown")
+            if finish_reason == "length":
+                raise RuntimeError("GPT-5 response truncated (finish_reason=length) — reasoning consumed all tokens")
+            elif finish_reason == "content_filter":
+                raise RuntimeError("GPT-5 response blocked by content filter")
+            return ""
+
+        return content
+
+    return cached_llm_call(model, messages, temperature, _token_budget(request_body),
+                           _fetch, sample=sample)
 
+
+def call_llm_samples(messages, api_key, model="gpt-5", temperature=0.7, num_samples=3):
+    """num_samples completions of one prompt from a single request (`n`).
+
+    Returns one text per sample, in order; each is cached under the key
+    call_llm(sample=i) would use, so the two paths share the cache. Empty
+    choices come back as "" (they vote for nothing).
+    """
+    url = API_ENDPOINTS.get(model, API_ENDPOINTS["gpt-5"])
+    request_body = build_request_body(messages, model, temperature)
+
+    def _fetch(n):
+        try:
+            data = post_json(url, dict(request_body, n=n), api_key,
+                             read_timeout=180, verbose=True)
+        except GatewayError as e:
+            print(f"    {e}")
+            raise
+        choices = sorted(data.get("choices", []), key=lambda c: c.get("index", 0))
+        if choices and all(not c["message"].get("content") and c.get("finish_reason") == "length"
+                           for c in choices):
+            raise RuntimeError("GPT-5 response truncated (finish_reason=length) — reasoning consumed all tokens")
+        contents = [c["message"].get("content") or "" for c in choices]
+        return (contents + [""] * n)[:n]
+
+    return cached_llm_samples(model, messages, temperature, _token_budget(request_body),
+                              list(range(num_samples)), _fetch)
+
+
+def build_request_body(messages, model="gpt-5", temperature=0.2):
+    """Chat-completions body for call_llm (also used for --batch job lines)."""
     # GPT-5 has specific API requirements — no custom temperature, uses max_completion_tokens
     # Match the working cdi_llm_predictor.py: ALL gpt-5 variants (including nano) use same format
     is_gpt5 = model.startswith("gpt-5")
@@ -73,66 +135,11 @@ def call_llm(messages, api_key, model="gpt-5", temperature=0.2, max_tokens=16000
     else:
         request_body["temperature"] = temperature
         request_body["max_tokens"] = 4000
+    return request_body
 
-    payload = json.dumps(request_body)
 
-    max_retries = 5
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, headers=headers, data=payload, timeout=180)
-
-            if response.status_code == 429 or response.status_code >= 500:
-                wait = 2 ** (attempt + 1) + random.random() * 2
-                print(f"    API {response.status_code}, retrying in {wait:.0f}s (attempt {attempt+1}/{max_retries})")
-                time.sleep(wait)
-                continue
-
-            if response.status_code != 200:
-                print(f"    API {response.status_code}: {response.text[:300]}")
-                # 400-level errors (except 429) are permanent — don't retry
-                if 400 <= response.status_code < 500 and response.status_code != 429:
-                    raise RuntimeError(f"API {response.status_code}: {response.text[:200]}")
-                # Other errors — retry
-                wait = 2 ** (attempt + 1)
-                if attempt < max_retries - 1:
-                    print(f"    Retrying in {wait}s (attempt {attempt+1}/{max_retries})")
-                    time.sleep(wait)
-                    continue
-                else:
-                    raise RuntimeError(f"API {response.status_code}: {response.text[:200]}")
-
-            data = response.json()
-            content = data["choices"][0]["message"]["content"]
-
-            # Handle empty GPT-5 responses (reasoning consumed all tokens)
-            if content is None or content == "":
-                finish_reason = data["choices"][0].get("finish_reason", "unknown")
-                if finish_reason == "length":
-                    raise RuntimeError("GPT-5 response truncated (finish_reason=length) — reasoning consumed all tokens")
-                elif finish_reason == "content_filter":
-                    raise RuntimeError("GPT-5 response blocked by content filter")
-                return ""
-
-            time.sleep(0.5)  # Rate limit buffer
-            return content
-
-        except requests.exceptions.Timeout:
-            wait = 2 ** (attempt + 1) + random.random() * 2
-            print(f"    Timeout, retrying in {wait:.0f}s (attempt {attempt+1}/{max_retries})")
-            time.sleep(wait)
-        except requests.exceptions.ConnectionError as e:
-            wait = 2 ** (attempt + 1) + random.random() * 2
-            print(f"    Connection error, retrying in {wait:.0f}s: {e}")
-            time.sleep(wait)
-        except requests.exceptions.RequestException as e:
-            if attempt < max_retries - 1:
-                wait = 2 ** (attempt + 1)
-                print(f"    Request error, retrying in {wait}s: {e}")
-                time.sleep(wait)
-            else:
-                raise
-
-    raise RuntimeError(f"API call failed after {max_retries} retries")
+def _token_budget(request_body):
+    return request_body.get("max_completion_tokens", request_body.get("max_tokens"))
 
 
 # ===========================================================================
@@ -875,76 +882,51 @@ def normalize_diagnosis(text: str) -> str:
     return text
 
 
-def diagnoses_match(predicted: str, ground_truth: str, threshold: float = 0.5) -> bool:
-    """Check if predicted diagnosis matches ground truth.
-    Ported from evaluate_cdi_accuracy.py which achieved 58.6% recall.
-    Uses fuzzy matching + comprehensive clinical equivalents dictionary.
-    """
-    pred = normalize_diagnosis(predicted)
-    truth = normalize_diagnosis(ground_truth)
-
-    # Exact match
-    if pred == truth:
-        return True
-
-    # Substring match (either direction)
-    if pred in truth or truth in pred:
-        return True
-
-    # Clinical equivalents — comprehensive dictionary matching evaluate_cdi_accuracy.py
-    clinical_equivalents = {
-        'pressure ulcer': ['decubitus ulcer', 'pressure injury', 'pressure sore', 'bed sore', 'stage 2', 'stage 3', 'stage 4'],
-        'malnutrition': ['protein calorie malnutrition', 'hypoalbuminemia', 'cachexia', 'underweight', 'severe malnutrition', 'moderate malnutrition', 'mild malnutrition', 'protein calorie'],
-        'sepsis': ['severe sepsis', 'septic shock', 'urosepsis', 'septicemia'],
-        'thrombocytopenia': ['pancytopenia', 'low platelets'],
-        'anemia': ['anaemia', 'blood loss anemia', 'acute blood loss anemia', 'iron deficiency anemia', 'chronic anemia', 'normocytic anemia', 'anemia of chronic disease'],
-        'respiratory failure': ['hypoxic respiratory failure', 'acute respiratory failure', 'hypoxia', 'hypercapnic', 'hypercapnia', 'respiratory distress'],
-        'heart failure': ['chf', 'congestive heart failure', 'systolic heart failure', 'diastolic heart failure',
-                          'acute on chronic heart failure', 'hfref', 'hfpef', 'pulmonary edema', 'diastolic chf', 'systolic chf'],
-        'acute kidney injury': ['aki', 'acute renal failure', 'acute renal insufficiency', 'ckd', 'kidney disease', 'renal failure'],
-        'hyperglycemia': ['diabetes with hyperglycemia', 'steroid induced hyperglycemia', 'uncontrolled diabetes', 'diabetes mellitus'],
-        'hypoglycemia': ['diabetes with hypoglycemia'],
-        'hyponatremia': ['hypovolemic hyponatremia', 'euvolemic hyponatremia', 'hypervolemic hyponatremia', 'low sodium'],
-        'encephalopathy': ['metabolic encephalopathy', 'hepatic encephalopathy', 'toxic encephalopathy', 'delirium', 'altered mental status'],
-        'lactic acidosis': ['elevated lactate', 'hyperlactatemia'],
-        'obesity': ['morbid obesity', 'severe obesity', 'class ii obesity', 'class iii obesity', 'class 2 obesity', 'class 3 obesity', 'bmi 35', 'bmi 40', 'bmi 45'],
-        'hematoma': ['groin hematoma', 'postoperative hematoma', 'retroperitoneal hematoma'],
-        'debridement': ['excisional debridement', 'surgical debridement', 'wound debridement'],
-        'quadriplegia': ['functional quadriplegia', 'tetraplegia', 'paralysis'],
-        'pulmonary edema': ['acute pulmonary edema', 'cardiogenic pulmonary edema', 'non cardiogenic pulmonary edema', 'flash pulmonary edema'],
-        'hyperkalemia': ['high potassium'],
-        'hypomagnesemia': ['low magnesium'],
-        'coagulation': ['coagulopathy', 'dic', 'disseminated intravascular'],
-    }
-
-    for base_term, equivalent_terms in clinical_equivalents.items():
-        pred_has = base_term in pred or any(term in pred for term in equivalent_terms)
-        truth_has = base_term in truth or any(term in truth for term in equivalent_terms)
-        if pred_has and truth_has:
-            return True
-
-    # Key word overlap (matching evaluate_cdi_accuracy.py approach)
-    pred_words = set(pred.split())
-    truth_words = set(truth.split())
+# Clinical equivalents — comprehensive dictionary matching evaluate_cdi_accuracy.py
+CLINICAL_EQUIVALENTS = {
+    'pressure ulcer': ['decubitus ulcer', 'pressure injury', 'pressure sore', 'bed sore', 'stage 2', 'stage 3', 'stage 4'],
+    'malnutrition': ['protein calorie malnutrition', 'hypoalbuminemia', 'cachexia', 'underweight', 'severe malnutrition', 'moderate malnutrition', 'mild malnutrition', 'protein calorie'],
+    'sepsis': ['severe sepsis', 'septic shock', 'urosepsis', 'septicemia'],
+    'thrombocytopenia': ['pancytopenia', 'low platelets'],
+    'anemia': ['anaemia', 'blood loss anemia', 'acute blood loss anemia', 'iron deficiency anemia', 'chronic anemia', 'normocytic anemia', 'anemia of chronic disease'],
+    'respiratory failure': ['hypoxic respiratory failure', 'acute respiratory failure', 'hypoxia', 'hypercapnic', 'hypercapnia', 'respiratory distress'],
+    'heart failure': ['chf', 'congestive heart failure', 'systolic heart failure', 'diastolic heart failure',
+                      'acute on chronic heart failure', 'hfref', 'hfpef', 'pulmonary edema', 'diastolic chf', 'systolic chf'],
+    'acute kidney injury': ['aki', 'acute renal failure', 'acute renal insufficiency', 'ckd', 'kidney disease', 'renal failure'],
+    'hyperglycemia': ['diabetes with hyperglycemia', 'steroid induced hyperglycemia', 'uncontrolled diabetes', 'diabetes mellitus'],
+    'hypoglycemia': ['diabetes with hypoglycemia'],
+    'hyponatremia': ['hypovolemic hyponatremia', 'euvolemic hyponatremia', 'hypervolemic hyponatremia', 'low sodium'],
+    'encephalopathy': ['metabolic encephalopathy', 'hepatic encephalopathy', 'toxic encephalopathy', 'delirium', 'altered mental status'],
+    'lactic acidosis': ['elevated lactate', 'hyperlactatemia'],
+    'obesity': ['morbid obesity', 'severe obesity', 'class ii obesity', 'class iii obesity', 'class 2 obesity', 'class 3 obesity', 'bmi 35', 'bmi 40', 'bmi 45'],
+    'hematoma': ['groin hematoma', 'postoperative hematoma', 'retroperitoneal hematoma'],
+    'debridement': ['excisional debridement', 'surgical debridement', 'wound debridement'],
+    'quadriplegia': ['functional quadriplegia', 'tetraplegia', 'paralysis'],
+    'pulmonary edema': ['acute pulmonary edema', 'cardiogenic pulmonary edema', 'non cardiogenic pulmonary edema', 'flash pulmonary edema'],
+    'hyperkalemia': ['high potassium'],
+    'hypomagnesemia': ['low magnesium'],
+    'coagulation': ['coagulopathy', 'dic', 'disseminated intravascular'],
+}
 
-    stop_words = {'and', 'or', 'the', 'a', 'an', 'with', 'without', 'due', 'to', 'of', 'in', 'on',
-                  'confirmed', 'ruled', 'out', 'poa', 'present', 'admission', 'acute', 'chronic',
-                  'type', 'by', 'from', 'is', 'was', 'are', 'were', 'not', 'no', 'unspecified',
-                  'other', 'nos', 'nec', 'specified', 'site', 'for'}
-    pred_words -= stop_words
-    truth_words -= stop_words
+# Ignored by the key-word overlap check
+MATCH_STOP_WORDS = {'and', 'or', 'the', 'a', 'an', 'with', 'without', 'due', 'to', 'of', 'in', 'on',
+                    'confirmed', 'ruled', 'out', 'poa', 'present', 'admission', 'acute', 'chronic',
+                    'type', 'by', 'from', 'is', 'was', 'are', 'were', 'not', 'no', 'unspecified',
+                    'other', 'nos', 'nec', 'specified', 'site', 'for'}
 
-    if not pred_words or not truth_words:
-        return False
+# Built once, features memoised per string (see diagnosis_matcher.py)
+_MATCHER = DiagnosisMatcher(CLINICAL_EQUIVALENTS, MATCH_STOP_WORDS, normalize_diagnosis)
 
-    overlap = len(pred_words & truth_words)
-    max_len = max(len(pred_words), len(truth_words))
 
-    if max_len == 0:
-        return False
+def diagnoses_match(predicted: str, ground_truth: str, threshold: float = 0.5) -> bool:
+    """Check if predicted diagnosis matches ground truth.
+    Ported from evaluate_cdi_accuracy.py which achieved 58.6% recall.
+    Uses fuzzy matching + comprehensive clinical equivalents dictionary.
 
-    # 50% overlap threshold (matching evaluate_cdi_accuracy.py, was 60% before)
-    return overlap / max_len >= threshold
+    Exact, substring, shared equivalent class, then key-word overlap
+    (50% threshold, matching evaluate_cdi_accuracy.py, was 60% before).
+    """
+    return _MATCHER.match(predicted, ground_truth, threshold)
 
 
 # ===========================================================================
@@ -955,16 +937,37 @@ class HillClimbRunner:
     """Robust hill-climbing evaluation runner."""
 
     def __init__(self, api_key: str, model: str, data_path: str,
-                 sample_size: int = 30, results_dir: str = "results"):
+                 sample_size: int = 30, results_dir: str = "results",
+                 batch: bool = False, batch_base_url: Optional[str] = None,
+                 batch_deployment: Optional[str] = None, n_samples: bool = False,
+                 fresh: bool = False):
         self.api_key = api_key
         self.model = model
         self.data_path = data_path
         self.sample_size = sample_size
         self.results_dir = Path(results_dir)
         self.results_dir.mkdir(exist_ok=True)
+        # --batch: single-prompt variants go through the Batch API (see
+        # _batch_predict); multi-step variants stay synchronous.
+        self.batch = batch
+        self.batch_base_url = batch_base_url
+        self.batch_deployment = batch_deployment
+        # --n-samples: self-consistency variants request all samples in one
+        # call (`n`) instead of one call per sample; see
+        # _predict_self_consistency.
+        self.n_samples = n_samples
 
         self.log_file = self.results_dir / f"hill_climb_{datetime.now().strftime('%Y%m%d_%H%M%S')}.tsv"
-        self.checkpoint_file = self.results_dir / "hill_climb_checkpoint.json"
+        # Finished cases and variants for this model / dataset content /
+        # sample size / prompt text; a rerun with the same settings resumes
+        # from it (fresh=True deletes it instead). Discarded once a run
+        # completes.
+        self.checkpoint = RunCheckpoint("hill_climb", {
+            "model": model, "data": os.path.abspath(data_path),
+            "data_sha256": file_hash(data_path),
+            "sample_size": sample_size, "n_samples": n_samples,
+            "prompts": config_hash(PROMPT_VARIANTS),
+        }, resume=not fresh)
         self.detail_log = self.results_dir / f"hill_climb_detail_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
 
         self.all_results = []
@@ -1058,8 +1061,14 @@ class HillClimbRunner:
                 'ip_consult_note': _str_or_none(row.get('ip_consult_note')),
                 'true_diagnoses': true_dx,
             })
-
-        print(f"Loaded {len(cases)} valid cases (from {len(df)} total)")
+            # Rows of the same encounter with the same notes share one
+            # prediction per variant (see encounters.py)
+            cases[-1]['encounter'] = encounter_key(cases[-1]['id'],
+                                                   self._build_notes_text(cases[-1]))
+
+        n_encounters = len({c['encounter'] for c in cases})
+        print(f"Loaded {len(cases)} valid cases (from {len(df)} total), "
+              f"{n_encounters} distinct encounters")
         return cases
 
     def _build_notes_text(self, case: Dict) -> str:
@@ -1103,13 +1112,20 @@ class HillClimbRunner:
 
         return "".join(parts)
 
-    def _call_single(self, system: str, user_content: str, temperature: float = 0.2) -> str:
-        """Make a single LLM call and return raw text."""
+    @staticmethod
+    def _messages(system: str, user_content: str) -> List[Dict]:
         messages = []
         if system:
             messages.append({"role": "system", "content": system})
         messages.append({"role": "user", "content": user_content})
-        return call_llm(messages, self.api_key, model=self.model, temperature=temperature)
+        return messages
+
+    def _call_single(self, system: str, user_content: str, temperature: float = 0.2,
+                     sample: int = 0) -> str:
+        """Make a single LLM call and return raw text."""
+        messages = self._messages(system, user_content)
+        return call_llm(messages, self.api_key, model=self.model, temperature=temperature,
+                        sample=sample)
 
     def predict_case(self, case: Dict, variant: Dict) -> List[Dict]:
         """Run prediction on a single case using a prompt variant.
@@ -1177,19 +1193,41 @@ class HillClimbRunner:
         user_content = variant["user_prefix"] + notes
         num_samples = variant.get("num_samples", 3)
         vote_threshold = variant.get("vote_threshold", 2)
+        temperature = variant.get("temperature", 0.7)
 
-        all_predictions = []
-        for s in range(num_samples):
-            raw = self._call_single(
-                variant.get("system", ""),
-                user_content,
-                variant.get("temperature", 0.7),
-            )
-            preds = parse_llm_diagnoses(raw)
-            all_predictions.append(preds)
-            if s < num_samples - 1:
-                time.sleep(1)  # brief pause between samples
-
+        raws = None
+        if self.n_samples and not self.model.startswith("claude"):
+            # One request, num_samples choices — prompt ingested once
+            try:
+                raws = call_llm_samples(self._messages(variant.get("system", ""), user_content),
+                                        self.api_key, model=self.model,
+                                        temperature=temperature, num_samples=num_samples)
+            except GatewayError as e:
+                if e.status_code is not None and 400 <= e.status_code < 500 \
+                        and e.status_code != 429 and e.names_param("n"):
+                    print(" (n-sampling rejected, one call per sample from now on)", end="")
+                    self.n_samples = False
+                else:
+                    # Not about `n` (5xx after retries, auth, another
+                    # parameter): one call per sample would fail the same way
+                    raise
+            except RuntimeError as e:
+                # Truncated or filtered choices: retry one call per sample
+                print(f" (n-sampled request failed: {e})", end="")
+        if raws is None:
+            # One call per sample, all in flight at once
+            with ThreadPoolExecutor(max_workers=num_samples) as pool:
+                raws = list(pool.map(
+                    lambda s: self._call_single(variant.get("system", ""), user_content,
+                                                temperature, sample=s),
+                    range(num_samples)))
+
+        all_predictions = [parse_llm_diagnoses(raw) for raw in raws]
+        return self._vote_samples(all_predictions, vote_threshold)
+
+    @staticmethod
+    def _vote_samples(all_predictions: List[List[Dict]], vote_threshold: int) -> List[Dict]:
+        """Keep diagnoses that appear in at least vote_threshold samples."""
         # Vote: count how many samples include each diagnosis (by normalized name)
         diagnosis_votes = {}  # normalized_name -> {count, best_entry}
         for preds in all_predictions:
@@ -1287,6 +1325,78 @@ class HillClimbRunner:
         )
         return parse_llm_diagnoses(raw_validate)
 
+    # Variants that are a single prompt (sampled once or N times) can be
+    # submitted as one Batch API job; chained variants need each pass's
+    # output before the next request exists.
+    BATCHABLE_METHODS = ("standard", "self_consistency")
+
+    def _batch_predict(self, cases: List[Dict], variant_name: str,
+                       variant: Dict) -> List:
+        """Predict every case for a single-prompt variant via the Batch API.
+
+        Returns one entry per case: the prediction list, or the exception
+        the case failed with (re-raised by evaluate_variant so batch and
+        synchronous runs report errors the same way).
+        """
+        method = variant.get("predict_method", "standard")
+        if method == "self_consistency":
+            num_samples = variant.get("num_samples", 3)
+            temperature = variant.get("temperature", 0.7)
+        else:
+            num_samples = 1
+            temperature = variant.get("temperature", 0.2)
+
+        # One set of requests per encounter; later cases reuse the first
+        owner = {}
+        for i, case in enumerate(cases):
+            owner.setdefault(case.get('encounter', i), i)
+        requests_ = []
+        specs = {}
+        for i in sorted(set(owner.values())):
+            case = cases[i]
+            messages = self._messages(variant.get("system", ""),
+                                      variant["user_prefix"] + self._build_notes_text(case))
+            body = build_request_body(messages, self.model, temperature)
+            for s in range(num_samples):
+                custom_id = f"{i}:{s}"
+                specs[custom_id] = (messages, s)
+                requests_.append(make_request(
+                    custom_id, body,
+                    cache_key=cache_key(self.model, messages, temperature,
+                                        _token_budget(body), s)))
+
+        def _fallback(req):
+            messages, s = specs[req["custom_id"]]
+            return call_llm(messages, self.api_key, model=self.model,
+                            temperature=temperature, sample=s)
+
+        print(f"  Batch: {len(requests_)} requests for {len(cases)} cases "
+              f"({len(owner)} encounters)")
+        answers = run_batch(requests_, self.api_key,
+                            job_dir=str(self.results_dir / "batch_jobs"),
+                            job_name=f"hill_climb_{variant_name}",
+                            base_url=self.batch_base_url,
+                            deployment=self.batch_deployment,
+                            fallback=_fallback)
+
+        by_owner = {}
+        for i in sorted(set(owner.values())):
+            samples = []
+            for s in range(num_samples):
+                content, error = answers[f"{i}:{s}"]
+                if error:
+                    samples = RuntimeError(f"batch pass {s} failed: {error}")
+                    break
+                samples.append(parse_llm_diagnoses(content))
+            if isinstance(samples, Exception):
+                by_owner[i] = samples
+            elif method == "self_consistency":
+                by_owner[i] = self._vote_samples(samples, variant.get("vote_threshold", 2))
+            else:
+                by_owner[i] = samples[0]
+        return [by_owner[owner[case.get('encounter', i)]]
+                for i, case in enumerate(cases)]
+
     def evaluate_variant(self, cases: List[Dict], variant_name: str, variant: Dict) -> Dict:
         """Evaluate a prompt variant against all cases."""
         total_true = 0
@@ -1295,11 +1405,49 @@ class HillClimbRunner:
         case_results = []
         errors = 0
 
+        # Cases of this variant finished by an earlier, interrupted run. The
+        # key includes the variant's definition, so editing a prompt
+        # re-runs it.
+        variant_id = f"{variant_name}:{config_hash(variant)}"
+        case_keys = [f"{variant_id}|{case['id']}:{i}" for i, case in enumerate(cases)]
+        pending = [i for i, key in enumerate(case_keys) if key not in self.checkpoint]
+        if len(pending) < len(cases):
+            print(f"  Resuming: {len(cases) - len(pending)}/{len(cases)} cases already done")
+
+        batch_predictions = None
+        if (self.batch and pending and not self.model.startswith("claude")
+                and variant.get("predict_method", "standard") in self.BATCHABLE_METHODS):
+            batch_predictions = dict(zip(pending, self._batch_predict(
+                [cases[i] for i in pending], variant_name, variant)))
+
+        # Predictions already made for an encounter this variant; later
+        # query rows of the encounter are scored against the same list
+        by_encounter = {}
+
         for i, case in enumerate(cases):
+            done = self.checkpoint.get(case_keys[i])
+            if done is not None:
+                total_true += done['case_result']['total_true']
+                total_matched += done['case_result']['matched']
+                total_predicted += len(done['predictions'])
+                case_results.append(done['case_result'])
+                if case.get('encounter') is not None:
+                    by_encounter.setdefault(case['encounter'], done['predictions'])
+                continue
+
             print(f"  Case {i+1}/{len(cases)} (ID: {case['id']})...", end="", flush=True)
 
             try:
-                predictions = self.predict_case(case, variant)
+                if batch_predictions is not None:
+                    predictions = batch_predictions[i]
+                    if isinstance(predictions, Exception):
+                        raise predictions
+                elif case.get('encounter') in by_encounter:
+                    predictions = by_encounter[case['encounter']]
+                else:
+                    predictions = self.predict_case(case, variant)
+                    if case.get('encounter') is not None:
+                        by_encounter[case['encounter']] = predictions
                 pred_names = [p.get('diagnosis', str(p)) if isinstance(p, dict) else str(p) for p in predictions]
 
                 # Match predictions to ground truth
@@ -1324,6 +1472,9 @@ class HillClimbRunner:
                     'matched': case_matched,
                     'total_true': len(case['true_diagnoses']),
                 })
+                # Failed cases aren't checkpointed, so a resumed run retries them
+                self.checkpoint.append(case_keys[i], {'case_result': case_results[-1],
+                                                      'predictions': pred_names})
 
             except Exception as e:
                 errors += 1
@@ -1335,8 +1486,6 @@ class HillClimbRunner:
                     'matched': 0,
                     'total_true': len(case['true_diagnoses']),
                 })
-                # Brief pause after error before next case
-                time.sleep(3)
                 continue
 
         recall = total_matched / total_true if total_true > 0 else 0
@@ -1384,16 +1533,9 @@ class HillClimbRunner:
         with open(self.detail_log, 'a') as f:
             f.write(json.dumps(result, default=str) + '\n')
 
-    def save_checkpoint(self, best_variant: str, best_recall: float):
-        """Save checkpoint for resume."""
-        checkpoint = {
-            'best_variant': best_variant,
-            'best_recall': best_recall,
-            'completed_variants': [r['variant'] for r in self.all_results],
-            'timestamp': datetime.now().isoformat(),
-        }
-        with open(self.checkpoint_file, 'w') as f:
-            json.dump(checkpoint, f, indent=2)
+    def save_checkpoint(self, variant: Dict, result: Dict):
+        """Checkpoint a finished variant's result, for resume."""
+        self.checkpoint.append(f"variant|{result['variant']}:{config_hash(variant)}", result)
 
     def run(self):
         """Run the full hill-climbing evaluation."""
@@ -1412,17 +1554,16 @@ class HillClimbRunner:
             print("ERROR: No cases loaded")
             return
 
-        # Check for checkpoint to resume
-        completed = set()
-        if self.checkpoint_file.exists():
-            try:
-                with open(self.checkpoint_file) as f:
-                    ckpt = json.load(f)
-                completed = set(ckpt.get('completed_variants', []))
-                if completed:
-                    print(f"Resuming — {len(completed)} variants already completed: {completed}")
-            except:
-                pass
+        # Variants finished by an earlier run with these settings (and an
+        # unchanged definition) keep their result and aren't re-run
+        completed = {}
+        for variant_name, variant in PROMPT_VARIANTS.items():
+            result = self.checkpoint.get(f"variant|{variant_name}:{config_hash(variant)}")
+            if result is not None:
+                completed[variant_name] = result
+        if completed:
+            print(f"Resuming from {self.checkpoint.dir} — {len(completed)} variants "
+                  f"already completed: {sorted(completed)}")
 
         best_variant = None
         best_recall = 0.0
@@ -1432,6 +1573,12 @@ class HillClimbRunner:
         for variant_name, variant in PROMPT_VARIANTS.items():
             if variant_name in completed:
                 print(f"\nSkipping {variant_name} (already completed)")
+                result = completed[variant_name]
+                self.log_result(result)
+                if result['recall'] > best_recall or (result['recall'] == best_recall and result['f1'] > best_f1):
+                    best_variant = variant_name
+                    best_recall = result['recall']
+                    best_f1 = result['f1']
                 continue
 
             print(f"\n{'=' * 80}")
@@ -1455,11 +1602,9 @@ class HillClimbRunner:
                 best_f1 = result['f1']
                 print(f"  >>> NEW BEST <<<")
 
-            self.save_checkpoint(best_variant, best_recall)
-
-            # Pause between variants to avoid rate limits
-            print("Pausing 5s before next variant...")
-            time.sleep(5)
+            self.save_checkpoint(variant, result)
+            # No pause between variants — the gateway rate governor
+            # (rate_limiter.py) paces requests to the learned limit.
 
         # Final summary
         print("\n" + "=" * 80)
@@ -1477,6 +1622,7 @@ class HillClimbRunner:
         print(f"Results saved to: {self.log_file}")
         print(f"Detail log: {self.detail_log}")
         print("=" * 80)
+        self.checkpoint.discard()
 
 
 # ===========================================================================
@@ -1504,7 +1650,23 @@ if __name__ == '__main__':
                              'types per case — same dataset evaluate_cdi_accuracy.py uses)')
     parser.add_argument('--sample-size', type=int, default=30)
     parser.add_argument('--results-dir', default='results')
+    parser.add_argument('--batch', action='store_true',
+                        help='Run standard / self-consistency variants through the Batch '
+                             'API (one job per variant). Multi-step variants and Claude '
+                             'models stay synchronous.')
+    parser.add_argument('--batch-base-url', default=None,
+                        help='Batch API base URL (default $CDI_BATCH_BASE_URL or AI Hub).')
+    parser.add_argument('--batch-deployment', default=None,
+                        help='Global-Batch deployment name, if different from --model.')
+    parser.add_argument('--n-samples', action='store_true',
+                        help='Self-consistency variants: request all samples in one call '
+                             '(n=num_samples) instead of one call per sample.')
+    parser.add_argument('--fresh', action='store_true',
+                        help='Ignore (and delete) an existing checkpoint for this '
+                             'configuration instead of resuming from it.')
+    add_cache_args(parser)
     args = parser.parse_args()
+    configure_from_args(args)
 
     runner = HillClimbRunner(
         api_key=args.api_key,
@@ -1512,5 +1674,10 @@ if __name__ == '__main__':
         data_path=args.data,
         sample_size=args.sample_size,
         results_dir=args.results_dir,
+        batch=args.batch,
+        batch_base_url=args.batch_base_url,
+        batch_deployment=args.batch_deployment,
+        n_samples=args.n_samples,
+        fresh=args.fresh,
     )
     runner.run()
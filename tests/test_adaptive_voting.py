@@ -0,0 +1,153 @@
+"""Adaptive voting: when CDIEngine stops issuing passes, and how it labels the result."""
+
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import cdi_engine  # noqa: E402
+from cdi_engine import CDIEngine  # noqa: E402
+
+AKI = {"diagnosis": "Acute kidney injury", "evidence": "Cr 2.1 from 0.9",
+       "confidence": "high", "category": "renal"}
+MALNUTRITION = {"diagnosis": "Severe protein-calorie malnutrition", "evidence": "BMI 16",
+                "confidence": "medium", "category": "nutrition"}
+HYPONATREMIA = {"diagnosis": "Hyponatremia", "evidence": "Na 126",
+                "confidence": "medium", "category": "electrolytes"}
+
+
+def _engine(monkeypatch, runs):
+    """An adaptive engine whose passes answer `runs` in order."""
+    answers = iter(runs)
+    sent = []
+
+    async def post_json_async(url, body, api_key, **kwargs):
+        sent.append(body)
+        answer = next(answers)
+        if isinstance(answer, Exception):
+            raise answer
+        return {"choices": [{"message": {"content": json.dumps(answer)},
+                             "finish_reason": "stop"}]}
+
+    monkeypatch.setattr(cdi_engine, "post_json_async", post_json_async)
+    return CDIEngine("test-key", model="gpt-4.1", adaptive_voting=True), sent
+
+
+def test_agreeing_first_wave_stops_early(monkeypatch):
+    engine, sent = _engine(monkeypatch, [[AKI, MALNUTRITION], [AKI, MALNUTRITION]])
+    result = engine.analyse("DISCHARGE SUMMARY\nCreatinine 2.1.", mode="balanced")
+
+    assert len(sent) == 2
+    assert result["metadata"]["voting_early_stopped"]
+    assert {p["diagnosis"] for p in result["predictions"]} == {AKI["diagnosis"],
+                                                               MALNUTRITION["diagnosis"]}
+    # 2/2 of a stopped balanced case: the skipped third pass could have dropped it
+    assert all(p["confidence"] == "medium" for p in result["predictions"])
+    assert all(p["vote_total"] == 2 for p in result["predictions"])
+
+
+def test_split_first_wave_runs_the_third_pass(monkeypatch):
+    engine, sent = _engine(monkeypatch, [[AKI], [HYPONATREMIA], [AKI, HYPONATREMIA]])
+    result = engine.analyse("DISCHARGE SUMMARY\nCreatinine 2.1.", mode="balanced")
+
+    assert len(sent) == 3
+    assert not result["metadata"]["voting_early_stopped"]
+    assert {p["diagnosis"] for p in result["predictions"]} == {AKI["diagnosis"],
+                                                               HYPONATREMIA["diagnosis"]}
+
+
+def test_failed_pass_without_early_stop_keeps_full_confidence(monkeypatch):
+    # The lone surviving run of the first wave isn't settled, so the third
+    # pass runs: every pass was issued, and 2/2 is "high" as without
+    # adaptive voting
+    engine, sent = _engine(monkeypatch, [RuntimeError("gateway down"), [AKI], [AKI]])
+    result = engine.analyse("DISCHARGE SUMMARY\nCreatinine 2.1.", mode="balanced")
+
+    assert len(sent) == 3
+    assert not result["metadata"]["voting_early_stopped"]
+    assert [p["diagnosis"] for p in result["predictions"]] == [AKI["diagnosis"]]
+    assert result["predictions"][0]["confidence"] == "high"
+
+
+def test_vote_settled():
+    engine = CDIEngine("test-key", model="gpt-4.1")
+    assert engine._vote_settled([[AKI], [AKI]], threshold=2, remaining=1)
+    # Hyponatremia has 1 vote; the one remaining pass could bring it to 2
+    assert not engine._vote_settled([[AKI, HYPONATREMIA], [AKI]], threshold=2, remaining=1)
+    # Remaining passes enough for a brand-new diagnosis to pass
+    assert not engine._vote_settled([[AKI], [AKI]], threshold=2, remaining=2)
+    # A lone run is never settled
+    assert not engine._vote_settled([[AKI]], threshold=2, remaining=1)
+
+
+# Recorded passes of one case each, with the name variants the model
+# actually alternates between, so later passes can land next to (or
+# between) buckets the first wave opened
+VARIANTS = [
+    ["Acute kidney injury", "Acute kidney injury stage 2", "AKI on CKD stage 3",
+     "Acute renal failure"],
+    ["Severe protein-calorie malnutrition", "Moderate protein-calorie malnutrition",
+     "Malnutrition"],
+    ["Hyponatremia", "Hypoosmolar hyponatremia", "Hypokalemia"],
+    ["Acute on chronic systolic heart failure", "Acute systolic heart failure",
+     "Chronic diastolic heart failure"],
+    ["Sepsis", "Severe sepsis", "Septic shock"],
+    ["Acute hypoxic respiratory failure", "Acute respiratory failure with hypoxia"],
+]
+
+
+def _recorded_passes(rng, num_runs):
+    passes = []
+    for _ in range(num_runs):
+        run = []
+        for group in VARIANTS:
+            if rng.random() < 0.6:
+                name = rng.choice(group)
+                run.append({"diagnosis": name, "evidence": "x" * rng.randrange(1, 30)})
+        passes.append(run or [dict(AKI)])
+    return passes
+
+
+def _all_passes_vote(engine, passes, threshold):
+    """The vote over every pass, grouped in the same waves as _adaptive_runs."""
+    first = len(passes) - threshold + 1
+    runs = passes[:first]
+    buckets = engine._vote_buckets(runs, threshold=threshold)
+    for run in passes[first:]:
+        buckets = engine._vote_buckets([run], buckets=buckets, first_run=len(runs),
+                                       threshold=threshold)
+        runs = runs + [run]
+    return engine._combine_runs(runs, threshold, buckets=buckets)
+
+
+def _accepted(predictions):
+    return sorted((p["diagnosis"], p["evidence"]) for p in predictions)
+
+
+def test_stopping_early_never_changes_the_output():
+    import asyncio
+    import random
+
+    engine = CDIEngine("test-key", model="gpt-4.1", adaptive_voting=True)
+    rng = random.Random(16)
+    stopped = 0
+    for mode in ("balanced", "high_recall"):
+        num_runs, threshold = cdi_engine.VOTING_MODES[mode]
+        for _ in range(300):
+            passes = _recorded_passes(rng, num_runs)
+
+            async def replay(user_content, n, t, first_sample=0, passes=passes):
+                return passes[first_sample:first_sample + n]
+
+            engine._self_consistency_runs = replay
+            runs, issued, buckets = asyncio.run(
+                engine._adaptive_runs("note", num_runs, threshold))
+            adaptive = engine._combine_runs(runs, threshold,
+                                            num_passes=num_runs if issued < num_runs else None,
+                                            buckets=buckets)
+            assert _accepted(adaptive) == _accepted(
+                _all_passes_vote(engine, passes, threshold))
+            stopped += issued < num_runs
+    # Enough of them actually stopped early for the check to mean something
+    assert stopped > 40
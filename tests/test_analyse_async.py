@@ -0,0 +1,117 @@
+"""CDIEngine's stage calls are awaited requests, not worker threads."""
+
+import asyncio
+import json
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import cdi_engine  # noqa: E402
+from cdi_engine import CDIEngine  # noqa: E402
+from prompt_cache import record_usage  # noqa: E402
+
+PREDICTIONS = [
+    {"diagnosis": "Acute kidney injury", "evidence": "Cr 2.1 from 0.9",
+     "confidence": "high", "category": "renal"},
+]
+
+
+def _fake_post(in_flight, peak, loops=None):
+    async def post_json_async(url, body, api_key, **kwargs):
+        if loops is not None:
+            loops.add(asyncio.get_running_loop())
+        if "GATEWAY DOWN" in body["messages"][-1]["content"]:
+            raise RuntimeError("gateway down")
+        if "CANCELLED" in body["messages"][-1]["content"]:
+            raise asyncio.CancelledError()
+        in_flight.append(body)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.05)
+        in_flight.remove(body)
+        data = {"choices": [{"message": {"content": json.dumps(PREDICTIONS)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 50}}
+        record_usage(data)
+        return data
+    return post_json_async
+
+
+def test_voting_passes_overlap_without_threads(monkeypatch):
+    in_flight, peak = [], []
+    monkeypatch.setattr(cdi_engine, "post_json_async", _fake_post(in_flight, peak))
+    engine = CDIEngine("test-key", model="gpt-4.1")
+    engine.analyse("DISCHARGE SUMMARY\nCreatinine 2.1.", mode="fast")   # starts the loop thread
+    threads = threading.active_count()
+
+    result = engine.analyse("DISCHARGE SUMMARY\nCreatinine 2.1.", mode="balanced")
+
+    assert max(peak) == 3
+    assert threading.active_count() == threads
+    assert result["metadata"]["voting_runs_succeeded"] == 3
+    assert result["metadata"]["token_usage"]["calls"] == 3
+
+
+def test_analyse_many_yields_failures(monkeypatch):
+    in_flight, peak = [], []
+    monkeypatch.setattr(cdi_engine, "post_json_async", _fake_post(in_flight, peak))
+    engine = CDIEngine("test-key", model="gpt-4.1")
+    cases = [{"discharge_summary": "DISCHARGE SUMMARY\nCreatinine 2.1."},
+             {"discharge_summary": "DISCHARGE SUMMARY\nGATEWAY DOWN"}]
+
+    async def collect():
+        return {i: r async for i, r in engine.analyse_many(cases, concurrency=2, mode="fast")}
+
+    outcomes = asyncio.run(collect())
+    assert outcomes[0]["metadata"]["token_usage"]["calls"] == 1
+    assert isinstance(outcomes[1], RuntimeError)
+
+
+def test_analyse_many_yields_cancelled_cases(monkeypatch):
+    in_flight, peak = [], []
+    monkeypatch.setattr(cdi_engine, "post_json_async", _fake_post(in_flight, peak))
+    engine = CDIEngine("test-key", model="gpt-4.1")
+    cases = [{"discharge_summary": "DISCHARGE SUMMARY\nCANCELLED"},
+             {"discharge_summary": "DISCHARGE SUMMARY\nCreatinine 2.1."}]
+
+    async def collect():
+        return {i: r async for i, r in engine.analyse_many(cases, concurrency=1, mode="fast")}
+
+    outcomes = asyncio.run(collect())
+    assert isinstance(outcomes[0], asyncio.CancelledError)
+    assert outcomes[1]["summary"]["total_findings"] == 1
+
+
+def test_blocking_calls_share_one_loop(monkeypatch):
+    loops = set()
+    monkeypatch.setattr(cdi_engine, "post_json_async", _fake_post([], [], loops))
+    engine = CDIEngine("test-key", model="gpt-4.1")
+    workers = [threading.Thread(target=engine.analyse,
+                                args=("DISCHARGE SUMMARY\nCreatinine 2.1.",),
+                                kwargs={"mode": "fast"})
+               for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    async def from_a_running_loop():
+        return engine.analyse("DISCHARGE SUMMARY\nCreatinine 2.1.", mode="fast")
+
+    assert asyncio.run(from_a_running_loop())["summary"]["total_findings"] == 1
+    assert len(loops) == 1      # so one pooled httpx client
+
+
+def test_stream_iterated_from_async_code(monkeypatch):
+    def fake_stream_events(url, body, api_key, **kwargs):
+        yield {"choices": [{"delta": {"content": json.dumps(PREDICTIONS)}}]}
+        yield {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+
+    monkeypatch.setattr(cdi_engine, "stream_events", fake_stream_events)
+    engine = CDIEngine("test-key", model="gpt-4.1")
+
+    async def consume():
+        return [e["event"] for e in engine.analyse_stream("DISCHARGE SUMMARY\nCreatinine 2.1.")]
+
+    assert asyncio.run(consume()) == ["finding", "done"]
@@ -0,0 +1,47 @@
+"""CDIEngine.analyse_stream closed by its consumer after the first event."""
+
+import gc
+import json
+import sys
+from concurrent.futures import Future
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import cdi_engine  # noqa: E402
+from cdi_engine import CDIEngine  # noqa: E402
+
+PREDICTIONS = [
+    {"diagnosis": "Acute kidney injury", "evidence": "Cr 2.1 from 0.9",
+     "confidence": "high", "category": "renal"},
+    {"diagnosis": "Severe protein-calorie malnutrition", "evidence": "BMI 16",
+     "confidence": "medium", "category": "nutrition"},
+]
+
+
+def _fake_stream_events(url, body, api_key, **kwargs):
+    text = json.dumps(PREDICTIONS)
+    half = len(text) // 2
+    for chunk in (text[:half], text[half:]):
+        yield {"choices": [{"delta": {"content": chunk}}]}
+    yield {"choices": [{"delta": {}, "finish_reason": "stop"}],
+           "usage": {"prompt_tokens": 100, "completion_tokens": 50}}
+
+
+def test_close_after_first_event(monkeypatch):
+    unraisable = []
+    monkeypatch.setattr(sys, "unraisablehook", unraisable.append)
+    monkeypatch.setattr(cdi_engine, "stream_events", _fake_stream_events)
+
+    engine = CDIEngine("test-key", model="gpt-4.1", pathology_scan=True)
+    scan = Future()                 # never started, so it can be cancelled
+    monkeypatch.setattr(engine, "_start_pathology_scan", lambda *a, **kw: scan)
+
+    stream = engine.analyse_stream("DISCHARGE SUMMARY\nCreatinine 2.1.", mode="fast")
+    first = next(stream)
+    assert first["event"] == "finding"
+    stream.close()
+    gc.collect()
+
+    assert unraisable == []
+    assert scan.cancelled()
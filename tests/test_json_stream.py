@@ -0,0 +1,46 @@
+"""json_stream salvage: what survives a response cut off by the token limit."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from json_stream import extract_items  # noqa: E402
+
+HEAD = '[{"diagnosis": "Acute kidney injury", "icd10_code": "N17.9"}, '
+AKI = {"diagnosis": "Acute kidney injury", "icd10_code": "N17.9"}
+
+
+def test_cut_in_a_key_keeps_the_whole_fields():
+    items, status = extract_items('[{"diagnosis": "AKI", "icd10_code": "N17.9", "evid')
+    assert items == [{"diagnosis": "AKI", "icd10_code": "N17.9"}]
+    assert status == "repaired"
+
+
+def test_cut_after_a_key_keeps_the_whole_fields():
+    for tail in ('"evidence"', '"evidence":', '"evidence": '):
+        items, _ = extract_items('[{"diagnosis": "AKI", "icd10_code": "N17.9", ' + tail)
+        assert items == [{"diagnosis": "AKI", "icd10_code": "N17.9"}]
+
+
+def test_cut_in_an_evidence_value_keeps_the_object():
+    items, _ = extract_items(HEAD + '{"diagnosis": "Sepsis", "icd10_code": "A41.9", '
+                                    '"evidence": "lactate 4.1 [ref')
+    assert items == [AKI, {"diagnosis": "Sepsis", "icd10_code": "A41.9",
+                           "evidence": "lactate 4.1 [ref"}]
+
+
+def test_cut_in_a_diagnosis_or_code_value_drops_the_object():
+    for cut in ('{"diagnosis": "Hypo', '{"diagnosis": "Hyponatremia", "icd10_code": "E8'):
+        items, status = extract_items(HEAD + cut)
+        assert items == [AKI]
+        assert status == "repaired"
+
+
+def test_cut_in_a_nested_evidence_list_keeps_every_element():
+    prefix = HEAD + '{"diagnosis": "Sepsis", "icd10_code": "A41.9", "evidence": ["lactate 4.1", '
+    items, _ = extract_items(prefix + '"WBC 1')
+    assert items[1]["evidence"] == ["lactate 4.1", "WBC 1"]
+    # A complete last element isn't mistaken for a dangling key
+    items, _ = extract_items(prefix + '"WBC 18"')
+    assert items[1]["evidence"] == ["lactate 4.1", "WBC 18"]
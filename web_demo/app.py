@@ -3,13 +3,14 @@ CDI LLM Predictor Web Demo
 A web interface for demonstrating the CDI diagnosis predictor
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+import json
 import sys
 import os
 
 # Add parent directory to path to import cdi_llm_predictor
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
-from cdi_llm_predictor import predict_missed_diagnoses
+from cdi_llm_predictor import predict_missed_diagnoses, stream_missed_diagnoses
 
 app = Flask(__name__)
 
@@ -66,6 +67,49 @@ def predict():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/predict/stream', methods=['POST'])
+def predict_stream():
+    """Streaming variant of /api/predict (server-sent events).
+
+    Same predictor and same diagnosis fields; each finding is sent as soon
+    as the model has written it:
+        data: {"event": "finding", "diagnosis": {...}}
+    then the final, filtered list:
+        data: {"event": "done", "count": N, "diagnoses": [...]}
+    or {"event": "error", "error": "..."} if the call fails.
+    """
+    global API_KEY
+
+    data = request.get_json()
+    discharge_summary = data.get('discharge_summary', '')
+    api_key = data.get('api_key', API_KEY)
+
+    if not discharge_summary:
+        return jsonify({'error': 'No discharge summary provided'}), 400
+
+    if not api_key:
+        return jsonify({'error': 'No API key provided'}), 400
+
+    API_KEY = api_key
+
+    def events():
+        try:
+            for event in stream_missed_diagnoses(discharge_summary, api_key, model="gpt-4.1"):
+                if event['event'] == 'finding':
+                    out = event
+                elif 'error' in event['result']:
+                    out = {'event': 'error', 'error': event['result']['error']}
+                else:
+                    diagnoses = event['result'].get('missed_diagnoses', [])
+                    out = {'event': 'done', 'count': len(diagnoses),
+                           'diagnoses': diagnoses}
+                yield f"data: {json.dumps(out)}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'event': 'error', 'error': str(e)})}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream')
+
+
 @app.route('/api/sample', methods=['GET'])
 def get_sample():
     """Get a sample discharge summary for testing"""